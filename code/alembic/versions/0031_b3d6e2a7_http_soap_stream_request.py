@@ -0,0 +1,27 @@
+"""Streamed requests and maximum body size in HTTP/SOAP channels
+
+Revision ID: 0031_b3d6e2a7
+Revises: 0030_9271ae91
+Create Date: 2016-06-02 11:24:07
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0031_b3d6e2a7'
+down_revision = '0030_9271ae91'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('stream_request', sa.Boolean(), nullable=True, default=False))
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('max_body_size', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column(model.HTTPSOAP.__tablename__, 'max_body_size')
+    op.drop_column(model.HTTPSOAP.__tablename__, 'stream_request')
@@ -0,0 +1,27 @@
+"""Pool size of outgoing FTP connections
+
+Revision ID: 0032_5c0d9a1f
+Revises: 0031_b3d6e2a7
+Create Date: 2016-06-09 14:02:51
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0032_5c0d9a1f'
+down_revision = '0031_b3d6e2a7'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common import FTP
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.OutgoingFTP.__tablename__, sa.Column(
+        'pool_size', sa.Integer(), nullable=True, server_default=str(FTP.DEFAULT.POOL_SIZE)))
+
+def downgrade():
+    op.drop_column(model.OutgoingFTP.__tablename__, 'pool_size')
@@ -0,0 +1,25 @@
+"""Pool size of SMTP connections
+
+Revision ID: 0033_7e1f4c2b
+Revises: 0032_5c0d9a1f
+Create Date: 2016-06-14 10:37:12
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0033_7e1f4c2b'
+down_revision = '0032_5c0d9a1f'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.SMTP.__tablename__, sa.Column('pool_size', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column(model.SMTP.__tablename__, 'pool_size')
@@ -0,0 +1,31 @@
+"""Prefetch, batching and acknowledgement mode of AMQP channels
+
+Revision ID: 0034_2a8e5d3c
+Revises: 0033_7e1f4c2b
+Create Date: 2016-06-20 09:12:45
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0034_2a8e5d3c'
+down_revision = '0033_7e1f4c2b'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.ChannelAMQP.__tablename__, sa.Column('prefetch_count', sa.Integer(), nullable=True))
+    op.add_column(model.ChannelAMQP.__tablename__, sa.Column('batch_size', sa.Integer(), nullable=True))
+    op.add_column(model.ChannelAMQP.__tablename__, sa.Column('batch_interval', sa.Integer(), nullable=True))
+    op.add_column(model.ChannelAMQP.__tablename__, sa.Column('ack_mode', sa.String(20), nullable=True))
+
+def downgrade():
+    op.drop_column(model.ChannelAMQP.__tablename__, 'ack_mode')
+    op.drop_column(model.ChannelAMQP.__tablename__, 'batch_interval')
+    op.drop_column(model.ChannelAMQP.__tablename__, 'batch_size')
+    op.drop_column(model.ChannelAMQP.__tablename__, 'prefetch_count')
@@ -0,0 +1,25 @@
+"""Consumer groups of pub/sub topics
+
+Revision ID: 0035_5c1b9e47
+Revises: 0034_2a8e5d3c
+Create Date: 2016-06-27 14:31:08
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0035_5c1b9e47'
+down_revision = '0034_2a8e5d3c'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.PubSubConsumer.__tablename__, sa.Column('group_name', sa.String(200), nullable=True))
+
+def downgrade():
+    op.drop_column(model.PubSubConsumer.__tablename__, 'group_name')
@@ -12,9 +12,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging, time
 from traceback import format_exc
 
-# anyjson
-from anyjson import dumps, loads
-
 # gevent
 from gevent import spawn
 
@@ -25,6 +22,8 @@ from bunch import Bunch
 import redis
 
 # Zato
+from zato.broker.codec import decode, get_codec
+from zato.broker.stream import BrokerStream, is_stream_transport, StreamConsumer
 from zato.common import BROKER, TRACE1, ZATO_NONE
 from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
 from zato.common.kvdb import LuaContainer
@@ -45,7 +44,7 @@ NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
 CODE_RENAMED = 10
 CODE_NO_SUCH_FROM_KEY = 11
 
-def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
+def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, config=None):
     
     # Imported here so it's guaranteed to be monkey-patched using gevent.monkey.patch_all by whoever called us
     from thread import start_new_thread
@@ -116,14 +115,21 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
            that bad as it may seem, there will be at most as many clients as there
            are servers in the cluster and truth to be told, Zero MQ < 3.x also would
            do client-side PUB/SUB filtering and it did scale nicely.
+
+           Alternatively, if config.transport is 'streams', messages of type 3) are added
+           to a Redis stream instead, see zato.broker.stream.BrokerStream for details.
         """
-        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs):
+        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs, config=None):
             self.kvdb = kvdb
             self.decrypt_func = kvdb.decrypt_func
             self.name = '{}-{}'.format(client_type, new_cid())
             self.topic_callbacks = topic_callbacks
             self.lua_container = LuaContainer(self.kvdb.conn, initial_lua_programs)
             self.ready = False
+            self.config = config
+            self.stream = BrokerStream(self.kvdb.conn, self.name, config) if is_stream_transport(config) else None
+            self.codec = get_codec((config or {}).get('codec'))
+            self.stream_consumer = None
 
         def run(self):
             logger.info('Starting broker client, host:[{}], port:[{}], name:[{}], topics:[{}]'.format(
@@ -135,6 +141,9 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             start_new_thread(self.pub_client.run, ())
             start_new_thread(self.sub_client.run, ())
 
+            if self.stream and TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY] in self.topic_callbacks:
+                start_new_thread(self.consume_stream, ())
+
             for client in(self.pub_client, self.sub_client):
                 while client.keep_running == ZATO_NONE:
                     time.sleep(0.01)
@@ -143,18 +152,22 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
         def publish(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL, *ignored_args, **ignored_kwargs):
             msg['msg_type'] = msg_type
             topic = TOPICS[msg_type]
-            self.pub_client.publish(topic, dumps(msg))
+            self.pub_client.publish(topic, self.codec.encode(msg))
 
         def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
             msg['msg_type'] = msg_type
 
             try:
-                msg = dumps(msg)
+                msg = self.codec.encode(msg)
             except Exception, e:
-                error_msg = 'JSON serialization failed for msg:[%r], e:[%s]'
+                error_msg = 'Serialization failed for msg:[%r], e:[%s]'
                 logger.error(error_msg, msg, format_exc(e))
                 raise
             else:
+                if self.stream and msg_type == MESSAGE_TYPE.TO_PARALLEL_ANY:
+                    self.stream.add(msg, expiration)
+                    return
+
                 topic = TOPICS[msg_type]
                 key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
                 
@@ -163,6 +176,20 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
 
                 self.pub_client.publish(topic, broker_msg)
 
+        def consume_stream(self):
+            """ Reads TO_PARALLEL_ANY messages off the broker stream, see zato.broker.stream.StreamConsumer for details.
+            """
+            kvdb = self.kvdb.copy()
+            kvdb.init()
+
+            stream = BrokerStream(kvdb.conn, self.name, self.config)
+            stream.create_group()
+
+            self.stream_consumer = StreamConsumer(stream, self.topic_callbacks[TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY]])
+            self.stream_consumer.run()
+
+            kvdb.close()
+
         def on_message(self, msg):
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug('Got broker message:[{}]'.format(msg))
@@ -181,9 +208,9 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                         if not payload:
                             logger.warning('No KVDB payload for key [{}] (already expired?)'.format(tmp_key))
                         else:
-                            payload = loads(payload)
+                            payload = decode(payload)
                 else:
-                    payload = loads(msg.data)
+                    payload = decode(msg.data)
 
                 if payload:
                     payload = Bunch(payload)
@@ -198,11 +225,14 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                         logger.debug('No payload in msg:[{}]'.format(msg))
 
         def close(self):
+            if self.stream_consumer:
+                self.stream_consumer.keep_running = False
+
             for client in(self.pub_client, self.sub_client):
                 client.keep_running = False
                 client.kvdb.close()
 
-    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs)
+    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, config)
     start_new_thread(client.run, ())
     
     return client
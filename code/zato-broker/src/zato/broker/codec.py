@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+
+# anyjson
+from anyjson import dumps, loads
+
+# msgpack
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Zato
+from zato.common import BROKER
+
+logger = logging.getLogger(__name__)
+
+# A JSON document never starts with this byte, it is followed by a codec's ID and then the actual message
+PREFIX = b'\x00'
+
+# ################################################################################################################################
+
+class Codec(object):
+    """ Serializes broker messages. Each codec other than JSON has its own single-byte ID and messages it produces
+    are prefixed with PREFIX and that ID. That is how recipients tell which codec to decode a message with,
+    without any configuration on their end.
+
+    Note that servers and connectors from before codecs were added decode everything as JSON. A codec other than JSON
+    may be configured only once all of them in a cluster have been upgraded.
+    """
+    name = None
+    id = None
+
+    def encode(self, msg):
+        raise NotImplementedError('Must be implemented by subclasses')
+
+    def decode(self, data):
+        raise NotImplementedError('Must be implemented by subclasses')
+
+class JSONCodec(Codec):
+    """ The default codec. Messages are not prefixed so they can be read by servers that know nothing about codecs.
+    """
+    name = BROKER.CODEC.JSON
+
+    def encode(self, msg):
+        return dumps(msg)
+
+    def decode(self, data):
+        return loads(data)
+
+class MsgPackCodec(Codec):
+    """ A compact, binary codec. Byte strings, e.g. XML or binary payloads, are kept as they are rather than escaped.
+    """
+    name = BROKER.CODEC.MSGPACK
+    id = b'm'
+
+    def encode(self, msg):
+        return PREFIX + self.id + msgpack.packb(msg, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data[2:], raw=False)
+
+# ################################################################################################################################
+
+_json_codec = JSONCodec()
+
+codecs = {
+    BROKER.CODEC.JSON: _json_codec,
+}
+
+codecs_by_id = {}
+
+def register_codec(codec):
+    """ Makes a new codec available to broker clients, codec.id must be a single byte not used by any other codec.
+    """
+    codecs[codec.name] = codec
+    if codec.id:
+        codecs_by_id[codec.id] = codec
+
+if msgpack:
+    register_codec(MsgPackCodec())
+
+def get_codec(name=None):
+    """ Returns a codec by its name, falling back to JSON if there is no such codec, e.g. because a library it needs
+    is not installed.
+    """
+    name = name or BROKER.CODEC.JSON
+    codec = codecs.get(name)
+
+    if not codec:
+        logger.warn('Broker codec `%s` not available, using `%s` instead', name, BROKER.CODEC.JSON)
+        codec = _json_codec
+
+    return codec
+
+def decode(data):
+    """ Decodes a message using the codec it was encoded with.
+    """
+    if data[:1] != PREFIX:
+        return _json_codec.decode(data)
+
+    codec = codecs_by_id.get(data[1:2])
+    if not codec:
+        raise ValueError('No broker codec for message prefixed with `{!r}`'.format(data[:2]))
+
+    return codec.decode(data)
+
+# ################################################################################################################################
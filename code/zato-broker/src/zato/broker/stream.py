@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from functools import partial
+from time import time
+from traceback import format_exc
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+from gevent.lock import Semaphore
+
+# Redis
+from redis import ResponseError
+
+# Zato
+from zato.broker.codec import decode
+from zato.common import BROKER
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+def is_stream_transport(config):
+    """ Returns True if a server's [broker] config section says that TO_PARALLEL_ANY messages should go through a stream.
+    """
+    return (config or {}).get('transport') == BROKER.TRANSPORT.STREAMS
+
+def _get_fields(values):
+    """ Turns a flat [key1, value1, key2, value2] Redis reply into a dict.
+    """
+    return dict(zip(values[::2], values[1::2]))
+
+# ################################################################################################################################
+
+class BrokerStream(object):
+    """ Delivers TO_PARALLEL_ANY messages through a Redis stream (Redis 5.0+) read by a single consumer group that all
+    parallel servers belong to. Each message is claimed by exactly one consumer in the same round trip that reads it,
+    so the cost of a message does not depend on how many servers there are.
+
+    Messages are acknowledged once they have been handled. Ones left unacknowledged by consumers that have not read
+    anything for claim_idle_time milliseconds, e.g. because the server they belonged to crashed, are claimed by other
+    consumers and handled again. Live consumers read every block_time milliseconds so messages they are still handling
+    are never claimed, however long it takes. Note that expiration applies only to messages delivered for the first time,
+    a message claimed from a crashed consumer is always handled.
+    """
+    def __init__(self, conn, consumer_name, config=None):
+        config = config or {}
+
+        self.conn = conn
+        self.consumer_name = consumer_name
+        self.key = BROKER.STREAM.KEY
+        self.group = BROKER.STREAM.GROUP
+        self.max_len = int(config.get('stream_max_len') or BROKER.STREAM.MAX_LEN)
+        self.batch_size = int(config.get('stream_batch_size') or BROKER.STREAM.BATCH_SIZE)
+        self.block_time = int(config.get('stream_block_time') or BROKER.STREAM.BLOCK_TIME)
+        self.claim_idle_time = int(config.get('stream_claim_idle_time') or BROKER.STREAM.CLAIM_IDLE_TIME)
+        self.claim_interval = int(config.get('stream_claim_interval') or BROKER.STREAM.CLAIM_INTERVAL)
+        self.last_claim = 0
+
+# ################################################################################################################################
+
+    def add(self, msg, expiration=BROKER.DEFAULT_EXPIRATION):
+        """ Adds an already encoded message to the stream, trimming the stream to approximately max_len messages.
+        """
+        return self.conn.execute_command(
+            'XADD', self.key, 'MAXLEN', '~', self.max_len, '*', 'msg', msg, 'exp', time() + expiration)
+
+# ################################################################################################################################
+
+    def create_group(self):
+        """ Creates the consumer group unless it exists already. A new group starts with all the messages
+        that are already in the stream.
+        """
+        try:
+            self.conn.execute_command('XGROUP', 'CREATE', self.key, self.group, '0', 'MKSTREAM')
+        except ResponseError, e:
+            if not e.message.startswith('BUSYGROUP'):
+                raise
+
+# ################################################################################################################################
+
+    def _get_messages(self, entries, check_expiration):
+        """ Returns a list of (msg_id, payload) tuples. Payload is None if a message expired or was deleted from the stream
+        before it could be read, such messages need to be acknowledged without being handled.
+        """
+        out = []
+        now = time()
+
+        for msg_id, values in entries:
+
+            # Trimmed off the stream before anyone read it
+            if not values:
+                out.append((msg_id, None))
+                continue
+
+            fields = _get_fields(values)
+
+            if check_expiration and float(fields['exp']) < now:
+                logger.warn('Broker message `%s` expired, not handling it', msg_id)
+                out.append((msg_id, None))
+            else:
+                out.append((msg_id, decode(fields['msg'])))
+
+        return out
+
+    def read(self, count=None):
+        """ Waits up to block_time milliseconds for new messages and returns up to count of them, batch_size by default,
+        each one claimed by this consumer.
+        """
+        response = self.conn.execute_command('XREADGROUP', 'GROUP', self.group, self.consumer_name,
+            'COUNT', count or self.batch_size, 'BLOCK', self.block_time, 'STREAMS', self.key, '>')
+
+        if not response:
+            return []
+
+        _, entries = response[0]
+        return self._get_messages(entries, True)
+
+    def ack(self, msg_ids):
+        """ Acknowledges handled messages in a single round trip.
+        """
+        if msg_ids:
+            self.conn.execute_command('XACK', self.key, self.group, *msg_ids)
+
+    def touch(self):
+        """ Lets other consumers know that this one is alive without reading any new messages, so that the ones
+        it is still handling are not claimed while it has no room for more.
+        """
+        self.conn.execute_command('XREADGROUP', 'GROUP', self.group, self.consumer_name,
+            'COUNT', 1, 'STREAMS', self.key, '0')
+
+    def delete_consumer(self):
+        """ Deletes this consumer from the group unless it has messages pending. Returns True if it was deleted.
+        """
+        if self.conn.execute_command('XPENDING', self.key, self.group, '-', '+', 1, self.consumer_name):
+            return False
+
+        self.conn.execute_command('XGROUP', 'DELCONSUMER', self.key, self.group, self.consumer_name)
+        return True
+
+# ################################################################################################################################
+
+    def get_stale_consumers(self):
+        """ Returns a list of (name, pending) tuples describing other consumers that have not read anything
+        for at least claim_idle_time milliseconds.
+        """
+        out = []
+
+        for consumer in self.conn.execute_command('XINFO', 'CONSUMERS', self.key, self.group):
+            consumer = _get_fields(consumer)
+
+            if consumer['name'] != self.consumer_name and consumer['idle'] >= self.claim_idle_time:
+                out.append((consumer['name'], int(consumer['pending'])))
+
+        return out
+
+    def claim(self, count=None):
+        """ Claims up to count messages, batch_size by default, not acknowledged by stale consumers and deletes
+        the stale consumers that have no such messages.
+        """
+        max_count = count or self.batch_size
+        out = []
+
+        for name, pending in self.get_stale_consumers():
+
+            if not pending:
+                self.conn.execute_command('XGROUP', 'DELCONSUMER', self.key, self.group, name)
+                continue
+
+            count = max_count - len(out)
+            if count <= 0:
+                continue
+
+            msg_ids = [msg_id for msg_id, _, _, _ in
+                self.conn.execute_command('XPENDING', self.key, self.group, '-', '+', count, name)]
+
+            if not msg_ids:
+                continue
+
+            entries = self.conn.execute_command('XCLAIM', self.key, self.group, self.consumer_name,
+                self.claim_idle_time, *msg_ids)
+
+            # Entries no longer in the stream may be returned as None rather than as empty ones
+            entries = [entry for entry in entries if entry]
+            claimed = self._get_messages(entries, False)
+
+            if claimed:
+                logger.info('Claimed `%d` broker message(s) from stale consumer `%s`', len(claimed), name)
+                out.extend(claimed)
+
+        return out
+
+    def should_claim(self):
+        """ Returns True if it is time to look for messages of stale consumers again.
+        """
+        now = time()
+        if now - self.last_claim >= self.claim_interval:
+            self.last_claim = now
+            return True
+
+# ################################################################################################################################
+
+class StreamConsumer(object):
+    """ Reads messages off a BrokerStream and invokes a callback with each one in a new greenlet. No more than batch_size
+    messages are handled at a time - until there is room for more, nothing new is read so that servers with spare capacity
+    can pick up what this one cannot. Handled messages are acknowledged in one round trip before each subsequent read.
+    """
+    def __init__(self, stream, callback):
+        self.stream = stream
+        self.callback = callback
+        self.keep_running = True
+        self.in_flight = Semaphore(stream.batch_size)
+        self.handling = set() # Greenlets handling messages right now
+        self.handled = []     # IDs of messages to acknowledge
+
+    def _on_handled(self, msg_id, greenlet):
+        self.handling.discard(greenlet)
+        self.handled.append(msg_id)
+        self.in_flight.release()
+
+    def consume(self):
+        """ Acknowledges messages handled so far and, if there is room for more within block_time, claims or reads
+        as many as there is room for and starts to handle them.
+        """
+        to_ack, self.handled = self.handled, []
+
+        try:
+            self.stream.ack(to_ack)
+        except Exception:
+
+            # No other consumer would claim them from us so they need to be acknowledged on next attempt
+            self.handled.extend(to_ack)
+            raise
+
+        if not self.in_flight.acquire(timeout=self.stream.block_time / 1000.0):
+            self.stream.touch()
+            return
+
+        self.in_flight.release()
+        count = self.in_flight.counter
+
+        messages = self.stream.claim(count) if self.stream.should_claim() else []
+        if len(messages) < count:
+            messages.extend(self.stream.read(count - len(messages)))
+
+        for msg_id, payload in messages:
+            if payload is None:
+                self.handled.append(msg_id)
+            else:
+                self.in_flight.acquire()
+                greenlet = spawn(self.callback, Bunch(payload))
+                self.handling.add(greenlet)
+                greenlet.link(partial(self._on_handled, msg_id))
+
+    def close(self):
+        """ Gives messages still being handled up to block_time to complete, acknowledges them and deletes the consumer
+        from the group unless it still has messages pending. These will be claimed by other consumers, which also deletes
+        this one afterwards.
+        """
+        joinall(list(self.handling), timeout=self.stream.block_time / 1000.0)
+
+        self.stream.ack(self.handled)
+        self.handled = []
+
+        if not self.stream.delete_consumer():
+            logger.info('Consumer `%s` left with broker messages pending', self.stream.consumer_name)
+
+    def run(self):
+        while self.keep_running:
+            try:
+                self.consume()
+            except Exception, e:
+                logger.warn('Could not consume broker stream messages, e:`%s`', format_exc(e))
+                sleep(1)
+
+        try:
+            self.close()
+        except Exception, e:
+            logger.warn('Could not close broker stream consumer, e:`%s`', format_exc(e))
+
+# ################################################################################################################################
@@ -13,9 +13,6 @@ import logging, time
 from threading import Thread
 from traceback import format_exc
 
-# anyjson
-from anyjson import dumps, loads
-
 # Bunch
 from bunch import Bunch
 
@@ -23,6 +20,8 @@ from bunch import Bunch
 import redis
 
 # Zato
+from zato.broker.codec import decode, get_codec
+from zato.broker.stream import BrokerStream, is_stream_transport
 from zato.common import BROKER, TRACE1, ZATO_NONE
 from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
 from zato.common.util import new_cid
@@ -100,13 +99,18 @@ class BrokerClient(Thread):
        that bad as it may seem, there will be at most as many clients as there
        are servers in the cluster and truth to be told, Zero MQ < 3.x also would
        do client-side PUB/SUB filtering and it did scale nicely.
+
+       Alternatively, if config.transport is 'streams', messages of type 3) are added
+       to a Redis stream instead, see zato.broker.stream.BrokerStream for details.
     """
-    def __init__(self, kvdb, client_type, topic_callbacks):
+    def __init__(self, kvdb, client_type, topic_callbacks, config=None):
         Thread.__init__(self)
         self.kvdb = kvdb
         self.decrypt_func = kvdb.decrypt_func
         self.name = '{}-{}'.format(client_type, new_cid())
         self.topic_callbacks = topic_callbacks
+        self.stream = BrokerStream(self.kvdb.conn, self.name, config) if is_stream_transport(config) else None
+        self.codec = get_codec((config or {}).get('codec'))
         
     def run(self):
         logger.info('Starting broker client, host:[{}], port:[{}], name:[{}], topics:[{}]'.format(
@@ -125,18 +129,22 @@ class BrokerClient(Thread):
     def publish(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL):
         msg['msg_type'] = msg_type
         topic = TOPICS[msg_type]
-        self.pub_client.publish(topic, dumps(msg))
+        self.pub_client.publish(topic, self.codec.encode(msg))
         
     def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
         msg['msg_type'] = msg_type
         
         try:
-            msg = dumps(msg)
+            msg = self.codec.encode(msg)
         except Exception, e:
-            error_msg = 'JSON serialization failed for msg:[%r], e:[%s]'
+            error_msg = 'Serialization failed for msg:[%r], e:[%s]'
             logger.error(error_msg, msg, format_exc(e))
             raise
         else:
+            if self.stream and msg_type == MESSAGE_TYPE.TO_PARALLEL_ANY:
+                self.stream.add(msg, expiration)
+                return
+
             topic = TOPICS[msg_type]
             key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
             
@@ -168,9 +176,9 @@ class BrokerClient(Thread):
                     if not payload:
                         logger.warning('No KVDB payload for key [{}] (already expired?)'.format(tmp_key))
                     else:
-                        payload = loads(payload)
+                        payload = decode(payload)
             else:
-                payload = loads(msg.data)
+                payload = decode(msg.data)
                 
             if payload:
                 payload = Bunch(payload)
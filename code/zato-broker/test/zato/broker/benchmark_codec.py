@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Compares sizes of broker messages and time it takes to encode and decode them with each of the codecs available.
+# Run as python benchmark_codec.py [number-of-iterations].
+
+# stdlib
+import sys
+from timeit import timeit
+
+# Zato
+from zato.broker.codec import codecs, decode
+from zato.common import BROKER, CHANNEL, DATA_FORMAT
+from zato.common.broker_message import MESSAGE_TYPE, SERVICE
+
+# ################################################################################################################################
+
+_xml = b'<request><customer id="123"><name>Hello "there"</name><address>Street 1/2, City</address></customer></request>'
+
+def get_publish_msg(payload, data_format):
+    """ A typical message sent by Service.invoke_async.
+    """
+    return {
+        'action': SERVICE.PUBLISH.value,
+        'channel': CHANNEL.INVOKE_ASYNC,
+        'data_format': data_format,
+        'transport': None,
+        'is_async': True,
+        'expiration': BROKER.DEFAULT_EXPIRATION,
+        'callback': None,
+        'zato_ctx': {},
+        'environ': {},
+        'cid': 'K04XS42T5J8RAHN8WCE5Y9BWN7AH',
+        'service': 'my.service',
+        'payload': payload,
+        'msg_type': MESSAGE_TYPE.TO_PARALLEL_ANY,
+    }
+
+messages = [
+    ('small XML', get_publish_msg(_xml, DATA_FORMAT.XML)),
+    ('large XML', get_publish_msg(_xml * 100, DATA_FORMAT.XML)),
+    ('JSON dict', get_publish_msg({'customer': {'id': 123, 'name': 'Hello "there"', 'tags': range(20)}}, DATA_FORMAT.JSON)),
+]
+
+# ################################################################################################################################
+
+def main(number):
+    print('{:<10} {:<8} {:>8} {:>12} {:>12}'.format('Message', 'Codec', 'Bytes', 'Encode (us)', 'Decode (us)'))
+
+    for msg_name, msg in messages:
+        for codec_name, codec in sorted(codecs.items()):
+            data = codec.encode(msg)
+
+            encode_time = timeit(lambda: codec.encode(msg), number=number) / number * 1e6
+            decode_time = timeit(lambda: decode(data), number=number) / number * 1e6
+
+            print('{:<10} {:<8} {:>8} {:>12.2f} {:>12.2f}'.format(msg_name, codec_name, len(data), encode_time, decode_time))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# anyjson
+from anyjson import dumps
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.broker import codec
+from zato.broker.codec import Codec, decode, get_codec, PREFIX, register_codec
+from zato.common import BROKER, CHANNEL, DATA_FORMAT
+from zato.common.broker_message import MESSAGE_TYPE, SERVICE
+
+# ################################################################################################################################
+
+class ReversingCodec(Codec):
+    name = 'reversing'
+    id = b'r'
+
+    def encode(self, msg):
+        return PREFIX + self.id + dumps(msg)[::-1]
+
+    def decode(self, data):
+        return codec._json_codec.decode(data[2:][::-1])
+
+def _get_publish_msg():
+    """ A typical message sent by Service.invoke_async.
+    """
+    return {
+        'action': SERVICE.PUBLISH.value,
+        'channel': CHANNEL.INVOKE_ASYNC,
+        'data_format': DATA_FORMAT.XML,
+        'transport': None,
+        'is_async': True,
+        'expiration': BROKER.DEFAULT_EXPIRATION,
+        'callback': None,
+        'zato_ctx': {},
+        'environ': {},
+        'cid': 'K04XS42T5J8RAHN8WCE5Y9BWN7AH',
+        'service': 'my.service',
+        'payload': b'<request><customer id="123">Hello "there"</customer></request>',
+        'msg_type': MESSAGE_TYPE.TO_PARALLEL_ANY,
+    }
+
+# ################################################################################################################################
+
+class CodecTestCase(TestCase):
+
+    def test_json(self):
+        msg = _get_publish_msg()
+        data = get_codec().encode(msg)
+
+        # Not prefixed so that servers without codecs can still read it
+        eq_(data[:1], b'{')
+        eq_(decode(data), msg)
+
+    def test_get_codec_fallback(self):
+        eq_(get_codec('no-such-codec').name, BROKER.CODEC.JSON)
+
+    def test_register_codec(self):
+        register_codec(ReversingCodec())
+        try:
+            msg = _get_publish_msg()
+            data = get_codec('reversing').encode(msg)
+
+            eq_(data[:2], PREFIX + b'r')
+            eq_(decode(data), msg)
+        finally:
+            del codec.codecs['reversing']
+            del codec.codecs_by_id[b'r']
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, decode, PREFIX + b'?' + b'abc')
+
+    def test_msgpack(self):
+        msg = _get_publish_msg()
+        json_data = get_codec(BROKER.CODEC.JSON).encode(msg)
+        msgpack_data = get_codec(BROKER.CODEC.MSGPACK).encode(msg)
+
+        eq_(msgpack_data[:2], PREFIX + b'm')
+        eq_(decode(msgpack_data), msg)
+
+        # The point of it all
+        eq_(len(msgpack_data) < len(json_data), True)
+
+# ################################################################################################################################
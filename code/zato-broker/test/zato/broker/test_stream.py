@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from itertools import count
+from unittest import TestCase
+
+# anyjson
+from anyjson import dumps
+
+# gevent
+import gevent
+from gevent.event import Event
+
+# nose
+from nose.tools import eq_
+
+# Redis
+from redis import ResponseError
+
+# Zato
+from zato.broker.stream import BrokerStream, is_stream_transport, StreamConsumer
+from zato.common import BROKER
+
+# ################################################################################################################################
+
+class FakeRedis(object):
+    """ Implements just enough of Redis streams for BrokerStream to work with, including idle times of pending messages
+    and consumers which tests set explicitly.
+    """
+    def __init__(self):
+        self.entries = []
+        self.groups = {}
+        self.pending = {}
+        self.consumers = {}
+        self.counter = count(1)
+        self.commands = []
+
+    def execute_command(self, name, *args):
+        self.commands.append(name)
+        return getattr(self, name.lower())(*args)
+
+    def _get_entry(self, msg_id):
+        for entry in self.entries:
+            if entry[0] == msg_id:
+                return entry
+
+    def xadd(self, key, maxlen, approx, max_len, star, *values):
+        msg_id = '{}-0'.format(next(self.counter))
+        self.entries.append((msg_id, list(values)))
+        self.entries = self.entries[-max_len:]
+        return msg_id
+
+    def xgroup(self, action, key, group, *args):
+        if action == 'CREATE':
+            if group in self.groups:
+                raise ResponseError('BUSYGROUP Consumer Group name already exists')
+            self.groups[group] = 0
+
+        elif action == 'DELCONSUMER':
+            del self.consumers[args[0]]
+
+    def xreadgroup(self, _group, group, consumer, _count, batch_size, *args):
+        key, _id = args[-2:]
+
+        # Reading messages already delivered only resets the consumer's idle time
+        if _id == '0':
+            self.consumers[consumer] = 0
+            return None
+
+        self.consumers.setdefault(consumer, 0)
+
+        last = self.groups[group]
+        entries = [entry for entry in self.entries if int(entry[0].split('-')[0]) > last][:batch_size]
+
+        if not entries:
+            return None
+
+        for msg_id, _ in entries:
+            self.pending[msg_id] = [consumer, 0]
+
+        self.groups[group] = int(entries[-1][0].split('-')[0])
+        return [[key, entries]]
+
+    def xack(self, key, group, *msg_ids):
+        for msg_id in msg_ids:
+            self.pending.pop(msg_id, None)
+
+    def xpending(self, key, group, start, end, batch_size, consumer_name=None):
+        return [[msg_id, consumer, idle, 1] for msg_id, (consumer, idle) in sorted(self.pending.items())
+            if consumer_name in (None, consumer)][:batch_size]
+
+    def xclaim(self, key, group, consumer, min_idle, *msg_ids):
+        self.consumers.setdefault(consumer, 0)
+
+        for msg_id in msg_ids:
+            self.pending[msg_id] = [consumer, 0]
+
+        return [self._get_entry(msg_id) for msg_id in msg_ids]
+
+    def xinfo(self, _consumers, key, group):
+        return [['name', name, 'pending', len([1 for value in self.pending.values() if value[0] == name]), 'idle', idle]
+            for name, idle in self.consumers.items()]
+
+def _get_stream(conn, consumer_name='consumer1', **config):
+    stream = BrokerStream(conn, consumer_name, config)
+    stream.create_group()
+
+    return stream
+
+# ################################################################################################################################
+
+class BrokerStreamTestCase(TestCase):
+
+    def test_is_stream_transport(self):
+        eq_(is_stream_transport(None), False)
+        eq_(is_stream_transport({'transport':BROKER.TRANSPORT.PUBSUB}), False)
+        eq_(is_stream_transport({'transport':BROKER.TRANSPORT.STREAMS}), True)
+
+    def test_create_group(self):
+        conn = FakeRedis()
+        _get_stream(conn)
+
+        # The group exists already
+        _get_stream(conn, 'consumer2')
+        eq_(conn.groups, {BROKER.STREAM.GROUP: 0})
+
+    def test_read_once(self):
+        conn = FakeRedis()
+        stream1 = _get_stream(conn, 'consumer1', stream_batch_size='2')
+        stream2 = _get_stream(conn, 'consumer2', stream_batch_size='2')
+
+        for idx in range(3):
+            stream1.add(dumps({'idx':idx}))
+
+        # Each message is given to one consumer only, in batches of up to batch_size messages
+        eq_([payload['idx'] for _, payload in stream1.read()], [0, 1])
+        eq_([payload['idx'] for _, payload in stream2.read()], [2])
+        eq_(stream1.read(), [])
+
+    def test_ack(self):
+        conn = FakeRedis()
+        stream = _get_stream(conn)
+
+        stream.add(dumps({'a':1}))
+        stream.add(dumps({'a':2}))
+
+        msg_ids = [msg_id for msg_id, _ in stream.read()]
+        eq_(sorted(conn.pending), msg_ids)
+
+        # A single round trip for all the messages, none if there is nothing to acknowledge
+        stream.ack(msg_ids)
+        stream.ack([])
+
+        eq_(conn.pending, {})
+        eq_(conn.commands.count('XACK'), 1)
+
+    def test_expired(self):
+        conn = FakeRedis()
+        stream = _get_stream(conn)
+
+        stream.add(dumps({'a':1}), expiration=-1)
+        eq_([payload for _, payload in stream.read()], [None])
+
+    def test_claim(self):
+        conn = FakeRedis()
+        stream1 = _get_stream(conn, 'consumer1', stream_claim_idle_time='1000')
+        stream2 = _get_stream(conn, 'consumer2', stream_claim_idle_time='1000')
+
+        stream1.add(dumps({'a':1}), expiration=-1)
+        stream1.add(dumps({'a':2}))
+        stream1.read()
+
+        # Not idle long enough yet
+        eq_(stream2.claim(), [])
+
+        # Consumer1 is gone now
+        for msg_id in conn.pending:
+            conn.pending[msg_id][1] = 1000
+        conn.consumers['consumer1'] = 1000
+
+        # Messages claimed from a stale consumer are handled even if they are expired by now
+        claimed = stream2.claim()
+        eq_([payload['a'] for _, payload in claimed], [1, 2])
+        eq_(set(consumer for consumer, _ in conn.pending.values()), set(['consumer2']))
+
+        # The stale consumer has no pending messages any longer so it is deleted on next claim
+        stream2.claim()
+        eq_(sorted(conn.consumers), ['consumer2'])
+
+    def test_claim_live_consumer(self):
+        conn = FakeRedis()
+        stream1 = _get_stream(conn, 'consumer1', stream_claim_idle_time='1000')
+        stream2 = _get_stream(conn, 'consumer2', stream_claim_idle_time='1000')
+
+        stream1.add(dumps({'a':1}))
+        stream1.read()
+
+        # A message handled for a long time by a consumer that keeps reading is not claimed
+        conn.pending.values()[0][1] = 5000
+        eq_(stream2.claim(), [])
+        eq_(conn.pending.values()[0][0], 'consumer1')
+
+    def test_claim_batch_size(self):
+        conn = FakeRedis()
+        stream1 = _get_stream(conn, 'consumer1', stream_batch_size='3')
+        stream2 = _get_stream(conn, 'consumer2', stream_batch_size='2', stream_claim_idle_time='1000')
+
+        for idx in range(3):
+            stream1.add(dumps({'idx':idx}))
+        stream1.read()
+
+        conn.consumers['consumer1'] = 1000
+
+        # No more than batch_size messages are claimed at a time
+        eq_([payload['idx'] for _, payload in stream2.claim()], [0, 1])
+        eq_([payload['idx'] for _, payload in stream2.claim()], [2])
+
+    def test_should_claim(self):
+        stream = _get_stream(FakeRedis(), stream_claim_interval='60')
+        eq_(stream.should_claim(), True)
+        eq_(stream.should_claim(), None)
+
+# ################################################################################################################################
+
+class StreamConsumerTestCase(TestCase):
+
+    def setUp(self):
+        self.conn = FakeRedis()
+        self.stream = _get_stream(self.conn, stream_batch_size='2', stream_block_time='10')
+        self.stream.last_claim = float('inf') # Nothing to claim in these tests
+        self.can_complete = Event()
+        self.handled = []
+
+        for idx in range(3):
+            self.stream.add(dumps({'idx':idx}))
+
+    def _callback(self, msg):
+        self.can_complete.wait()
+        self.handled.append(msg.idx)
+
+    def test_consume_in_flight(self):
+        consumer = StreamConsumer(self.stream, self._callback)
+        consumer.consume()
+
+        # Only as many messages as can be handled at a time are read ..
+        eq_(len(consumer.handling), 2)
+        eq_(sorted(self.conn.pending), ['1-0', '2-0'])
+
+        # .. and, until they are handled, the consumer only lets others know it is alive ..
+        self.conn.consumers['consumer1'] = 5000
+        consumer.consume()
+        eq_(sorted(self.conn.pending), ['1-0', '2-0'])
+        eq_(self.conn.consumers['consumer1'], 0)
+
+        self.can_complete.set()
+        gevent.joinall(list(consumer.handling))
+        eq_(sorted(self.handled), [0, 1])
+
+        # .. after which they are acknowledged and the rest is read.
+        consumer.consume()
+        eq_(sorted(self.conn.pending), ['3-0'])
+
+        gevent.joinall(list(consumer.handling))
+        eq_(sorted(self.handled), [0, 1, 2])
+
+    def test_close(self):
+        consumer = StreamConsumer(self.stream, self._callback)
+        consumer.consume()
+
+        # Messages being handled keep the consumer from being deleted ..
+        consumer.close()
+        eq_(sorted(self.conn.consumers), ['consumer1'])
+
+        # .. and once they are handled and acknowledged, it is deleted.
+        self.can_complete.set()
+        consumer.close()
+        eq_(sorted(self.handled), [0, 1])
+        eq_(self.conn.pending, {})
+        eq_(sorted(self.conn.consumers), [])
+
+# ################################################################################################################################
@@ -367,6 +367,7 @@ zato_services = {
     'zato.server.delete':'zato.server.service.internal.server.Delete',
     'zato.server.edit':'zato.server.service.internal.server.Edit',
     'zato.server.get-by-id':'zato.server.service.internal.server.GetByID',
+    'zato.server.get-conn-pool-stats':'zato.server.service.internal.server.GetConnPoolStats',
 
     # Services
     'zato.service.configure-request-response':'zato.server.service.internal.service.ConfigureRequestResponse',
@@ -111,9 +111,44 @@ http_server_header=Zato
 zeromq_connect_sleep=0.1
 aws_host=
 use_soap_envelope=True
+http_spool_threshold=1048576 # In bytes, streamed HTTP requests bigger than that are spooled over to temporary files
+wsdl_cache_dir=./wsdl-cache # Where parsed WSDLs of Suds connections are kept across restarts, relative to server's directory
 
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
+flush_interval=5 # In seconds, how often per-worker statistics are written to the KVDB
+
+[conn_pool]
+acquire_timeout=10 # In seconds, how long to wait for a free connection before giving up
+max_size_ratio=1 # Queues may grow up to pool_size * max_size_ratio connections under load, 1 = no growth
+idle_timeout=300 # In seconds, connections above pool_size idle for that long are closed
+health_check_interval=60 # In seconds, how often to validate idle connections
+# Any of the above, as well as max_size, can be set for a particular connection in a subsection named after it, e.g.
+# [[My Odoo connection]]
+# acquire_timeout=30
+# max_size=20
+
+[out_amqp]
+direct_publish=False # If True, workers publish AMQP messages themselves instead of through the broker and AMQP connectors
+pool_size=4 # How many channels to each outgoing connection a worker keeps open
+queue_size=10000 # How many messages at most may await being published, services sending more wait for room in the queue
+batch_size=100 # How many messages at most to publish at once
+batch_interval=0.01 # In seconds, how long to wait for a batch to fill up before publishing it anyway
+confirm=True # Whether to wait for the broker to confirm each batch, unconfirmed messages are sent through AMQP connectors
+confirm_timeout=10 # In seconds, how long to wait for confirmations
+
+[access_log]
+format=combined # combined or json, lines are logged as-is so the zato_access_log logger's formatter should be %(message)s
+buffer_size=10000 # How many requests at most may await being logged, the oldest ones are dropped if there are more
+flush_interval=0.5 # In seconds, how often to write out the log
+batch_size=500 # How many lines at most to write out at once
+
+[audit_log]
+batch_size=100 # How many records at most to write to the ODB in a single transaction
+flush_interval=1 # In seconds, how long to wait for a batch to fill up before writing it out anyway
+max_queue_size=10000 # How many records at most may await being written out
+overflow_policy=drop # What to do when the queue is full - drop, block or spill
+spill_dir=./audit-spill # Where to spill records over to if overflow_policy is spill, relative to server's directory
 
 [kvdb]
 host={{kvdb_host}}
@@ -130,6 +165,17 @@ redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
 
+[broker]
+transport=pubsub # Either pubsub or streams, the latter requires Redis 5.0+
+# Either json or msgpack. Servers and connectors from before the codec option was added can read JSON only,
+# so msgpack may be enabled only after all of them in the cluster have been upgraded.
+codec=json
+stream_max_len=100000
+stream_batch_size=100 # How many messages each worker handles at a time at most
+stream_block_time=1000 # In milliseconds
+stream_claim_idle_time=120000 # In milliseconds
+stream_claim_interval=30 # In seconds
+
 [startup_services_first_worker]
 zato.helpers.input-logger=Sample payload for a startup service (first worker)
 zato.notif.init-notifiers=
@@ -145,6 +191,12 @@ zato.helpers.input-logger=Sample payload for a startup service (any worker)
 move_to_target_queues_interval=3 # In seconds
 delete_expired_interval=180 # In seconds
 invoke_callbacks_interval=2 # In seconds
+callback_max_batch_size=100
+callback_max_in_flight=1 # Batches delivered to each consumer concurrently by all servers, anything above 1 means messages may arrive out of order
+callback_backoff_initial=1 # In seconds, doubled after each consecutive failure
+callback_backoff_max=60 # In seconds
+callback_lease_time=300 # In seconds, must be longer than delivering a batch, including callback_backoff_max, may take
+fan_out=True # Whether to copy messages to subscribers' queues as soon as they are published, in that order rather than by priority
 
 [profiler]
 enabled=False
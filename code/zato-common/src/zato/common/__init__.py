@@ -359,6 +359,9 @@ class KVDB(Attrs):
     SERVICE_TIME_BASIC = 'zato:stats:service:time:basic:'
     SERVICE_TIME_RAW = 'zato:stats:service:time:raw:'
     SERVICE_TIME_RAW_BY_MINUTE = 'zato:stats:service:time:raw-by-minute:'
+    SERVICE_TIME_RAW_CONVERTED = 'zato:stats:service:time:raw-converted'
+    SERVICE_TIME_HIST = 'zato:stats:service:time:hist:'
+    SERVICE_TIME_HIST_BY_MINUTE = 'zato:stats:service:time:hist-by-minute:'
     SERVICE_TIME_AGGREGATED_BY_MINUTE = 'zato:stats:service:time:aggr-by-minute:'
     SERVICE_TIME_AGGREGATED_BY_HOUR = 'zato:stats:service:time:aggr-by-hour:'
     SERVICE_TIME_AGGREGATED_BY_DAY = 'zato:stats:service:time:aggr-by-day:'
@@ -371,6 +374,10 @@ class KVDB(Attrs):
     SERVICE_SUMMARY_BY_MONTH = 'zato:stats:service:summary:by-month:'
     SERVICE_SUMMARY_BY_YEAR = 'zato:stats:service:summary:by-year:'
 
+    # Sets of names of statistics keys, one per each key prefix and time slice
+    SERVICE_STATS_INDEX = 'zato:stats:service:index:'
+    SERVICE_STATS_INDEX_BUILT = 'zato:stats:service:index-built'
+
     REQ_RESP_SAMPLE = 'zato:req-resp:sample:'
     RESP_SLOW = 'zato:resp:slow:'
 
@@ -386,6 +393,10 @@ class KVDB(Attrs):
     ASYNC_INVOKE_PROCESSED_FLAG_PATTERN = 'zato:async-invoke-with-pattern:processed:{}:{}'
     ASYNC_INVOKE_PROCESSED_FLAG = '1'
 
+class REQ_RESP_SAMPLE_MODE(Attrs):
+    SYNC = 'sync'   # Sample request/response pairs are stored before a service returns
+    ASYNC = 'async' # They are stored in a separate greenlet, off the path of the request
+
 class SCHEDULER:
 
     class JOB_TYPE(Attrs):
@@ -471,6 +482,23 @@ class DELIVERY_CALLBACK_INVOKER(Attrs):
 class BROKER:
     DEFAULT_EXPIRATION = 15 # In seconds
 
+    class TRANSPORT:
+        PUBSUB = 'pubsub'
+        STREAMS = 'streams'
+
+    class CODEC:
+        JSON = 'json'
+        MSGPACK = 'msgpack'
+
+    class STREAM:
+        KEY = 'zato:broker:stream:to-parallel-any'
+        GROUP = 'zato.parallel'
+        MAX_LEN = 100000
+        BATCH_SIZE = 100
+        BLOCK_TIME = 1000 # In milliseconds
+        CLAIM_IDLE_TIME = 120000 # In milliseconds
+        CLAIM_INTERVAL = 30 # In seconds
+
 class MISC:
     DEFAULT_HTTP_TIMEOUT=10
     DEFAULT_AUDIT_BACK_LOG = 24 * 60 # 24 hours * 60 days ≅ 2 months
@@ -486,6 +514,12 @@ class ADAPTER_PARAMS:
 class AUDIT_LOG:
     REPLACE_WITH = SECRET_SHADOW
 
+    # What to do with new audit records if there are already too many of them waiting to be stored in the ODB
+    class OVERFLOW_POLICY:
+        DROP = 'drop'
+        BLOCK = 'block'
+        SPILL = 'spill'
+
 class INFO_FORMAT:
     DICT = 'dict'
     TEXT = 'text'
@@ -574,6 +608,7 @@ class PUB_SUB:
     DEFAULT_MIME_TYPE = 'text/plain'
     DEFAULT_EXPIRATION = 60.0 # In seconds
     DEFAULT_GET_MAX_BATCH_SIZE = 100
+    MAX_GET_WAIT = 60 # In seconds, how long a long-polling get may wait for messages at most
     DEFAULT_IS_FIFO = True
     DEFAULT_MAX_DEPTH = 500
     DEFAULT_MAX_BACKLOG = 1000
@@ -629,18 +664,34 @@ class PUB_SUB:
             def __iter__(self):
                 return iter((self.TOPIC.id, self.MESSAGES.id))
 
+class AMQP:
+    class DEFAULT:
+        BATCH_INTERVAL = 100 # In milliseconds
+
+    class ACK_MODE(Constants):
+        ON_RECEIVE = ValueConstant('on-receive')
+        ON_SUCCESS = ValueConstant('on-success')
+
 class EMAIL:
     class DEFAULT:
         TIMEOUT = 10
         PING_ADDRESS = 'invalid@invalid'
         GET_CRITERIA = 'UNSEEN'
         IMAP_DEBUG_LEVEL = 0
+        SEND_MANY_QUEUE_SIZE = 1000
+        SEND_MANY_CONCURRENCY = 5
+        IMAP_FETCH_BATCH_SIZE = 500
 
     class IMAP:
         class MODE(Constants):
             PLAIN = ValueConstant('plain')
             SSL = ValueConstant('ssl')
 
+        class FETCH_MODE(Constants):
+            FULL = ValueConstant('full')
+            HEADERS = ValueConstant('headers')
+            STRUCTURE = ValueConstant('structure')
+
     class SMTP:
         class MODE(Constants):
             PLAIN = ValueConstant('plain')
@@ -682,6 +733,10 @@ class TLS:
     DIR_CA_CERTS = 'ca-certs'
     DIR_KEYS_CERTS = 'keys-certs'
 
+class FTP:
+    class DEFAULT:
+        POOL_SIZE = 3
+
 class ODOO:
     class DEFAULT:
         PORT = 8069
@@ -741,6 +796,10 @@ class path(object):
         self.children_only = False
         self.children_only_idx = None
 
+        # Compiled lazily and reused for as long as the path itself does not change
+        self._object_path = None
+        self._object_path_key = None
+
     def get_from(self, elem):
         if self.ns:
             _path = '{{{}}}{}'.format(self.ns, self.path)
@@ -749,7 +808,10 @@ class path(object):
         try:
             if self.children_only:
                 elem = elem.getchildren()[self.children_only_idx]
-            value = _ObjectPath(_path)(elem)
+            if self._object_path_key != _path:
+                self._object_path = _ObjectPath(_path)
+                self._object_path_key = _path
+            value = self._object_path(elem)
             if self.text_only:
                 return value.text
             return value
@@ -852,10 +914,12 @@ class StatsElem(object):
     mean_all_services - an arithmetical average of all the mean response times  of all services (in ms)
     usage_perc_all_services - this service's usage as a percentage of all_services_usage (up to 2 decimal points)
     time_perc_all_services - this service's share as a percentage of all_services_time (up to 2 decimal points)
+    p50, p90, p99 - 50th, 90th and 99th percentile of response times (in ms)
     expected_time_elems - an OrderedDict of all the time slots mapped to a mean time and rate
     temp_rate - a temporary place for keeping request rates, needed to get a weighted mean of uneven execution periods
     temp_mean - just like temp_rate but for mean response times
     temp_mean_count - how many periods containing a mean rate there were
+    temp_histogram - a histogram of response times the percentiles are computed from
     """
     def __init__(self, service_name=None, mean=None):
         self.service_name = service_name
@@ -872,10 +936,14 @@ class StatsElem(object):
         self.mean_all_services = 0
         self.usage_perc_all_services = 0
         self.time_perc_all_services = 0
+        self.p50 = 0
+        self.p90 = 0
+        self.p99 = 0
         self.expected_time_elems = OrderedDict()
         self.temp_rate = 0
         self.temp_mean = 0
         self.temp_mean_count = 0
+        self.temp_histogram = None
 
     def get_attrs(self, ignore=[]):
         for attr in dir(self):
@@ -233,6 +233,9 @@ class CHANNEL(Constants):
     STOMP_DELETE = ValueConstant('')
     STOMP_CHANGE_PASSWORD = ValueConstant('')
 
+    AMQP_MESSAGE_ACK = ValueConstant('')
+    AMQP_MESSAGE_REJECT = ValueConstant('')
+
 class AMQP_CONNECTOR(Constants):
     code_start = 101200
     CLOSE = ValueConstant('')
@@ -251,6 +254,7 @@ class SERVICE(Constants):
     EDIT = ValueConstant('')
     DELETE = ValueConstant('')
     PUBLISH = ValueConstant('')
+    CONFIGURE_REQUEST_RESPONSE = ValueConstant('')
 
 class STATS(Constants):
     code_start = 102000
@@ -22,7 +22,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import backref, relationship
 
 # Zato
-from zato.common import CASSANDRA, CLOUD, HTTP_SOAP_SERIALIZATION_TYPE, INVOCATION_TARGET, MISC, NOTIF, MSG_PATTERN_TYPE, \
+from zato.common import CASSANDRA, CLOUD, FTP, HTTP_SOAP_SERIALIZATION_TYPE, INVOCATION_TARGET, MISC, NOTIF, MSG_PATTERN_TYPE, \
      ODOO, PUB_SUB, SCHEDULER, STOMP, PARAMS_PRIORITY, URL_PARAMS_PRIORITY
 from zato.common.odb import AMQP_DEFAULT_PRIORITY, WMQ_DEFAULT_PRIORITY
 
@@ -474,6 +474,9 @@ class HTTPSOAP(Base):
     sec_tls_ca_cert = relationship('TLSCACert', backref=backref('http_soap', order_by=name, cascade='all, delete, delete-orphan'))
     has_rbac = Column(Boolean, nullable=False, default=False)
 
+    stream_request = Column(Boolean, nullable=True, default=False)
+    max_body_size = Column(Integer, nullable=True)
+
     service_id = Column(Integer, ForeignKey('service.id', ondelete='CASCADE'), nullable=True)
     service = relationship('Service', backref=backref('http_soap', order_by=name, cascade='all, delete, delete-orphan'))
 
@@ -487,7 +490,8 @@ class HTTPSOAP(Base):
                  url_path=None, method=None, soap_action=None, soap_version=None, data_format=None, ping_method=None,
                  pool_size=None, merge_url_params_req=None, url_params_pri=None, params_pri=None, serialization_type=None, \
                  timeout=None, sec_tls_ca_cert_id=None, service_id=None, service=None, security=None, cluster_id=None, \
-                 cluster=None, service_name=None, security_id=None, has_rbac=None, security_name=None, content_type=None):
+                 cluster=None, service_name=None, security_id=None, has_rbac=None, security_name=None, content_type=None,
+                 stream_request=None, max_body_size=None):
         self.id = id
         self.name = name
         self.is_active = is_active
@@ -518,6 +522,8 @@ class HTTPSOAP(Base):
         self.has_rbac = has_rbac
         self.security_name = security_name
         self.content_type = content_type
+        self.stream_request = stream_request
+        self.max_body_size = max_body_size
 
 # ################################################################################################################################
 
@@ -889,13 +895,14 @@ class OutgoingFTP(Base):
     timeout = Column(Integer, nullable=True)
     port = Column(Integer, server_default=str(FTP_PORT), nullable=False)
     dircache = Column(Boolean(), nullable=False)
+    pool_size = Column(Integer(), nullable=True, server_default=str(FTP.DEFAULT.POOL_SIZE))
 
     cluster_id = Column(Integer, ForeignKey('cluster.id', ondelete='CASCADE'), nullable=False)
     cluster = relationship(Cluster, backref=backref('out_conns_ftp', order_by=name, cascade='all, delete, delete-orphan'))
 
     def __init__(self, id=None, name=None, is_active=None, host=None, user=None,
                  password=None, acct=None, timeout=None, port=None, dircache=None,
-                 cluster_id=None):
+                 cluster_id=None, pool_size=None):
         self.id = id
         self.name = name
         self.is_active = is_active
@@ -907,6 +914,7 @@ class OutgoingFTP(Base):
         self.port = port
         self.dircache = dircache
         self.cluster_id = cluster_id
+        self.pool_size = pool_size
 
 class OutgoingOdoo(Base):
     """ An outgoing Odoo connection.
@@ -1021,6 +1029,10 @@ class ChannelAMQP(Base):
     queue = Column(String(200), nullable=False)
     consumer_tag_prefix = Column(String(200), nullable=False)
     data_format = Column(String(20), nullable=True)
+    prefetch_count = Column(Integer, nullable=True)
+    batch_size = Column(Integer, nullable=True)
+    batch_interval = Column(Integer, nullable=True) # In milliseconds
+    ack_mode = Column(String(20), nullable=True)
 
     service_id = Column(Integer, ForeignKey('service.id', ondelete='CASCADE'), nullable=False)
     service = relationship(Service, backref=backref('channels_amqp', order_by=name, cascade='all, delete, delete-orphan'))
@@ -1030,7 +1042,8 @@ class ChannelAMQP(Base):
 
     def __init__(self, id=None, name=None, is_active=None, queue=None,
                  consumer_tag_prefix=None, def_id=None, def_name=None,
-                 service_name=None, data_format=None):
+                 service_name=None, data_format=None, prefetch_count=None,
+                 batch_size=None, batch_interval=None, ack_mode=None):
         self.id = id
         self.name = name
         self.is_active = is_active
@@ -1040,6 +1053,10 @@ class ChannelAMQP(Base):
         self.def_name = def_name # Not used by the DB
         self.service_name = service_name # Not used by the DB
         self.data_format = data_format
+        self.prefetch_count = prefetch_count
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.ack_mode = ack_mode
 
 class ChannelSTOMP(Base):
     """ An incoming STOMP connection.
@@ -1455,6 +1472,9 @@ class PubSubConsumer(Base):
     max_depth = Column(Integer, nullable=False)
     delivery_mode = Column(String(200), nullable=False)
 
+    # Consumers of a topic with the same group name share a queue and each message is delivered to only one of them
+    group_name = Column(String(200), nullable=True)
+
     # Our only callback type right now is an HTTP outconn but more will come with time.
     callback_id = Column(Integer, ForeignKey('http_soap.id', ondelete='CASCADE'), nullable=True)
     callback_type = Column(String(20), nullable=True, default=PUB_SUB.CALLBACK_TYPE.OUTCONN_PLAIN_HTTP)
@@ -1471,7 +1491,7 @@ class PubSubConsumer(Base):
     http_soap = relationship(SecurityBase, backref=backref('pubsub_consumers', order_by=max_depth, cascade='all, delete, delete-orphan'))
 
     def __init__(self, id=None, is_active=None, sub_key=None, max_depth=None, delivery_mode=None, callback_id=None,
-                callback_type=None, topic_id=None, sec_def_id=None, cluster_id=None):
+                callback_type=None, topic_id=None, sec_def_id=None, cluster_id=None, group_name=None):
         self.id = id
         self.is_active = is_active
         self.sub_key = sub_key
@@ -1482,6 +1502,7 @@ class PubSubConsumer(Base):
         self.topic_id = topic_id
         self.sec_def_id = sec_def_id
         self.cluster_id = cluster_id
+        self.group_name = group_name
         self.last_seen = None # Not used by the DB
 
 # ################################################################################################################################
@@ -1757,6 +1778,7 @@ class SMTP(Base):
     password = Column(String(400), nullable=True)
     mode = Column(String(20), nullable=False)
     ping_address = Column(String(200), nullable=False)
+    pool_size = Column(Integer(), nullable=True) # No pooling if not set
 
     cluster_id = Column(Integer, ForeignKey('cluster.id', ondelete='CASCADE'), nullable=False)
     cluster = relationship(Cluster, backref=backref('smtp_conns', order_by=name, cascade='all, delete, delete-orphan'))
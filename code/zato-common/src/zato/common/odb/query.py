@@ -375,7 +375,8 @@ def _channel_amqp(session, cluster_id):
         ChannelAMQP.id, ChannelAMQP.name, ChannelAMQP.is_active,
         ChannelAMQP.queue, ChannelAMQP.consumer_tag_prefix,
         ConnDefAMQP.name.label('def_name'), ChannelAMQP.def_id,
-        ChannelAMQP.data_format,
+        ChannelAMQP.data_format, ChannelAMQP.prefetch_count,
+        ChannelAMQP.batch_size, ChannelAMQP.batch_interval, ChannelAMQP.ack_mode,
         Service.name.label('service_name'),
         Service.impl_name.label('service_impl_name')).\
         filter(ChannelAMQP.def_id==ConnDefAMQP.id).\
@@ -543,6 +544,8 @@ def _http_soap(session, cluster_id):
         HTTPSOAP.audit_repl_patt_type,
         HTTPSOAP.timeout,
         HTTPSOAP.sec_tls_ca_cert_id,
+        case([(HTTPSOAP.stream_request != None, HTTPSOAP.stream_request)], else_=False).label('stream_request'),
+        HTTPSOAP.max_body_size,
         TLSCACert.name.label('sec_tls_ca_cert_name'),
         SecurityBase.sec_type,
         Service.name.label('service_name'),
@@ -620,7 +623,7 @@ def _out_ftp(session, cluster_id):
     return session.query(
         OutgoingFTP.id, OutgoingFTP.name, OutgoingFTP.is_active,
         OutgoingFTP.host, OutgoingFTP.port, OutgoingFTP.user, OutgoingFTP.password,
-        OutgoingFTP.acct, OutgoingFTP.timeout, OutgoingFTP.dircache).\
+        OutgoingFTP.acct, OutgoingFTP.timeout, OutgoingFTP.dircache, OutgoingFTP.pool_size).\
         filter(Cluster.id==OutgoingFTP.cluster_id).\
         filter(Cluster.id==cluster_id).\
         order_by(OutgoingFTP.name)
@@ -954,6 +957,7 @@ def _pubsub_consumer(session, cluster_id, needs_columns=False):
         PubSubConsumer.max_depth,
         PubSubConsumer.sub_key,
         PubSubConsumer.delivery_mode,
+        PubSubConsumer.group_name,
         PubSubConsumer.callback_id,
         PubSubConsumer.callback_type,
         HTTPSOAP.name.label('callback_name'),
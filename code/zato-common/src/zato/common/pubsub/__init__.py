@@ -15,14 +15,20 @@ from datetime import datetime, timedelta
 from json import dumps, loads
 from logging import getLogger
 from sys import maxint
+from time import time
 from traceback import format_exc
 import logging
 
+# dateutil
+from dateutil.parser import parse
+
 # gevent
+from gevent import sleep, spawn
+from gevent.event import Event
 from gevent.lock import RLock
 
 # Zato
-from zato.common import PUB_SUB, ZATO_NONE, ZATO_NOT_GIVEN
+from zato.common import PUB_SUB, ZATO_ERROR, ZATO_NONE, ZATO_NOT_GIVEN, ZATO_OK
 from zato.common.kvdb import LuaContainer
 from zato.common.pubsub import lua
 from zato.common.util import datetime_to_seconds, make_repr, new_cid
@@ -30,6 +36,7 @@ from zato.common.util import datetime_to_seconds, make_repr, new_cid
 # ################################################################################################################################
 
 logger = getLogger(__name__)
+logger_overflown = getLogger('zato_pubsub_overflown')
 
 # ################################################################################################################################
 
@@ -129,6 +136,16 @@ class PubCtx(HasAutoRepr):
 
 # ################################################################################################################################
 
+class PubManyCtx(HasAutoRepr):
+    """ A set of data describing a batch of messages to publish to a single topic.
+    """
+    def __init__(self, client_id=None, topic=None, msgs=None):
+        self.client_id = client_id
+        self.topic = topic
+        self.msgs = msgs or []
+
+# ################################################################################################################################
+
 class SubCtx(HasAutoRepr):
     """ Subscription context - what to subscribe to.
     """
@@ -142,11 +159,12 @@ class GetCtx(HasAutoRepr):
     """ A set of data describing where to fetch messages from.
     """
     def __init__(self, sub_key=None, max_batch_size=PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE, is_fifo=PUB_SUB.DEFAULT_IS_FIFO,
-                   get_format=PUB_SUB.GET_FORMAT.OBJECT.id):
+                   get_format=PUB_SUB.GET_FORMAT.OBJECT.id, wait=0):
         self.sub_key = sub_key
         self.max_batch_size = max_batch_size
         self.is_fifo = is_fifo # Fetch in FIFO or LIFO order
         self.get_format = get_format
+        self.wait = wait # In seconds, how long to wait for messages if there are none at the moment
 
 # ################################################################################################################################
 
@@ -189,7 +207,8 @@ class Consumer(Client):
     """ Pub/sub consumer.
     """
     def __init__(self, id, name, is_active=True, sub_key=None, max_depth=PUB_SUB.DEFAULT_MAX_BACKLOG,
-            delivery_mode=PUB_SUB.DELIVERY_MODE.PULL.id, callback_id='', callback_name=None, callback_type=ZATO_NOT_GIVEN):
+            delivery_mode=PUB_SUB.DELIVERY_MODE.PULL.id, callback_id='', callback_name=None, callback_type=ZATO_NOT_GIVEN,
+            group_name=None):
         super(Consumer, self).__init__(id, name, is_active)
         self.sub_key = sub_key
         self.max_depth = max_depth
@@ -197,6 +216,7 @@ class Consumer(Client):
         self.callback_id = callback_id
         self.callback_name = callback_name
         self.callback_type = callback_type
+        self.group_name = group_name # Consumers of a topic in the same group compete for messages from a shared queue
 
 # ################################################################################################################################
 
@@ -415,7 +435,89 @@ class PubSub(object):
     def _not_implemented(self, *ignored_args, **ignored_kwargs):
         raise NotImplementedError('Must be overridden in subclasses')
 
-    publish = subscribe = get = acknowledge_delete = reject = create = _not_implemented
+    publish = publish_many = subscribe = get = acknowledge_delete = reject = create = _not_implemented
+
+# ################################################################################################################################
+
+class QueueNotifier(object):
+    """ Shares a single subscription to a Redis channel, which names of consumer queues new messages were added to
+    are published to, among all the greenlets waiting for messages and callbacks interested in all the notifications.
+    The subscription is opened when it is needed for the first time.
+    """
+    def __init__(self, kvdb, channel):
+        self.kvdb = kvdb
+        self.channel = channel
+        self.waiters = {} # Key = consumer queue, value = set of events to set when messages are added to it
+        self.callbacks = []
+        self.listener = None
+
+    def _start_listener(self):
+        if not self.listener:
+            self.listener = spawn(self._listen)
+
+    def add_callback(self, callback):
+        """ Adds a callable to invoke with a consumer queue's name each time a notification arrives.
+        """
+        self.callbacks.append(callback)
+        self._start_listener()
+
+    def remove_callback(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def add_waiter(self, cons_queue):
+        """ Returns an event that will be set once messages are added to a given queue.
+        """
+        event = Event()
+        self.waiters.setdefault(cons_queue, set()).add(event)
+        self._start_listener()
+
+        return event
+
+    def remove_waiter(self, cons_queue, event):
+        events = self.waiters.get(cons_queue)
+        if events:
+            events.discard(event)
+            if not events:
+                del self.waiters[cons_queue]
+
+    def notify(self, cons_queue):
+        for event in self.waiters.get(cons_queue, ()):
+            event.set()
+
+        for callback in self.callbacks:
+            try:
+                callback(cons_queue)
+            except Exception, e:
+                logger.warn('Could not invoke pub/sub notification callback `%s`, e:`%s`', callback, format_exc(e))
+
+    def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.kvdb.pubsub()
+                pubsub.subscribe(self.channel)
+
+                for msg in pubsub.listen():
+                    if msg['type'] == 'message':
+                        self.notify(msg['data'])
+
+            except Exception, e:
+                logger.warn('Pub/sub notification listener error, e:`%s`', format_exc(e))
+
+                # The connection is given back to the pool before a new subscription is opened
+                if pubsub:
+                    try:
+                        pubsub.reset()
+                    except Exception, e:
+                        logger.warn('Could not reset pub/sub notification listener, e:`%s`', format_exc(e))
+
+                # Notifications may have been lost in the meantime so all the waiters check their queues again
+                for events in self.waiters.values():
+                    for event in events:
+                        event.set()
+
+                sleep(1)
 
 # ################################################################################################################################
 
@@ -424,6 +526,7 @@ class RedisPubSub(PubSub, LuaContainer):
     """
     # Main public API
     LUA_PUBLISH = 'lua-publish'
+    LUA_PUBLISH_MANY = 'lua-publish-many'
     LUA_GET_FROM_CONSUMER_QUEUE = 'lua-get-from-consumer-queue'
     LUA_REJECT = 'lua-reject'
     LUA_ACK_DELETE = 'lua-ack-delete'
@@ -433,22 +536,38 @@ class RedisPubSub(PubSub, LuaContainer):
     LUA_DELETE_EXPIRED_CONSUMER = 'lua-delete-expired-consumer'
     LUA_MOVE_TO_TARGET_QUEUES = 'lua-move-to-target-queues'
 
+    # Consumer queues no longer used
+    LUA_MOVE_CONSUMER_QUEUE = 'lua-move-consumer-queue'
+    LUA_DROP_CONSUMER_QUEUE = 'lua-drop-consumer-queue'
+
     # Message browsing
     LUA_GET_MESSAGE_LIST = 'lua-get-message-list'
 
     # Message deleting
     LUA_DELETE_FROM_TOPIC = 'lua-delete-from-topic'
 
+    # Callback delivery
+    LUA_RELEASE_DELIVERY_LEASE = 'lua-release-delivery-lease'
+
 # ################################################################################################################################
 
-    def __init__(self, kvdb, key_prefix='zato:pubsub:'):
+    def __init__(self, kvdb, key_prefix='zato:pubsub:', fan_out=False):
         super(RedisPubSub, self).__init__()
         self.kvdb = kvdb
         self.lua_programs = {}
 
+        # If True, messages are copied to queues of consumers already subscribed to a topic when they are published,
+        # otherwise they wait in the topic until move_to_target_queues runs. Unlike the latter, which moves messages
+        # by their priority, fanning out adds them to queues in the order they are published in.
+        self.fan_out = fan_out
+
+        # String to string, key = sub_key of a consumer belonging to a group, value = the group's queue
+        self.sub_to_group_queue = {}
+
         self.MSG_IDS_PREFIX = '{}{}'.format(key_prefix, 'zset:msg-ids:{}')
         self.BACKLOG_FULL_KEY = '{}{}'.format(key_prefix, 'hash:backlog-full')
         self.CONSUMER_MSG_IDS_PREFIX = '{}{}'.format(key_prefix, 'list:consumer:msg-ids:{}')
+        self.GROUP_MSG_IDS_PREFIX = '{}{}'.format(key_prefix, 'list:group:msg-ids:{}:{}') # Topic name and group name
         self.CONSUMER_IN_FLIGHT_IDS_PREFIX = '{}{}'.format(key_prefix, 'set:consumer:in-flight:ids:{}')
         self.CONSUMER_IN_FLIGHT_DATA_PREFIX = '{}{}'.format(key_prefix, 'hash:consumer:in-flight:data:{}')
         self.MSG_VALUES_KEY = '{}{}'.format(key_prefix, 'hash:msg-values')
@@ -458,9 +577,19 @@ class RedisPubSub(PubSub, LuaContainer):
         self.LAST_PUB_TIME_KEY = '{}{}'.format(key_prefix, 'hash:last-pub-time') # In UTC
         self.LAST_SEEN_CONSUMER_KEY = '{}{}'.format(key_prefix, 'hash:last-seen-consumer') # In UTC
         self.LAST_SEEN_PRODUCER_KEY = '{}{}'.format(key_prefix, 'hash:last-seen-producer') # In UTC
+        self.TOPIC_CONSUMERS_PREFIX = '{}{}'.format(key_prefix, 'hash:topic-consumers:{}') # Consumer queue -> its max depth
+        self.DELIVERY_STATS_PREFIX = '{}{}'.format(key_prefix, 'hash:delivery-stats:{}') # By sub_key
+        self.DELIVERY_LEASE_PREFIX = '{}{}'.format(key_prefix, 'string:delivery-lease:{}:{}') # By sub_key and lease number
+
+        # Names of consumer queues new messages were added to are published to this channel
+        self.NOTIFY_CHANNEL = '{}{}'.format(key_prefix, 'channel:notify')
+        self.notifier = QueueNotifier(self.kvdb, self.NOTIFY_CHANNEL)
 
         self.add_lua_program(self.LUA_PUBLISH, lua.lua_publish)
+        self.add_lua_program(self.LUA_PUBLISH_MANY, lua.lua_publish_many)
         self.add_lua_program(self.LUA_MOVE_TO_TARGET_QUEUES, lua.lua_move_to_target_queues)
+        self.add_lua_program(self.LUA_MOVE_CONSUMER_QUEUE, lua.lua_move_consumer_queue)
+        self.add_lua_program(self.LUA_DROP_CONSUMER_QUEUE, lua.lua_drop_consumer_queue)
         self.add_lua_program(self.LUA_GET_FROM_CONSUMER_QUEUE, lua.lua_get_from_cons_queue)
         self.add_lua_program(self.LUA_REJECT, lua.lua_reject)
         self.add_lua_program(self.LUA_ACK_DELETE, lua.lua_ack_delete)
@@ -468,6 +597,7 @@ class RedisPubSub(PubSub, LuaContainer):
         self.add_lua_program(self.LUA_DELETE_EXPIRED_CONSUMER, lua.lua_delete_expired_consumer)
         self.add_lua_program(self.LUA_GET_MESSAGE_LIST, lua.lua_get_message_list)
         self.add_lua_program(self.LUA_DELETE_FROM_TOPIC, lua.lua_delete_from_topic)
+        self.add_lua_program(self.LUA_RELEASE_DELIVERY_LEASE, lua.lua_release_delivery_lease)
 
 # ################################################################################################################################
 
@@ -497,20 +627,105 @@ class RedisPubSub(PubSub, LuaContainer):
 
     def delete_topic_metadata(self, topic):
         self.kvdb.hdel(self.LAST_PUB_TIME_KEY, topic.name)
+        self.kvdb.delete(self.TOPIC_CONSUMERS_PREFIX.format(topic.name))
 
     def delete_consumer_metadata(self, client):
         self.kvdb.hdel(self.LAST_SEEN_CONSUMER_KEY, client.id)
+        self.kvdb.delete(self.DELIVERY_STATS_PREFIX.format(client.sub_key))
 
     def delete_producer_metadata(self, client):
         self.kvdb.hdel(self.LAST_SEEN_PRODUCER_KEY, client.id)
 
+# ################################################################################################################################
+
+    # Each topic's consumers are kept in Redis too so that publishers can fan messages out to their queues.
+    # The hashes are updated by all servers regardless of whether they fan messages out themselves.
+
+    def get_consumer_queue(self, sub_key):
+        """ Returns the queue a consumer gets messages from - either its own one or that of a group it belongs to.
+        """
+        return self.sub_to_group_queue.get(sub_key) or self.CONSUMER_MSG_IDS_PREFIX.format(sub_key)
+
+    def _set_topic_consumer(self, sub_key, topic_name, max_depth):
+        if sub_key:
+            self.kvdb.hset(self.TOPIC_CONSUMERS_PREFIX.format(topic_name), self.get_consumer_queue(sub_key), max_depth)
+
+    def _delete_topic_consumer_queue(self, topic_name, cons_queue):
+        """ Stops delivering messages to a consumer queue unless it is a group's one that other consumers still use.
+        Returns True if the queue is no longer used. Must be called with self.update_lock held.
+        """
+        for client_id in self.topic_to_cons.get(topic_name, []):
+            if self.get_consumer_queue(self.cons_to_sub[client_id]) == cons_queue:
+                return False
+
+        self.kvdb.hdel(self.TOPIC_CONSUMERS_PREFIX.format(topic_name), cons_queue)
+        return True
+
+    def _move_consumer_queue(self, source_queue, target_queue):
+        """ Moves messages waiting in a queue no longer used to the one its consumer gets messages from now.
+        """
+        moved = self.run_lua(self.LUA_MOVE_CONSUMER_QUEUE, [source_queue, target_queue])
+        if moved:
+            self.logger.info('Moved %s message(s) from `%s` to `%s`', moved, source_queue, target_queue)
+            self.kvdb.publish(self.NOTIFY_CHANNEL, target_queue)
+
+    def _drop_consumer_queue(self, cons_queue):
+        """ Deletes a queue no consumer gets messages from anymore, along with messages no other consumer waits for.
+        """
+        dropped = self.run_lua(self.LUA_DROP_CONSUMER_QUEUE, [
+            cons_queue, self.UNACK_COUNTER_KEY, self.MSG_VALUES_KEY, self.MSG_METADATA_KEY, self.MSG_EXPIRE_AT_KEY])
+        if dropped:
+            self.logger.info('Dropped %s message(s) from `%s`', dropped, cons_queue)
+
+    def add_subscription(self, sub_key, client_id, topic):
+        super(RedisPubSub, self).add_subscription(sub_key, client_id, topic)
+
+        consumer = self.consumers.get(client_id)
+        self._set_topic_consumer(sub_key, topic, consumer.max_depth if consumer else PUB_SUB.DEFAULT_MAX_BACKLOG)
+
+    def add_consumer(self, client, topic):
+        with self.update_lock:
+            old_queue = self.get_consumer_queue(client.sub_key)
+
+            if client.group_name:
+                self.sub_to_group_queue[client.sub_key] = self.GROUP_MSG_IDS_PREFIX.format(topic.name, client.group_name)
+            else:
+                self.sub_to_group_queue.pop(client.sub_key, None)
+
+            super(RedisPubSub, self).add_consumer(client, topic)
+            self._set_topic_consumer(client.sub_key, topic.name, client.max_depth)
+
+            # The consumer moved to another group, or left one, so the previous queue may not be needed anymore,
+            # in which case messages still waiting in it go to the new one.
+            new_queue = self.get_consumer_queue(client.sub_key)
+            if old_queue != new_queue:
+                if self._delete_topic_consumer_queue(topic.name, old_queue):
+                    self._move_consumer_queue(old_queue, new_queue)
+
+    def update_consumer(self, client, topic):
+        super(RedisPubSub, self).update_consumer(client, topic)
+
+        consumer = self.consumers[client.id]
+        self._set_topic_consumer(consumer.sub_key, topic.name, consumer.max_depth)
+
+    def delete_consumer(self, client, topic):
+        with self.update_lock:
+            cons_queue = self.get_consumer_queue(client.sub_key)
+
+            super(RedisPubSub, self).delete_consumer(client, topic)
+            self.sub_to_group_queue.pop(client.sub_key, None)
+
+            # Nobody will get messages from that queue anymore, e.g. it was the last member of a group
+            if self._delete_topic_consumer_queue(topic.name, cons_queue):
+                self._drop_consumer_queue(cons_queue)
+
 # ################################################################################################################################
 
     def _raise_cant_publish_error(self, ctx):
         raise PermissionDenied("Permision denied. Can't publish to `{}`".format(ctx.topic))
 
-    def publish(self, ctx):
-        """ Publishes a message on a selected topic.
+    def _validate_publish(self, ctx):
+        """ Raises PermissionDenied if the producer cannot publish to a topic.
         """
         # Note that the client always receives the same response but logs contain details
         with self.update_lock:
@@ -530,38 +745,113 @@ class RedisPubSub(PubSub, LuaContainer):
                 self.logger.warn('Producer `%s` is not active. Producer `%s`.', ctx.client_id, ctx.topic)
                 self._raise_cant_publish_error(ctx)
 
+    def _get_score(self, priority, now_seconds):
+        """ The score is built by prefixing the number of milliseconds since UNIX epoch with message's priority. Hence higher
+        priority messages will get higher score whereas messages of equal priority will be still scored according
+        to their time of being published. But in the latter case this is still approximate with a high rate of publications
+        so if guarantees regarding the order of messages are required the messages should be arranged
+        in sequences on client side.
+        """
+        return '{}{}'.format(priority, now_seconds)
+
+    def _get_publish_keys(self, topic):
+        """ Returns keys publishing programs operate on, including queues of topic's consumers if messages are fanned out,
+        so that all of them are declared upfront, as Redis requires.
+        """
+        topic_consumers_key = self.TOPIC_CONSUMERS_PREFIX.format(topic)
+
+        keys = [self.MSG_IDS_PREFIX.format(topic), self.MSG_VALUES_KEY, self.MSG_METADATA_KEY, self.MSG_EXPIRE_AT_KEY,
+            self.LAST_PUB_TIME_KEY, self.LAST_SEEN_PRODUCER_KEY, topic_consumers_key, self.UNACK_COUNTER_KEY]
+
+        if self.fan_out:
+            keys.extend(self.kvdb.hkeys(topic_consumers_key))
+
+        return keys
+
+    def _log_overflown(self, overflown, payloads):
+        """ Logs messages that could not be fanned out to consumer queues that were full, the same way the ones found
+        by move_to_target_queues are.
+        """
+        for cons_queue, msg_id in overflown:
+            sub_key = cons_queue[cons_queue.rfind(':')+1:]
+            consumer = self.get_consumer_by_sub_key(sub_key)
+
+            self.logger.warn('Message overflow, queue:`%s`, msg_id:`%s`', cons_queue, msg_id)
+            logger_overflown.warn('%s - %s - %s', msg_id, consumer.name if consumer else sub_key, payloads[msg_id])
+
+    def publish(self, ctx):
+        """ Publishes a message on a selected topic.
+        """
+        self._validate_publish(ctx)
+
         if self.get_topic_depth(ctx.topic) >= self.topics[ctx.topic].max_depth:
             self.logger.warn('Topic full, `%s`, max depth `%s`', ctx.topic, self.topics[ctx.topic].max_depth)
             raise ItemFull('Topic full', ctx.topic, self.topics[ctx.topic].max_depth)
 
-        id_key = self.MSG_IDS_PREFIX.format(ctx.topic)
-
         # Each message will carry information what topic it's intended for
         ctx.msg.topic = ctx.topic
 
-        # The score is built by prefixing the number of milliseconds since UNIX epoch with message's priority. Hence higher
-        # priority messages will get higher score whereas messages of equal priority will be still scored according
-        # to their time of being published. But in the latter case this is still approximate with a high rate of publications
-        # so if guarantees regarding the order of messages are required the messages should be arranged
-        # in sequences on client side.
-
-        now_seconds = datetime_to_seconds(datetime.utcnow())
-        score = '{}{}'.format(ctx.msg.priority, now_seconds)
+        score = self._get_score(ctx.msg.priority, datetime_to_seconds(datetime.utcnow()))
 
         try:
-            self.run_lua(
-                self.LUA_PUBLISH, [
-                    id_key, self.MSG_VALUES_KEY, self.MSG_METADATA_KEY, self.MSG_EXPIRE_AT_KEY, self.LAST_PUB_TIME_KEY,
-                      self.LAST_SEEN_PRODUCER_KEY],
+            overflown = self.run_lua(
+                self.LUA_PUBLISH, self._get_publish_keys(ctx.topic),
                     [score, ctx.msg.msg_id, ctx.msg.expire_at_utc.isoformat(), ctx.msg.payload, ctx.msg.to_json(),
-                       ctx.topic, datetime.utcnow().isoformat(), ctx.client_id])
+                       ctx.topic, datetime.utcnow().isoformat(), ctx.client_id, int(self.fan_out), self.NOTIFY_CHANNEL])
         except Exception, e:
             self.logger.error('Pub error `%s`', format_exc(e))
             raise
         else:
+            if overflown:
+                self._log_overflown(overflown, {ctx.msg.msg_id: ctx.msg.payload})
+
             self.logger.info('Published `%s` to `%s`, exp `%s`', ctx.msg.msg_id, ctx.topic, ctx.msg.expire_at_utc.isoformat())
             return ctx
 
+    def publish_many(self, ctx):
+        """ Publishes a batch of messages on a selected topic. The producer is validated once and the topic's depth is checked
+        and all the messages are stored in a single Lua call. Returns a list of dicts, one for each message, with its ID
+        and status, messages that would exceed topic's max depth are not published.
+        """
+        self._validate_publish(ctx)
+
+        now = datetime.utcnow()
+        now_seconds = datetime_to_seconds(now)
+        max_depth = self.topics[ctx.topic].max_depth
+
+        args = [max_depth, ctx.topic, now.isoformat(), ctx.client_id, int(self.fan_out), self.NOTIFY_CHANNEL]
+
+        for msg in ctx.msgs:
+            msg.topic = ctx.topic
+            args.extend([self._get_score(msg.priority, now_seconds), msg.msg_id, msg.expire_at_utc.isoformat(), msg.payload,
+                msg.to_json()])
+
+        try:
+            result, overflown = self.run_lua(self.LUA_PUBLISH_MANY, self._get_publish_keys(ctx.topic), args)
+        except Exception, e:
+            self.logger.error('Pub error `%s`', format_exc(e))
+            raise
+
+        if overflown:
+            self._log_overflown(overflown, dict((msg.msg_id, msg.payload) for msg in ctx.msgs))
+
+        out = []
+        full = 0
+
+        for msg, is_published in zip(ctx.msgs, result):
+            if is_published:
+                out.append({'msg_id': msg.msg_id, 'status': ZATO_OK, 'details': ''})
+            else:
+                out.append({'msg_id': msg.msg_id, 'status': ZATO_ERROR, 'details': 'Topic full'})
+                full += 1
+
+        if full:
+            self.logger.warn('Topic full, `%s`, max depth `%s`, `%d` message(s) not published', ctx.topic, max_depth, full)
+
+        self.logger.info('Published `%d` message(s) to `%s`', len(out) - full, ctx.topic)
+
+        return out
+
 # ################################################################################################################################
 
     def subscribe(self, ctx, sub_key=None):
@@ -579,9 +869,9 @@ class RedisPubSub(PubSub, LuaContainer):
 
 # ################################################################################################################################
 
-    def get(self, ctx):
-        self.logger.debug('Get by sub_key `%s`', ctx.sub_key)
-
+    def _get(self, ctx):
+        """ Returns messages currently available to a consumer, possibly none.
+        """
         with self.in_flight_lock:
             with self.update_lock:
 
@@ -596,32 +886,64 @@ class RedisPubSub(PubSub, LuaContainer):
                         consumer.name, consumer.max_depth)
 
                 # Now that the client is known to be a valid one we can get all their messages
-                cons_queue = self.CONSUMER_MSG_IDS_PREFIX.format(ctx.sub_key)
+                cons_queue = self.get_consumer_queue(ctx.sub_key)
                 cons_in_flight_ids = self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(ctx.sub_key)
                 cons_in_flight_data = self.CONSUMER_IN_FLIGHT_DATA_PREFIX.format(ctx.sub_key)
 
-                messages = self.run_lua(
+                return self.run_lua(
                     self.LUA_GET_FROM_CONSUMER_QUEUE,
                     [cons_queue, cons_in_flight_ids, cons_in_flight_data, self.LAST_SEEN_CONSUMER_KEY,
                          self.MSG_METADATA_KEY, self.MSG_VALUES_KEY],
                     [ctx.max_batch_size, datetime.utcnow().isoformat(), self.sub_to_cons[ctx.sub_key]])
 
-                self.logger.debug('Get messages `%s`:`%r`', ctx.sub_key, messages)
+    def _wait_and_get(self, ctx):
+        """ Returns messages available to a consumer, waiting up to ctx.wait seconds for new ones if there are none.
+        No locks are held while waiting.
+        """
+        deadline = time() + min(ctx.wait, PUB_SUB.MAX_GET_WAIT)
+        cons_queue = self.get_consumer_queue(ctx.sub_key)
+
+        # Registered before the first attempt so that no notification is missed in between
+        event = self.notifier.add_waiter(cons_queue)
+
+        try:
+            messages = self._get(ctx)
+
+            while not messages:
+                remaining = deadline - time()
+                if remaining <= 0 or not event.wait(remaining):
+                    break
+
+                # Another consumer from the same group, or another server, may have taken the messages already
+                event.clear()
+                messages = self._get(ctx)
+
+            return messages
+
+        finally:
+            self.notifier.remove_waiter(cons_queue, event)
+
+    def get(self, ctx):
+        self.logger.debug('Get by sub_key `%s`', ctx.sub_key)
+
+        messages = self._wait_and_get(ctx) if ctx.wait else self._get(ctx)
 
-                for msg in messages:
+        self.logger.debug('Get messages `%s`:`%r`', ctx.sub_key, messages)
 
-                    if self.logger.isEnabledFor(logging.DEBUG):
-                        self.logger.debug('Get result: sub_key `%s`, msg `%s`', ctx.sub_key, msg)
-                    else:
-                        self.logger.info('Get result: sub_key `%s`, metadata `%s`', ctx.sub_key, msg[1])
+        for msg in messages:
 
-                    payload = msg[0][0] if msg[0] else None
-                    metadata = loads(msg[1][0])
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('Get result: sub_key `%s`, msg `%s`', ctx.sub_key, msg)
+            else:
+                self.logger.info('Get result: sub_key `%s`, metadata `%s`', ctx.sub_key, msg[1])
 
-                    if ctx.get_format == PUB_SUB.GET_FORMAT.JSON.id:
-                        yield {'payload': payload, 'metadata':metadata}
-                    else:
-                        yield Message(payload=payload, **metadata)
+            payload = msg[0][0] if msg[0] else None
+            metadata = loads(msg[1][0])
+
+            if ctx.get_format == PUB_SUB.GET_FORMAT.JSON.id:
+                yield {'payload': payload, 'metadata':metadata}
+            else:
+                yield Message(payload=payload, **metadata)
 
 # ################################################################################################################################
 
@@ -633,7 +955,7 @@ class RedisPubSub(PubSub, LuaContainer):
 
         cons_in_flight_ids = self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(ctx.sub_key)
         cons_in_flight_data = self.CONSUMER_IN_FLIGHT_DATA_PREFIX.format(ctx.sub_key)
-        cons_queue = self.CONSUMER_MSG_IDS_PREFIX.format(ctx.sub_key)
+        cons_queue = self.get_consumer_queue(ctx.sub_key)
 
         result = self.run_lua(
             self.LUA_ACK_DELETE,
@@ -658,7 +980,7 @@ class RedisPubSub(PubSub, LuaContainer):
         # But as long as they don't know each other's subscription keys they can't reject each other's messages.
         self.validate_sub_key(ctx.sub_key)
 
-        cons_queue = self.CONSUMER_MSG_IDS_PREFIX.format(ctx.sub_key)
+        cons_queue = self.get_consumer_queue(ctx.sub_key)
         cons_in_flight_ids = self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(ctx.sub_key)
         cons_in_flight_data = self.CONSUMER_IN_FLIGHT_DATA_PREFIX.format(ctx.sub_key)
 
@@ -690,7 +1012,7 @@ class RedisPubSub(PubSub, LuaContainer):
             # Delete from consumer queues
             for consumer in self.cons_to_topic:
                 sub_key = self.cons_to_sub[consumer]
-                consumer_msg_ids = self.CONSUMER_MSG_IDS_PREFIX.format(sub_key)
+                consumer_msg_ids = self.get_consumer_queue(sub_key)
                 consumer_in_flight_ids = self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(sub_key)
 
                 keys = [consumer_msg_ids, consumer_in_flight_ids, self.MSG_VALUES_KEY, self.MSG_EXPIRE_AT_KEY, 
@@ -702,11 +1024,9 @@ class RedisPubSub(PubSub, LuaContainer):
 # ############################################################################################################################
 
     def move_to_target_queues(self):
-        """ Invoked periodically in order to fetch data sent to a topic and move it to each consumer's queue.
+        """ Invoked periodically in order to fetch data sent to a topic and move it to each consumer's queue,
+        or only once to a queue of each consumer group.
         """
-        # TODO: We currently deliver messages to each consumer. However, we also need to support 
-        # the delivery to only one consumer chosen randomly from each of the subscribed ones.
-
         with self.update_lock:
 
             out = []
@@ -732,18 +1052,28 @@ class RedisPubSub(PubSub, LuaContainer):
 
                 consumers = self.topic_to_cons.get(topic, [])
                 if consumers:
+
+                    # Consumers in the same group share a queue and each message is moved to it only once
+                    target_queues = {}
+
                     for consumer in consumers:
                         sub_key = self.cons_to_sub[consumer]
                         self.logger.debug('Move: Found sub `%s` for topic `%s` by consumer `%s`', sub_key, topic, consumer)
 
-                        keys.append(self.CONSUMER_MSG_IDS_PREFIX.format(sub_key))
-                        args.append(self.consumers[consumer].max_depth)
+                        target_queues.setdefault(self.get_consumer_queue(sub_key), self.consumers[consumer].max_depth)
+
+                    for target_queue, max_depth in target_queues.items():
+                        keys.append(target_queue)
+                        args.append(max_depth)
 
                     move_result = self.run_lua(self.LUA_MOVE_TO_TARGET_QUEUES, keys, args)
                     if move_result:
                         self.logger.info('Move: result `%s`, keys `%s`', move_result, ', '.join(keys))
                         out.append(move_result)
 
+                        for target_queue in set(elem[1] for elem in move_result if elem[0] == PUB_SUB.MOVE_RESULT.MOVED):
+                            self.kvdb.publish(self.NOTIFY_CHANNEL, target_queue)
+
                 else:
                     self.logger.info('Move: no consumers for topic `%s`', topic)
 
@@ -761,7 +1091,20 @@ class RedisPubSub(PubSub, LuaContainer):
         """ Returns current depth of a consumer's queue. Doesn't held onto any locks so by the time the data
         is returned to the caller the depth may have already changed.
         """
-        return self.kvdb.llen(self.CONSUMER_MSG_IDS_PREFIX.format(sub_key))
+        return self.kvdb.llen(self.get_consumer_queue(sub_key))
+
+    def get_consumer_queue_lag(self, sub_key):
+        """ Returns the number of seconds the oldest message in a consumer's queue has been waiting for, or 0 if there are
+        no messages. For consumers belonging to a group this is the lag of the group as a whole.
+        """
+        msg_id = self.kvdb.lindex(self.get_consumer_queue(sub_key), -1)
+        metadata = self.kvdb.hget(self.MSG_METADATA_KEY, msg_id) if msg_id else None
+
+        if not metadata:
+            return 0
+
+        creation_time_utc = parse(loads(metadata)['creation_time_utc'])
+        return max((datetime.utcnow() - creation_time_utc).total_seconds(), 0)
 
     def get_consumer_queue_in_flight_depth(self, sub_key):
         """ Returns current depth of an in-flight consumer's queue. Doesn't held onto any locks so by the time the data
@@ -810,7 +1153,7 @@ class RedisPubSub(PubSub, LuaContainer):
         """
         for item in self.run_lua(
             self.LUA_GET_MESSAGE_LIST, [
-                self.CONSUMER_MSG_IDS_PREFIX.format(sub_key), self.MSG_METADATA_KEY], [PUB_SUB.MESSAGE_SOURCE.CONSUMER_QUEUE.id]):
+                self.get_consumer_queue(sub_key), self.MSG_METADATA_KEY], [PUB_SUB.MESSAGE_SOURCE.CONSUMER_QUEUE.id]):
             yield Message(**loads(item))
 
     def get_consumer_in_flight_message_list(self, sub_key):
@@ -856,6 +1199,48 @@ class RedisPubSub(PubSub, LuaContainer):
 
         return out
 
+    def update_delivery_stats(self, sub_key, msg_count, delivery_time, error=None):
+        """ Records an attempt to deliver a batch of messages to a consumer's callback, delivery_time is in milliseconds.
+        """
+        key = self.DELIVERY_STATS_PREFIX.format(sub_key)
+
+        pipe = self.kvdb.pipeline()
+        pipe.hincrby(key, 'batches', 1)
+        pipe.hincrbyfloat(key, 'time_total', delivery_time)
+        pipe.hset(key, 'time_last', delivery_time)
+
+        if error:
+            pipe.hincrby(key, 'failures', 1)
+            pipe.hset(key, 'last_failure', datetime.utcnow().isoformat())
+            pipe.hset(key, 'last_error', error)
+        else:
+            pipe.hincrby(key, 'delivered', msg_count)
+
+        pipe.execute()
+
+    def acquire_delivery_lease(self, sub_key, max_leases, expires):
+        """ Acquires one of max_leases cluster-wide leases on delivering a batch of messages to a consumer's callback,
+        expires is in seconds. Returns a (key, token) tuple the lease can be released with or None if all of them
+        are currently held, e.g. by other servers.
+        """
+        token = new_cid()
+
+        for idx in range(max_leases):
+            key = self.DELIVERY_LEASE_PREFIX.format(sub_key, idx)
+            if self.kvdb.set(key, token, px=int(expires * 1000), nx=True):
+                return key, token
+
+    def release_delivery_lease(self, lease):
+        """ Releases a delivery lease unless it has already expired.
+        """
+        key, token = lease
+        self.run_lua(self.LUA_RELEASE_DELIVERY_LEASE, [key], [token])
+
+    def get_delivery_stats(self, sub_key):
+        """ Returns statistics of deliveries to a consumer's callback, if there were any.
+        """
+        return self.kvdb.hgetall(self.DELIVERY_STATS_PREFIX.format(sub_key))
+
     def get_callback_consumers(self):
         """ Returns these consumers who specified their messages should be delivered through callback URLs.
         """
@@ -889,6 +1274,29 @@ class PubSubAPI(object):
 
         return self.impl.publish(ctx)
 
+    def publish_many(self, messages, topic, client_id=None):
+        """ Publishes a batch of messages to a given topic in a single round trip. Each message is either a payload
+        or a dict with payload and optionally mime_type, priority, expiration and msg_id keys. Returns a list of dicts,
+        one for each message, with msg_id, status and details keys.
+        """
+        client_id = client_id or self.get_default_producer().id
+        producer = self.impl.producers[client_id].name
+
+        ctx = PubManyCtx()
+        ctx.client_id = client_id
+        ctx.topic = topic
+
+        for msg in messages:
+            if not isinstance(msg, dict):
+                msg = {'payload': msg}
+
+            ctx.msgs.append(Message(
+                msg['payload'], topic, msg.get('mime_type') or PUB_SUB.DEFAULT_MIME_TYPE,
+                msg.get('priority') or PUB_SUB.DEFAULT_PRIORITY, msg.get('expiration') or PUB_SUB.DEFAULT_EXPIRATION,
+                msg.get('msg_id'), producer))
+
+        return self.impl.publish_many(ctx)
+
     def subscribe(self, client_id, topics, sub_key=None):
         """ Subscribes a client to one or more topic. Returns a subscription key assigned.
         """
@@ -906,10 +1314,11 @@ class PubSubAPI(object):
         return self.impl.subscribe(ctx, sub_key)
 
     def get(self, sub_key, max_batch_size=PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE, is_fifo=PUB_SUB.DEFAULT_IS_FIFO,
-            get_format=PUB_SUB.GET_FORMAT.DEFAULT.id):
-        """ Gets one or more message, if any are available, for the given subscription key.
+            get_format=PUB_SUB.GET_FORMAT.DEFAULT.id, wait=0):
+        """ Gets one or more message, if any are available, for the given subscription key. If there are none and wait
+        is given, blocks for up to that many seconds (but no more than PUB_SUB.MAX_GET_WAIT) until any are published.
         """
-        return self.impl.get(GetCtx(sub_key, max_batch_size, is_fifo, get_format))
+        return self.impl.get(GetCtx(sub_key, max_batch_size, is_fifo, get_format, wait))
 
     def acknowledge(self, sub_key, msg_ids):
         """ Acknowledges one or more message IDs for a given subscription key.
@@ -972,6 +1381,12 @@ class PubSubAPI(object):
     def get_consumer_queue_in_flight_depth(self, sub_key):
         return self.impl.get_consumer_queue_in_flight_depth(sub_key)
 
+    def get_consumer_queue_lag(self, sub_key):
+        return self.impl.get_consumer_queue_lag(sub_key)
+
+    def get_delivery_stats(self, sub_key):
+        return self.impl.get_delivery_stats(sub_key)
+
     def get_consumer_by_sub_key(self, sub_key):
         return self.impl.get_consumer_by_sub_key(sub_key)
 
@@ -8,7 +8,50 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-lua_publish = """
+# Shared by publishing programs, copies a message ID to queues of consumers subscribed to a topic at the time of publication.
+# Consumer queues are passed in as KEYS[9] onwards, as resolved by the caller, and each one is checked against a topic's hash
+# of consumer queue -> max depth of that queue so that queues of consumers deleted in the meantime are skipped.
+# Queues already at their max depth are not pushed to and are added to the overflown table instead. Queues pushed to
+# are added to the notified table so that a notification can be published for each of them once the whole program completes.
+#
+# Note that messages are pushed in the order they are published in, regardless of their priority.
+_lua_fan_out = """
+
+   local function get_consumers(keys, topic_consumers_key)
+       local consumers = {}
+
+       for idx = 9, #keys do
+           local max_depth = redis.call('hget', topic_consumers_key, keys[idx])
+           if max_depth then
+               table.insert(consumers, {keys[idx], tonumber(max_depth)})
+           end
+       end
+
+       return consumers
+   end
+
+   local function fan_out(consumers, unack_counter, msg_id, overflown, notified)
+       local pushed = 0
+
+       for _, consumer in ipairs(consumers) do
+           local cons_queue = consumer[1]
+
+           if redis.call('llen', cons_queue) >= consumer[2] then
+               table.insert(overflown, {cons_queue, msg_id})
+           else
+               redis.call('lpush', cons_queue, msg_id)
+               notified[cons_queue] = true
+               pushed = pushed + 1
+           end
+       end
+
+       if pushed > 0 then
+           redis.pcall('hincrby', unack_counter, msg_id, pushed)
+       end
+   end
+"""
+
+lua_publish = _lua_fan_out + """
 
    local id_key = KEYS[1]
    local msg_values = KEYS[2]
@@ -16,6 +59,8 @@ lua_publish = """
    local msg_expire_at = KEYS[4]
    local last_pub_time_key = KEYS[5]
    local last_seen_producer_key = KEYS[6]
+   local topic_consumers_key = KEYS[7]
+   local unack_counter = KEYS[8]
 
    local score = ARGV[1]
    local msg_id = ARGV[2]
@@ -25,13 +70,106 @@ lua_publish = """
    local topic_name = ARGV[6]
    local utc_now = ARGV[7]
    local client_id = ARGV[8]
+   local is_fan_out = tonumber(ARGV[9]) == 1
+   local notify_channel = ARGV[10]
+
+   local consumers = {}
+   local overflown = {}
+   local notified = {}
+
+   if is_fan_out then
+       consumers = get_consumers(KEYS, topic_consumers_key)
+   end
+
+   -- Without any consumers yet the message waits in the topic until it is moved to their queues
+   if #consumers == 0 then
+       redis.pcall('zadd', id_key, score, msg_id)
+   end
 
-   redis.pcall('zadd', id_key, score, msg_id)
    redis.pcall('hset', msg_values, msg_id, msg_value)
    redis.pcall('hset', msg_metadata_key, msg_id, msg_metadata)
    redis.pcall('hset', msg_expire_at, msg_id, expire_at)
    redis.pcall('hset', last_pub_time_key, topic_name, utc_now)
    redis.pcall('hset', last_seen_producer_key, client_id, utc_now)
+
+   if #consumers > 0 then
+       fan_out(consumers, unack_counter, msg_id, overflown, notified)
+   end
+
+   for cons_queue, _ in pairs(notified) do
+       redis.call('publish', notify_channel, cons_queue)
+   end
+
+   return overflown
+"""
+
+lua_publish_many = _lua_fan_out + """
+
+   local id_key = KEYS[1]
+   local msg_values = KEYS[2]
+   local msg_metadata_key = KEYS[3]
+   local msg_expire_at = KEYS[4]
+   local last_pub_time_key = KEYS[5]
+   local last_seen_producer_key = KEYS[6]
+   local topic_consumers_key = KEYS[7]
+   local unack_counter = KEYS[8]
+
+   local max_depth = tonumber(ARGV[1])
+   local topic_name = ARGV[2]
+   local utc_now = ARGV[3]
+   local client_id = ARGV[4]
+   local is_fan_out = tonumber(ARGV[5]) == 1
+   local notify_channel = ARGV[6]
+
+   local consumers = {}
+   local overflown = {}
+   local notified = {}
+
+   if is_fan_out then
+       consumers = get_consumers(KEYS, topic_consumers_key)
+   end
+
+   -- Items on idx 7 and above come in groups of five, one group for each message
+   local depth = redis.call('zcard', id_key)
+   local published = 0
+   local out = {}
+
+   for idx = 7, #ARGV, 5 do
+
+       -- Messages above topic's max depth are not published and the caller is told about it
+       if depth >= max_depth then
+           table.insert(out, 0)
+       else
+           local msg_id = ARGV[idx+1]
+
+           redis.pcall('hset', msg_values, msg_id, ARGV[idx+3])
+           redis.pcall('hset', msg_metadata_key, msg_id, ARGV[idx+4])
+           redis.pcall('hset', msg_expire_at, msg_id, ARGV[idx+2])
+
+           -- Without any consumers yet the message waits in the topic until it is moved to their queues
+           if #consumers == 0 then
+               redis.pcall('zadd', id_key, ARGV[idx], msg_id)
+               depth = depth + 1
+           else
+               fan_out(consumers, unack_counter, msg_id, overflown, notified)
+           end
+
+           published = published + 1
+           table.insert(out, 1)
+       end
+   end
+
+   redis.pcall('hset', last_seen_producer_key, client_id, utc_now)
+
+   if published > 0 then
+       redis.pcall('hset', last_pub_time_key, topic_name, utc_now)
+   end
+
+   for cons_queue, _ in pairs(notified) do
+       redis.call('publish', notify_channel, cons_queue)
+   end
+
+   return {out, overflown}
 """
 
 lua_move_to_target_queues = """
@@ -334,3 +472,53 @@ lua_delete_from_topic = """
    return result
 
 """
+
+lua_move_consumer_queue = """
+   local source_queue = KEYS[1]
+   local target_queue = KEYS[2]
+   local moved = 0
+
+   -- Popping from the tail and pushing onto the head keeps the order of the messages moved
+   while redis.pcall('rpoplpush', source_queue, target_queue) do
+       moved = moved + 1
+   end
+
+   return moved
+"""
+
+lua_drop_consumer_queue = """
+   local cons_queue = KEYS[1]
+   local unack_counter = KEYS[2]
+   local msg_values = KEYS[3]
+   local msg_metadata_key = KEYS[4]
+   local msg_expire_at = KEYS[5]
+
+   local ids = redis.pcall('lrange', cons_queue, 0, -1)
+
+   for id_idx, id in ipairs(ids) do
+
+       -- No one will ever confirm the message from this queue and if no one else waits for it, all traces of it are deleted.
+       if redis.pcall('hincrby', unack_counter, id, -1) <= 0 then
+           redis.pcall('hdel', unack_counter, id)
+           redis.pcall('hdel', msg_values, id)
+           redis.pcall('hdel', msg_metadata_key, id)
+           redis.pcall('hdel', msg_expire_at, id)
+       end
+   end
+
+   redis.pcall('del', cons_queue)
+
+   return #ids
+"""
+
+lua_release_delivery_lease = """
+   local lease_key = KEYS[1]
+   local token = ARGV[1]
+
+   -- The lease may have already expired and been acquired by someone else
+   if redis.pcall('get', lease_key) == token then
+       return redis.pcall('del', lease_key)
+   else
+       return 0
+   end
+"""
@@ -233,13 +233,23 @@ class ServiceTestCase(TestCase):
         """ Sets up a service's invocation environment, then invokes and returns
         an instance of the service.
         """
+        # Not imported at module level, zato-common does not depend on zato-server
+        from zato.server.service import WorkerFacades
+
         instance = class_()
+        server = FakeServer(service_store_name_to_impl_name, service_store_impl_name_to_service)
+
         worker_store = MagicMock()
         worker_store.worker_config = MagicMock
         worker_store.worker_config.outgoing_connections = MagicMock(return_value=(None, None, None, None))
         worker_store.worker_config.cloud_openstack_swift = MagicMock(return_value=None)
         worker_store.worker_config.cloud_aws_s3 = MagicMock(return_value=None)
         worker_store.invoke_matcher.is_allowed = MagicMock(return_value=True)
+
+        invocation_ctx = Bunch()
+        invocation_ctx.slow_threshold = server.service_store.services[class_.get_impl_name()]['slow_threshold']
+        invocation_ctx.facades = WorkerFacades(worker_store)
+        worker_store.invocation_ctx_store.get = MagicMock(return_value=invocation_ctx)
         
         simple_io_config = {
             'int_parameters': SIMPLE_IO.INT_PARAMETERS.VALUES,
@@ -248,8 +258,7 @@ class ServiceTestCase(TestCase):
         }
         
         class_.update(
-            instance, channel, FakeServer(service_store_name_to_impl_name, service_store_impl_name_to_service),
-            None, worker_store, new_cid(), request_data, request_data, simple_io_config=simple_io_config,
+            instance, channel, server, None, worker_store, new_cid(), request_data, request_data, simple_io_config=simple_io_config,
             data_format=data_format, job_type=job_type)
 
         def get_data(self, *ignored_args, **ignored_kwargs):
@@ -284,6 +293,9 @@ class ServiceTestCase(TestCase):
 
         sio_keys = set(getattr(instance.SimpleIO, 'input_required', []))
         sio_keys.update(set(getattr(instance.SimpleIO, 'input_optional', [])))
+
+        # Elements with their types forced, such as Integer, are compared by their names
+        sio_keys = set(getattr(key, 'name', key) for key in sio_keys)
         given_keys = set(request_data.keys())
         
         diff = sio_keys ^ given_keys
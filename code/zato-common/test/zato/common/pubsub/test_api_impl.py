@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from json import loads
 from datetime import datetime
+from time import time
 from unittest import TestCase
 
 # datadiff
@@ -19,12 +20,19 @@ from datadiff.tools import assert_equal
 # dateutil
 from dateutil.parser import parse
 
+# gevent
+import gevent
+
+# mock
+from mock import patch
+
 # Zato
-from zato.common import PUB_SUB
+from zato.common import PUB_SUB, ZATO_ERROR, ZATO_OK
 from zato.common.log_message import CID_LENGTH
-from zato.common.pubsub import AckCtx, Client, Consumer, GetCtx, Message, PubCtx, PubSubAPI, PubSubException, RedisPubSub, \
-     RejectCtx, SubCtx, Topic
+from zato.common.pubsub import AckCtx, Client, Consumer, GetCtx, Message, PubCtx, PubSubAPI, PubSubException, \
+     QueueNotifier, RedisPubSub, RejectCtx, SubCtx, Topic
 from zato.common.test import rand_bool, rand_date_utc, rand_int, rand_string
+from zato.common.util import new_cid
 from .common import RedisPubSubCommonTestCase
 
 class RedisPubSubTestCase(RedisPubSubCommonTestCase):
@@ -156,6 +164,249 @@ class RedisPubSubTestCase(RedisPubSubCommonTestCase):
             'msg_id': rand_string(),
         })
 
+    def test_publish_many(self):
+        topic = Topic(rand_string(), max_depth=3)
+        self.api.add_topic(topic)
+
+        producer = Client(rand_int(), rand_string())
+        self.api.add_producer(producer, topic)
+
+        msg_id = rand_string()
+        messages = [rand_string(), {'payload': rand_string(), 'mime_type': 'text/xml', 'priority': 7, 'msg_id': msg_id},
+            rand_string(), rand_string()]
+
+        results = self.api.publish_many(messages, topic.name, producer.id)
+
+        self.assertEquals(len(results), 4)
+        self.assertEquals([result['status'] for result in results], [ZATO_OK, ZATO_OK, ZATO_OK, ZATO_ERROR])
+        self.assertEquals(results[1]['msg_id'], msg_id)
+        self.assertEquals(results[3]['details'], 'Topic full')
+
+        # Only the messages below topic's max depth were published
+        self.assertEquals(self.api.get_topic_depth(topic.name), 3)
+
+        msg_values = self.kvdb.hgetall(self.api.impl.MSG_VALUES_KEY)
+        self.assertEquals(len(msg_values), 3)
+        self.assertEquals(msg_values[msg_id], messages[1]['payload'])
+
+        msg_metadata = loads(self.kvdb.hget(self.api.impl.MSG_METADATA_KEY, msg_id))
+        self.assertEquals(msg_metadata['mime_type'], 'text/xml')
+        self.assertEquals(msg_metadata['priority'], 7)
+        self.assertEquals(msg_metadata['producer'], producer.name)
+
+        self.assertIn(topic.name, self.kvdb.hkeys(self.api.impl.LAST_PUB_TIME_KEY))
+        self.assertIn(str(producer.id), self.kvdb.hkeys(self.api.impl.LAST_SEEN_PRODUCER_KEY))
+
+        # The producer is validated for the batch as a whole
+        self.api.impl.producers[producer.id].is_active = False
+        self.assertRaises(PubSubException, self.api.publish_many, [rand_string()], topic.name, producer.id)
+
+    def test_publish_fan_out(self):
+        self.api.impl.fan_out = True
+
+        topic = Topic(rand_string())
+        self.api.add_topic(topic)
+
+        producer = Client(rand_int(), rand_string())
+        self.api.add_producer(producer, topic)
+
+        # No consumers yet so the message waits in the topic
+        ctx1 = self.api.publish(rand_string(), topic.name, client_id=producer.id)
+        self.assertEquals(self.api.get_topic_depth(topic.name), 1)
+
+        consumer1 = Consumer(rand_int(), rand_string(), sub_key=new_cid())
+        consumer2 = Consumer(rand_int(), rand_string(), sub_key=new_cid(), max_depth=1)
+        self.api.add_consumer(consumer1, topic)
+        self.api.add_consumer(consumer2, topic)
+
+        # Now it is copied to both consumer queues right away, without waiting for move_to_target_queues
+        ctx2 = self.api.publish(rand_string(), topic.name, client_id=producer.id)
+        self.assertEquals(self.api.get_topic_depth(topic.name), 1)
+
+        cons_queue1 = self.api.impl.CONSUMER_MSG_IDS_PREFIX.format(consumer1.sub_key)
+        cons_queue2 = self.api.impl.CONSUMER_MSG_IDS_PREFIX.format(consumer2.sub_key)
+
+        self.assertEquals(self.kvdb.lrange(cons_queue1, 0, -1), [ctx2.msg.msg_id])
+        self.assertEquals(self.kvdb.lrange(cons_queue2, 0, -1), [ctx2.msg.msg_id])
+        self.assertEquals(self.kvdb.hget(self.api.impl.UNACK_COUNTER_KEY, ctx2.msg.msg_id), '2')
+
+        # The second consumer's queue is full so it does not receive any more messages
+        results = self.api.publish_many([rand_string()], topic.name, producer.id)
+        msg_id = results[0]['msg_id']
+
+        self.assertEquals(self.kvdb.lrange(cons_queue1, 0, -1), [msg_id, ctx2.msg.msg_id])
+        self.assertEquals(self.kvdb.lrange(cons_queue2, 0, -1), [ctx2.msg.msg_id])
+        self.assertEquals(self.kvdb.hget(self.api.impl.UNACK_COUNTER_KEY, msg_id), '1')
+
+        # Polling still moves the message published before there were any consumers
+        self.api.impl.move_to_target_queues()
+        self.assertEquals(self.api.get_topic_depth(topic.name), 0)
+        self.assertIn(ctx1.msg.msg_id, self.kvdb.lrange(cons_queue1, 0, -1))
+
+        # Deleted consumers are no longer published to
+        self.api.delete_consumer(consumer1, topic)
+        self.api.publish(rand_string(), topic.name, client_id=producer.id)
+        self.assertEquals(self.kvdb.hkeys(self.api.impl.TOPIC_CONSUMERS_PREFIX.format(topic.name)), [cons_queue2])
+
+        # Not even if they are deleted after their queues have been looked up by the publisher
+        get_publish_keys = self.api.impl._get_publish_keys
+        self.api.impl._get_publish_keys = lambda topic_name: get_publish_keys(topic_name) + [cons_queue1]
+
+        try:
+            self.api.publish(rand_string(), topic.name, client_id=producer.id)
+        finally:
+            self.api.impl._get_publish_keys = get_publish_keys
+
+        self.assertEquals(self.kvdb.llen(cons_queue1), 0)
+
+    def _check_consumer_group(self, fan_out):
+        self.api.impl.fan_out = fan_out
+
+        topic = Topic(rand_string())
+        self.api.add_topic(topic)
+
+        producer = Client(rand_int(), rand_string())
+        self.api.add_producer(producer, topic)
+
+        group_name = rand_string()
+        consumer1 = Consumer(rand_int(), rand_string(), sub_key=new_cid(), group_name=group_name)
+        consumer2 = Consumer(rand_int(), rand_string(), sub_key=new_cid(), group_name=group_name)
+        consumer3 = Consumer(rand_int(), rand_string(), sub_key=new_cid())
+
+        for consumer in consumer1, consumer2, consumer3:
+            self.api.add_consumer(consumer, topic)
+
+        msg_ids = [self.api.publish(rand_string(), topic.name, client_id=producer.id).msg.msg_id for x in range(2)]
+        self.api.impl.move_to_target_queues()
+
+        # Group members share a queue, one copy of each message for the group and another for the consumer outside it
+        group_queue = self.api.impl.GROUP_MSG_IDS_PREFIX.format(topic.name, group_name)
+        self.assertEquals(self.api.impl.get_consumer_queue(consumer1.sub_key), group_queue)
+        self.assertEquals(self.api.impl.get_consumer_queue(consumer2.sub_key), group_queue)
+        self.assertEquals(sorted(self.kvdb.lrange(group_queue, 0, -1)), sorted(msg_ids))
+        self.assertEquals(self.api.get_consumer_queue_current_depth(consumer3.sub_key), 2)
+
+        for msg_id in msg_ids:
+            self.assertEquals(self.kvdb.hget(self.api.impl.UNACK_COUNTER_KEY, msg_id), '2')
+
+        # Each message is delivered to only one member of the group, max_batch_size is an inclusive index in LRANGE ..
+        msgs1 = list(self.api.get(consumer1.sub_key, max_batch_size=0))
+        msgs2 = list(self.api.get(consumer2.sub_key))
+
+        self.assertEquals(len(msgs1), 1)
+        self.assertEquals(len(msgs2), 1)
+        self.assertEquals(sorted([msgs1[0].msg_id, msgs2[0].msg_id]), sorted(msg_ids))
+
+        # .. and is in flight for that member only.
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer1.sub_key), 1)
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer2.sub_key), 1)
+
+        # A rejected message goes back to the group and can be received by another member
+        self.api.reject(consumer1.sub_key, msgs1[0].msg_id)
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer1.sub_key), 0)
+
+        msgs2 = list(self.api.get(consumer2.sub_key))
+        self.assertEquals([msg.msg_id for msg in msgs2], [msgs1[0].msg_id])
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer2.sub_key), 2)
+
+        # The group's queue is published to as long as any of its members is left
+        self.api.delete_consumer(consumer1, topic)
+        self.assertIn(group_queue, self.kvdb.hkeys(self.api.impl.TOPIC_CONSUMERS_PREFIX.format(topic.name)))
+
+        self.api.delete_consumer(consumer2, topic)
+        self.assertNotIn(group_queue, self.kvdb.hkeys(self.api.impl.TOPIC_CONSUMERS_PREFIX.format(topic.name)))
+
+    def test_consumer_group_change(self):
+        topic = Topic(rand_string())
+        self.api.add_topic(topic)
+
+        producer = Client(rand_int(), rand_string())
+        self.api.add_producer(producer, topic)
+
+        consumer = Consumer(rand_int(), rand_string(), sub_key=new_cid())
+        self.api.add_consumer(consumer, topic)
+
+        msg_id = self.api.publish(rand_string(), topic.name, client_id=producer.id).msg.msg_id
+        self.api.impl.move_to_target_queues()
+
+        own_queue = self.api.impl.CONSUMER_MSG_IDS_PREFIX.format(consumer.sub_key)
+        self.assertEquals(self.kvdb.lrange(own_queue, 0, -1), [msg_id])
+
+        # Messages waiting for a consumer follow it to the group it joins ..
+        consumer.group_name = rand_string()
+        self.api.add_consumer(consumer, topic)
+
+        group_queue = self.api.impl.GROUP_MSG_IDS_PREFIX.format(topic.name, consumer.group_name)
+        self.assertEquals(self.kvdb.lrange(own_queue, 0, -1), [])
+        self.assertEquals(self.kvdb.lrange(group_queue, 0, -1), [msg_id])
+
+        # .. and back to its own queue once the last member leaves the group.
+        consumer.group_name = None
+        self.api.add_consumer(consumer, topic)
+
+        self.assertEquals(self.kvdb.lrange(group_queue, 0, -1), [])
+        self.assertEquals(self.kvdb.lrange(own_queue, 0, -1), [msg_id])
+        self.assertEquals(self.kvdb.hget(self.api.impl.UNACK_COUNTER_KEY, msg_id), '1')
+
+        # No one will receive messages from the queue of a deleted consumer so they are not waited for anymore
+        self.api.delete_consumer(consumer, topic)
+
+        self.assertEquals(self.kvdb.lrange(own_queue, 0, -1), [])
+        self.assertIsNone(self.kvdb.hget(self.api.impl.UNACK_COUNTER_KEY, msg_id))
+        self.assertIsNone(self.kvdb.hget(self.api.impl.MSG_VALUES_KEY, msg_id))
+
+    def test_consumer_group_move(self):
+        self._check_consumer_group(False)
+
+    def test_consumer_group_fan_out(self):
+        self._check_consumer_group(True)
+
+    def test_consumer_queue_lag(self):
+        topic = Topic(rand_string())
+        self.api.add_topic(topic)
+
+        producer = Client(rand_int(), rand_string())
+        self.api.add_producer(producer, topic)
+
+        consumer = Consumer(rand_int(), rand_string(), sub_key=new_cid())
+        self.api.add_consumer(consumer, topic)
+
+        self.assertEquals(self.api.get_consumer_queue_lag(consumer.sub_key), 0)
+
+        self.api.publish(rand_string(), topic.name, client_id=producer.id)
+        self.api.impl.move_to_target_queues()
+
+        self.assertTrue(self.api.get_consumer_queue_lag(consumer.sub_key) > 0)
+
+    def test_get_wait(self):
+        self.api.impl.fan_out = True
+
+        topic = Topic(rand_string())
+        self.api.add_topic(topic)
+
+        producer = Client(rand_int(), rand_string())
+        self.api.add_producer(producer, topic)
+
+        consumer = Consumer(rand_int(), rand_string(), sub_key=new_cid())
+        self.api.add_consumer(consumer, topic)
+
+        # Nothing is published so get returns once the time to wait is up
+        start = time()
+        self.assertEquals(list(self.api.get(consumer.sub_key, wait=0.2)), [])
+        self.assertTrue(time() - start >= 0.2)
+
+        # A message published while get is waiting is returned right away
+        payload = rand_string()
+        gevent.spawn_later(0.1, self.api.publish, payload, topic.name, client_id=producer.id)
+
+        start = time()
+        messages = list(self.api.get(consumer.sub_key, get_format=PUB_SUB.GET_FORMAT.JSON.id, wait=5))
+        self.assertTrue(time() - start < 5)
+
+        self.assertEquals(len(messages), 1)
+        self.assertEquals(messages[0]['payload'], payload)
+        self.assertEquals(self.api.impl.notifier.waiters, {})
+
 # ################################################################################################################################
 
     def test_delete_metadata(self):
@@ -418,6 +669,25 @@ class RedisPubSubTestCase(RedisPubSubCommonTestCase):
         self.assertIsInstance(response, bool)
         self.assertEquals(response, True)
 
+    def test_delivery_lease(self):
+        sub_key = rand_string()
+
+        lease1 = self.api.impl.acquire_delivery_lease(sub_key, 2, 10)
+        lease2 = self.api.impl.acquire_delivery_lease(sub_key, 2, 10)
+
+        self.assertNotEquals(lease1[0], lease2[0])
+
+        # Both leases are held so no one else can get one
+        self.assertIsNone(self.api.impl.acquire_delivery_lease(sub_key, 2, 10))
+
+        self.api.impl.release_delivery_lease(lease1)
+        lease3 = self.api.impl.acquire_delivery_lease(sub_key, 2, 10)
+        self.assertEquals(lease3[0], lease1[0])
+
+        # A lease that expired and was acquired by someone else is not released by its previous holder
+        self.api.impl.release_delivery_lease(lease1)
+        self.assertIsNone(self.api.impl.acquire_delivery_lease(sub_key, 2, 10))
+
 # ################################################################################################################################
 
     def test_default_clients(self):
@@ -554,19 +824,22 @@ class CtxObjectsTestCase(TestCase):
         self.assertEquals(ctx.max_batch_size, PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE)
         self.assertEquals(ctx.is_fifo, PUB_SUB.DEFAULT_IS_FIFO)
         self.assertEquals(ctx.get_format, PUB_SUB.GET_FORMAT.OBJECT.id)
+        self.assertEquals(ctx.wait, 0)
 
     def test_get_ctx_custom_attrs(self):
         sub_key = rand_string()
         max_batch_size = rand_int()
         is_fifo = rand_bool()
         get_format = rand_string()
+        wait = rand_int()
 
-        ctx = GetCtx(sub_key, max_batch_size, is_fifo, get_format)
+        ctx = GetCtx(sub_key, max_batch_size, is_fifo, get_format, wait)
 
         self.assertEquals(ctx.sub_key, sub_key)
         self.assertEquals(ctx.max_batch_size, max_batch_size)
         self.assertEquals(ctx.is_fifo, is_fifo)
         self.assertEquals(ctx.get_format, get_format)
+        self.assertEquals(ctx.wait, wait)
 
 # ################################################################################################################################
 
@@ -641,6 +914,7 @@ class CtxObjectsTestCase(TestCase):
         self.assertEquals(consumer.max_depth, PUB_SUB.DEFAULT_MAX_BACKLOG)
         self.assertEquals(consumer.delivery_mode, PUB_SUB.DELIVERY_MODE.PULL.id)
         self.assertEquals(consumer.callback_id, '')
+        self.assertEquals(consumer.group_name, None)
 
     def test_consumer_custom_attrs(self):
         id = rand_int()
@@ -650,7 +924,8 @@ class CtxObjectsTestCase(TestCase):
         max_depth = rand_int()
         delivery_mode = rand_string()
         callback_id = rand_int()
-        consumer = Consumer(id, name, is_active, sub_key, max_depth, delivery_mode, callback_id)
+        group_name = rand_string()
+        consumer = Consumer(id, name, is_active, sub_key, max_depth, delivery_mode, callback_id, group_name=group_name)
 
         self.assertEquals(consumer.id, id)
         self.assertEquals(consumer.name, name)
@@ -659,6 +934,7 @@ class CtxObjectsTestCase(TestCase):
         self.assertEquals(consumer.max_depth, max_depth)
         self.assertEquals(consumer.delivery_mode, delivery_mode)
         self.assertEquals(consumer.callback_id, callback_id)
+        self.assertEquals(consumer.group_name, group_name)
 
 # ################################################################################################################################
 
@@ -719,3 +995,96 @@ class CtxObjectsTestCase(TestCase):
         assert_equal(unjsonified, expected)
 
 # ################################################################################################################################
+
+class _QueueNotifier(QueueNotifier):
+    def _start_listener(self):
+        pass # Notifications are sent directly by tests rather than received from Redis
+
+class QueueNotifierTestCase(TestCase):
+
+    def test_waiters(self):
+        notifier = _QueueNotifier(None, rand_string())
+
+        event1 = notifier.add_waiter('queue1')
+        event2 = notifier.add_waiter('queue1')
+        event3 = notifier.add_waiter('queue2')
+
+        notifier.notify('queue1')
+        self.assertEquals([event1.is_set(), event2.is_set(), event3.is_set()], [True, True, False])
+
+        notifier.remove_waiter('queue1', event1)
+        notifier.remove_waiter('queue1', event2)
+        notifier.remove_waiter('queue2', event3)
+        self.assertEquals(notifier.waiters, {})
+
+    def test_callbacks(self):
+        notifier = _QueueNotifier(None, rand_string())
+        notified = []
+
+        def invalid_callback(cons_queue):
+            raise Exception(cons_queue)
+
+        # A callback raising an exception doesn't stop the other ones from being invoked
+        notifier.add_callback(invalid_callback)
+        notifier.add_callback(notified.append)
+
+        notifier.notify('queue1')
+        notifier.remove_callback(notified.append)
+        notifier.notify('queue2')
+
+        self.assertEquals(notified, ['queue1'])
+
+    def test_listener_reconnects(self):
+
+        class FakePubSub(object):
+            def __init__(self, messages):
+                self.messages = messages
+                self.channels = []
+                self.is_reset = False
+
+            def subscribe(self, channel):
+                self.channels.append(channel)
+
+            def listen(self):
+                for msg in self.messages:
+                    if isinstance(msg, Exception):
+                        raise msg
+                    yield msg
+
+                gevent.sleep(10) # Stays subscribed until the test kills the listener
+
+            def reset(self):
+                self.is_reset = True
+
+        class FakeKVDB(object):
+            def __init__(self, *pubsubs):
+                self.pubsubs = list(pubsubs)
+
+            def pubsub(self):
+                return self.pubsubs.pop(0)
+
+        channel = rand_string()
+        dropped = FakePubSub([{'type':'subscribe', 'data':1}, Exception('Connection dropped')])
+        reconnected = FakePubSub([{'type':'subscribe', 'data':1}, {'type':'message', 'data':'queue1'}])
+
+        notifier = QueueNotifier(FakeKVDB(dropped, reconnected), channel)
+        notified = []
+
+        with patch('zato.common.pubsub.sleep'):
+            event = notifier.add_waiter('queue2')
+            notifier.add_callback(notified.append)
+            gevent.sleep(0.01)
+
+        try:
+            # The dropped subscription is reset and a new one is opened in its place
+            self.assertTrue(dropped.is_reset)
+            self.assertFalse(reconnected.is_reset)
+            self.assertEquals(reconnected.channels, [channel])
+
+            # Waiters are woken up in case they missed anything and new notifications are received again
+            self.assertTrue(event.is_set())
+            self.assertEquals(notified, ['queue1'])
+        finally:
+            notifier.listener.kill()
+
+# ################################################################################################################################
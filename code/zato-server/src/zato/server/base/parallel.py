@@ -12,7 +12,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging, os, time, signal
 from datetime import datetime
 from httplib import INTERNAL_SERVER_ERROR, responses
-from logging import INFO
 from tempfile import mkstemp
 from threading import Thread
 from traceback import format_exc
@@ -48,7 +47,7 @@ from tzlocal import get_localzone
 
 # Zato
 from zato.broker.client import BrokerClient
-from zato.common import ACCESS_LOG_DT_FORMAT, KVDB, MISC, SERVER_JOIN_STATUS, SERVER_UP_STATUS,\
+from zato.common import KVDB, MISC, SERVER_JOIN_STATUS, SERVER_UP_STATUS,\
      ZATO_ODB_POOL_NAME
 from zato.common.broker_message import AMQP_CONNECTOR, code_to_name, HOT_DEPLOY, JMS_WMQ_CONNECTOR, MESSAGE_TYPE, TOPICS, \
      ZMQ_CONNECTOR
@@ -60,6 +59,7 @@ from zato.server.base.worker import WorkerStore
 from zato.server.config import ConfigDict, ConfigStore
 from zato.server.connection.amqp.channel import start_connector as amqp_channel_start_connector
 from zato.server.connection.amqp.outgoing import start_connector as amqp_out_start_connector
+from zato.server.connection.http_soap.access_log import AccessLog
 from zato.server.connection.http_soap.url_data import Matcher
 from zato.server.connection.jms_wmq.channel import start_connector as jms_wmq_channel_start_connector
 from zato.server.connection.jms_wmq.outgoing import start_connector as jms_wmq_out_start_connector
@@ -117,6 +117,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         self.user_ctx_lock = gevent.lock.RLock()
 
         self.access_logger = logging.getLogger('zato_access_log')
+        self.access_log = None
+
+        # Looked up once rather than for each request
+        self.local_tz = get_localzone()
 
         # The main config store
         self.config = ConfigStore()
@@ -128,11 +132,13 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         """
         cid = kwargs.get('cid', new_cid())
 
-        wsgi_environ['zato.local_tz'] = get_localzone()
+        req_time = time.time()
+
+        wsgi_environ['zato.local_tz'] = self.local_tz
         wsgi_environ['zato.request_timestamp_utc'] = utcnow()
 
-        local_dt = wsgi_environ['zato.request_timestamp_utc'].replace(tzinfo=UTC).astimezone(wsgi_environ['zato.local_tz'])
-        wsgi_environ['zato.request_timestamp'] = wsgi_environ['zato.local_tz'].normalize(local_dt)
+        local_dt = wsgi_environ['zato.request_timestamp_utc'].replace(tzinfo=UTC).astimezone(self.local_tz)
+        wsgi_environ['zato.request_timestamp'] = self.local_tz.normalize(local_dt)
 
         wsgi_environ['zato.http.response.headers'] = {'X-Zato-CID': cid}
 
@@ -169,7 +175,8 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         if isinstance(payload, unicode):
             payload = payload.encode('utf-8')
 
-        if self.access_logger.isEnabledFor(INFO):
+        # Only a tuple is enqueued here, everything is formatted and written out in background
+        if self.access_log and self.access_log.is_enabled:
 
             channel_item = wsgi_environ.get('zato.http.channel_item')
             if channel_item:
@@ -177,19 +184,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
             else:
                 channel_name = '-'
 
-            self.access_logger.info('', extra = {
-                'remote_ip': wsgi_environ['zato.http.remote_addr'],
-                'cid_resp_time': '{}/{}'.format(cid, (utcnow() - wsgi_environ['zato.request_timestamp_utc']).total_seconds()),
-                'channel_name': channel_name,
-                'req_timestamp_utc': wsgi_environ['zato.request_timestamp_utc'].strftime(ACCESS_LOG_DT_FORMAT),
-                'req_timestamp': wsgi_environ['zato.request_timestamp'].strftime(ACCESS_LOG_DT_FORMAT),
-                'method': wsgi_environ['REQUEST_METHOD'],
-                'path': wsgi_environ['PATH_INFO'],
-                'http_version': wsgi_environ['SERVER_PROTOCOL'],
-                'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                'response_size': len(payload),
-                'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
-                })
+            self.access_log.add(wsgi_environ['zato.http.remote_addr'], cid, req_time, time.time() - req_time, channel_name,
+                wsgi_environ['REQUEST_METHOD'], wsgi_environ['PATH_INFO'], wsgi_environ['SERVER_PROTOCOL'],
+                wsgi_environ['zato.http.response.status'].split()[0], len(payload),
+                wsgi_environ.get('HTTP_USER_AGENT', '(None)'))
 
         return [payload]
 
@@ -321,6 +319,14 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         server's been allowed to join the cluster or not.
         """
         self.worker_store = WorkerStore(self.config, self)
+
+        # HTTP access log, written out in a background greenlet
+        access_log_config = self.fs_server_config.get('access_log', {})
+        self.access_log = AccessLog(self.access_logger, access_log_config.get('format', 'combined'),
+            int(access_log_config.get('buffer_size', 10000)), float(access_log_config.get('flush_interval', 0.5)),
+            int(access_log_config.get('batch_size', 500)))
+        self.access_log.start()
+
         self.worker_store.invoke_matcher.read_config(self.fs_server_config.invoke_patterns_allowed)
         self.worker_store.target_matcher.read_config(self.fs_server_config.invoke_target_patterns_allowed)
 
@@ -407,7 +413,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         self.component_enabled.slow_response = asbool(self.fs_server_config.component_enabled.slow_response)
 
         # Pub/sub
-        self.pubsub = PubSubAPI(RedisPubSub(self.kvdb.conn))
+        self.pubsub = PubSubAPI(RedisPubSub(self.kvdb.conn, fan_out=asbool(self.fs_server_config.pubsub.get('fan_out', False))))
 
         # Repo location so that AMQP subprocesses know where to read
         # the server's configuration from.
@@ -857,7 +863,8 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
             broker_callbacks[TOPICS[MESSAGE_TYPE.TO_SINGLETON]] = parallel_server.on_broker_msg_singleton
 
         parallel_server.broker_client = BrokerClient(
-            parallel_server.kvdb, 'parallel', broker_callbacks, parallel_server.get_lua_programs())
+            parallel_server.kvdb, 'parallel', broker_callbacks, parallel_server.get_lua_programs(),
+            parallel_server.fs_server_config.get('broker'))
 
         parallel_server.worker_store.set_broker_client(parallel_server.broker_client)
 
@@ -903,6 +910,22 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
     def destroy(self):
         """ A Spring Python hook for closing down all the resources held.
         """
+        # Statistics not flushed to the KVDB yet
+        if self.worker_store and self.worker_store.service_stats:
+            self.worker_store.service_stats.stop()
+
+        # HTTP access log not written out yet
+        if self.access_log:
+            self.access_log.stop()
+
+        # Audit log of HTTP/SOAP channels not written to the ODB yet
+        if self.worker_store and self.worker_store.audit_writer:
+            self.worker_store.audit_writer.stop()
+
+        # AMQP messages not published yet
+        if self.worker_store:
+            self.worker_store.stop_amqp_direct_publishers()
+
         if self.singleton_server:
 
             # Close all the connector subprocesses this server has possibly started
@@ -34,29 +34,36 @@ import gevent
 from gunicorn.workers.ggevent import GeventWorker as GunicornGeventWorker
 from gunicorn.workers.sync import SyncWorker as GunicornSyncWorker
 
+# Paste
+from paste.util.converters import asbool
+
 # retools
 from retools.lock import Lock
 
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, HTTP_SOAP_SERIALIZATION_TYPE, KVDB, MSG_PATTERN_TYPE, NOTIF, PUB_SUB, \
+from zato.common import AUDIT_LOG, CHANNEL, DATA_FORMAT, HTTP_SOAP_SERIALIZATION_TYPE, KVDB, MSG_PATTERN_TYPE, NOTIF, PUB_SUB, \
      SEC_DEF_TYPE, SIMPLE_IO, TRACE1, ZATO_NONE, ZATO_ODB_POOL_NAME
 from zato.common import broker_message
-from zato.common.broker_message import code_to_name, SERVICE
+from zato.common.broker_message import code_to_name, MESSAGE_TYPE, SERVICE
 from zato.common.dispatch import dispatcher
 from zato.common.match import Matcher
 from zato.common.pubsub import Client, Consumer, Topic
 from zato.common.util import get_tls_ca_cert_full_path, get_tls_key_cert_full_path, get_tls_from_payload, new_cid, pairwise, \
-     parse_extra_into_dict, parse_tls_channel_security_definition, store_tls
+     parse_extra_into_dict, parse_tls_channel_security_definition, payload_from_request, store_tls
 from zato.server.base import BrokerMessageReceiver
+from zato.server.connection.amqp.publisher import DirectPublisher
 from zato.server.connection.cassandra import CassandraAPI, CassandraConnStore
 from zato.server.connection.cloud.aws.s3 import S3Wrapper
 from zato.server.connection.cloud.openstack.swift import SwiftWrapper
 from zato.server.connection.email import IMAPAPI, IMAPConnStore, SMTPAPI, SMTPConnStore
 from zato.server.connection.ftp import FTPStore
+from zato.server.connection.http_soap.audit import AuditWriter
 from zato.server.connection.http_soap.channel import RequestDispatcher, RequestHandler
 from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper, SudsSOAPWrapper
 from zato.server.connection.http_soap.url_data import URLData
 from zato.server.connection.odoo import OdooWrapper
+from zato.server.connection.queue import ConnectionQueue
+from zato.server.connection.request_response import SampleConfig
 from zato.server.connection.search.es import ElasticSearchAPI, ElasticSearchConnStore
 from zato.server.connection.search.solr import SolrAPI, SolrConnStore
 from zato.server.connection.stomp import ChannelSTOMPConnStore, STOMPAPI, channel_main_loop as stomp_channel_main_loop, \
@@ -67,7 +74,8 @@ from zato.server.message import JSONPointerStore, NamespaceStore, XPathStore
 from zato.server.query import CassandraQueryAPI, CassandraQueryStore
 
 from zato.server.rbac_ import RBAC
-from zato.server.stats import MaintenanceTool
+from zato.server.service import InvocationContextStore
+from zato.server.stats import MaintenanceTool, ServiceStatsAccumulator
 
 logger = logging.getLogger(__name__)
 
@@ -94,6 +102,12 @@ class WorkerStore(BrokerMessageReceiver):
         self.broker_client = None
         self.pubsub = None
         self.rbac = RBAC()
+        self.service_stats = None
+        self.req_resp_sample_config = None
+        self.audit_writer = None
+
+        # Outgoing AMQP connection name -> DirectPublisher, updated in place because service facades refer to it
+        self.amqp_direct_publishers = {}
 
         # Which services can be invoked
         self.invoke_matcher = Matcher()
@@ -106,6 +120,17 @@ class WorkerStore(BrokerMessageReceiver):
         # Statistics maintenance
         self.stats_maint = MaintenanceTool(self.kvdb.conn)
 
+        # Per-worker statistics, periodically flushed to the KVDB
+        self.service_stats = ServiceStatsAccumulator(
+            self.kvdb, float(self.server.fs_server_config.stats.get('flush_interval', 5)))
+        self.service_stats.start()
+
+        # How often to store sample request/response pairs of each service
+        self.req_resp_sample_config = SampleConfig(self.kvdb)
+
+        # Per-service data and facades reused across invocations
+        self.invocation_ctx_store = InvocationContextStore(self)
+
         self.msg_ns_store = NamespaceStore()
         self.json_pointer_store = JSONPointerStore()
         self.xpath_store = XPathStore()
@@ -162,19 +187,27 @@ class WorkerStore(BrokerMessageReceiver):
         # Odoo
         self.init_odoo()
 
+        # AMQP
+        self.init_amqp_direct_publishers()
+
         # RBAC
         self.init_rbac()
 
+        # Audit log of HTTP/SOAP channels, stored in the ODB in the background
+        self.audit_writer = self._get_audit_writer()
+        self.audit_writer.start()
+
         # Request dispatcher - matches URLs, checks security and dispatches HTTP
         # requests to services.
-        self.request_dispatcher = RequestDispatcher(simple_io_config=self.worker_config.simple_io)
+        self.request_dispatcher = RequestDispatcher(simple_io_config=self.worker_config.simple_io,
+            spool_threshold=int(self.server.fs_server_config.misc.get('http_spool_threshold', 1048576)))
         self.request_dispatcher.url_data = URLData(
             deepcopy(self.worker_config.http_soap),
             self.server.odb.get_url_security(self.server.cluster_id, 'channel')[0],
             self.worker_config.basic_auth, self.worker_config.ntlm, self.worker_config.oauth, self.worker_config.tech_acc,
             self.worker_config.wss, self.worker_config.apikey, self.worker_config.aws, self.worker_config.openstack_security,
             self.worker_config.xpath_sec, self.worker_config.tls_channel_sec, self.worker_config.tls_key_cert, self.kvdb,
-            self.broker_client, self.server.odb, self.json_pointer_store, self.xpath_store)
+            self.broker_client, self.server.odb, self.json_pointer_store, self.xpath_store, self.audit_writer)
 
         self.request_dispatcher.request_handler = RequestHandler(self.server)
 
@@ -193,12 +226,30 @@ class WorkerStore(BrokerMessageReceiver):
         self.broker_client = broker_client
         self.request_dispatcher.url_data.broker_client = broker_client
 
+        # Facades publishing through the broker need to be built anew
+        self.invocation_ctx_store.invalidate()
+
     def filter(self, msg):
         # TODO: Fix it, worker doesn't need to accept all the messages
         return True
 
-    def _update_queue_build_cap(self, item):
-        item.queue_build_cap = float(self.server.fs_server_config.misc.queue_build_cap)
+    def _update_queue_config(self, item):
+        """ Sets configuration of connection queues, server-wide defaults from the [conn_pool] section of server.conf
+        can be overridden for particular connections in its subsections named after them.
+        """
+        item['queue_build_cap'] = float(self.server.fs_server_config.misc.queue_build_cap)
+
+        pool_config = dict(self.server.fs_server_config.get('conn_pool', {}))
+        pool_config.update(pool_config.pop(item['name'], None) or {})
+
+        if pool_config.get('max_size'):
+            item['pool_max_size'] = int(pool_config['max_size'])
+        else:
+            item['pool_max_size'] = int((item.get('pool_size') or 1) * float(pool_config.get('max_size_ratio', 1)))
+
+        for name in 'acquire_timeout', 'idle_timeout', 'health_check_interval':
+            value = pool_config.get(name)
+            item['pool_' + name] = float(value) if value is not None else None
 
     def _update_aws_config(self, msg):
         """ Parses the address to AWS we store into discrete components S3Connection objects expect.
@@ -268,7 +319,13 @@ class WorkerStore(BrokerMessageReceiver):
         wrapper_config['tls_verify'] = tls_verify
 
         if wrapper_config['serialization_type'] == HTTP_SOAP_SERIALIZATION_TYPE.SUDS.id:
-            wrapper_config['queue_build_cap'] = float(self.server.fs_server_config.misc.queue_build_cap)
+            self._update_queue_config(wrapper_config)
+
+            wsdl_cache_dir = self.server.fs_server_config.misc.get('wsdl_cache_dir')
+            if wsdl_cache_dir:
+                wsdl_cache_dir = os.path.abspath(os.path.join(self.server.base_dir, wsdl_cache_dir))
+            wrapper_config['wsdl_cache_dir'] = wsdl_cache_dir
+
             wrapper = SudsSOAPWrapper(wrapper_config)
             wrapper.build_client_queue()
             return wrapper
@@ -283,6 +340,42 @@ class WorkerStore(BrokerMessageReceiver):
             for name in config_dict:
                 yield config_dict[name]
 
+    def get_conn_pool_stats(self):
+        """ Returns metrics of all the connection queues of outgoing connections in this worker.
+        """
+        wrappers = [item.conn for item in self.yield_outconn_http_config_dicts()]
+
+        for config_key in 'out_odoo', 'cloud_openstack_swift', 'cloud_aws_s3':
+            config_dict = getattr(self.worker_config, config_key)
+            wrappers.extend(config_dict[name].get('conn') for name in config_dict)
+
+        wrappers.extend(item.impl for item in self.search_solr_api._conn_store.items.values())
+
+        out = []
+        for wrapper in wrappers:
+            conn_queue = getattr(wrapper, 'client', None)
+            if isinstance(conn_queue, ConnectionQueue):
+                out.append(conn_queue.get_stats())
+
+        return sorted(out, key=lambda stats: (stats['conn_type'], stats['name']))
+
+# ################################################################################################################################
+
+    def _get_audit_writer(self):
+        """ Returns a writer for the audit log of HTTP/SOAP channels, configured through the [audit_log] section
+        of server.conf, if there is one.
+        """
+        config = self.server.fs_server_config.get('audit_log', {})
+
+        spill_dir = config.get('spill_dir')
+        if spill_dir:
+            spill_dir = os.path.abspath(os.path.join(self.server.base_dir, spill_dir))
+            if not os.path.exists(spill_dir):
+                os.makedirs(spill_dir)
+
+        return AuditWriter(self.server.odb, int(config.get('batch_size', 100)), float(config.get('flush_interval', 1)),
+            int(config.get('max_queue_size', 10000)), config.get('overflow_policy', AUDIT_LOG.OVERFLOW_POLICY.DROP), spill_dir)
+
 # ################################################################################################################################
 
     def init_sql(self):
@@ -306,6 +399,9 @@ class WorkerStore(BrokerMessageReceiver):
         previously had (initially this would be a ConfigDict of connection definitions).
         """
         config_list = self.worker_config.out_ftp.get_config_list()
+        for config in config_list:
+            self._update_queue_config(config)
+
         self.worker_config.out_ftp = FTPStore()
         self.worker_config.out_ftp.add_params(config_list)
 
@@ -333,7 +429,7 @@ class WorkerStore(BrokerMessageReceiver):
                 config = config_attr[name]['config']
                 if isinstance(wrapper, S3Wrapper):
                     self._update_aws_config(config)
-                config.queue_build_cap = float(self.server.fs_server_config.misc.queue_build_cap)
+                self._update_queue_config(config)
                 config_attr[name].conn = wrapper(config, self.server)
                 config_attr[name].conn.build_queue()
 
@@ -436,7 +532,7 @@ class WorkerStore(BrokerMessageReceiver):
 
     def init_simple(self, config, api, name):
         for k, v in config.items():
-            self._update_queue_build_cap(v.config)
+            self._update_queue_config(v.config)
             try:
                 api.create(k, v.config)
             except Exception, e:
@@ -474,10 +570,57 @@ class WorkerStore(BrokerMessageReceiver):
         for name in names:
             item = config = self.worker_config.out_odoo[name]
             config = item['config']
-            config.queue_build_cap = float(self.server.fs_server_config.misc.queue_build_cap)
+            self._update_queue_config(config)
             item.conn = OdooWrapper(config, self.server)
             item.conn.build_queue()
 
+# ################################################################################################################################
+
+    def _publish_amqp_through_broker(self, params):
+        self.broker_client.publish(params, msg_type=MESSAGE_TYPE.TO_AMQP_PUBLISHING_CONNECTOR_ALL)
+
+    def init_amqp_direct_publishers(self, out_id=None, def_id=None):
+        """ (Re-)creates publishers through which AMQP messages are sent by the worker itself rather than by AMQP connectors,
+        unless it is disabled in the [out_amqp] section of server.conf. Configuration is always read from the ODB because
+        workers are not sent the full details of AMQP connections and definitions when they change. If out_id or def_id
+        is given, only the publisher of that outgoing connection, or of ones using that definition, is re-created.
+        """
+        config = self.server.fs_server_config.get('out_amqp', {})
+
+        if not asbool(config.get('direct_publish', False)):
+            return
+
+        def is_affected(out_amqp):
+            if out_id is None and def_id is None:
+                return True
+            return out_amqp.id == out_id or out_amqp.def_id == def_id
+
+        for name, publisher in self.amqp_direct_publishers.items():
+            if is_affected(publisher.out_amqp):
+                publisher.stop()
+                del self.amqp_direct_publishers[name]
+
+        def_amqp = {}
+        for item in self.server.odb.get_def_amqp_list(self.server.cluster_id):
+            def_amqp[item.id] = Bunch(item._asdict())
+
+        for item in self.server.odb.get_out_amqp_list(self.server.cluster_id):
+            out_amqp = Bunch(item._asdict())
+
+            if not (out_amqp.is_active and is_affected(out_amqp)):
+                continue
+
+            out_amqp.pool_size = int(config.get('pool_size', 4))
+            self._update_queue_config(out_amqp)
+
+            publisher = DirectPublisher(out_amqp, def_amqp[out_amqp.def_id], self._publish_amqp_through_broker,
+                out_amqp.pool_size, int(config.get('queue_size', 10000)), int(config.get('batch_size', 100)),
+                float(config.get('batch_interval', 0.01)), asbool(config.get('confirm', True)),
+                float(config.get('confirm_timeout', 10)))
+            publisher.start()
+
+            self.amqp_direct_publishers[out_amqp.name] = publisher
+
 # ################################################################################################################################
 
     def init_rbac(self):
@@ -530,7 +673,7 @@ class WorkerStore(BrokerMessageReceiver):
                 self.pubsub.add_consumer(
                     Consumer(
                         config.client_id, config.name, config.is_active, config.sub_key, config.max_depth,
-                        config.delivery_mode, config.callback_id, config.callback_name, callback_type),
+                        config.delivery_mode, config.callback_id, config.callback_name, callback_type, config.group_name),
                     Topic(config.topic_name))
 
 # ################################################################################################################################
@@ -1018,6 +1161,10 @@ class WorkerStore(BrokerMessageReceiver):
         else:
             payload = msg['payload']
 
+        # A batch of messages, each of which needs to be parsed individually
+        if msg.get('is_batch'):
+            wsgi_environ['zato.request.payload'] = [payload_from_request(cid, item, data_format, transport) for item in payload]
+
         service = self.server.service_store.new_instance_by_name(msg['service'])
         service.update_handle(self._set_service_response_data, service, payload,
             channel, data_format, transport, self.server, self.broker_client, self, cid,
@@ -1046,7 +1193,27 @@ class WorkerStore(BrokerMessageReceiver):
         return self.on_message_invoke_service(msg, CHANNEL.SCHEDULER, 'SCHEDULER_JOB_EXECUTED', args)
 
     def on_broker_msg_CHANNEL_AMQP_MESSAGE_RECEIVED(self, msg, args=None):
-        return self.on_message_invoke_service(msg, CHANNEL.AMQP, 'CHANNEL_AMQP_MESSAGE_RECEIVED', args)
+        if not msg.get('delivery_tags'):
+            return self.on_message_invoke_service(msg, CHANNEL.AMQP, 'CHANNEL_AMQP_MESSAGE_RECEIVED', args)
+
+        # The channel's consumer waits for us to confirm that the service processed its messages. If it did not,
+        # they are rejected and the AMQP broker will deliver them again.
+        try:
+            response = self.on_message_invoke_service(msg, CHANNEL.AMQP, 'CHANNEL_AMQP_MESSAGE_RECEIVED', args)
+        except Exception:
+            self._settle_amqp_messages(msg, broker_message.CHANNEL.AMQP_MESSAGE_REJECT.value)
+            raise
+        else:
+            self._settle_amqp_messages(msg, broker_message.CHANNEL.AMQP_MESSAGE_ACK.value)
+            return response
+
+    def _settle_amqp_messages(self, msg, action):
+        self.broker_client.publish({
+            'action': action,
+            'id': msg['channel_id'],
+            'consumer_tag': msg['consumer_tag'],
+            'delivery_tags': msg['delivery_tags'],
+        }, MESSAGE_TYPE.TO_AMQP_CONSUMING_CONNECTOR_ALL)
 
     def on_broker_msg_CHANNEL_JMS_WMQ_MESSAGE_RECEIVED(self, msg, args=None):
         return self.on_message_invoke_service(msg, CHANNEL.JMS_WMQ, 'CHANNEL_JMS_WMQ_MESSAGE_RECEIVED', args)
@@ -1108,6 +1275,9 @@ class WorkerStore(BrokerMessageReceiver):
                 log_func('Could not access wrapper, e:[{}]'.format(format_exc(e)))
             else:
                 try:
+                    # Connection queues have their own background greenlets to stop
+                    if isinstance(getattr(wrapper, 'client', None), ConnectionQueue):
+                        wrapper.client.close()
                     wrapper.session.close()
                 finally:
                     del config_dict[name]
@@ -1131,6 +1301,11 @@ class WorkerStore(BrokerMessageReceiver):
         old_name = msg.get('old_name')
         del_name = old_name if old_name else msg['name']
 
+        # .. make sure WSDL is fetched and parsed anew if it's a Suds connection ..
+        item = getattr(self.worker_config, 'out_' + msg['transport']).get(del_name)
+        if item and isinstance(item.get('conn'), SudsSOAPWrapper):
+            item.conn.clear_wsdl_cache()
+
         # .. delete the connection if it exists ..
         self._delete_config_close_wrapper_http_soap(del_name, msg['transport'], logger.debug)
 
@@ -1165,6 +1340,7 @@ class WorkerStore(BrokerMessageReceiver):
 
         # Delete it from the service store
         del self.server.service_store.services[msg.impl_name]
+        self.invocation_ctx_store.invalidate(msg.impl_name)
 
         # Delete it from the filesystem, including any bytecode left over. Note that
         # other parallel servers may wish to do exactly the same so we just ignore
@@ -1188,9 +1364,42 @@ class WorkerStore(BrokerMessageReceiver):
         for name in('is_active', 'slow_threshold'):
             self.server.service_store.services[msg.impl_name][name] = msg[name]
 
+        self.invocation_ctx_store.invalidate(msg.impl_name)
+
+    def on_broker_msg_SERVICE_CONFIGURE_REQUEST_RESPONSE(self, msg, *args):
+        self.req_resp_sample_config.set(msg.name, msg.freq, msg.mode)
+
+# ################################################################################################################################
+
+    def on_broker_msg_DEFINITION_AMQP_EDIT(self, msg, *args):
+        self.init_amqp_direct_publishers(def_id=msg.id)
+
+    def on_broker_msg_DEFINITION_AMQP_DELETE(self, msg, *args):
+        self.init_amqp_direct_publishers(def_id=msg.id)
+
+    def on_broker_msg_DEFINITION_AMQP_CHANGE_PASSWORD(self, msg, *args):
+        self.init_amqp_direct_publishers(def_id=msg.id)
+
+    def on_broker_msg_OUTGOING_AMQP_CREATE(self, msg, *args):
+        self.init_amqp_direct_publishers(out_id=msg.id)
+
+    def on_broker_msg_OUTGOING_AMQP_EDIT(self, msg, *args):
+        self.init_amqp_direct_publishers(out_id=msg.id)
+
+    def on_broker_msg_OUTGOING_AMQP_DELETE(self, msg, *args):
+        self.init_amqp_direct_publishers(out_id=msg.id)
+
+    def stop_amqp_direct_publishers(self):
+        """ Stops all the publishers, handing over messages not published yet to AMQP connectors.
+        """
+        for publisher in self.amqp_direct_publishers.values():
+            publisher.stop()
+        self.amqp_direct_publishers.clear()
+
 # ################################################################################################################################
 
     def on_broker_msg_OUTGOING_FTP_CREATE_EDIT(self, msg, *args):
+        self._update_queue_config(msg)
         self.worker_config.out_ftp.create_edit(msg, msg.get('old_name'))
 
     def on_broker_msg_OUTGOING_FTP_DELETE(self, msg, *args):
@@ -1211,6 +1420,9 @@ class WorkerStore(BrokerMessageReceiver):
     def on_broker_msg_HOT_DEPLOY_AFTER_DEPLOY(self, msg, *args):
         self.rbac.create_resource(msg.id)
 
+        # Redeployed services may have been given their slow_threshold anew
+        self.invocation_ctx_store.invalidate()
+
 # ################################################################################################################################
 
     def on_broker_msg_STATS_DELETE(self, msg, *args):
@@ -1355,7 +1567,7 @@ class WorkerStore(BrokerMessageReceiver):
         self._delete_config_close_wrapper(del_name, config_dict, conn_type, logger.debug)
 
         # .. and create a new one
-        msg['queue_build_cap'] = float(self.server.fs_server_config.misc.queue_build_cap)
+        self._update_queue_config(msg)
         wrapper = wrapper_class(msg, self.server)
         wrapper.build_queue()
 
@@ -1423,7 +1635,7 @@ class WorkerStore(BrokerMessageReceiver):
         self.pubsub.add_consumer(
             Consumer(
                 msg.client_id, msg.client_name, msg.is_active, msg.sub_key, msg.max_depth,
-                msg.delivery_mode, msg.callback_id, msg.callback_name, msg.callback_type),
+                msg.delivery_mode, msg.callback_id, msg.callback_name, msg.callback_type, msg.get('group_name')),
             Topic(msg.topic_name))
 
     def on_broker_msg_PUB_SUB_CONSUMER_CREATE(self, msg):
@@ -1538,14 +1750,14 @@ class WorkerStore(BrokerMessageReceiver):
 # ################################################################################################################################
 
     def on_broker_msg_SEARCH_SOLR_CREATE(self, msg):
-        self._update_queue_build_cap(msg)
+        self._update_queue_config(msg)
         self.search_solr_api.create(msg.name, msg)
 
     def on_broker_msg_SEARCH_SOLR_EDIT(self, msg):
         # It might be a rename
         old_name = msg.get('old_name')
         del_name = old_name if old_name else msg['name']
-        self._update_queue_build_cap(msg)
+        self._update_queue_config(msg)
         self.search_solr_api.edit(del_name, msg)
 
     def on_broker_msg_SEARCH_SOLR_DELETE(self, msg):
@@ -1554,6 +1766,7 @@ class WorkerStore(BrokerMessageReceiver):
 # ################################################################################################################################
 
     def on_broker_msg_EMAIL_SMTP_CREATE(self, msg):
+        self._update_queue_config(msg)
         self.email_smtp_api.create(msg.name, msg)
 
     def on_broker_msg_EMAIL_SMTP_EDIT(self, msg):
@@ -1561,6 +1774,7 @@ class WorkerStore(BrokerMessageReceiver):
         old_name = msg.get('old_name')
         del_name = old_name if old_name else msg['name']
         msg.password = self.email_smtp_api.get(del_name, True).config.password
+        self._update_queue_config(msg)
         self.email_smtp_api.edit(del_name, msg)
 
     def on_broker_msg_EMAIL_SMTP_DELETE(self, msg):
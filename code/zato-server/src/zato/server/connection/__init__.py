@@ -185,7 +185,7 @@ class BaseConnector(BrokerMessageReceiver):
         self.kvdb.init()
         
         # Broker client
-        self.broker_client = BrokerClient(self.kvdb, self.broker_client_id, self.broker_callbacks)
+        self.broker_client = BrokerClient(self.kvdb, self.broker_client_id, self.broker_callbacks, fs_server_config.get('broker'))
         self.broker_client.start()
 
         # ODB        
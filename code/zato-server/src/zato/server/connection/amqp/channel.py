@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function
 
 # stdlib
 import logging, os
+from collections import deque
 from random import getrandbits
 from os import getpid
 from socket import getfqdn, gethostbyname, gethostname
@@ -19,7 +20,7 @@ from threading import Thread
 from bunch import Bunch
 
 # Zato
-from zato.common import TRACE1
+from zato.common import AMQP, TRACE1
 from zato.common.broker_message import CHANNEL, MESSAGE_TYPE, TOPICS
 from zato.common.util import new_cid
 from zato.server.connection.amqp import BaseAMQPConnection, BaseAMQPConnector
@@ -31,25 +32,100 @@ logger = logging.getLogger('zato_connector')
 
 class ConsumingConnection(BaseAMQPConnection):
     """ A connection for consuming the AMQP messages.
+
+    Messages are handed over to the callback in batches of up to batch_size ones, each batch waiting for no longer
+    than batch_interval milliseconds. With ack_mode set to AMQP.ACK_MODE.ON_SUCCESS messages are not acknowledged
+    upon receiving them - instead, the consumer waits for settle to be called with results of their processing.
     """
-    def __init__(self, conn_params, channel_name, queue, consumer_tag_prefix, callback):
+    def __init__(self, conn_params, channel_name, queue, consumer_tag_prefix, callback, prefetch_count=0, batch_size=1,
+            batch_interval=AMQP.DEFAULT.BATCH_INTERVAL, ack_mode=AMQP.ACK_MODE.ON_RECEIVE.value):
         super(ConsumingConnection, self).__init__(conn_params, channel_name)
         self.queue = queue
         self.consumer_tag_prefix = consumer_tag_prefix
         self.callback = callback
-        
+        self.prefetch_count = prefetch_count or 0
+        self.batch_size = max(batch_size or 1, 1)
+        self.batch_interval = (batch_interval or AMQP.DEFAULT.BATCH_INTERVAL) / 1000.0
+        self.ack_on_success = ack_mode == AMQP.ACK_MODE.ON_SUCCESS.value
+        self.consumer_tag = None
+        self.batch = []
+
+        # Results of processing messages, reported by other threads but acted upon only in the one running the IO loop
+        self.to_settle = deque()
+
     def _on_channel_open(self, channel):
         """ We've opened a channel to the broker.
         """
         super(ConsumingConnection, self)._on_channel_open(channel)
+
+        # Delivery tags are valid only within the channel they were received on
+        self.batch = []
+        self.to_settle.clear()
+
+        if self.batch_size > 1 or self.ack_on_success:
+            self.conn.add_timeout(self.batch_interval, self._on_timeout)
+
+        if self.prefetch_count:
+            channel.basic_qos(self._on_basic_qos_ok, prefetch_count=self.prefetch_count)
+        else:
+            self.consume()
+
+    def _on_basic_qos_ok(self, *ignored):
         self.consume()
-        
+
     def _on_basic_consume(self, channel, method_frame, header_frame, body):
         """ We've got a message to handle.
         """
-        self.callback(method_frame, header_frame, body)
-        channel.basic_ack(delivery_tag=method_frame.delivery_tag)
-        
+        self.batch.append((method_frame.delivery_tag, header_frame, body))
+
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def _on_timeout(self):
+        """ Periodically hands over incomplete batches and settles messages already processed.
+        """
+        try:
+            self._flush()
+            self._settle()
+        finally:
+            if self.keep_connecting:
+                self.conn.add_timeout(self.batch_interval, self._on_timeout)
+
+    def _flush(self):
+        """ Hands the current batch over to the callback and acknowledges it unless this is to be done after
+        the messages are processed.
+        """
+        if not self.batch:
+            return
+
+        batch, self.batch = self.batch, []
+        self.callback(self.consumer_tag, batch)
+
+        if not self.ack_on_success:
+
+            # All the messages received before the last one in the batch have been acknowledged already
+            self.channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+
+    def _settle(self):
+        while self.to_settle:
+            consumer_tag, delivery_tags, is_ok = self.to_settle.popleft()
+
+            # Messages from a previous channel, the broker has already made them available for redelivery
+            if consumer_tag != self.consumer_tag:
+                continue
+
+            for delivery_tag in delivery_tags:
+                if is_ok:
+                    self.channel.basic_ack(delivery_tag=delivery_tag)
+                else:
+                    self.channel.basic_reject(delivery_tag=delivery_tag, requeue=True)
+
+    def settle(self, consumer_tag, delivery_tags, is_ok):
+        """ Acknowledges messages processed successfully or rejects, and requeues, the ones that could not be processed.
+        May be called from any thread.
+        """
+        self.to_settle.append((consumer_tag, delivery_tags, is_ok))
+
     def consume(self, queue=None, consumer_tag_prefix=None):
         """ Starts consuming messages from the broker.
         """
@@ -60,6 +136,7 @@ class ConsumingConnection(BaseAMQPConnection):
             _consumer_tag_prefix, gethostbyname(gethostname()), getfqdn(),
             getpid(), getrandbits(64)).ljust(72, '0')
         
+        self.consumer_tag = consumer_tag
         self.channel.basic_consume(self._on_basic_consume, queue=_queue, consumer_tag=consumer_tag)
         logger.info(u'Started an AMQP consumer for [{0}], queue [{1}], tag [{2}]'.format(
             self._conn_info(), _queue, consumer_tag))
@@ -96,6 +173,10 @@ class ConsumingConnector(BaseAMQPConnector):
         self.channel_amqp.consumer_tag_prefix = item.consumer_tag_prefix
         self.channel_amqp.service = item.service_name
         self.channel_amqp.data_format = item.data_format
+        self.channel_amqp.prefetch_count = item.prefetch_count
+        self.channel_amqp.batch_size = item.batch_size
+        self.channel_amqp.batch_interval = item.batch_interval
+        self.channel_amqp.ack_mode = item.ack_mode
         
     def _setup_amqp(self):
         """ Sets up the AMQP listener on startup.
@@ -112,7 +193,8 @@ class ConsumingConnector(BaseAMQPConnector):
         if super(ConsumingConnector, self).filter(msg):
             return True
         
-        elif msg.action in(CHANNEL.AMQP_EDIT.value, CHANNEL.AMQP_DELETE.value):
+        elif msg.action in(CHANNEL.AMQP_EDIT.value, CHANNEL.AMQP_DELETE.value, CHANNEL.AMQP_MESSAGE_ACK.value,
+                CHANNEL.AMQP_MESSAGE_REJECT.value):
             if self.channel_amqp.id == msg.id:
                 return True
         else:
@@ -135,7 +217,8 @@ class ConsumingConnector(BaseAMQPConnector):
     def _amqp_consumer(self):
         consumer = ConsumingConnection(self._amqp_conn_params(), self.channel_amqp.name,
             self.channel_amqp.queue, self.channel_amqp.consumer_tag_prefix,
-            self._on_message)
+            self._on_message, self.channel_amqp.get('prefetch_count'), self.channel_amqp.get('batch_size'),
+            self.channel_amqp.get('batch_interval'), self.channel_amqp.get('ack_mode'))
         t = Thread(target=consumer._run)
         t.start()
         
@@ -158,19 +241,47 @@ class ConsumingConnector(BaseAMQPConnector):
         if self.channel_amqp.get('consumer'):
             self.channel_amqp.consumer.close()
                 
-    def _on_message(self, method_frame, header_frame, body):
-        """ A callback to be invoked by ConsumingConnection on each new AMQP message.
+    def _on_message(self, consumer_tag, messages):
+        """ A callback to be invoked by ConsumingConnection on each new batch of AMQP messages, each of them being
+        a (delivery_tag, header_frame, body) tuple. The whole batch is relayed to a service in a single broker message.
         """
-        with self.def_amqp_lock:
-            with self.channel_amqp_lock:
-                params = {}
-                params['action'] = CHANNEL.AMQP_MESSAGE_RECEIVED.value
-                params['service'] = self.channel_amqp.service
-                params['data_format'] = self.channel_amqp.data_format
-                params['cid'] = new_cid()
-                params['payload'] = body
-                
-                self.broker_client.invoke_async(params)
+        # No locks needed - on updates, self.channel_amqp is replaced rather than modified in place.
+        channel_amqp = self.channel_amqp
+
+        params = {}
+        params['action'] = CHANNEL.AMQP_MESSAGE_RECEIVED.value
+        params['service'] = channel_amqp.service
+        params['data_format'] = channel_amqp.data_format
+        params['cid'] = new_cid()
+
+        if (channel_amqp.get('batch_size') or 1) > 1:
+            params['payload'] = [body for _, _, body in messages]
+            params['is_batch'] = True
+        else:
+            params['payload'] = messages[0][2]
+
+        # The worker processing the messages will let us know whether to acknowledge or reject them
+        if channel_amqp.get('ack_mode') == AMQP.ACK_MODE.ON_SUCCESS.value:
+            params['channel_id'] = channel_amqp.id
+            params['consumer_tag'] = consumer_tag
+            params['delivery_tags'] = [delivery_tag for delivery_tag, _, _ in messages]
+
+        self.broker_client.invoke_async(params)
+
+    def _settle(self, msg, is_ok):
+        consumer = self.channel_amqp.get('consumer')
+        if consumer:
+            consumer.settle(msg.consumer_tag, msg.delivery_tags, is_ok)
+
+    def on_broker_msg_CHANNEL_AMQP_MESSAGE_ACK(self, msg, *args):
+        """ Acknowledges messages a service has processed successfully.
+        """
+        self._settle(msg, True)
+
+    def on_broker_msg_CHANNEL_AMQP_MESSAGE_REJECT(self, msg, *args):
+        """ Rejects messages a service could not process so that the AMQP broker delivers them again.
+        """
+        self._settle(msg, False)
 
     def on_broker_msg_CHANNEL_AMQP_CREATE(self, msg, *args):
         """ Creates a new outgoing AMQP connection. Note that the implementation
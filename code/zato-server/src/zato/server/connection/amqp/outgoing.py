@@ -67,14 +67,17 @@ class _Connection(Connection):
 
 class PublisherFacade(object):
     """ An AMQP facade for services so they aren't aware that publishing AMQP
-    messages actually requires us to use the Zato broker underneath.
+    messages actually requires us to use the Zato broker underneath, unless
+    messages are published directly by workers, using direct_publishers.
     """
-    def __init__(self, broker_client):
+    def __init__(self, broker_client, direct_publishers=None):
         self.broker_client = broker_client # A Zato broker client, not the AMQP one.
+        self.direct_publishers = direct_publishers if direct_publishers is not None else {}
     
     def send(self, msg, out_name, exchange, routing_key, properties={}, headers={}, *args, **kwargs):
         """ Publishes the message on the Zato broker which forwards it to one of the
-        AMQP connectors.
+        AMQP connectors or, if there is a direct publisher for out_name, enqueues it
+        to be published by the worker itself.
         """
         params = {}
         params['action'] = OUTGOING.AMQP_PUBLISH.value
@@ -86,8 +89,13 @@ class PublisherFacade(object):
         params['headers'] = headers
         params['args'] = args
         params['kwargs'] = kwargs
-        
-        self.broker_client.publish(params, msg_type=MESSAGE_TYPE.TO_AMQP_PUBLISHING_CONNECTOR_ALL)
+
+        direct_publisher = self.direct_publishers.get(out_name)
+
+        if direct_publisher:
+            direct_publisher.put(params)
+        else:
+            self.broker_client.publish(params, msg_type=MESSAGE_TYPE.TO_AMQP_PUBLISHING_CONNECTOR_ALL)
         
     def conn(self):
         """ Returns self. Added to make the facade look like other outgoing
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+# stdlib
+import logging
+from datetime import datetime
+from time import time
+from traceback import format_exc
+
+# amqp
+from amqp import Connection, Message
+
+# gevent
+from gevent import getcurrent, GreenletExit, joinall, spawn, Timeout
+from gevent.queue import Empty, Queue
+
+# Kombu
+from kombu.serialization import dumps
+
+# Zato
+from zato.common.util import get_component_name
+from zato.server.connection.queue import ConnectionQueue, get_pool_config
+
+logger = logging.getLogger(__name__)
+
+# Properties of messages which, unless given on input, are taken from outgoing connections
+_properties = ('content_type', 'content_encoding', 'delivery_mode', 'priority', 'expiration', 'user_id', 'app_id',
+    'correlation_id', 'cluster_id')
+
+# ################################################################################################################################
+
+class _Channel(object):
+    """ An AMQP channel, along with its own connection, through which batches of messages are published.
+    If confirm is True, the channel is in publisher confirms mode and each batch is published only when
+    the broker confirms all of its messages.
+
+    Basic.Ack and Basic.Nack are handled by the channel itself rather than through channel events
+    because amqp 1.0.x, which Zato depends on, knows nothing about Basic.Nack.
+    """
+    def __init__(self, def_amqp, confirm):
+        self.conn = Connection(
+            host='{}:{}'.format(def_amqp.host, def_amqp.port), userid=def_amqp.username, password=def_amqp.password,
+            virtual_host=def_amqp.vhost, frame_max=def_amqp.frame_max, heartbeat=def_amqp.heartbeat,
+            client_properties={'zato-component':get_component_name('out-amqp')})
+        self.channel = self.conn.channel()
+        self.confirm = confirm
+        self.delivery_tag = 0
+        self.unconfirmed = {} # Delivery tag -> index in current batch
+        self.pending = set()  # Indexes of messages from current batch not accepted by the broker yet
+
+        if confirm:
+            self.channel.confirm_select()
+
+            # Overrides the class-level map for this channel only
+            self.channel._METHOD_MAP = dict(self.channel._METHOD_MAP)
+            self.channel._METHOD_MAP[(60, 80)] = self._on_ack
+            self.channel._METHOD_MAP[(60, 120)] = self._on_nack
+
+    def _confirm(self, delivery_tag, multiple, is_ack):
+        tags = [tag for tag in self.unconfirmed if tag <= delivery_tag] if multiple else [delivery_tag]
+        for tag in tags:
+            idx = self.unconfirmed.pop(tag, None)
+            if idx is not None and is_ack:
+                self.pending.discard(idx)
+
+    def _on_ack(self, channel, args):
+        """ Basic.Ack - delivery_tag, multiple
+        """
+        self._confirm(args.read_longlong(), args.read_bit(), True)
+
+    def _on_nack(self, channel, args):
+        """ Basic.Nack - delivery_tag, multiple, requeue
+        """
+        self._confirm(args.read_longlong(), args.read_bit(), False)
+
+    def publish(self, batch):
+        """ Publishes a batch of (body, exchange, routing_key, headers, properties) tuples and returns the ones
+        the broker did not accept. If publishing does not complete, self.pending tells which messages the broker
+        has not accepted. Without publisher confirms, each message is considered accepted once it is sent.
+        """
+        self.pending = set(range(len(batch)))
+
+        for idx, (body, exchange, routing_key, headers, properties) in enumerate(batch):
+            self.channel.basic_publish(Message(body, application_headers=headers, **properties), exchange, routing_key)
+
+            if self.confirm:
+                self.delivery_tag += 1
+                self.unconfirmed[self.delivery_tag] = idx
+            else:
+                self.pending.discard(idx)
+
+        # Basic.Ack / Basic.Nack
+        while self.unconfirmed:
+            self.channel.wait([(60, 80), (60, 120)])
+
+        return [batch[idx] for idx in sorted(self.pending)]
+
+    def check(self):
+        if not self.channel.is_open:
+            raise Exception('Channel is closed')
+
+        self.conn.heartbeat_tick()
+
+    def close(self):
+        self.conn.close()
+
+# ################################################################################################################################
+
+class DirectPublisher(object):
+    """ Publishes messages to an AMQP broker directly from a worker. Messages are put on a queue of up to queue_size
+    elements and published by greenlets, one for each channel in a pool of pool_size, in batches of up to batch_size
+    messages, each batch waiting up to batch_interval seconds to fill up. With publisher confirms, up to confirm_timeout
+    seconds are given to the broker to confirm a batch.
+
+    Messages that could not be published, or were not accepted by the broker, are handed over to fallback_func
+    which is expected to send them through the Zato broker to AMQP connectors instead.
+    """
+    def __init__(self, out_amqp, def_amqp, fallback_func, pool_size=4, queue_size=10000, batch_size=100,
+            batch_interval=0.01, confirm=True, confirm_timeout=10):
+        self.out_amqp = out_amqp
+        self.def_amqp = def_amqp
+        self.fallback_func = fallback_func
+        self.queue = Queue(queue_size)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.confirm = confirm
+        self.confirm_timeout = confirm_timeout
+        self.component_name = get_component_name('out-amqp')
+        self.keep_running = True
+
+        self.conn_queue = ConnectionQueue(
+            pool_size, out_amqp.get('queue_build_cap', 30), out_amqp.name, 'AMQP',
+            '{}:{}{}'.format(def_amqp.host, def_amqp.port, def_amqp.vhost), self._add_client, health_check_func=_Channel.check,
+            close_client_func=_Channel.close, **get_pool_config(out_amqp))
+
+        self.greenlets = []
+        self.idle = set() # Greenlets waiting for messages to publish
+
+    def _add_client(self):
+        self.conn_queue.put_client(_Channel(self.def_amqp, self.confirm))
+
+    def start(self):
+        self.conn_queue.build_queue()
+        self.greenlets = [spawn(self._run) for _ in range(self.conn_queue.pool_size)]
+
+    def stop(self, timeout=None):
+        """ Stops publishing messages and hands over the ones not published yet to fallback_func. Batches being published
+        at the moment are given up to timeout seconds, by default confirm_timeout plus batch_interval, to complete.
+        """
+        self.keep_running = False
+
+        # Idle greenlets have no messages so they can be stopped right away ..
+        for greenlet in list(self.idle):
+            greenlet.kill()
+
+        # .. the other ones are given time to publish their batches ..
+        joinall(self.greenlets, timeout=timeout or self.confirm_timeout + self.batch_interval)
+
+        # .. and a batch still being published after that is handed over to fallback_func as its greenlet exits.
+        # The queue is closed first so that channels discarded by these greenlets are not replaced with new ones.
+        self.conn_queue.close()
+
+        for greenlet in self.greenlets:
+            greenlet.kill()
+        self.greenlets = []
+
+        while not self.queue.empty():
+            self._fallback([self.queue.get(block=False)])
+
+# ################################################################################################################################
+
+    def get_message(self, params):
+        """ Turns parameters of PublisherFacade.send into a (body, exchange, routing_key, headers, properties) tuple,
+        using defaults of the outgoing connection for properties not given on input, the way AMQP connectors do.
+        """
+        msg_properties = params['properties'] or {}
+        properties = {}
+
+        for name in _properties:
+            value = msg_properties.get(name) or self.out_amqp.get(name)
+            if value is not None:
+                properties[name] = value
+
+        headers = dict(params['headers'] or {})
+        headers.setdefault('X-Zato-Component', self.component_name)
+        headers.setdefault('X-Zato-Msg-TS', datetime.utcnow().isoformat())
+
+        body = params['body']
+
+        # Serialize the body unless the content type is explicitly given - the same as Kombu does in AMQP connectors
+        if not properties.get('content_type'):
+            properties['content_type'], properties['content_encoding'], body = dumps(body, serializer='json')
+
+        elif isinstance(body, unicode):
+            properties.setdefault('content_encoding', 'utf-8')
+            body = body.encode(properties['content_encoding'])
+
+        return (body, params['exchange'], params['routing_key'], headers, properties), params
+
+    def put(self, params):
+        """ Enqueues a message to be published, waiting for room in the queue if it is full.
+        """
+        self.queue.put(self.get_message(params))
+
+# ################################################################################################################################
+
+    def _get_batch(self):
+        current = getcurrent()
+        self.idle.add(current)
+
+        try:
+            batch = [self.queue.get()]
+        finally:
+            self.idle.discard(current)
+
+        until = time() + self.batch_interval
+
+        while len(batch) < self.batch_size:
+            timeout = until - time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+
+        return batch
+
+    def _fallback(self, batch):
+        for _, params in batch:
+            try:
+                self.fallback_func(params)
+            except Exception, e:
+                logger.warn('Could not publish message to `%s` through the broker, e:`%s`', self.out_amqp.name, format_exc(e))
+
+    def publish(self, batch):
+        """ Publishes a batch of enqueued messages, handing over the ones that could not be published to fallback_func.
+        """
+        try:
+            client = self.conn_queue.acquire()
+        except (Exception, GreenletExit), e:
+            logger.warn('Could not obtain a channel to `%s`, e:`%s`', self.out_amqp.name, format_exc(e))
+            self._fallback(batch)
+
+            if isinstance(e, GreenletExit):
+                raise
+            return
+
+        try:
+            with Timeout(self.confirm_timeout):
+                nacked = client.publish([msg for msg, _ in batch])
+        except (Exception, Timeout, GreenletExit), e:
+
+            # GreenletExit means the publisher is stopping. Either way, only messages the broker has not confirmed
+            # are handed over to fallback_func so that none of the ones it already accepted is published twice.
+            self.conn_queue.discard(client)
+            pending = [batch[idx] for idx in sorted(client.pending)]
+            logger.warn('Could not publish %d message(s) to `%s`, e:`%s`', len(pending), self.out_amqp.name, format_exc(e))
+            self._fallback(pending)
+
+            if isinstance(e, GreenletExit):
+                raise
+        else:
+            self.conn_queue.release(client)
+
+            if nacked:
+                logger.warn('%d message(s) not confirmed by `%s`', len(nacked), self.out_amqp.name)
+                nacked = set(id(msg) for msg in nacked)
+                self._fallback([elem for elem in batch if id(elem[0]) in nacked])
+
+    def _run(self):
+        while self.keep_running:
+            batch = self._get_batch()
+            try:
+                self.publish(batch)
+            except Exception, e:
+                logger.warn('Could not publish messages to `%s`, e:`%s`', self.out_amqp.name, format_exc(e))
+
+# ################################################################################################################################
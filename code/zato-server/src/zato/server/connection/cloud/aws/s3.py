@@ -68,3 +68,6 @@ class S3Wrapper(Wrapper):
         conn.sanity_check()
 
         self.client.put_client(conn)
+
+    def health_check(self, conn):
+        conn.sanity_check()
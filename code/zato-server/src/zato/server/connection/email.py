@@ -9,11 +9,24 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+import re
 from contextlib import contextmanager
 from cStringIO import StringIO
 from logging import getLogger, INFO
+from smtplib import SMTPException, SMTPResponseException, SMTPServerDisconnected
+from socket import error as socket_error
+from time import time
 from traceback import format_exc
 
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import GreenletExit, spawn
+from gevent.event import AsyncResult
+from gevent.lock import RLock
+from gevent.queue import Queue
+
 # imbox
 from imbox import Imbox as _Imbox
 from imbox.imap import ImapTransport as _ImapTransport
@@ -24,6 +37,7 @@ from outbox import AnonymousOutbox, Attachment, Email, Outbox
 
 # Zato
 from zato.common import IMAPMessage, EMAIL
+from zato.server.connection.queue import ConnectionQueue, get_pool_config
 from zato.server.store import BaseAPI, BaseStore
 
 logger = getLogger(__name__)
@@ -34,6 +48,57 @@ _modes = {
     EMAIL.SMTP.MODE.STARTTLS.value: 'TLS'
 }
 
+# What to ask IMAP servers for depending on a fetch mode
+_fetch_items = {
+    EMAIL.IMAP.FETCH_MODE.FULL.value: 'BODY.PEEK[]',
+    EMAIL.IMAP.FETCH_MODE.HEADERS.value: 'BODY.PEEK[HEADER]',
+    EMAIL.IMAP.FETCH_MODE.STRUCTURE.value: 'BODYSTRUCTURE',
+}
+
+_uid_re = re.compile(r'UID (\d+)')
+
+# Pooled SMTP sessions that raised any of these are not put back into their queue
+_discard_on = (SMTPException, socket_error)
+
+# ################################################################################################################################
+
+def get_uid_set(uids):
+    """ Turns a list of UIDs into an IMAP sequence set, with consecutive ones collapsed into ranges, e.g. 1:3,7,9:10.
+    """
+    out = []
+    uids = sorted(int(uid) for uid in uids)
+
+    for idx, uid in enumerate(uids):
+        if idx and uid == uids[idx-1] + 1:
+            out[-1][1] = uid
+        else:
+            out.append([uid, uid])
+
+    return ','.join(str(start) if start == end else '{}:{}'.format(start, end) for start, end in out)
+
+def get_body_structure(data):
+    """ Extracts a parenthesized BODYSTRUCTURE out of a line of a FETCH response.
+    """
+    start = data.find('(', data.find('BODYSTRUCTURE'))
+    depth = 0
+    in_quotes = False
+
+    for idx in range(start, len(data)):
+        char = data[idx]
+
+        if char == '"' and data[idx-1] != '\\':
+            in_quotes = not in_quotes
+
+        elif not in_quotes:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if not depth:
+                    return data[start:idx+1]
+
+    return data[start:]
+
 # ################################################################################################################################
 
 class Imbox(_Imbox):
@@ -55,15 +120,62 @@ class Imbox(_Imbox):
 
         return email_object
 
-    def search(self, criteria):
+    def search(self, criteria, since_uid=None):
+        """ Returns UIDs of messages matching the criteria, in ascending order. If since_uid is given,
+        only UIDs greater than it are returned.
+        """
+        if since_uid:
+            criteria = 'UID {}:* {}'.format(int(since_uid) + 1, criteria)
+
         message, data = self.connection.uid('search', None, criteria)
-        return data[0].split()
+        uid_list = sorted(data[0].split(), key=int)
+
+        # An n:* range always matches the newest message, even if its UID is lower than n
+        if since_uid:
+            uid_list = [uid for uid in uid_list if int(uid) > int(since_uid)]
+
+        return uid_list
+
+    def _parse_fetch_response(self, data, fetch_mode):
+        """ Yields (UID, message) tuples out of a response to a UID FETCH. Depending on the server, UIDs may be returned
+        either before or after message literals.
+        """
+        payload = None
+
+        for item in data:
 
-    def fetch_list(self, criteria):
-        uid_list = self.search(criteria)
+            if isinstance(item, tuple):
+                header, payload = item
+            else:
+                header = item
 
-        for uid in uid_list:
-            yield (uid, self.fetch_by_uid(uid))
+            match = _uid_re.search(header)
+            if not match:
+                continue
+
+            uid = match.group(1)
+
+            if fetch_mode == EMAIL.IMAP.FETCH_MODE.STRUCTURE.value:
+                yield uid, get_body_structure(header)
+            elif payload is not None:
+                yield uid, parse_email(payload)
+
+            payload = None
+
+    def fetch_list(self, criteria, since_uid=None, batch_size=None, fetch_mode=EMAIL.IMAP.FETCH_MODE.FULL.value):
+        """ Yields (UID, message) tuples for all messages matching the criteria, fetched in batches of batch_size each,
+        using a single UID FETCH per batch. Depending on fetch_mode, messages are parsed out of full contents or headers
+        only, or they are their BODYSTRUCTURE strings as returned by the server.
+        """
+        uid_list = self.search(criteria, since_uid)
+        batch_size = batch_size or EMAIL.DEFAULT.IMAP_FETCH_BATCH_SIZE
+        fetch_items = '(UID {})'.format(_fetch_items[fetch_mode])
+
+        for idx in range(0, len(uid_list), batch_size):
+            message, data = self.connection.uid('fetch', get_uid_set(uid_list[idx:idx+batch_size]), fetch_items)
+
+            for uid, msg in self._parse_fetch_response(data, fetch_mode):
+                yield uid, msg
 
     def close(self):
         self.connection.close()
@@ -95,10 +207,46 @@ class _Connection(object):
 
 # ################################################################################################################################
 
+class _SendManyBatch(object):
+    """ Collects results of messages enqueued by a single call to SMTPConnection.send_many.
+    """
+    def __init__(self, size, callback):
+        self.results = [None] * size
+        self.remaining = size
+        self.callback = callback
+        self.async_result = AsyncResult()
+
+        if not size:
+            self.async_result.set(self.results)
+
+    def add(self, result):
+        self.results[result.idx] = result
+
+        if self.callback:
+            try:
+                self.callback(result)
+            except Exception, e:
+                logger.warn('Error in send_many callback, e:`%s`', format_exc(e))
+
+        self.remaining -= 1
+        if not self.remaining:
+            self.async_result.set(self.results)
+
+# ################################################################################################################################
+
 class SMTPConnection(_Connection):
+    """ An outgoing SMTP connection. If pool_size is set in its config, it keeps a queue of that many authenticated
+    SMTP sessions, kept alive with NOOPs while they are idle, over which all messages are sent. Otherwise, each message
+    is sent over a new session.
+    """
     def __init__(self, config, config_no_sensitive):
         self.config = config
         self.config_no_sensitive = config_no_sensitive
+        self.conn_queue = None
+        self.send_queue = None
+        self.send_greenlets = []
+        self.enqueue_jobs = [] # Messages of send_many calls not yet all put in send_queue
+        self.send_lock = RLock()
 
         self.conn_args = [self.config.host.encode('utf-8'), int(self.config.port), self.config.mode_outbox,
             self.config.is_debug, self.config.timeout]
@@ -116,7 +264,40 @@ class SMTPConnection(_Connection):
         else:
             self.conn_class = AnonymousOutbox
 
-    def send(self, msg, from_=None):
+        pool_size = int(config.get('pool_size') or 0)
+
+        if pool_size and config.is_active:
+            self.conn_queue = ConnectionQueue(
+                pool_size, config.get('queue_build_cap', 30), config.name, 'SMTP', '{}:{}'.format(config.host, config.port),
+                self._add_client, health_check_func=self._keep_alive, close_client_func=self._close_client,
+                discard_on=_discard_on, **get_pool_config(config))
+            self.conn_queue.build_queue()
+
+    def _add_client(self):
+        conn = self.conn_class(*self.conn_args)
+        conn.connect()
+        self.conn_queue.put_client(conn)
+
+    def _keep_alive(self, conn):
+        code, response = conn._conn.noop()
+        if code != 250:
+            raise SMTPResponseException(code, response)
+
+    def _close_client(self, conn):
+        conn.disconnect()
+
+    @contextmanager
+    def get_conn(self):
+        """ Yields a connection taken from the queue, if there is one, or a new one otherwise, closed once the block exits.
+        """
+        if self.conn_queue:
+            with self.conn_queue() as conn:
+                yield conn
+        else:
+            with self.conn_class(*self.conn_args) as conn:
+                yield conn
+
+    def _get_email(self, msg):
 
         headers = msg.headers or {}
         atts = [Attachment(att['name'], StringIO(att['contents'])) for att in msg.attachments] if msg.attachments else []
@@ -133,9 +314,32 @@ class SMTPConnection(_Connection):
         body, html_body = (None, msg.body) if msg.is_html else (msg.body, None)
         email = Email(msg.to, msg.subject, body, html_body, msg.charset, headers, msg.is_rfc2231)
 
+        return email, atts
+
+    def _send(self, msg, from_=None):
+        """ Sends a message, raising an exception if it could not be done. Returns a list of attachments sent.
+        """
+        email, atts = self._get_email(msg)
+        from_ = from_ or msg.from_
+
+        with self.get_conn() as conn:
+            try:
+                conn.send(email, atts, from_)
+            except SMTPServerDisconnected:
+
+                # Sessions in the queue may have been closed by the server since they were last used,
+                # in which case we reconnect once and try again.
+                if not self.conn_queue:
+                    raise
+
+                conn.connect()
+                conn.send(email, atts, from_)
+
+        return atts
+
+    def send(self, msg, from_=None):
         try:
-            with self.conn_class(*self.conn_args) as conn:
-                conn.send(email, atts, from_ or msg.from_)
+            atts = self._send(msg, from_)
         except Exception, e:
             logger.warn('Could not send an SMTP message to `%s`, e:`%s`', self.config_no_sensitive, format_exc(e))
         else:
@@ -144,6 +348,95 @@ class SMTPConnection(_Connection):
                 logger.info('SMTP message `%r` sent from `%r` to `%r`, attachments:`%r`',
                     msg.subject, msg.from_, msg.to, atts_info)
 
+    def send_many(self, msgs, from_=None, callback=None):
+        """ Sends many messages in background and returns immediately. Up to EMAIL.DEFAULT.SEND_MANY_QUEUE_SIZE messages
+        may await being sent at a time, by as many greenlets as there may be connections in the queue or, if connections
+        are not pooled, EMAIL.DEFAULT.SEND_MANY_CONCURRENCY of them.
+
+        Returns a gevent AsyncResult which is set, once all the messages have been handled, to a list of
+        Bunch(idx, msg, ok, exception, time) objects, in the same order as msgs. If given, callback is invoked with each
+        such object as soon as it is available.
+        """
+        msgs = list(msgs)
+        batch = _SendManyBatch(len(msgs), callback)
+
+        if msgs:
+            with self.send_lock:
+                self._start_send_many()
+
+                job = Bunch(msgs=msgs, from_=from_, batch=batch, next_idx=0)
+                job.greenlet = spawn(self._enqueue, self.send_queue, job)
+                self.enqueue_jobs.append(job)
+
+        return batch.async_result
+
+    def _start_send_many(self):
+        with self.send_lock:
+            if self.send_queue is None:
+                concurrency = self.conn_queue.max_size if self.conn_queue else EMAIL.DEFAULT.SEND_MANY_CONCURRENCY
+                self.send_queue = Queue(EMAIL.DEFAULT.SEND_MANY_QUEUE_SIZE)
+                self.send_greenlets = [spawn(self._send_many_worker, self.send_queue) for _ in range(concurrency)]
+
+    def _enqueue(self, send_queue, job):
+        for idx in range(len(job.msgs)):
+
+            # Blocks if the queue is full
+            send_queue.put((idx, job.msgs[idx], job.from_, job.batch))
+            job.next_idx = idx + 1
+
+        with self.send_lock:
+            if job in self.enqueue_jobs:
+                self.enqueue_jobs.remove(job)
+
+    def _send_many_worker(self, send_queue):
+        while True:
+            idx, msg, from_, batch = send_queue.get()
+            result = Bunch(idx=idx, msg=msg, ok=False, exception=None)
+            start = time()
+
+            try:
+                self._send(msg, from_)
+            except GreenletExit:
+                result.exception = Exception('Connection closed')
+                raise
+            except Exception, e:
+                logger.warn('Could not send an SMTP message to `%s`, e:`%s`', self.config_no_sensitive, format_exc(e))
+                result.exception = e
+            else:
+                result.ok = True
+            finally:
+                result.time = time() - start
+                batch.add(result)
+
+    def close(self):
+        """ Stops greenlets sending messages in background, marking the ones not sent yet, including those being sent
+        at the moment, as failed, and closes the queue of connections, if there is one.
+        """
+        closed = Exception('Connection closed')
+
+        with self.send_lock:
+
+            # Stopped first so that nothing is put in the queue once it has been drained
+            enqueue_jobs, self.enqueue_jobs = self.enqueue_jobs, []
+            for job in enqueue_jobs:
+                job.greenlet.kill()
+                for idx in range(job.next_idx, len(job.msgs)):
+                    job.batch.add(Bunch(idx=idx, msg=job.msgs[idx], ok=False, exception=closed, time=0.0))
+
+            # Each worker in the middle of sending a message adds a result for it as it exits
+            for greenlet in self.send_greenlets:
+                greenlet.kill()
+            self.send_greenlets = []
+
+            if self.send_queue is not None:
+                while not self.send_queue.empty():
+                    idx, msg, from_, batch = self.send_queue.get(block=False)
+                    batch.add(Bunch(idx=idx, msg=msg, ok=False, exception=closed, time=0.0))
+                self.send_queue = None
+
+        if self.conn_queue:
+            self.conn_queue.close()
+
 # ################################################################################################################################
 
 class SMTPAPI(BaseAPI):
@@ -159,6 +452,13 @@ class SMTPConnStore(BaseStore):
         config.mode_outbox = _modes[config.mode]
         return SMTPConnection(config, config_no_sensitive)
 
+    def _delete(self, name):
+        item = self.items.get(name)
+        if item and item.impl:
+            item.impl.close()
+
+        super(SMTPConnStore, self)._delete(name)
+
 # ################################################################################################################################
 
 class IMAPConnection(_Connection):
@@ -172,11 +472,17 @@ class IMAPConnection(_Connection):
         yield conn
         conn.close()
 
-    def get(self, folder='INBOX'):
+    def get(self, folder='INBOX', since_uid=None, batch_size=None, fetch_mode=EMAIL.IMAP.FETCH_MODE.FULL.value):
+        """ Yields (UID, IMAPMessage) tuples for messages matching the connection's criteria as soon as each batch of them
+        is fetched. Polling services may store the greatest UID seen and pass it on as since_uid the next time
+        to fetch new messages only.
+        """
         with self.get_connection() as conn:
             conn.connection.select(folder)
 
-            for uid, msg in conn.fetch_list(' '.join(self.config.get_criteria.splitlines())):
+            criteria = ' '.join(self.config.get_criteria.splitlines())
+
+            for uid, msg in conn.fetch_list(criteria, since_uid, batch_size, fetch_mode):
                 yield (uid, IMAPMessage(uid, conn, msg))
 
     def ping(self):
@@ -11,35 +11,82 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import logging
 from copy import deepcopy
+from ftplib import all_errors
 from threading import RLock
 from traceback import format_exc
 
 # pyfilesystem
+from fs.errors import RemoteConnectionError
 from fs.ftpfs import FTPFS, _GLOBAL_DEFAULT_TIMEOUT
 
 # Zato
-from zato.common import Inactive, SECRET_SHADOW, TRACE1
+from zato.common import FTP, Inactive, SECRET_SHADOW, TRACE1
+from zato.server.connection.queue import ConnectionQueue, get_pool_config
 
 logger = logging.getLogger(__name__)
 
+# Connections that raised any of these, either directly through ftplib, which includes socket errors, or translated by FTPFS,
+# are not put back into their queue.
+_discard_on = all_errors + (RemoteConnectionError,)
+
 class FTPFacade(FTPFS):
     """ A thin wrapper around fs's FTPFS so it looks like the other Zato connection objects.
     """
     def conn(self):
         return self
 
+    def keep_alive(self):
+        """ Sends a NOOP so that neither the server nor anything in between closes an idle connection.
+        """
+        self.ftp.voidcmd('NOOP')
+
 class FTPStore(object):
-    """ An object through which services access FTP connections.
+    """ An object through which services access FTP connections. Each active connection has a queue of pool_size
+    logged in FTPFacade objects, kept alive with NOOPs sent while they are idle and replaced with new ones if that fails.
     """
     def __init__(self):
         self.conn_params = {}
+        self.conn_queues = {}
         self._lock = RLock()
 
+    def _new_facade(self, params):
+        timeout = float(params.timeout) if params.timeout else _GLOBAL_DEFAULT_TIMEOUT
+        return FTPFacade(params.host, params.user, params.get('password'), params.acct, timeout, int(params.port), params.dircache)
+
+    def _close_queue(self, name):
+        """ Closes the queue of connections of a given name, if there is one. Must not be called without holding
+        onto self._lock
+        """
+        conn_queue = self.conn_queues.pop(name, None)
+        if conn_queue:
+            conn_queue.close()
+
+    def _build_queue(self, params):
+        """ Creates a new queue of connections of a given name, closing the previous one, if any. Must not be called
+        without holding onto self._lock
+        """
+        self._close_queue(params.name)
+
+        if not params.is_active:
+            return
+
+        def add_client():
+            conn_queue.put_client(self._new_facade(params))
+
+        conn_queue = ConnectionQueue(
+            int(params.get('pool_size') or FTP.DEFAULT.POOL_SIZE), params.get('queue_build_cap', 30), params.name, 'FTP',
+            '{}:{}'.format(params.host, params.port), add_client, health_check_func=FTPFacade.keep_alive,
+            close_client_func=FTPFacade.close, discard_on=_discard_on, **get_pool_config(params))
+        conn_queue.build_queue()
+
+        self.conn_queues[params.name] = conn_queue
+
     def _add(self, params):
         """ Adds one set of params to the list of connection parameters. Must not
         be called without holding onto self._lock
         """
         self.conn_params[params.name] = params
+        self._build_queue(params)
 
         msg = 'FTP params added:[{!r}]'
         
@@ -64,11 +111,25 @@ class FTPStore(object):
             return [elem.encode('utf-8') for elem in sorted(self.conn_params)]
 
     def get(self, name):
+        """ Returns a new connection, not taken from a queue, which is up to the caller to close. Use acquire instead
+        to reuse connections already established.
+        """
+        with self._lock:
+            params = self.conn_params[name]
+            if params.is_active:
+                return self._new_facade(params)
+            else:
+                raise Inactive(params.name)
+
+    def acquire(self, name):
+        """ Returns a context manager which takes a connection from its queue, waiting for one if all of them are in use,
+        and puts it back once the block is exited, e.g. with self.outgoing.ftp.acquire('My FTP') as conn: ...
+        A connection is closed and replaced with a new one instead if the block raises an FTP or socket error.
+        """
         with self._lock:
             params = self.conn_params[name]
             if params.is_active:
-                timeout = float(params.timeout) if params.timeout else _GLOBAL_DEFAULT_TIMEOUT
-                return FTPFacade(params.host, params.user, params.get('password'), params.acct, timeout, int(params.port), params.dircache)
+                return self.conn_queues[name]()
             else:
                 raise Inactive(params.name)
 
@@ -88,6 +149,7 @@ class FTPStore(object):
 
             if old_name and old_name != params.name:
                 del self.conn_params[old_name]
+                self._close_queue(old_name)
 
             msg = 'FTP connection stored, name:[{}], old_name:[{}]'.format(params.name, old_name)
             logger.info(msg)
@@ -95,9 +157,11 @@ class FTPStore(object):
     def change_password(self, name, password):
         with self._lock:
             self.conn_params[name].password = password
+            self._build_queue(self.conn_params[name])
             logger.info('Password updated - FTP connection [{}]'.format(name))
 
     def delete(self, name):
         with self._lock:
             del self.conn_params[name]
+            self._close_queue(name)
             logger.info('FTP connection [{}] deleted'.format(name))
@@ -9,7 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-from httplib import BAD_REQUEST, CONFLICT, FORBIDDEN, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
+from httplib import BAD_REQUEST, CONFLICT, FORBIDDEN, METHOD_NOT_ALLOWED, NOT_FOUND, REQUEST_ENTITY_TOO_LARGE, UNAUTHORIZED
 
 # Zato
 from zato.common import TOO_MANY_REQUESTS, HTTPException
@@ -45,4 +45,8 @@ class Unauthorized(ClientHTTPError):
 
 class TooManyRequests(ClientHTTPError):
     def __init__(self, cid, msg):
-        super(TooManyRequests, self).__init__(cid, msg, TOO_MANY_REQUESTS)
\ No newline at end of file
+        super(TooManyRequests, self).__init__(cid, msg, TOO_MANY_REQUESTS)
+
+class RequestEntityTooLarge(ClientHTTPError):
+    def __init__(self, cid, msg):
+        super(RequestEntityTooLarge, self).__init__(cid, msg, REQUEST_ENTITY_TOO_LARGE)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from collections import deque
+from datetime import datetime
+from logging import INFO
+from traceback import format_exc
+
+# anyjson
+from anyjson import dumps
+
+# gevent
+from gevent import sleep, spawn
+
+# pytz
+from pytz import UTC
+
+# tzlocal
+from tzlocal import get_localzone
+
+# Zato
+from zato.common import ACCESS_LOG_DT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+class TimestampCache(object):
+    """ Formats timestamps of requests, both in UTC and in the server's local timezone, at a granularity of one second.
+    Each second is formatted only once no matter how many requests there were in it.
+    """
+    def __init__(self, local_tz=None):
+        self.local_tz = local_tz or get_localzone()
+        self.second = None
+        self.formatted = None
+
+    def get(self, timestamp):
+        """ Returns a (UTC, local) tuple of formatted timestamps for a given number of seconds since the epoch.
+        """
+        second = int(timestamp)
+        if second != self.second:
+            utc = datetime.utcfromtimestamp(second).replace(tzinfo=UTC)
+            local = self.local_tz.normalize(utc.astimezone(self.local_tz))
+            self.formatted = (utc.strftime(ACCESS_LOG_DT_FORMAT), local.strftime(ACCESS_LOG_DT_FORMAT))
+            self.second = second
+
+        return self.formatted
+
+# ################################################################################################################################
+
+# Each formatter receives a record enqueued by AccessLog.add and a TimestampCache and returns a line to be logged
+
+def format_combined(record, ts_cache):
+    remote_ip, cid, req_time, resp_time, channel_name, method, path, http_version, status_code, response_size, \
+        user_agent = record
+
+    return '{} {}/{} "{}" [{}] "{} {} {}" {} {} "-" "{}"'.format(remote_ip, cid, resp_time, channel_name,
+        ts_cache.get(req_time)[1], method, path, http_version, status_code, response_size, user_agent)
+
+def format_json(record, ts_cache):
+    remote_ip, cid, req_time, resp_time, channel_name, method, path, http_version, status_code, response_size, \
+        user_agent = record
+
+    req_timestamp_utc, req_timestamp = ts_cache.get(req_time)
+
+    return dumps({
+        'remote_ip': remote_ip,
+        'cid': cid,
+        'resp_time': resp_time,
+        'channel_name': channel_name,
+        'req_timestamp_utc': req_timestamp_utc,
+        'req_timestamp': req_timestamp,
+        'method': method,
+        'path': path,
+        'http_version': http_version,
+        'status_code': status_code,
+        'response_size': response_size,
+        'user_agent': user_agent,
+    })
+
+formatters = {
+    'combined': format_combined,
+    'json': format_json,
+}
+
+# Fields access log records used to be logged with, before lines were formatted by AccessLog itself. They are still given
+# to loggers whose handlers are configured with formats from older logging.conf files.
+_legacy_fields = ('remote_ip', 'cid_resp_time', 'channel_name', 'req_timestamp_utc', 'req_timestamp', 'method', 'path',
+    'http_version', 'status_code', 'response_size', 'user_agent')
+
+def is_legacy_format(access_logger):
+    """ Returns True if any handler of the access logger formats records using fields from _legacy_fields.
+    """
+    for handler in getattr(access_logger, 'handlers', []):
+        fmt = getattr(handler.formatter, '_fmt', None) or ''
+        if any('%({})'.format(name) in fmt for name in _legacy_fields):
+            return True
+
+    return False
+
+def get_legacy_extra(record, ts_cache):
+    """ Returns a dict of _legacy_fields for a record enqueued by AccessLog.add, to be logged with as extra.
+    """
+    remote_ip, cid, req_time, resp_time, channel_name, method, path, http_version, status_code, response_size, \
+        user_agent = record
+
+    req_timestamp_utc, req_timestamp = ts_cache.get(req_time)
+
+    return {
+        'remote_ip': remote_ip,
+        'cid_resp_time': '{}/{}'.format(cid, resp_time),
+        'channel_name': channel_name,
+        'req_timestamp_utc': req_timestamp_utc,
+        'req_timestamp': req_timestamp,
+        'method': method,
+        'path': path,
+        'http_version': http_version,
+        'status_code': status_code,
+        'response_size': response_size,
+        'user_agent': user_agent,
+    }
+
+def register_formatter(name, func):
+    """ Makes a new output format available to access logs, func(record, ts_cache) needs to return a line to be logged.
+    """
+    formatters[name] = func
+
+# ################################################################################################################################
+
+class AccessLog(object):
+    """ HTTP access log. Handling a request only appends a tuple describing it to a ring buffer, whereas formatting and
+    writing out the log takes place in a background greenlet, in batches of up to batch_size lines, each of which
+    is logged as a single record. If the buffer holds buffer_size records already, the oldest ones are dropped.
+
+    If the access logger's handlers still use a format from before lines were formatted here, each request is logged
+    as a separate record, with the fields that format expects given in extra, and the format configured is ignored.
+    """
+    def __init__(self, access_logger, format='combined', buffer_size=10000, flush_interval=0.5, batch_size=500, local_tz=None):
+        self.access_logger = access_logger
+        self.format = formatters[format]
+        self.buffer = deque(maxlen=buffer_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ts_cache = TimestampCache(local_tz)
+        self.dropped = 0
+        self.keep_running = False
+        self.flush_greenlet = None
+
+        # Levels are not expected to change at runtime so there is no need to check it for each request
+        self.is_enabled = access_logger.isEnabledFor(INFO)
+
+        # Neither is logging configuration
+        self.is_legacy = is_legacy_format(access_logger)
+
+        if self.is_legacy:
+            logger.warn('HTTP access log format in logging.conf uses per-request fields, consider changing it to `%(message)s`')
+
+    def add(self, remote_ip, cid, req_time, resp_time, channel_name, method, path, http_version, status_code, response_size,
+            user_agent):
+        """ Enqueues information about a request, req_time is the number of seconds since the epoch, as returned by time(),
+        and resp_time is in seconds.
+        """
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+
+        self.buffer.append((remote_ip, cid, req_time, resp_time, channel_name, method, path, http_version, status_code,
+            response_size, user_agent))
+
+    def _flush_legacy(self):
+        buffer = self.buffer
+
+        while buffer:
+            record = buffer.popleft()
+            try:
+                self.access_logger.info('', extra=get_legacy_extra(record, self.ts_cache))
+            except Exception, e:
+                logger.warn('Could not log access log record `%r`, e:`%s`', record, format_exc(e))
+
+    def flush(self):
+        """ Formats and writes out everything enqueued so far.
+        """
+        if self.is_legacy:
+            self._flush_legacy()
+            self._log_dropped()
+            return
+
+        buffer = self.buffer
+        lines = []
+
+        while buffer:
+            record = buffer.popleft()
+            try:
+                lines.append(self.format(record, self.ts_cache))
+            except Exception, e:
+                logger.warn('Could not format access log record `%r`, e:`%s`', record, format_exc(e))
+
+            if len(lines) == self.batch_size:
+                self.access_logger.info('\n'.join(lines))
+                lines = []
+
+        if lines:
+            self.access_logger.info('\n'.join(lines))
+
+        self._log_dropped()
+
+    def _log_dropped(self):
+        if self.dropped:
+            logger.warn('Access log buffer full, dropped `%s` record(s)', self.dropped)
+            self.dropped = 0
+
+    def _run(self):
+        while self.keep_running:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception, e:
+                logger.warn('Could not flush access log, e:`%s`', format_exc(e))
+
+    def start(self):
+        self.keep_running = True
+        self.flush_greenlet = spawn(self._run)
+
+    def stop(self):
+        self.keep_running = False
+        if self.flush_greenlet:
+            self.flush_greenlet.kill(block=False)
+            self.flush_greenlet = None
+
+        self.flush()
+
+# ################################################################################################################################
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+import os
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from time import time
+from traceback import format_exc
+
+# gevent
+from gevent import spawn
+from gevent.queue import Empty, Full, Queue
+
+# Zato
+from zato.common import AUDIT_LOG
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+# Columns of response data, each new row needs to have all of them, even if empty, to be inserted in a single statement
+_resp_columns = ('resp_time', 'resp_headers', 'resp_payload', 'invoke_ok', 'auth_ok')
+
+# ################################################################################################################################
+
+class AuditWriter(object):
+    """ Stores audit log of HTTP/SOAP channels in the ODB in the background. Records are enqueued by URLData and written out
+    in batches, each in a single transaction, either once there are batch_size of them or once flush_interval seconds
+    have passed since the first one was enqueued.
+
+    Each record is a CID along with a function and its arguments which return the record's actual data - this lets
+    the potentially expensive work, such as masking out payloads or serializing WSGI environ, take place in the background
+    rather than while a request is being handled. Responses are matched with their requests by CID, either in the same
+    batch or, if the request has been already stored, by updating the existing row.
+
+    There are never more than max_queue_size records in memory. If that many are already waiting, overflow_policy
+    decides whether to drop new records, block until there is room for them, or spill them over to a file in spill_dir
+    until the queue drains. Once records start to be spilled over, all the new ones are spilled over too, so that
+    a response is never stored before its request. Records to be spilled over wait in a queue of their own, of up to
+    max_queue_size records too, and they are prepared and written to the file by the same background greenlet.
+    """
+    def __init__(self, odb, batch_size=100, flush_interval=1.0, max_queue_size=10000,
+            overflow_policy=AUDIT_LOG.OVERFLOW_POLICY.DROP, spill_dir=None):
+        self.odb = odb
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.queue = Queue(max_queue_size)
+        self.keep_running = False
+        self.writer_greenlet = None
+        self.dropped = 0
+
+        if overflow_policy == AUDIT_LOG.OVERFLOW_POLICY.SPILL:
+            if not spill_dir:
+                raise ValueError('spill_dir is required if overflow_policy is `{}`'.format(overflow_policy))
+            self.spill_path = os.path.join(spill_dir, 'audit-{}.spill'.format(os.getpid()))
+            self.spill_queue = Queue(max_queue_size)
+        else:
+            self.spill_path = None
+            self.spill_queue = None
+
+        self.is_spilling = False
+
+    def __repr__(self):
+        return '<{} at {} qsize:[{}], overflow_policy:[{}], is_spilling:[{}], dropped:[{}]>'.format(
+            self.__class__.__name__, hex(id(self)), self.queue.qsize(), self.overflow_policy, self.is_spilling, self.dropped)
+
+# ################################################################################################################################
+
+    def add_request(self, cid, func, *args):
+        """ Enqueues a request, func(*args) will be called in the background and needs to return a dictionary of data
+        describing the request.
+        """
+        self._add((True, cid, func, args))
+
+    def add_response(self, cid, func, *args):
+        """ Enqueues a response to a previously enqueued request, same as with add_request, func(*args) needs to return
+        a dictionary of data describing the response.
+        """
+        self._add((False, cid, func, args))
+
+    def _add(self, record):
+        if self.is_spilling:
+            self._add_spill(record)
+            return
+
+        try:
+            if self.overflow_policy == AUDIT_LOG.OVERFLOW_POLICY.BLOCK:
+                self.queue.put(record)
+            else:
+                self.queue.put_nowait(record)
+
+        except Full:
+            if self.overflow_policy == AUDIT_LOG.OVERFLOW_POLICY.SPILL:
+                self.is_spilling = True
+                self._add_spill(record)
+            else:
+                self._drop(record)
+
+    def _add_spill(self, record):
+        try:
+            self.spill_queue.put_nowait(record)
+        except Full:
+            self._drop(record)
+
+    def _drop(self, record):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logger.warn('Audit queue full, dropped `%s` record(s) so far, cid:`%s`', self.dropped, record[1])
+
+# ################################################################################################################################
+
+    def _prepare(self, record):
+        """ Turns an enqueued record into a dictionary of data to be stored, None if it could not be prepared.
+        """
+        is_request, cid, func, args = record
+        try:
+            data = func(*args)
+        except Exception, e:
+            logger.warn('Could not prepare audit data, cid:`%s`, e:`%s`', cid, format_exc(e))
+        else:
+            data['cid'] = cid
+            return is_request, data
+
+    def _spill(self):
+        """ Prepares records waiting to be spilled over and appends them to the spill file.
+        """
+        if not self.spill_queue or self.spill_queue.empty():
+            return
+
+        records = []
+        while not self.spill_queue.empty():
+            records.append(self.spill_queue.get_nowait())
+
+        prepared = [elem for elem in (self._prepare(record) for record in records) if elem]
+
+        try:
+            with open(self.spill_path, 'ab') as f:
+                for elem in prepared:
+                    dump(elem, f, HIGHEST_PROTOCOL)
+        except Exception, e:
+            self.dropped += len(prepared)
+            logger.warn('Could not spill `%s` audit record(s) over to `%s`, e:`%s`', len(prepared), self.spill_path,
+                format_exc(e))
+
+    def _read_spilled(self):
+        """ Returns all the records spilled over so far and removes the file they were in.
+        """
+        out = []
+
+        if not os.path.exists(self.spill_path):
+            return out
+
+        with open(self.spill_path, 'rb') as f:
+            while True:
+                try:
+                    out.append(load(f))
+                except EOFError:
+                    break
+
+        os.remove(self.spill_path)
+
+        return out
+
+# ################################################################################################################################
+
+    def store(self, prepared):
+        """ Stores a list of already prepared (is_request, data) pairs in the ODB, in the order they were enqueued.
+        """
+        requests = []
+        requests_by_cid = {}
+        responses = []
+
+        for is_request, data in prepared:
+            if is_request:
+                for name in _resp_columns:
+                    data.setdefault(name, None)
+                requests.append(data)
+                requests_by_cid[data['cid']] = data
+            else:
+                # The request is in the same batch so the response can be inserted along with it
+                request = requests_by_cid.get(data['cid'])
+                if request:
+                    request.update(data)
+                else:
+                    responses.append(data)
+
+        try:
+            self.odb.audit_set_http_soap_batch(requests, responses)
+        except Exception, e:
+            logger.warn('Could not store `%s` audit request(s) and `%s` response(s), e:`%s`',
+                len(requests), len(responses), format_exc(e))
+
+    def _get_batch(self):
+        """ Waits for at most flush_interval seconds for records and returns up to batch_size of them.
+        """
+        batch = []
+
+        try:
+            batch.append(self.queue.get(timeout=self.flush_interval))
+        except Empty:
+            return batch
+
+        deadline = time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+
+        return batch
+
+    def flush(self, batch):
+        prepared = [elem for elem in (self._prepare(record) for record in batch) if elem]
+        if prepared:
+            self.store(prepared)
+
+    def _drain_spilled(self):
+        """ Stores all the records spilled over, all of which are newer than anything that has been in the queue.
+        """
+        self._spill()
+        spilled = self._read_spilled()
+
+        # From now on new records can go to the queue again
+        self.is_spilling = False
+
+        for idx in xrange(0, len(spilled), self.batch_size):
+            self.store(spilled[idx:idx+self.batch_size])
+
+    def _store_all(self):
+        """ Stores everything that has not been stored yet, including records spilled over.
+        """
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+            if len(batch) == self.batch_size:
+                self.flush(batch)
+                batch = []
+
+        self.flush(batch)
+
+        if self.is_spilling:
+            self._drain_spilled()
+
+    def _run(self):
+        while self.keep_running:
+            try:
+                self._spill()
+                self.flush(self._get_batch())
+
+                if self.is_spilling and self.queue.empty():
+                    self._drain_spilled()
+
+            except Exception, e:
+                logger.warn('Exception in audit writer, e:`%s`', format_exc(e))
+
+        try:
+            self._store_all()
+        except Exception, e:
+            logger.warn('Could not store audit log while stopping, e:`%s`', format_exc(e))
+
+# ################################################################################################################################
+
+    def start(self):
+        self.keep_running = True
+        self.writer_greenlet = spawn(self._run)
+
+    def stop(self, timeout=10):
+        """ Stops the background greenlet, giving it up to timeout seconds to store everything that has not been stored yet.
+        If the greenlet has not been started, everything is stored by the caller.
+        """
+        self.keep_running = False
+
+        if self.writer_greenlet:
+            self.writer_greenlet.join(timeout)
+
+            if not self.writer_greenlet.dead:
+                self.writer_greenlet.kill(block=False)
+                logger.warn('Audit writer did not stop within %ss, `%s` record(s) not stored', timeout,
+                    self.queue.qsize() + (self.spill_queue.qsize() if self.spill_queue else 0))
+
+            self.writer_greenlet = None
+
+        else:
+            self._store_all()
+
+# ################################################################################################################################
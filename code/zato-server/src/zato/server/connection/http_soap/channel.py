@@ -10,7 +10,9 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
-from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
+from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, \
+     REQUEST_ENTITY_TOO_LARGE, UNAUTHORIZED
+from tempfile import SpooledTemporaryFile
 from traceback import format_exc
 
 # anyjson
@@ -27,7 +29,7 @@ from zato.common import CHANNEL, DATA_FORMAT, HTTP_RESPONSES, SEC_DEF_TYPE, SIMP
      URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_ERROR, ZATO_NONE, ZATO_OK
 from zato.common.util import payload_from_request
 from zato.server.connection.http_soap import BadRequest, ClientHTTPError, Forbidden, MethodNotAllowed, NotFound, \
-     TooManyRequests, Unauthorized
+     RequestEntityTooLarge, TooManyRequests, Unauthorized
 from zato.server.service.internal import AdminService
 
 logger = logging.getLogger(__name__)
@@ -39,6 +41,13 @@ _status_method_not_allowed = b'{} {}'.format(METHOD_NOT_ALLOWED, HTTP_RESPONSES[
 _status_unauthorized = b'{} {}'.format(UNAUTHORIZED, HTTP_RESPONSES[UNAUTHORIZED])
 _status_forbidden = b'{} {}'.format(FORBIDDEN, HTTP_RESPONSES[FORBIDDEN])
 _status_too_many_requests = b'{} {}'.format(TOO_MANY_REQUESTS, HTTP_RESPONSES[TOO_MANY_REQUESTS])
+_status_request_entity_too_large = b'{} {}'.format(REQUEST_ENTITY_TOO_LARGE, HTTP_RESPONSES[REQUEST_ENTITY_TOO_LARGE])
+
+# How many bytes at a time to read streamed requests in
+_stream_chunk_size = 65536
+
+# Streamed requests bigger than that many bytes are spooled over to a temporary file unless configured otherwise
+_default_spool_threshold = 1048576
 
 soap_doc = b"""<?xml version='1.0' encoding='UTF-8'?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns="https://zato.io/ns/20130518"><soap:Body>{body}</soap:Body></soap:Envelope>""" # noqa
 
@@ -90,11 +99,13 @@ def get_client_error_wrapper(transport, data_format):
 class RequestDispatcher(object):
     """ Dispatches all the incoming HTTP/SOAP requests to appropriate handlers.
     """
-    def __init__(self, url_data=None, security=None, request_handler=None, simple_io_config=None):
+    def __init__(self, url_data=None, security=None, request_handler=None, simple_io_config=None,
+            spool_threshold=_default_spool_threshold):
         self.url_data = url_data
         self.security = security
         self.request_handler = request_handler
         self.simple_io_config = simple_io_config
+        self.spool_threshold = spool_threshold
 
     def wrap_error_message(self, cid, url_type, msg):
         """ Wraps an error message in a transport-specific envelope.
@@ -117,6 +128,53 @@ class RequestDispatcher(object):
 
         return soap_action
 
+    def get_payload(self, cid, channel_item, wsgi_environ):
+        """ Returns the body of a request. Channels that stream requests receive a file-like object, spooled over
+        to a temporary file if the body is bigger than self.spool_threshold, whereas all the other ones receive a string.
+        Either way, a body bigger than channel's max_body_size is rejected, if possible without reading it at all.
+        """
+        wsgi_input = wsgi_environ['wsgi.input']
+        max_body_size = channel_item.get('max_body_size')
+
+        if max_body_size:
+            try:
+                content_length = int(wsgi_environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                raise BadRequest(cid, 'Invalid Content-Length')
+
+            if content_length > max_body_size:
+                raise RequestEntityTooLarge(cid, 'Request body exceeds {} bytes'.format(max_body_size))
+
+        if not channel_item.get('stream_request'):
+            if not max_body_size:
+                return wsgi_input.read()
+
+            # Content-Length may have been not sent at all
+            payload = wsgi_input.read(max_body_size + 1)
+            if len(payload) > max_body_size:
+                raise RequestEntityTooLarge(cid, 'Request body exceeds {} bytes'.format(max_body_size))
+
+            return payload
+
+        stream = SpooledTemporaryFile(self.spool_threshold)
+        size = 0
+
+        while True:
+            data = wsgi_input.read(_stream_chunk_size)
+            if not data:
+                break
+
+            size += len(data)
+            if max_body_size and size > max_body_size:
+                stream.close()
+                raise RequestEntityTooLarge(cid, 'Request body exceeds {} bytes'.format(max_body_size))
+
+            stream.write(data)
+
+        stream.seek(0)
+
+        return stream
+
     def dispatch(self, cid, req_timestamp, wsgi_environ, worker_store):
         """ Base method for dispatching incoming HTTP/SOAP messages. If the security
         configuration is one of the technical account or HTTP basic auth,
@@ -145,18 +203,25 @@ class RequestDispatcher(object):
         # This is needed in parallel.py's on_wsgi_request
         wsgi_environ['zato.http.channel_item'] = channel_item
 
-        payload = wsgi_environ['wsgi.input'].read()
-        
         # OK, we can possibly handle it
         if url_match not in (None, False):
 
-            # This is a synchronous call so that whatever happens next we are always
-            # able to have at least initial audit log of requests.
-            if channel_item['audit_enabled']:
-                self.url_data.audit_set_request(cid, channel_item, payload, wsgi_environ)
+            stream = None
 
             try:
 
+                # Streamed requests are made available to services through self.request.stream only,
+                # they are never read into memory as a whole unless a service asks for its payload.
+                payload = self.get_payload(cid, channel_item, wsgi_environ)
+                if not isinstance(payload, basestring):
+                    stream, payload = payload, ''
+                    wsgi_environ['zato.request.stream'] = stream
+
+                # The request is enqueued before anything else takes place so that whatever happens next
+                # we are always able to have at least initial audit log of requests.
+                if channel_item['audit_enabled']:
+                    self.url_data.audit_set_request(cid, channel_item, payload, wsgi_environ)
+
                 # Raise 404 if the channel is inactive
                 if not channel_item['is_active']:
                     logger.warn('url_data:`%s` is not active, raising NotFound', sorted(url_match.items()))
@@ -185,8 +250,13 @@ class RequestDispatcher(object):
                 # Eagerly parse the request but only if we expect XPath-based credentials. The request will be re-used
                 # in later steps, it won't be parsed twice or more.
                 if sec.sec_def != ZATO_NONE and sec.sec_def.sec_type == SEC_DEF_TYPE.XPATH_SEC:
+                    if stream:
+                        raw_request = stream.read()
+                        stream.seek(0)
+                    else:
+                        raw_request = payload
                     wsgi_environ['zato.request.payload'] = payload_from_request(
-                        cid, payload, channel_item.data_format, channel_item.transport)
+                        cid, raw_request, channel_item.data_format, channel_item.transport)
 
                 # Will raise an exception on any security violation
                 self.url_data.check_security(
@@ -233,6 +303,9 @@ class RequestDispatcher(object):
                     elif isinstance(e, TooManyRequests):
                         status = _status_too_many_requests
 
+                    elif isinstance(e, RequestEntityTooLarge):
+                        status = _status_request_entity_too_large
+
                 else:
                     status_code = INTERNAL_SERVER_ERROR
                     response = _format_exc
@@ -254,9 +327,15 @@ class RequestDispatcher(object):
                     response = error_wrapper(cid, response)
 
                 wsgi_environ['zato.http.response.status'] = status
-                
+
                 return response
 
+            finally:
+
+                # Services have already returned so a spooled over request is not needed anymore
+                if stream:
+                    stream.close()
+
         # This is 404, no such URL path and SOAP action is known.
         else:
             response = b"[{}] Unknown URL:[{}] or SOAP action:[{}]".format(cid, path_info, soap_action)
@@ -9,18 +9,27 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+import os
 from copy import deepcopy
 from cStringIO import StringIO
 from datetime import datetime
+from hashlib import sha1, sha256
 from json import dumps, loads
+from shutil import rmtree
 from logging import DEBUG, getLogger
+from time import time
 from traceback import format_exc
+from urlparse import urljoin
+
+# Bunch
+from bunch import Bunch
 
 # gevent
-from gevent.lock import RLock
+from gevent import joinall, killall, spawn, Timeout
+from gevent.lock import RLock, Semaphore
 
 # lxml
-from lxml.etree import fromstring, tostring
+from lxml.etree import fromstring, iterparse, tostring, XPath
 
 # parse
 from parse import PARSE_RE
@@ -33,10 +42,27 @@ from requests.exceptions import Timeout as RequestsTimeout
 from zato.common import CONTENT_TYPE, DATA_FORMAT, Inactive, SEC_DEF_TYPE, soapenv11_namespace, soapenv12_namespace, TimeoutException, \
      URL_TYPE, ZATO_NONE
 from zato.common.util import get_component_name
-from zato.server.connection.queue import ConnectionQueue
+from zato.server.connection.queue import ConnectionQueue, get_pool_config
 
 logger = getLogger(__name__)
 
+# Locations of documents a WSDL or XSD imports, WSDL uses 'location' and XSD uses 'schemaLocation' to point to them
+_get_import_locations = XPath(
+    '//*[local-name()="import" or local-name()="include"]/@location | '
+    '//*[local-name()="import" or local-name()="include" or local-name()="redefine"]/@schemaLocation')
+
+# ################################################################################################################################
+
+def _free_elem(elem):
+    """ Frees memory taken by an element iterparse returned once it has been processed, along with the one taken
+    by everything that precedes it in the document, so that the document is not built up in memory as it is being parsed.
+    """
+    elem.clear()
+
+    for item in [elem] + list(elem.iterancestors()):
+        while item.getprevious() is not None:
+            del item.getparent()[0]
+
 # ################################################################################################################################
 
 class HTTPSAdapter(requests.adapters.HTTPAdapter):
@@ -311,8 +337,17 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 # ################################################################################################################################
 
     def http_request(self, method, cid, data='', params=None, *args, **kwargs):
+        """ Invokes the resource. If stream=True is given on input, the response's body is not read upfront. Instead,
+        response.data is an iterator over its parts - JSON objects, one per line, or XML elements, either named xml_tag
+        or all the children of the root element, depending on the connection's data format, or chunks of up to
+        chunk_size bytes if no data format is set.
+        """
         self._enforce_is_active()
 
+        stream = kwargs.get('stream')
+        chunk_size = kwargs.pop('chunk_size', 8192)
+        xml_tag = kwargs.pop('xml_tag', None)
+
         # We never touch strings/unicode because apparently the user already serialized outgoing data
         needs_serialize = not isinstance(data, basestring)
 
@@ -341,6 +376,10 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 
         response = self.invoke_http(cid, method, address, data, headers, {}, params=qs_params, *args, **kwargs)
 
+        if stream:
+            response.data = self._iter_data(response, chunk_size, xml_tag)
+            return response
+
         if logger.isEnabledFor(DEBUG):
             logger.debug('CID:`%s`, response:`%s`', cid, response.text)
 
@@ -355,6 +394,37 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 
         return response
 
+    def _iter_data(self, response, chunk_size, xml_tag):
+        """ Yields parts of a streamed response's body, closing the response once there are no more of them.
+        """
+        try:
+            if self.config['data_format'] == DATA_FORMAT.JSON:
+                for line in response.iter_lines(chunk_size):
+                    if line.strip():
+                        yield loads(line)
+
+            elif self.config['data_format'] == DATA_FORMAT.XML:
+                response.raw.decode_content = True
+                depth = 0
+
+                for event, elem in iterparse(response.raw, events=('start', 'end'), tag=xml_tag):
+                    if xml_tag:
+                        if event == 'end':
+                            yield elem
+                            _free_elem(elem)
+                    else:
+                        # Without a tag, each child of the root element is returned once it is complete
+                        depth += 1 if event == 'start' else -1
+                        if event == 'end' and depth == 1:
+                            yield elem
+                            _free_elem(elem)
+
+            else:
+                for chunk in response.iter_content(chunk_size):
+                    yield chunk
+        finally:
+            response.close()
+
 # ################################################################################################################################
 
     def get(self, cid, params=None, *args, **kwargs):
@@ -381,6 +451,75 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 
 # ################################################################################################################################
 
+class PlainHTTPFacade(object):
+    """ Lets services access outgoing plain HTTP connections through the same API as the ConfigDict they are kept in,
+    e.g. self.outgoing.plain_http['My Connection'].conn.get(self.cid), and invoke many of them concurrently.
+    """
+    def __init__(self, config_dict):
+        self._config_dict = config_dict
+
+    def __getitem__(self, name):
+        return self._config_dict[name]
+
+    def __iter__(self):
+        return iter(self._config_dict)
+
+    def __nonzero__(self):
+        return bool(self._config_dict)
+
+    def __getattr__(self, name):
+        return getattr(self._config_dict, name)
+
+    def _invoke(self, cid, idx, call, results, semaphore):
+        with semaphore:
+            self._invoke_impl(cid, idx, call, results)
+
+    def _invoke_impl(self, cid, idx, call, results):
+        start = time()
+        name = call['name']
+
+        try:
+            timeout = call.get('timeout')
+            exception = TimeoutException(cid, 'Invocation of `{}` did not complete within {}s'.format(name, timeout))
+
+            with Timeout(timeout, exception):
+                response = self._config_dict[name].conn.http_request(call.get('method', 'GET'), cid, call.get('data', ''),
+                    call.get('params'), headers=call.get('headers', {}))
+
+        except Exception, e:
+            logger.warn('CID:`%s` Could not invoke `%s`, e:`%s`', cid, name, format_exc(e))
+            results[idx] = Bunch(name=name, ok=False, response=None, exception=e, time=time() - start)
+        else:
+            results[idx] = Bunch(name=name, ok=True, response=response, exception=None, time=time() - start)
+
+    def invoke_many(self, cid, calls, timeout=None, concurrency=None):
+        """ Invokes connections concurrently, each in a separate greenlet, at most concurrency of them at a time.
+        Each of the calls is a dictionary with the name of a connection and, optionally, method, data, params, headers
+        and timeout, in seconds, of that particular call. Waits for at most timeout seconds for all of them to complete.
+
+        Returns a list of results, in the same order as calls, each with name, ok, response, exception and time keys.
+        Calls that did not complete within their own timeouts, or the overall one, are returned with ok=False
+        and a TimeoutException.
+        """
+        results = [None] * len(calls)
+        semaphore = Semaphore(concurrency or len(calls) or 1)
+
+        greenlets = [spawn(self._invoke, cid, idx, call, results, semaphore) for idx, call in enumerate(calls)]
+        joinall(greenlets, timeout=timeout)
+
+        # Calls still running are not waited for any longer, whatever has completed so far is returned
+        killall(greenlets, block=False)
+
+        for idx, result in enumerate(results):
+            if result is None:
+                name = calls[idx]['name']
+                results[idx] = Bunch(name=name, ok=False, response=None, time=timeout,
+                    exception=TimeoutException(cid, 'Invocation of `{}` did not complete within {}s'.format(name, timeout)))
+
+        return results
+
+# ################################################################################################################################
+
 class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
     """ A thin wrapper around the suds SOAP library
     """
@@ -396,19 +535,23 @@ class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
         self.conn_type = 'Suds SOAP'
         self.client = ConnectionQueue(
             self.config['pool_size'], self.config['queue_build_cap'], self.config['name'], self.conn_type, self.address,
-            self.add_client)
+            self.add_client, **get_pool_config(self.config))
+
+        # Parsed WSDL is kept in a client all the ones in the queue are cloned from and, across restarts,
+        # in a directory named after the WSDL's address and its contents' hash.
+        self.wsdl_cache_dir = self.config.get('wsdl_cache_dir')
+        self.wsdl_client = None
+        self.wsdl_client_lock = RLock()
 
     def set_auth(self):
         """ Configures the security for requests, if any is to be configured at all.
         """
         self.suds_auth = {'username':self.config['username'], 'password':self.config['password']}
 
-    def add_client(self):
-
-        logger.info('About to add a client to `%s` (%s)', self.address, self.conn_type)
-
+    def _get_client_kwargs(self):
+        """ Returns keyword arguments to create suds clients with, depending on what security definition is used, if any.
+        """
         # Lazily-imported here to make sure gevent monkey patches everything well in advance
-        from suds.client import Client
         from suds.transport.https import HttpAuthenticated
         from suds.transport.https import WindowsHttpAuthenticated
         from suds.wsse import Security, UsernameToken
@@ -416,26 +559,101 @@ class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
         sec_type = self.config['sec_type']
 
         if sec_type == SEC_DEF_TYPE.BASIC_AUTH:
-            transport = HttpAuthenticated(**self.suds_auth)
+            return {'transport': HttpAuthenticated(**self.suds_auth)}
 
         elif sec_type == SEC_DEF_TYPE.NTLM:
-            transport = WindowsHttpAuthenticated(**self.suds_auth)
+            return {'transport': WindowsHttpAuthenticated(**self.suds_auth)}
 
         elif sec_type == SEC_DEF_TYPE.WSS:
             security = Security()
             token = UsernameToken(self.suds_auth['username'], self.suds_auth['password'])
             security.tokens.append(token)
 
-            client = Client(self.address, autoblend=True, wsse=security)
+            return {'wsse': security}
+
+        # No security at all
+        return {'timeout': self.config['timeout']}
+
+    def get_wsdl_hash(self, transport):
+        """ Returns a hash of contents of the WSDL and all the documents it imports, directly or not, fetched with
+        the transport given on input. Documents are only looked through for imports rather than fully parsed by suds.
+        """
+        from suds.transport import Request
+
+        wsdl_hash = sha256()
+        to_fetch = [self.address]
+        seen = set(to_fetch)
+
+        while to_fetch:
+            url = to_fetch.pop(0)
+            data = transport.open(Request(url)).read()
+            wsdl_hash.update(data)
+
+            for location in _get_import_locations(fromstring(data)):
+                location = urljoin(url, location)
+                if location not in seen:
+                    seen.add(location)
+                    to_fetch.append(location)
+
+        return wsdl_hash.hexdigest()
+
+    def _get_wsdl_cache_base_dir(self):
+        return os.path.join(self.wsdl_cache_dir, sha1(self.address.encode('utf-8')).hexdigest())
 
-        if sec_type in(SEC_DEF_TYPE.BASIC_AUTH, SEC_DEF_TYPE.NTLM):
-            client = Client(self.address, autoblend=True, transport=transport)
+    def _get_wsdl_cache_location(self, transport):
+        """ Returns a directory to cache the parsed WSDL in, removing cached versions of the WSDL whose contents were different.
+        """
+        base_dir = self._get_wsdl_cache_base_dir()
+        wsdl_hash = self.get_wsdl_hash(transport)
+
+        if os.path.exists(base_dir):
+            for name in os.listdir(base_dir):
+                if name != wsdl_hash:
+                    rmtree(os.path.join(base_dir, name), True)
+
+        return os.path.join(base_dir, wsdl_hash)
+
+    def clear_wsdl_cache(self):
+        """ Removes the WSDL parsed and cached on disk, e.g. because the connection has been edited.
+        """
+        self.wsdl_client = None
+        if self.wsdl_cache_dir:
+            rmtree(self._get_wsdl_cache_base_dir(), True)
+
+    def get_wsdl_client(self):
+        """ Returns a client holding the parsed WSDL. It is created only once, and only if the WSDL has not been parsed
+        and cached on disk yet is it actually parsed.
+        """
+        with self.wsdl_client_lock:
+            if not self.wsdl_client:
+
+                # Lazily-imported here to make sure gevent monkey patches everything well in advance
+                from suds.cache import ObjectCache
+                from suds.client import Client
+                from suds.transport.http import HttpTransport
+
+                kwargs = self._get_client_kwargs()
 
-        # Still could be either none at all or WSS
-        if not sec_type:
-            client = Client(self.address, autoblend=True, timeout=self.config['timeout'])
+                if self.wsdl_cache_dir:
+                    location = self._get_wsdl_cache_location(kwargs.get('transport') or HttpTransport())
+
+                    # Policy 1 means that whole WSDL objects are pickled rather than XML documents they were parsed from
+                    kwargs['cache'] = ObjectCache(location)
+                    kwargs['cachingpolicy'] = 1
+
+                start = time()
+                self.wsdl_client = Client(self.address, autoblend=True, **kwargs)
+
+                logger.info('Obtained WSDL from `%s` in %.3fs (%s)', self.address, time() - start, self.conn_type)
+
+            return self.wsdl_client
+
+    def add_client(self):
+
+        logger.info('About to add a client to `%s` (%s)', self.address, self.conn_type)
 
-        self.client.put_client(client)
+        # All the clients share the WSDL parsed once, clones have their own options, including transports
+        self.client.put_client(self.get_wsdl_client().clone())
 
     def build_client_queue(self):
 
@@ -35,8 +35,8 @@ from secwall.wsse import WSSE
 from sortedcontainers import SortedListWithKey
 
 # Zato
-from zato.common import AUDIT_LOG, DATA_FORMAT, MISC, MSG_PATTERN_TYPE, SEC_DEF_TYPE, TRACE1, ZATO_NONE
-from zato.common.broker_message import code_to_name, CHANNEL, SECURITY
+from zato.common import AUDIT_LOG, MISC, MSG_PATTERN_TYPE, SEC_DEF_TYPE, TRACE1, ZATO_NONE
+from zato.common.broker_message import code_to_name, SECURITY
 from zato.common.dispatch import dispatcher
 from zato.common.util import parse_tls_channel_security_definition
 from zato.server.connection.http_soap import Forbidden, Unauthorized
@@ -47,6 +47,7 @@ class Matcher(object):
     """ Matches incoming URL paths in requests received against the pattern it's configured to react to.
     For instance, '/permission/user/{user_id}/group/{group_id}' gets translated and compiled to the regex 
     of '/permission/user/(?P<user_id>\\w+)/group/(?P<group_id>\\w+)$' which in runtime is used for matching.
+    Dots outside of {param} groups match only dots, e.g. '/api/v1.0' does not match '/api/v100'.
     """
     def __init__(self, pattern):
         self.group_names = []
@@ -63,6 +64,13 @@ class Matcher(object):
 
     def _set_up_matcher(self, pattern):
         orig_groups = self._brace_pattern.findall(pattern)
+
+        # Dots outside of {param} groups are escaped so they do not match any character
+        parts = self._brace_pattern.split(pattern)
+        pattern = _unescaped_dot.sub(r'\\.', parts[0])
+        for idx, part in enumerate(parts[1:]):
+            pattern += orig_groups[idx] + _unescaped_dot.sub(r'\\.', part)
+
         groups = [elem.replace('{', '').replace('}', '') for elem in orig_groups]
         groups = [[elem, self._elem_re_template.format(elem)] for elem in groups]
 
@@ -77,6 +85,155 @@ class Matcher(object):
         if m:
             return dict(zip(self.group_names, m.groups()))
 
+# Characters which, when found outside of {param} groups, make a channel's pattern impossible to index by its segments,
+# e.g. '/a?b' may match both '/ab' and '/b'. Dots are not among them because Matcher escapes them.
+_regex_meta = re_compile(r'[$^*+?()\[\]{}|\\]')
+_brace_pattern = re_compile('\{[a-zA-Z0-9 _\$.\-|=~^]+\}')
+_unescaped_dot = re_compile(r'(?<!\\)\.')
+
+class _RouterNode(object):
+    """ A single node of URLRouter's segment trie.
+    """
+    __slots__ = ('literal', 'wildcard', 'items')
+
+    def __init__(self):
+        self.literal = {}
+        self.wildcard = None
+        self.items = []
+
+class URLRouter(object):
+    """ An index of HTTP channels which lets URLData.match find candidate channels without running each channel's Matcher.
+    Channels are hashed by their SOAP action first and then kept in a trie of URL path segments, with any segment
+    containing a {param} group stored under a wildcard branch. Channels whose patterns cannot be indexed this way,
+    for instance because they contain regex metacharacters, are kept in a fallback list, sorted by name, and always
+    become candidates.
+    Candidates are confirmed with their own Matcher in the same order URLData.channel_data uses so the outcome is always
+    the same as that of a linear scan.
+    """
+    def __init__(self, channel_data=()):
+        self.soap_actions = {}
+        self.fallback = SortedListWithKey(key=attrgetter('name'))
+
+        for item in channel_data:
+            self.add(item)
+
+    def _get_path(self, match_target):
+        """ Returns a (soap_action, segments) tuple for a given match target or None if it cannot be indexed.
+        Each segment is either a string to be compared literally or None for a segment with {param} groups.
+        """
+        soap_action, separator, url_path = match_target.partition(MISC.SEPARATOR)
+
+        if not separator or soap_action.endswith(':') or _regex_meta.search(soap_action):
+            return None
+
+        segments = []
+
+        for segment in url_path.split('/'):
+            if _brace_pattern.search(segment):
+                if _regex_meta.search(_brace_pattern.sub('', segment)):
+                    return None
+                segments.append(None)
+
+            elif _regex_meta.search(segment):
+                return None
+
+            else:
+                segments.append(segment)
+
+        return soap_action, segments
+
+    def _get_node(self, soap_action, segments, create):
+        node = self.soap_actions.get(soap_action)
+        if not node:
+            if not create:
+                return None
+            node = self.soap_actions[soap_action] = _RouterNode()
+
+        for segment in segments:
+            if segment is None:
+                if not node.wildcard:
+                    if not create:
+                        return None
+                    node.wildcard = _RouterNode()
+                node = node.wildcard
+            else:
+                child = node.literal.get(segment)
+                if not child:
+                    if not create:
+                        return None
+                    child = node.literal[segment] = _RouterNode()
+                node = child
+
+        return node
+
+    def add(self, item):
+        """ Adds a new channel to the index.
+        """
+        path = self._get_path(item.match_target)
+        if path is None:
+            self.fallback.add(item)
+        else:
+            self._get_node(path[0], path[1], True).items.append(item)
+
+    def remove(self, item):
+        """ Removes a channel from the index, does nothing if there is no such channel.
+        """
+        path = self._get_path(item.match_target)
+        if path is None:
+            for idx, elem in enumerate(self.fallback):
+                if elem is item:
+                    del self.fallback[idx]
+                    break
+        else:
+            node = self._get_node(path[0], path[1], False)
+            if node:
+                node.items[:] = [elem for elem in node.items if elem is not item]
+
+    def _collect(self, node, segments, idx, out):
+        if idx == len(segments):
+            out.extend(node.items)
+            return
+
+        segment = segments[idx]
+
+        child = node.literal.get(segment)
+        if child:
+            self._collect(child, segments, idx + 1, out)
+
+        # {param} groups never match empty strings
+        if node.wildcard and segment:
+            self._collect(node.wildcard, segments, idx + 1, out)
+
+    def match(self, target):
+        """ Returns a (match, channel_item) tuple for the first channel matching target or (None, None) if there is none.
+        """
+        candidates = []
+        soap_action, _, url_path = target.partition(MISC.SEPARATOR)
+
+        node = self.soap_actions.get(soap_action)
+        if node:
+
+            # Matchers end with a $ which also matches right before a trailing newline
+            if url_path.endswith('\n'):
+                url_path = url_path[:-1]
+
+            self._collect(node, url_path.split('/'), 0, candidates)
+
+        # The fallback list is already sorted so it is used as-is unless there are other candidates to merge it with
+        if not candidates:
+            candidates = self.fallback
+        else:
+            candidates.extend(self.fallback)
+            if len(candidates) > 1:
+                candidates.sort(key=attrgetter('name'))
+
+        for item in candidates:
+            match = item.match_target_compiled.match(target)
+            if match is not None:
+                return match, item
+
+        return None, None
+
 class OAuthStore(object):
     def __init__(self, oauth_config):
         self.oauth_config = oauth_config
@@ -87,7 +244,7 @@ class URLData(OAuthDataStore):
     def __init__(self, channel_data=None, url_sec=None, basic_auth_config=None, ntlm_config=None, oauth_config=None,
                  tech_acc_config=None, wss_config=None, apikey_config=None, aws_config=None, openstack_config=None,
                  xpath_sec_config=None, tls_channel_sec_config=None, tls_key_cert_config=None, kvdb=None, broker_client=None,
-                 odb=None, json_pointer_store=None, xpath_store=None):
+                 odb=None, json_pointer_store=None, xpath_store=None, audit_writer=None):
         self.channel_data = SortedListWithKey(channel_data, key=attrgetter('name'))
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
@@ -108,6 +265,12 @@ class URLData(OAuthDataStore):
         self.json_pointer_store = json_pointer_store
         self.xpath_store = xpath_store
 
+        # Stores audit log in the background, in batches
+        self.audit_writer = audit_writer
+
+        # Built lazily from self.channel_data on first use and updated incrementally afterwards
+        self.router = None
+
         self.url_sec_lock = RLock()
         self.update_lock = RLock()
         self._wss = WSSE()
@@ -341,14 +504,16 @@ class URLData(OAuthDataStore):
         the list of HTTP channel targets.
         """
         target = '{}{}{}'.format(soap_action, self._target_separator, url_path)
-        for item in self.channel_data:
-            match = item.match_target_compiled.match(target)
-            if match is not None:
-                if logger.isEnabledFor(TRACE1):
-                    logger.log(TRACE1, 'Matched target:`%s` with:`%r`', target, item)
-                return match, item
 
-        return None, None
+        if self.router is None:
+            self.router = URLRouter(self.channel_data)
+
+        match, item = self.router.match(target)
+        if match is not None:
+            if logger.isEnabledFor(TRACE1):
+                logger.log(TRACE1, 'Matched target:`%s` with:`%r`', target, item)
+
+        return match, item
 
     def check_security(self, sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store):
         """ Authenticates and authorizes a given request. Returns None on success
@@ -400,7 +565,9 @@ class URLData(OAuthDataStore):
 
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
-            self.channel_data.pop(match_idx)
+            old_data = self.channel_data.pop(match_idx)
+            if self.router is not None:
+                self.router.remove(old_data)
 
 # ################################################################################################################################
 
@@ -851,6 +1018,9 @@ class URLData(OAuthDataStore):
 
             channel_item[name] = msg[name]
 
+        channel_item.stream_request = msg.get('stream_request', False)
+        channel_item.max_body_size = msg.get('max_body_size')
+
         if msg.get('security_id'):
             channel_item['sec_type'] = msg['sec_type']
             channel_item['security_id'] = msg['security_id']
@@ -893,9 +1063,14 @@ class URLData(OAuthDataStore):
         """ Creates a new channel, both its core data and the related security definition.
         """
         match_target = '{}{}{}'.format(msg.soap_action, MISC.SEPARATOR, msg.url_path)
-        self.channel_data.add(self._channel_item_from_msg(msg, match_target, old_data))
+        channel_item = self._channel_item_from_msg(msg, match_target, old_data)
+
+        self.channel_data.add(channel_item)
         self.url_sec[match_target] = self._sec_info_from_msg(msg)
 
+        if self.router is not None:
+            self.router.add(channel_item)
+
     def _delete_channel(self, msg):
         """ Deletes a channel, both its core data and the related security definition. Returns the deleted data.
         """
@@ -911,6 +1086,8 @@ class URLData(OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             old_data = self.channel_data.pop(match_idx)
+            if self.router is not None:
+                self.router.remove(old_data)
         else:
             old_data = {}
 
@@ -964,7 +1141,13 @@ class URLData(OAuthDataStore):
         return dumps({key: repr(value) for key, value in env})
 
     def audit_set_request(self, cid, channel_item, payload, wsgi_environ):
-        """ Stores initial audit information, right after receiving a request.
+        """ Stores initial audit information, right after receiving a request. Only a shallow copy of WSGI environ
+        is made here, the rest takes place in the background, in self.audit_writer.
+        """
+        self.audit_writer.add_request(cid, self._get_audit_request, channel_item, payload, dict(wsgi_environ), datetime.utcnow())
+
+    def _get_audit_request(self, channel_item, payload, wsgi_environ, req_time):
+        """ Returns audit data of a request, with payload's elements replaced as configured for the channel.
         """
         if channel_item['audit_repl_patt_type'] == MSG_PATTERN_TYPE.JSON_POINTER.id:
             payload = loads(payload) if payload else ''
@@ -988,29 +1171,34 @@ class URLData(OAuthDataStore):
         if not remote_addr:
             remote_addr = wsgi_environ.get('REMOTE_ADDR', '(None)')
 
-        self.odb.audit_set_request_http_soap(channel_item['id'], channel_item['name'], cid,
-            channel_item['transport'], channel_item['connection'], datetime.utcnow(),
-            channel_item.get('username'), remote_addr, self._dump_wsgi_environ(wsgi_environ), payload)
+        return {
+            'conn_id': channel_item['id'],
+            'name': channel_item['name'],
+            'transport': channel_item['transport'],
+            'connection': channel_item['connection'],
+            'req_time': req_time,
+            'user_token': channel_item.get('username'),
+            'remote_addr': remote_addr,
+            'req_headers': self._dump_wsgi_environ(wsgi_environ),
+            'req_payload': payload,
+        }
 
     def audit_set_response(self, cid, response, wsgi_environ):
         """ Stores audit info regarding a response to a previous request.
         """
-        payload = dumps({
-            'cid': cid,
-            'invoke_ok': wsgi_environ['zato.http.response.status'][0] not in ('4', '5'),
-            'auth_ok':  wsgi_environ['zato.http.response.status'][0] != '4',
-            'resp_time': datetime.utcnow().isoformat(),
-            'resp_headers': self._dump_wsgi_environ(wsgi_environ),
-            'resp_payload': response,
-        })
-
-        self.broker_client.publish({
-            'cid': cid,
-            'data_format':DATA_FORMAT.JSON,
-            'action': CHANNEL.HTTP_SOAP_AUDIT_RESPONSE.value,
-            'payload': payload,
-            'service': 'zato.http-soap.set-audit-response-data'
-        })
+        status = wsgi_environ['zato.http.response.status']
+        self.audit_writer.add_response(cid, self._get_audit_response, response, status, dict(wsgi_environ), datetime.utcnow())
+
+    def _get_audit_response(self, response, status, wsgi_environ, resp_time):
+        """ Returns audit data of a response.
+        """
+        return {
+            'invoke_ok': status[0] not in ('4', '5'),
+            'auth_ok':  status[0] != '4',
+            'resp_time': resp_time,
+            'resp_headers': self._dump_wsgi_environ(wsgi_environ).encode('utf-8'),
+            'resp_payload': response.encode('utf-8') if isinstance(response, unicode) else response,
+        }
 
     def on_broker_msg_CHANNEL_HTTP_SOAP_AUDIT_CONFIG(self, msg):
         for item in self.channel_data:
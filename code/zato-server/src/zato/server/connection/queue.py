@@ -10,7 +10,10 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+import weakref
 from datetime import datetime, timedelta
+from time import time
+from traceback import format_exc
 
 # gevent
 import gevent
@@ -24,54 +27,261 @@ logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
+def get_pool_config(config):
+    """ Returns keyword arguments for ConnectionQueue out of pool-related keys of an outgoing connection's config,
+    as set by WorkerStore based on the [conn_pool] section of server.conf.
+    """
+    return {
+        'acquire_timeout': config.get('pool_acquire_timeout'),
+        'max_size': config.get('pool_max_size'),
+        'idle_timeout': config.get('pool_idle_timeout'),
+        'health_check_interval': config.get('pool_health_check_interval'),
+    }
+
+# ################################################################################################################################
+
 class _Connection(object):
-    """ Meant to be used as a part of a 'with' block - returns a connection from its queue each time 'with' is entered
-    assuming the queue isn't empty.
+    """ Meant to be used as a part of a 'with' block - returns a connection from its queue each time 'with' is entered,
+    waiting up to the queue's acquire_timeout seconds for one to become available if all of them are in use.
     """
-    def __init__(self, client_queue, conn_name):
-        self.queue = client_queue
+    def __init__(self, conn_queue, conn_name):
+        self.conn_queue = conn_queue
         self.conn_name = conn_name
         self.client = None
 
     def __enter__(self):
-        try:
-            self.client = self.queue.get(block=False)
-        except Empty:
-            self.client = None
-            msg = 'No free connections to `{}`'.format(self.conn_name)
-            logger.error(msg)
-            raise Exception(msg)
-        else:
-            return self.client
+        self.client = self.conn_queue.acquire()
+        return self.client
 
     def __exit__(self, type, value, traceback):
         if self.client:
-            self.queue.put(self.client)
+
+            # The block failed because of the connection itself so the client cannot be reused
+            if type and issubclass(type, self.conn_queue.discard_on):
+                self.conn_queue.discard(self.client)
+            else:
+                self.conn_queue.release(self.client)
+
+# ################################################################################################################################
+
+def _run_maintenance(queue_ref, interval):
+    """ Periodically checks idle clients of a queue, holding only a weak reference to it so that queues no longer in use
+    are garbage-collected, and the greenlet stops, even if they were never closed explicitly.
+    """
+    while True:
+        gevent.sleep(interval)
+
+        conn_queue = queue_ref()
+        if not conn_queue or not conn_queue.keep_connecting:
+            return
+
+        try:
+            conn_queue.check_idle()
+        except Exception, e:
+            logger.warn('Could not check idle clients of `%s`, e:`%s`', conn_queue.conn_name, format_exc(e))
+
+        del conn_queue
 
 # ################################################################################################################################
 
 class ConnectionQueue(object):
-    """ Holds connections to resources. Each time it's called a connection is fetched from its underlying queue
-    assuming any connection is still available.
+    """ Holds connections to resources. Each time it's called a connection is fetched from its underlying queue,
+    waiting up to acquire_timeout seconds if all of them are in use.
+
+    The queue is initially built with pool_size clients. If max_size is greater than that, each time no client is free,
+    a new one is added in background, up to max_size of them, and the ones above pool_size are dropped after having been
+    idle for idle_timeout seconds. Every health_check_interval seconds, idle clients are validated using health_check_func,
+    if one is given, and the ones that fail are replaced with new clients. So are clients whose 'with' blocks raised
+    any of the discard_on exceptions. Clients dropped for any reason, as well as all of them once the queue is closed,
+    are closed with close_client_func, if there is one.
     """
-    def __init__(self, pool_size, queue_build_cap, conn_name, conn_type, address, add_client_func):
-        self.queue = Queue(pool_size)
+    def __init__(self, pool_size, queue_build_cap, conn_name, conn_type, address, add_client_func, acquire_timeout=None,
+            max_size=None, idle_timeout=None, health_check_interval=None, health_check_func=None, close_client_func=None,
+            discard_on=()):
+        self.pool_size = pool_size
+        self.max_size = max(max_size or pool_size, pool_size)
+        self.queue = Queue(self.max_size)
         self.queue_build_cap = queue_build_cap
         self.conn_name = conn_name
         self.conn_type = conn_type
         self.address = address
         self.add_client_func = add_client_func
+        self.acquire_timeout = 10.0 if acquire_timeout is None else float(acquire_timeout)
+        self.idle_timeout = 300.0 if idle_timeout is None else float(idle_timeout)
+        self.health_check_interval = 60.0 if health_check_interval is None else float(health_check_interval)
+        self.health_check_func = health_check_func
+        self.close_client_func = close_client_func
+        self.discard_on = discard_on
         self.keep_connecting = True
+        self.build_greenlet = None
+        self.maintenance_greenlet = None
+
+        # How many clients have been created and how many are being created right now
+        self.size = 0
+        self.pending = 0
+
+        # Metrics
+        self.in_use = 0
+        self.acquired = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
 
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def __call__(self):
-        return _Connection(self.queue, self.conn_name)
+        return _Connection(self, self.conn_name)
+
+# ################################################################################################################################
+
+    def acquire(self):
+        """ Returns a free client, waiting up to self.acquire_timeout seconds for one if there are none at the moment.
+        """
+        try:
+            client, _ = self.queue.get(block=False)
+        except Empty:
+            self.misses += 1
+            self._grow()
+
+            start = time()
+            try:
+                client, _ = self.queue.get(timeout=self.acquire_timeout)
+            except Empty:
+                self.timeouts += 1
+                msg = 'No free connections to `{}` within {}s'.format(self.conn_name, self.acquire_timeout)
+                logger.error(msg)
+                raise Exception(msg)
+            finally:
+                wait_time = time() - start
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+
+        self.in_use += 1
+        self.acquired += 1
+
+        return client
+
+    def release(self, client):
+        """ Returns a client acquired previously back to the queue.
+        """
+        self.in_use -= 1
+
+        # The queue has been closed in the meantime
+        if not self.keep_connecting:
+            self._close_client(client)
+            return
+
+        self.queue.put((client, time()))
+
+    def discard(self, client):
+        """ Closes a client acquired previously that turned out to be no longer usable, instead of returning it
+        to the queue, and adds a new one in its place.
+        """
+        self.in_use -= 1
+        self.size -= 1
+        self._close_client(client)
+
+        if self.keep_connecting and self.size + self.pending < self.pool_size:
+            self._spawn_add_client()
 
     def put_client(self, client):
-        self.queue.put(client)
+        """ Adds a newly created client to the queue, called by add_client_func.
+        """
+        if not self.keep_connecting:
+            self._close_client(client)
+            return
+
+        self.size += 1
+        self.queue.put((client, time()))
         self.logger.info('Added `%s` client to %s (%s)', self.conn_name, self.address, self.conn_type)
 
+# ################################################################################################################################
+
+    def _close_client(self, client):
+        if self.close_client_func:
+            try:
+                self.close_client_func(client)
+            except Exception, e:
+                self.logger.warn('Could not close `%s` client to %s (%s), e:`%s`', self.conn_name, self.address, self.conn_type,
+                    format_exc(e))
+
+    def _add_client(self):
+        try:
+            self.add_client_func()
+        except Exception, e:
+            self.logger.warn('Could not add `%s` client to %s (%s), e:`%s`', self.conn_name, self.address, self.conn_type,
+                format_exc(e))
+        finally:
+            self.pending -= 1
+
+    def _spawn_add_client(self):
+        self.pending += 1
+        gevent.spawn(self._add_client)
+
+    def _grow(self):
+        """ Adds a new client in background unless there are max_size of them already.
+        """
+        if self.keep_connecting and self.size + self.pending < self.max_size:
+            self._spawn_add_client()
+
+    def check_idle(self):
+        """ Drops clients above pool_size that have been idle for too long and validates all the other idle ones,
+        replacing those that are no longer valid.
+        """
+        now = time()
+
+        for _ in range(self.queue.qsize()):
+            try:
+                client, last_used = self.queue.get(block=False)
+            except Empty:
+                break
+
+            if self.size > self.pool_size and now - last_used > self.idle_timeout:
+                self.size -= 1
+                self._close_client(client)
+                self.logger.info('Dropped idle `%s` client to %s (%s), size:`%s`', self.conn_name, self.address,
+                    self.conn_type, self.size)
+                continue
+
+            if self.health_check_func:
+                try:
+                    self.health_check_func(client)
+                except Exception, e:
+                    self.size -= 1
+                    self._close_client(client)
+                    self.logger.warn('Dropped invalid `%s` client to %s (%s), e:`%s`', self.conn_name, self.address,
+                        self.conn_type, format_exc(e))
+                    continue
+
+            self.queue.put((client, last_used))
+
+        # Replace clients that have been dropped
+        while self.keep_connecting and self.size + self.pending < self.pool_size:
+            self._spawn_add_client()
+
+    def get_stats(self):
+        """ Returns metrics of the queue, including how many clients there are, how many of them are in use and how long
+        callers had to wait for them.
+        """
+        return {
+            'name': self.conn_name,
+            'conn_type': self.conn_type,
+            'address': self.address,
+            'pool_size': self.pool_size,
+            'max_size': self.max_size,
+            'size': self.size,
+            'idle': self.queue.qsize(),
+            'in_use': self.in_use,
+            'acquired': self.acquired,
+            'misses': self.misses,
+            'timeouts': self.timeouts,
+            'wait_time_total': round(self.wait_time_total, 6),
+            'wait_time_max': round(self.wait_time_max, 6),
+        }
+
+# ################################################################################################################################
+
     def _build_queue(self):
 
         start = datetime.utcnow()
@@ -79,27 +289,31 @@ class ConnectionQueue(object):
 
         try:
             while self.keep_connecting:
-                while not self.queue.full():
+                while self.keep_connecting and self.size < self.pool_size:
 
                     gevent.sleep(0.5)
 
                     now = datetime.utcnow()
 
                     self.logger.info('%d/%d %s clients obtained to `%s` (%s) after %s (cap: %ss)',
-                        self.queue.qsize(), self.queue.maxsize, self.conn_type, self.address, self.conn_name, now - start,
+                        self.size, self.pool_size, self.conn_type, self.address, self.conn_name, now - start,
                         self.queue_build_cap)
 
                     if  now >= build_until:
 
                         self.logger.warn('Built %s/%s %s clients to `%s` within %s seconds, sleeping until %s',
-                            self.queue.qsize(), self.queue.maxsize, self.conn_type, self.address, self.queue_build_cap, build_until)
+                            self.size, self.pool_size, self.conn_type, self.address, self.queue_build_cap, build_until)
                         gevent.sleep(self.queue_build_cap)
 
                         start = datetime.utcnow()
                         build_until = start + timedelta(seconds=self.queue_build_cap)
 
+                # The queue has been closed in the meantime
+                if not self.keep_connecting:
+                    return
+
                 self.logger.info(
-                    'Obtained %d %s clients to `%s` for `%s`', self.queue.maxsize, self.conn_type, self.address, self.conn_name)
+                    'Obtained %d %s clients to `%s` for `%s`', self.pool_size, self.conn_type, self.address, self.conn_name)
 
                 # Ok, got all the connections
                 return
@@ -110,17 +324,42 @@ class ConnectionQueue(object):
         """ Spawns greenlets to populate the queue and waits up to self.queue_build_cap seconds until the queue is full.
         If it never is, raises an exception stating so.
         """
-        for x in range(self.queue.maxsize):
-            gevent.spawn(self.add_client_func)
+        for x in range(self.pool_size):
+            self._spawn_add_client()
 
         # Build the queue in background
-        gevent.spawn(self._build_queue)
+        self.build_greenlet = gevent.spawn(self._build_queue)
+
+        # Check idle clients in background
+        if self.max_size > self.pool_size or self.health_check_func:
+            self.maintenance_greenlet = gevent.spawn(_run_maintenance, weakref.ref(self), self.health_check_interval)
+
+    def close(self):
+        """ Stops all background activities of the queue and closes its idle clients, the ones in use are closed
+        when they are released.
+        """
+        self.keep_connecting = False
+        if self.build_greenlet:
+            self.build_greenlet.kill(block=False)
+            self.build_greenlet = None
+
+        if self.maintenance_greenlet:
+            self.maintenance_greenlet.kill(block=False)
+            self.maintenance_greenlet = None
+
+        while not self.queue.empty():
+            client, _ = self.queue.get(block=False)
+            self._close_client(client)
 
 # ################################################################################################################################
 
 class Wrapper(object):
     """ Base class for connections wrappers.
     """
+
+    # Subclasses may override it with a method that receives a client and raises an exception if it is no longer valid
+    health_check = None
+
     def __init__(self, config, conn_type, server=None):
         self.conn_type = conn_type
         self.config = config
@@ -129,7 +368,7 @@ class Wrapper(object):
 
         self.client = ConnectionQueue(
             self.config.pool_size, self.config.queue_build_cap, self.config.name, self.conn_type, self.config.auth_url,
-            self.add_client)
+            self.add_client, health_check_func=self.health_check, **get_pool_config(self.config))
 
         self.update_lock = RLock()
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -8,22 +8,55 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 import logging
+from threading import RLock
+
+# gevent
+from gevent import spawn
 
 # Zato
-from zato.common import KVDB, TRACE1
+from zato.common import KVDB, REQ_RESP_SAMPLE_MODE, TRACE1
 
 logger = logging.getLogger(__name__)
 
-def should_store(kvdb, service_usage, service_name):
-    """ Decides whether a service's request/response pair should be kept in the DB.
+class SampleConfig(object):
+    """ Keeps, in each worker, the configuration of how often and in which mode sample request/response pairs of services
+    should be stored. Each service's configuration is read from the KVDB only once, the first time the service is invoked,
+    and is kept up to date afterwards by broker messages sent out each time it changes.
     """
-    key = '{}{}'.format(KVDB.REQ_RESP_SAMPLE, service_name)
-    freq = int(kvdb.conn.hget(key, 'freq') or 0)
-    
-    if freq and service_usage % freq == 0:
-        return key, freq
-    
-    return None, None
+    def __init__(self, kvdb):
+        self.kvdb = kvdb
+        self.config = {}
+        self.update_lock = RLock()
+
+    def get(self, service_name):
+        """ Returns a (key, freq, mode) tuple for the service of the given name.
+        """
+        config = self.config.get(service_name)
+        if not config:
+            with self.update_lock:
+                key = '{}{}'.format(KVDB.REQ_RESP_SAMPLE, service_name)
+                freq, mode = self.kvdb.conn.hmget(key, 'freq', 'mode')
+                config = self.config[service_name] = (key, int(freq or 0), mode or REQ_RESP_SAMPLE_MODE.SYNC)
+
+        return config
+
+    def set(self, service_name, freq, mode=None):
+        """ Updates the configuration after it has changed in the KVDB.
+        """
+        with self.update_lock:
+            key = '{}{}'.format(KVDB.REQ_RESP_SAMPLE, service_name)
+            self.config[service_name] = (key, int(freq or 0), mode or REQ_RESP_SAMPLE_MODE.SYNC)
+
+    def should_store(self, service_usage, service_name):
+        """ Decides whether a service's request/response pair should be kept in the DB. Returns a (key, freq, mode) tuple,
+        with freq being 0 if nothing is to be stored.
+        """
+        key, freq, mode = self.get(service_name)
+
+        if freq and service_usage % freq == 0:
+            return key, freq, mode
+
+        return None, 0, None
 
 def store(kvdb, key, usage, freq, **data):
     """ Stores a service's request/response pair.
@@ -31,5 +64,10 @@ def store(kvdb, key, usage, freq, **data):
     if logger.isEnabledFor(TRACE1):
         msg = 'key:[{}], usage:[{}], freq:[{}], data:[{}]'.format(key, usage, freq, data)
         logger.log(TRACE1, msg)
-        
+
     kvdb.conn.hmset(key, data)
+
+def store_async(kvdb, key, usage, freq, **data):
+    """ Stores a service's request/response pair in a new greenlet.
+    """
+    spawn(store, kvdb, key, usage, freq, **data)
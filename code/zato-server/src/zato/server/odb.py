@@ -868,6 +868,28 @@ class ODBManager(SessionWrapper):
             session.add(audit)
             session.commit()
 
+    def audit_set_http_soap_batch(self, requests, responses):
+        """ Stores a batch of HTTP/SOAP audit data in a single transaction. requests is a list of dictionaries, each describing
+        a new row, possibly with response data already in it, and all of them with the same keys. responses is a list
+        of dictionaries with response data for requests stored previously, each matched by its CID.
+        """
+        with closing(self.session()) as session:
+
+            if requests:
+                for item in requests:
+                    item['cluster_id'] = self.cluster.id
+                session.execute(HTTSOAPAudit.__table__.insert(), requests)
+
+            for item in responses:
+                item = dict(item)
+                cid = item.pop('cid')
+                session.query(HTTSOAPAudit).\
+                    filter(HTTSOAPAudit.cid==cid).\
+                    filter(HTTSOAPAudit.cluster_id==self.cluster.id).\
+                    update(item, synchronize_session=False)
+
+            session.commit()
+
 # ################################################################################################################################
 
     def get_cloud_openstack_swift_list(self, cluster_id, needs_columns=False):
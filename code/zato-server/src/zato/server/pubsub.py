@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from httplib import OK
+from json import dumps
+from time import time
+from traceback import format_exc
+
+# gevent
+from gevent import sleep, spawn
+from gevent.event import Event
+from gevent.lock import BoundedSemaphore
+
+# huTools
+from huTools.structured import dict2xml
+
+# Zato
+from zato.common import DATA_FORMAT, PUB_SUB, ZATO_OK
+from zato.common.util import new_cid
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+class ConsumerDelivery(object):
+    """ Delivers messages to a single consumer's callback connection. A long-running greenlet waits until it is woken up
+    by a notification of new messages, or poll_interval seconds pass, and then keeps fetching and posting batches
+    of up to max_batch_size messages for as long as there are any. Up to max_in_flight batches can be posted concurrently.
+
+    Each batch holds one of max_in_flight cluster-wide leases from before it is fetched until it is acknowledged or rejected,
+    so max_in_flight applies to all servers taken together and, if it is 1, messages are delivered in order. A lease expires
+    after lease_time seconds in case a server holding it goes down.
+
+    Messages from a batch that could not be delivered are rejected so they can be delivered again and the consumer backs off
+    for backoff_initial seconds, doubled after each consecutive failure up to backoff_max seconds. The batch's lease is held
+    for as long as the backoff lasts so other servers back off too.
+    """
+    def __init__(self, pubsub, consumer, get_outconn, max_batch_size=PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE, max_in_flight=1,
+            poll_interval=2, backoff_initial=1, backoff_max=60, lease_time=300):
+        self.pubsub = pubsub
+        self.consumer = consumer
+        self.get_outconn = get_outconn
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.in_flight = BoundedSemaphore(max_in_flight)
+        self.lease_time = lease_time
+        self.poll_interval = poll_interval
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.failures = 0 # Consecutive ones only
+        self.backoff_until = 0
+        self.keep_running = False
+        self.greenlet = None
+        self.event = Event()
+
+    def start(self):
+        self.keep_running = True
+        self.greenlet = spawn(self._run)
+
+    def stop(self):
+        self.keep_running = False
+        self.event.set()
+
+    def wake(self):
+        """ Tells the greenlet there are new messages to deliver.
+        """
+        self.event.set()
+
+# ################################################################################################################################
+
+    def get_backoff(self):
+        return min(self.backoff_initial * 2 ** (self.failures - 1), self.backoff_max)
+
+    def _run(self):
+        while self.keep_running:
+            self.event.wait(self.poll_interval)
+            self.event.clear()
+
+            try:
+                self.deliver_available()
+            except Exception, e:
+                logger.warn('Could not deliver messages to `%s`, e:`%s`', self.consumer.name, format_exc(e))
+
+    def deliver_available(self):
+        """ Delivers messages for as long as there are any in the consumer's queue.
+        """
+        while self.keep_running:
+
+            self.in_flight.acquire()
+
+            # Checked only now because a batch that has just completed may have failed
+            backoff = self.backoff_until - time()
+            if backoff > 0:
+                self.in_flight.release()
+                sleep(backoff)
+                continue
+
+            lease = None
+            messages = []
+
+            try:
+                # If all the leases are held by other servers, they will deliver whatever there is in the queue
+                # and we will check it again when woken up next time or after poll_interval seconds.
+                lease = self.pubsub.impl.acquire_delivery_lease(self.consumer.sub_key, self.max_in_flight, self.lease_time)
+
+                if lease:
+                    # LRANGE's end index, which max_batch_size is given to, is inclusive
+                    messages = list(self.pubsub.get(
+                        self.consumer.sub_key, self.max_batch_size - 1, get_format=PUB_SUB.GET_FORMAT.JSON.id))
+            except Exception:
+                self.release(lease)
+                raise
+
+            if not messages:
+                self.release(lease)
+                return
+
+            spawn(self.deliver, messages, lease)
+
+    def release(self, lease):
+        """ Releases a batch's cluster-wide lease, if there is one, and its local slot.
+        """
+        try:
+            if lease:
+                self.pubsub.impl.release_delivery_lease(lease)
+        except Exception, e:
+            logger.warn('Could not release delivery lease of `%s`, e:`%s`', self.consumer.name, format_exc(e))
+        finally:
+            self.in_flight.release()
+
+# ################################################################################################################################
+
+    def _post(self, messages):
+        """ Posts messages to the consumer's callback connection, returns None on success or a description of the error.
+        """
+        outconn = self.get_outconn(self.consumer.callback_name)
+
+        out = {
+            'status': ZATO_OK,
+            'results_count': len(messages),
+            'results': messages
+        }
+
+        if outconn.config['data_format'] == DATA_FORMAT.XML:
+            out = dict2xml(out)
+            content_type = 'application/xml'
+        else:
+            out = dumps(out)
+            content_type = 'application/json'
+
+        response = outconn.conn.post(new_cid(), data=out, headers={'content-type': content_type})
+
+        if response.status_code != OK:
+            return '`{}` `{}`'.format(response.status_code, response.text)
+
+    def deliver(self, messages, lease):
+        """ Delivers a batch of messages, acknowledging them if the callback accepted them or rejecting them otherwise.
+        """
+        try:
+            msg_ids = [msg['metadata']['msg_id'] for msg in messages]
+            start = time()
+
+            try:
+                error = self._post(messages)
+            except Exception, e:
+                error = format_exc(e)
+
+            delivery_time = (time() - start) * 1000
+
+            if error:
+                self.failures += 1
+                self.backoff_until = time() + self.get_backoff()
+                self.pubsub.reject(self.consumer.sub_key, msg_ids)
+
+                logger.error('Could not deliver messages `%s`, sub_key `%s` to `%s`, reason `%s`, retrying in %ss',
+                    msg_ids, self.consumer.sub_key, self.consumer.name, error, self.get_backoff())
+
+                # Keeps the lease so that no server delivers anything until the backoff is over
+                sleep(self.backoff_until - time())
+            else:
+                self.failures = 0
+                self.backoff_until = 0
+                self.pubsub.acknowledge(self.consumer.sub_key, msg_ids)
+
+            self.pubsub.impl.update_delivery_stats(self.consumer.sub_key, len(msg_ids), delivery_time, error)
+
+        except Exception, e:
+            logger.warn('Could not handle delivery to `%s`, e:`%s`', self.consumer.name, format_exc(e))
+
+        finally:
+            self.release(lease)
+
+# ################################################################################################################################
+
+class CallbackDelivery(object):
+    """ Runs a ConsumerDelivery for each active consumer whose messages are delivered to callback connections
+    and wakes them up whenever new messages are added to their queues.
+    """
+    def __init__(self, pubsub, get_outconn, **delivery_config):
+        self.pubsub = pubsub
+        self.get_outconn = get_outconn
+        self.delivery_config = delivery_config
+        self.deliveries = {} # Key = sub_key, value = ConsumerDelivery
+
+    def start(self):
+        self.sync()
+
+        # Notifications about new messages arrive over a subscription shared with long-polling consumers
+        self.pubsub.impl.notifier.add_callback(self.notify)
+
+    def stop(self):
+        self.pubsub.impl.notifier.remove_callback(self.notify)
+        for delivery in self.deliveries.values():
+            delivery.stop()
+        self.deliveries.clear()
+
+    def sync(self):
+        """ Starts delivering to new callback consumers and stops it for the ones that have been deleted or deactivated.
+        """
+        consumers = dict((consumer.sub_key, consumer) for consumer in self.pubsub.impl.get_callback_consumers())
+
+        for sub_key in set(self.deliveries) - set(consumers):
+            self.deliveries.pop(sub_key).stop()
+            logger.info('Stopped pub/sub callback delivery for sub_key `%s`', sub_key)
+
+        for sub_key, consumer in consumers.items():
+            delivery = self.deliveries.get(sub_key)
+
+            if delivery:
+                delivery.consumer = consumer
+            else:
+                delivery = ConsumerDelivery(self.pubsub, consumer, self.get_outconn, **self.delivery_config)
+                delivery.start()
+                self.deliveries[sub_key] = delivery
+                logger.info('Started pub/sub callback delivery to `%s` for sub_key `%s`', consumer.name, sub_key)
+
+    def notify(self, cons_queue):
+        """ Wakes up deliveries to consumers getting messages from a given queue.
+        """
+        for delivery in self.deliveries.values():
+            if self.pubsub.impl.get_consumer_queue(delivery.consumer.sub_key) == cons_queue:
+                delivery.wake()
+
+# ################################################################################################################################
@@ -13,6 +13,7 @@ import logging
 from datetime import datetime
 from httplib import BAD_REQUEST, METHOD_NOT_ALLOWED
 from sys import maxint
+from threading import RLock
 from traceback import format_exc
 
 # anyjson
@@ -35,13 +36,14 @@ from retools.lock import Lock
 from gevent import Timeout, spawn
 
 # Zato
-from zato.common import BROKER, CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, ZatoException
+from zato.common import BROKER, CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, REQ_RESP_SAMPLE_MODE, ZatoException
 from zato.common.broker_message import SERVICE
 from zato.common.nav import DictNav, ListNav
 from zato.common.util import uncamelify, new_cid, payload_from_request, service_name_from_impl
 from zato.server.connection import request_response, slow_response
 from zato.server.connection.amqp.outgoing import PublisherFacade
 from zato.server.connection.email import EMailAPI
+from zato.server.connection.http_soap.outgoing import PlainHTTPFacade
 from zato.server.connection.jms_wmq.outgoing import WMQFacade
 from zato.server.connection.search import SearchAPI
 from zato.server.connection.zmq_.outgoing import ZMQFacade
@@ -158,6 +160,113 @@ class PatternsFacade(object):
 
 # ################################################################################################################################
 
+class _LazyAttr(object):
+    """ A non-data descriptor which creates an object's attribute on first access and stores it in the instance
+    so that later lookups, and any explicit assignments to the attribute, bypass the descriptor altogether.
+    None is never stored, which means that the attribute will be created again on next access.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = self.func(instance)
+        if value is not None:
+            instance.__dict__[self.name] = value
+
+        return value
+
+# ################################################################################################################################
+
+class WorkerFacades(object):
+    """ Facades which are the same for all the services of a worker and as such can be shared by all of them.
+    Each is created only when it is first needed.
+    """
+    def __init__(self, worker_store):
+        self.worker_store = worker_store
+
+    @_LazyAttr
+    def outgoing(self):
+
+        # Queues
+        out_amqp = PublisherFacade(self.worker_store.broker_client, self.worker_store.amqp_direct_publishers)
+        out_jms_wmq = WMQFacade(self.worker_store.broker_client)
+        out_zmq = ZMQFacade(self.worker_store.server)
+
+        # SQL
+        out_sql = self.worker_store.sql_pool_store
+
+        # Regular outconns
+        out_ftp, out_odoo, out_plain_http, out_soap = self.worker_store.worker_config.outgoing_connections()
+
+        return Outgoing(
+            out_amqp, out_ftp, out_jms_wmq, out_odoo, PlainHTTPFacade(out_plain_http), out_soap, out_sql,
+            self.worker_store.stomp_outconn_api, out_zmq)
+
+    @_LazyAttr
+    def cloud(self):
+        cloud = Cloud()
+        cloud.openstack.swift = self.worker_store.worker_config.cloud_openstack_swift
+        cloud.aws.s3 = self.worker_store.worker_config.cloud_aws_s3
+
+        return cloud
+
+    @_LazyAttr
+    def email(self):
+        return EMailAPI(self.worker_store.email_smtp_api, self.worker_store.email_imap_api)
+
+    @_LazyAttr
+    def search(self):
+        return SearchAPI(self.worker_store.search_es_api, self.worker_store.search_solr_api)
+
+class InvocationContext(object):
+    """ Everything that each invocation of a given service class needs and which does not change from one invocation
+    to another, prepared once per worker instead of in each call to Service._init.
+    """
+    __slots__ = ('impl_name', 'slow_threshold', 'facades')
+
+    def __init__(self, impl_name, slow_threshold, facades):
+        self.impl_name = impl_name
+        self.slow_threshold = slow_threshold
+        self.facades = facades
+
+class InvocationContextStore(object):
+    """ Keeps invocation contexts of all the service classes of a worker. Contexts are created on first use and need to be
+    invalidated each time anything they were built from changes, e.g. a service's slow_threshold or the broker client.
+    """
+    def __init__(self, worker_store):
+        self.worker_store = worker_store
+        self.facades = WorkerFacades(worker_store)
+        self.contexts = {}
+        self.update_lock = RLock()
+
+    def get(self, impl_name):
+        """ Returns an invocation context for a service of the given implementation name.
+        """
+        ctx = self.contexts.get(impl_name)
+        if not ctx:
+            with self.update_lock:
+                slow_threshold = self.worker_store.server.service_store.services[impl_name]['slow_threshold']
+                ctx = self.contexts[impl_name] = InvocationContext(impl_name, slow_threshold, self.facades)
+
+        return ctx
+
+    def invalidate(self, impl_name=None):
+        """ Invalidates the context of a single service or, if impl_name is not given, of all the services, including
+        all the facades they share.
+        """
+        with self.update_lock:
+            if impl_name:
+                self.contexts.pop(impl_name, None)
+            else:
+                self.contexts.clear()
+                self.facades = WorkerFacades(self.worker_store)
+
+# ################################################################################################################################
+
 class Service(object):
     """ A base class for all services deployed on Zato servers, no matter
     the transport and protocol, be it plain HTTP, SOAP, WebSphere MQ or any other,
@@ -173,8 +282,6 @@ class Service(object):
         self.channel = None
         self.cid = None
         self.in_reply_to = None
-        self.outgoing = None
-        self.cloud = None
         self.worker_store = None
         self.odb = None
         self.data_format = None
@@ -193,8 +300,8 @@ class Service(object):
         self.name = self.__class__.get_name()
         self.impl_name = self.__class__.get_impl_name()
         self.time = TimeUtil(None)
-        self.patterns = None
         self.user_config = None
+        self._facades = None
         self.dictnav = DictNav
         self.listnav = ListNav
         self.has_validate_input = False
@@ -258,40 +365,15 @@ class Service(object):
         self.time.kvdb = self.kvdb
         self.pubsub = self.worker_store.pubsub
 
-        self.slow_threshold = self.server.service_store.services[self.impl_name]['slow_threshold']
-
-        # Queues
-        out_amqp = PublisherFacade(self.broker_client)
-        out_jms_wmq = WMQFacade(self.broker_client)
-        out_zmq = ZMQFacade(self.server)
-
-        # Patterns
-        self.patterns = PatternsFacade(self)
-
-        # SQL
-        out_sql = self.worker_store.sql_pool_store
-
-        # Regular outconns
-        out_ftp, out_odoo, out_plain_http, out_soap = self.worker_store.worker_config.outgoing_connections()
-        self.outgoing = Outgoing(
-            out_amqp, out_ftp, out_jms_wmq, out_odoo, out_plain_http, out_soap, out_sql,
-            self.worker_store.stomp_outconn_api, out_zmq)
-
-        # Cloud
-        self.cloud = Cloud()
-        self.cloud.openstack.swift = self.worker_store.worker_config.cloud_openstack_swift
-        self.cloud.aws.s3 = self.worker_store.worker_config.cloud_aws_s3
+        # Everything that does not change between invocations has been already prepared by the worker
+        ctx = self.worker_store.invocation_ctx_store.get(self.impl_name)
+        self.slow_threshold = ctx.slow_threshold
+        self._facades = ctx.facades
 
         # Cassandra
         self.cassandra_conn = self.worker_store.cassandra_api
         self.cassandra_query = self.worker_store.cassandra_query_api
 
-        # E-mail
-        self.email = EMailAPI(self.worker_store.email_smtp_api, self.worker_store.email_imap_api)
-
-        # Search
-        self.search = SearchAPI(self.worker_store.search_es_api, self.worker_store.search_solr_api)
-
         is_sio = hasattr(self, 'SimpleIO')
         self.request.http.init(self.wsgi_environ)
 
@@ -299,7 +381,33 @@ class Service(object):
             self.request.init(is_sio, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ)
             self.response.init(self.cid, self.SimpleIO, self.data_format)
 
-        self.msg = MessageFacade(self.worker_store.msg_ns_store,
+    # Facades shared by all the services of a worker, None until a service is initialized
+
+    @_LazyAttr
+    def outgoing(self):
+        return self._facades.outgoing if self._facades else None
+
+    @_LazyAttr
+    def cloud(self):
+        return self._facades.cloud if self._facades else None
+
+    @_LazyAttr
+    def email(self):
+        return self._facades.email if self._facades else None
+
+    @_LazyAttr
+    def search(self):
+        return self._facades.search if self._facades else None
+
+    # Facades specific to each service instance, created on first access only
+
+    @_LazyAttr
+    def patterns(self):
+        return PatternsFacade(self)
+
+    @_LazyAttr
+    def msg(self):
+        return MessageFacade(self.worker_store.msg_ns_store,
             self.worker_store.json_pointer_store, self.worker_store.xpath_store, self.worker_store.msg_ns_store,
             self.request.payload, self.time)
 
@@ -367,11 +475,14 @@ class Service(object):
 
         wsgi_environ = kwargs.get('wsgi_environ', {})
         payload = wsgi_environ.get('zato.request.payload')
+        stream = wsgi_environ.get('zato.request.stream')
 
         # Here's an edge case. If a SOAP request has a single child in Body and this child is an empty element
         # (though possibly with attributes), checking for 'not payload' alone won't suffice - this evaluates
         # to False so we'd be parsing the payload again superfluously.
-        if not isinstance(payload, ObjectifiedElement) and not payload:
+        #
+        # Streamed requests are parsed only if the service asks for its payload.
+        if stream is None and not isinstance(payload, ObjectifiedElement) and not payload:
             payload = payload_from_request(cid, raw_request, data_format, transport)
 
         job_type = kwargs.get('job_type')
@@ -386,7 +497,7 @@ class Service(object):
             channel_params=channel_params,
             merge_channel_params=merge_channel_params,
             params_priority=params_priority, in_reply_to=wsgi_environ.get('zato.request_ctx.in_reply_to', None),
-            environ=kwargs.get('environ'))
+            environ=kwargs.get('environ'), stream=stream)
 
         # It's possible the call will be completely filtered out
         if service.accept():
@@ -564,7 +675,7 @@ class Service(object):
         Used for incrementing the service's usage count and storing the service invocation time.
         """
         if self.server.component_enabled.stats:
-            self.usage = self.kvdb.conn.incr('{}{}'.format(KVDB.SERVICE_USAGE, self.name))
+            self.usage = self.worker_store.service_stats.get_usage(self.name)
 
         self.invocation_time = datetime.utcnow()
 
@@ -588,27 +699,14 @@ class Service(object):
 
             self.processing_time = int(round(proc_time))
 
-            with self.kvdb.conn.pipeline() as pipe:
-
-                pipe.hset('{}{}'.format(KVDB.SERVICE_TIME_BASIC, self.name), 'last', self.processing_time)
-                pipe.rpush('{}{}'.format(KVDB.SERVICE_TIME_RAW, self.name), self.processing_time)
-
-                key = '{}{}:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE,
-                    self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
-                pipe.rpush(key, self.processing_time)
-
-                # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
-                # to aggregate processing times for a given minute and then it will expire
-
-                # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
-                pipe.expire(key, 300)
-
-                pipe.execute()
+            # Stored in the worker for now and flushed to the KVDB periodically
+            self.worker_store.service_stats.add_time(
+                self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'), self.processing_time)
 
         #
         # Sample requests/responses
         #
-        key, freq = request_response.should_store(self.kvdb, self.usage, self.name)
+        key, freq, mode = self.worker_store.req_resp_sample_config.should_store(self.usage, self.name)
         if freq:
 
             # TODO: Don't parse it here and a moment later below
@@ -621,7 +719,11 @@ class Service(object):
                 'req': self.request.raw_request or '',
                 'resp':resp,
             }
-            request_response.store(self.kvdb, key, self.usage, freq, **data)
+
+            if mode == REQ_RESP_SAMPLE_MODE.ASYNC:
+                request_response.store_async(self.kvdb, key, self.usage, freq, **data)
+            else:
+                request_response.store(self.kvdb, key, self.usage, freq, **data)
 
         #
         # Slow responses
@@ -818,7 +920,7 @@ class Service(object):
     def update(service, channel, server, broker_client, worker_store, cid, payload,
                raw_request, transport=None, simple_io_config=None, data_format=None,
                wsgi_environ={}, job_type=None, channel_params=None,
-               merge_channel_params=True, params_priority=None, in_reply_to=None, environ=None, init=True):
+               merge_channel_params=True, params_priority=None, in_reply_to=None, environ=None, init=True, stream=None):
         """ Takes a service instance and updates it with the current request's
         context data.
         """
@@ -829,6 +931,12 @@ class Service(object):
         service.cid = cid
         service.request.payload = payload
         service.request.raw_request = raw_request
+        service.request.stream = stream
+
+        # Needed by streamed requests to parse their payload lazily
+        service.request.cid = cid
+        service.request.data_format = data_format
+        service.request.transport = transport
         service.transport = transport
         service.request.simple_io_config = simple_io_config
         service.response.simple_io_config = simple_io_config
@@ -17,6 +17,7 @@ from zato.common.broker_message import CHANNEL, MESSAGE_TYPE
 from zato.common.odb.model import ChannelAMQP, Cluster, ConnDefAMQP, Service
 from zato.common.odb.query import channel_amqp_list
 from zato.server.connection.amqp.channel import start_connector
+from zato.server.service import Integer
 from zato.server.service.internal import AdminService, AdminSIO
 
 class _AMQPService(AdminService):
@@ -33,6 +34,7 @@ class GetList(AdminService):
         input_required = ('cluster_id',)
         output_required = ('id', 'name', 'is_active', 'queue', 'consumer_tag_prefix', 
             'def_name', 'def_id', 'service_name', 'data_format')
+        output_optional = (Integer('prefetch_count'), Integer('batch_size'), Integer('batch_interval'), 'ack_mode')
         
     def get_data(self, session):
         return channel_amqp_list(session, self.request.input.cluster_id, False)
@@ -48,7 +50,7 @@ class Create(AdminService):
         request_elem = 'zato_channel_amqp_create_request'
         response_elem = 'zato_channel_amqp_create_response'
         input_required = ('cluster_id', 'name', 'is_active', 'def_id', 'queue', 'consumer_tag_prefix', 'service')
-        input_optional = ('data_format',)
+        input_optional = ('data_format', Integer('prefetch_count'), Integer('batch_size'), Integer('batch_interval'), 'ack_mode')
         output_required = ('id', 'name')
 
     def handle(self):
@@ -85,6 +87,10 @@ class Create(AdminService):
                 item.def_id = input.def_id
                 item.service = service
                 item.data_format = input.data_format
+                item.prefetch_count = input.prefetch_count or None
+                item.batch_size = input.batch_size or None
+                item.batch_interval = input.batch_interval or None
+                item.ack_mode = input.ack_mode or None
                 
                 session.add(item)
                 session.commit()
@@ -109,7 +115,7 @@ class Edit(_AMQPService):
         request_elem = 'zato_channel_amqp_edit_request'
         response_elem = 'zato_channel_amqp_edit_response'
         input_required = ('id', 'cluster_id', 'name', 'is_active', 'def_id', 'queue', 'consumer_tag_prefix', 'service')
-        input_optional = ('data_format',)
+        input_optional = ('data_format', Integer('prefetch_count'), Integer('batch_size'), Integer('batch_interval'), 'ack_mode')
         output_required = ('id', 'name')
 
     def handle(self):
@@ -147,6 +153,10 @@ class Edit(_AMQPService):
                 item.def_id = input.def_id
                 item.service = service
                 item.data_format = input.data_format
+                item.prefetch_count = input.prefetch_count or None
+                item.batch_size = input.batch_size or None
+                item.batch_interval = input.batch_interval or None
+                item.ack_mode = input.ack_mode or None
                 
                 session.add(item)
                 session.commit()
@@ -137,6 +137,10 @@ class Edit(AdminService):
                 input.action = DEFINITION.AMQP_EDIT.value
                 input.old_name = old_name
                 self.broker_client.publish(input, msg_type=MESSAGE_TYPE.TO_AMQP_CONNECTOR_ALL)
+
+                # Workers may publish messages directly too
+                self.broker_client.publish({'action':DEFINITION.AMQP_EDIT.value, 'id':def_amqp.id},
+                    msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL)
                 
                 self.response.payload.id = def_amqp.id
                 self.response.payload.name = def_amqp.name
@@ -168,6 +172,7 @@ class Delete(AdminService):
 
                 msg = {'action': DEFINITION.AMQP_DELETE.value, 'id': self.request.input.id}
                 self.broker_client.publish(msg, msg_type=MESSAGE_TYPE.TO_AMQP_CONNECTOR_ALL)
+                self.broker_client.publish(msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL)
                 
             except Exception, e:
                 session.rollback()
@@ -188,6 +193,12 @@ class ChangePassword(ChangePasswordBase):
         def _auth(instance, password):
             instance.password = password
             
-        return self._handle(ConnDefAMQP, _auth, 
+        response = self._handle(ConnDefAMQP, _auth,
             DEFINITION.AMQP_CHANGE_PASSWORD.value, msg_type=MESSAGE_TYPE.TO_AMQP_CONNECTOR_ALL, 
             payload=self.request.payload)
+
+        # Workers read the new password from the ODB if they publish messages directly
+        self.broker_client.publish({'action':DEFINITION.AMQP_CHANGE_PASSWORD.value, 'id':self.request.input.id},
+            msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL)
+
+        return response
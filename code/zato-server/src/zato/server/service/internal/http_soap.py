@@ -88,7 +88,7 @@ class GetList(AdminService):
         output_optional = ('service_id', 'service_name', 'security_id', 'security_name', 'sec_type', 
             'method', 'soap_action', 'soap_version', 'data_format', 'host', 'ping_method', 'pool_size', 'merge_url_params_req',
             'url_params_pri', 'params_pri', 'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'),
-            'content_type')
+            'content_type', Boolean('stream_request'), Integer('max_body_size'))
         output_repeated = True
 
     def get_data(self, session):
@@ -116,7 +116,8 @@ class Create(_CreateEdit):
         input_required = ('cluster_id', 'name', 'is_active', 'connection', 'transport', 'is_internal', 'url_path')
         input_optional = ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format',
             'host', 'ping_method', 'pool_size', Boolean('merge_url_params_req'), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type')
+            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type',
+            Boolean('stream_request'), Integer('max_body_size'))
         output_required = ('id', 'name')
 
     def handle(self):
@@ -181,6 +182,8 @@ class Create(_CreateEdit):
                 item.timeout = input.get('timeout') or MISC.DEFAULT_HTTP_TIMEOUT
                 item.has_rbac = input.get('has_rbac') or False
                 item.content_type = input.get('content_type')
+                item.stream_request = input.get('stream_request') or False
+                item.max_body_size = input.get('max_body_size') or None
 
                 sec_tls_ca_cert_id = input.get('sec_tls_ca_cert_id')
                 item.sec_tls_ca_cert_id = sec_tls_ca_cert_id if sec_tls_ca_cert_id and sec_tls_ca_cert_id != ZATO_NONE else None
@@ -224,7 +227,8 @@ class Edit(_CreateEdit):
         input_required = ('id', 'cluster_id', 'name', 'is_active', 'connection', 'transport', 'url_path')
         input_optional = ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format', 
             'host', 'ping_method', 'pool_size', Boolean('merge_url_params_req'), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type')
+            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type',
+            Boolean('stream_request'), Integer('max_body_size'))
         output_required = ('id', 'name')
 
     def handle(self):
@@ -294,6 +298,8 @@ class Edit(_CreateEdit):
                 item.timeout = input.get('timeout') or MISC.DEFAULT_HTTP_TIMEOUT
                 item.has_rbac = input.get('has_rbac') or False
                 item.content_type = input.get('content_type')
+                item.stream_request = input.get('stream_request') or False
+                item.max_body_size = input.get('max_body_size') or None
 
                 sec_tls_ca_cert_id = input.get('sec_tls_ca_cert_id')
                 item.sec_tls_ca_cert_id = sec_tls_ca_cert_id if sec_tls_ca_cert_id and sec_tls_ca_cert_id != ZATO_NONE else None
@@ -25,6 +25,12 @@ class _AMQPService(AdminService):
         msg = {'action': OUTGOING.AMQP_DELETE.value, 'name': outgoing.name, 'id':outgoing.id}
         self.broker_client.publish(msg, MESSAGE_TYPE.TO_AMQP_PUBLISHING_CONNECTOR_ALL)
 
+    def notify_workers(self, action, outgoing):
+        """ Lets workers know that an outgoing connection has changed, in case they publish messages to it directly.
+        """
+        msg = {'action': action, 'name': outgoing.name, 'id':outgoing.id}
+        self.broker_client.publish(msg, MESSAGE_TYPE.TO_PARALLEL_ALL)
+
 class GetList(AdminService):
     """ Returns a list of outgoing AMQP connections.
     """
@@ -42,7 +48,7 @@ class GetList(AdminService):
         with closing(self.odb.session()) as session:
             self.response.payload[:] = self.get_data(session)
         
-class Create(AdminService):
+class Create(_AMQPService):
     """ Creates a new outgoing AMQP connection.
     """
     class SimpleIO(AdminSIO):
@@ -92,6 +98,8 @@ class Create(AdminService):
                 
                 if item.is_active:
                     start_connector(self.server.repo_location, item.id, item.def_id)
+
+                self.notify_workers(OUTGOING.AMQP_CREATE.value, item)
                 
                 self.response.payload.id = item.id
                 self.response.payload.name = item.name
@@ -157,6 +165,8 @@ class Edit(_AMQPService):
                 
                 if item.is_active:
                     start_connector(self.server.repo_location, item.id, item.def_id)
+
+                self.notify_workers(OUTGOING.AMQP_EDIT.value, item)
                 
                 self.response.payload.id = item.id
                 self.response.payload.name = item.name
@@ -187,6 +197,7 @@ class Delete(_AMQPService):
                 session.commit()
                 
                 self.delete_outgoing(channel)
+                self.notify_workers(OUTGOING.AMQP_DELETE.value, channel)
 
             except Exception, e:
                 session.rollback()
@@ -16,7 +16,7 @@ from traceback import format_exc
 from zato.common.broker_message import OUTGOING
 from zato.common.odb.model import OutgoingFTP
 from zato.common.odb.query import out_ftp_list
-from zato.server.service import Boolean
+from zato.server.service import Boolean, Integer
 from zato.server.service.internal import AdminService, AdminSIO, ChangePasswordBase
 
 class _FTPService(AdminService):
@@ -36,7 +36,7 @@ class GetList(AdminService):
         response_elem = 'zato_outgoing_ftp_get_list_response'
         input_required = ('cluster_id',)
         output_required = ('id', 'name', 'is_active', 'host', 'port')
-        output_optional = ('user', 'acct', 'timeout', Boolean('dircache'))
+        output_optional = ('user', 'acct', 'timeout', Boolean('dircache'), Integer('pool_size'))
         
     def get_data(self, session):
         return out_ftp_list(session, self.request.input.cluster_id, False)
@@ -52,7 +52,7 @@ class Create(_FTPService):
         request_elem = 'zato_outgoing_ftp_create_request'
         response_elem = 'zato_outgoing_ftp_create_response'
         input_required = ('cluster_id', 'name', 'is_active', 'host', 'port', Boolean('dircache'))
-        input_optional = ('user', 'acct', 'timeout')
+        input_optional = ('user', 'acct', 'timeout', Integer('pool_size'))
         output_required = ('id', 'name')
 
     def handle(self):
@@ -78,6 +78,7 @@ class Create(_FTPService):
                 item.user = input.user
                 item.acct = input.acct
                 item.timeout = input.timeout or None
+                item.pool_size = input.pool_size or None
 
                 session.add(item)
                 session.commit()
@@ -101,7 +102,7 @@ class Edit(_FTPService):
         request_elem = 'zato_outgoing_ftp_edit_request'
         response_elem = 'zato_outgoing_ftp_edit_response'
         input_required = ('id', 'cluster_id', 'name', 'is_active', 'host', 'port', Boolean('dircache'))
-        input_optional = ('user', 'acct', 'timeout')
+        input_optional = ('user', 'acct', 'timeout', Integer('pool_size'))
         output_required = ('id', 'name')
 
     def handle(self):
@@ -128,6 +129,7 @@ class Edit(_FTPService):
                 item.user = input.user
                 item.acct = input.acct
                 item.timeout = input.timeout or None
+                item.pool_size = input.pool_size or None
 
                 input.password = item.password
                 input.old_name = old_name
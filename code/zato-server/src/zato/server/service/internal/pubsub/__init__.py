@@ -9,7 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-from httplib import FORBIDDEN, INTERNAL_SERVER_ERROR, OK
+from httplib import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, OK
 from json import dumps, loads
 from logging import getLogger
 from traceback import format_exc
@@ -21,10 +21,11 @@ from gevent import sleep, spawn
 from huTools.structured import dict2xml
 
 # Zato
-from zato.common import DATA_FORMAT, PUB_SUB, ZATO_ERROR, ZATO_NONE, ZATO_OK
+from zato.common import PUB_SUB, ZATO_ERROR, ZATO_NONE, ZATO_OK
 from zato.common.pubsub import ItemFull, PermissionDenied
 from zato.common.util import get_basic_auth_credentials
 from zato.server.connection.http_soap import BadRequest, Forbidden, TooManyRequests, Unauthorized
+from zato.server.pubsub import CallbackDelivery
 from zato.server.service import AsIs, Bool, Int, Service
 from zato.server.service.internal import AdminService
 
@@ -49,64 +50,29 @@ class DeleteExpired(AdminService):
 # ################################################################################################################################
 
 class InvokeCallbacks(AdminService):
-    """ Invoked when a server is starting - periodically spawns a greenlet invoking consumer URL callbacks.
+    """ Invoked when a server is starting - delivers messages to consumers whose delivery mode is a callback URL.
+    Each such consumer has its own delivery greenlet and the list of consumers is refreshed periodically.
     """
-    def _reject(self, msg_ids, sub_key, consumer, reason):
-        self.pubsub.reject(sub_key, msg_ids)
-        self.logger.error('Could not deliver messages `%s`, sub_key `%s` to `%s`, reason `%s`', msg_ids, sub_key, consumer, reason)
-        
-    def _invoke_callbacks(self):
-        callback_consumers = list(self.pubsub.impl.get_callback_consumers())
-        self.logger.debug('Callback consumers found `%s`', callback_consumers)
-
-        for consumer in callback_consumers:
-            with self.lock(consumer.sub_key):
-                msg_ids = []
-
-                out = {
-                    'status': ZATO_OK,
-                    'results_count': 0,
-                    'results': []
-                }
-
-                messages = self.pubsub.get(consumer.sub_key, get_format=PUB_SUB.GET_FORMAT.JSON.id)
-
-                for msg in messages:
-                    msg_ids.append(msg['metadata']['msg_id'])
-                    out['results_count'] += 1
-                    out['results'].append(msg)
-
-                # messages is a generator so we still don't know if we had anything.
-                if msg_ids:
-                    outconn = self.outgoing.plain_http[consumer.callback_name]
-
-                    if outconn.config['data_format'] == DATA_FORMAT.XML:
-                        out = dict2xml(out)
-                        content_type = 'application/xml'
-                    else:
-                        out = dumps(out)
-                        content_type = 'application/json'
-
-                    try:
-                        response = outconn.conn.post(self.cid, data=out, headers={'content-type': content_type})
-                    except Exception, e:
-                        self._reject(msg_ids, consumer.sub_key, consumer, format_exc(e))
-                    else:
-                        if response.status_code == OK:
-                            self.pubsub.acknowledge(consumer.sub_key, msg_ids)
-                        else:
-                            self._reject(
-                                msg_ids, consumer.sub_key, consumer, '`{}` `{}`'.format(response.status_code, response.text))
+    def _get_outconn(self, name):
+        return self.outgoing.plain_http[name]
 
     def handle(self):
-        # TODO: self.logger's name should be 'zato_pubsub' so it got logged to the same location
-        # the rest of pub/sub does.
+        config = self.server.fs_server_config.pubsub
+        interval = float(config.invoke_callbacks_interval)
 
-        interval = float(self.server.fs_server_config.pubsub.invoke_callbacks_interval)
+        delivery = CallbackDelivery(self.pubsub, self._get_outconn,
+            max_batch_size=int(config.get('callback_max_batch_size', PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE)),
+            max_in_flight=int(config.get('callback_max_in_flight', 1)),
+            poll_interval=interval,
+            backoff_initial=float(config.get('callback_backoff_initial', 1)),
+            backoff_max=float(config.get('callback_backoff_max', 60)),
+            lease_time=float(config.get('callback_lease_time', 300)))
+
+        delivery.start()
 
         while True:
-            self.logger.debug('Invoking pub/sub callbacks, interval %rs', interval)
-            spawn(self._invoke_callbacks)
+            self.logger.debug('Refreshing pub/sub callback consumers, interval %rs', interval)
+            delivery.sync()
             sleep(interval)
 
 # ################################################################################################################################
@@ -164,7 +130,7 @@ class RESTHandler(Service):
     class SimpleIO(object):
         input_required = ('item_type', 'item')
         input_optional = ('max', 'dir', 'format', 'mime_type', Int('priority'), Int('expiration'), AsIs('msg_id'),
-            Bool('ack'), Bool('reject'))
+            Bool('ack'), Bool('reject'), Bool('batch'), Int('wait'))
         default = ZATO_NONE
         use_channel_params_only = True
 
@@ -219,9 +185,55 @@ class RESTHandler(Service):
 
 # ################################################################################################################################
 
+    def _publish_many(self):
+        """ Publishes a JSON array of messages on a topic. Each element is either a payload or an object with a payload
+        and, optionally, mime_type, priority, expiration and msg_id, defaulting to the ones from query string.
+        """
+        try:
+            messages = loads(self.request.raw_request)
+        except ValueError:
+            raise BadRequest(self.cid, 'Batch request must be a JSON array')
+
+        if not isinstance(messages, list):
+            raise BadRequest(self.cid, 'Batch request must be a JSON array')
+
+        defaults = {
+            'mime_type': self.request.input.mime_type or PUB_SUB.DEFAULT_MIME_TYPE,
+            'priority': int(self.request.input.priority or PUB_SUB.DEFAULT_PRIORITY),
+            'expiration': int(self.request.input.expiration or PUB_SUB.DEFAULT_EXPIRATION),
+        }
+
+        to_publish = []
+
+        for msg in messages:
+            if not isinstance(msg, dict):
+                msg = {'payload': msg}
+
+            if 'payload' not in msg:
+                raise BadRequest(self.cid, 'Each message in a batch must have a payload')
+
+            if not isinstance(msg['payload'], basestring):
+                msg['payload'] = dumps(msg['payload'])
+
+            for key, value in defaults.items():
+                msg.setdefault(key, value)
+
+            to_publish.append(msg)
+
+        results = self.pubsub.publish_many(to_publish, self.request.input.item, self.environ['client_id'])
+
+        self._set_payload_data({
+            'status': ZATO_OK,
+            'results_count': len(results),
+            'results': results
+        })
+
     def _handle_POST_topic(self):
-        """ Publishes a message on a topic.
+        """ Publishes a message on a topic, or a batch of them if requested to.
         """
+        if self.request.input.batch:
+            return self._publish_many()
+
         pub_data = {
             'payload': self.request.raw_request,
             'topic': self.request.input.item,
@@ -240,7 +252,8 @@ class RESTHandler(Service):
 # ################################################################################################################################
 
     def _handle_POST_msg(self):
-        """ Returns messages from topics, either in JSON or XML.
+        """ Returns messages from topics, either in JSON or XML. With ?wait=N, waits up to N seconds for messages
+        to be published if there are none.
         """
         out = {
             'status': ZATO_OK,
@@ -250,9 +263,10 @@ class RESTHandler(Service):
 
         max_batch_size = int(self.request.input.max) if self.request.input.max else PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE
         is_fifo = True if (self.request.input.dir == PUB_SUB.GET_DIR.FIFO or not self.request.input.dir) else False
+        wait = int(self.request.input.wait or 0)
 
         try:
-            for item in self.pubsub.get(self.environ['sub_key'], max_batch_size, is_fifo, self.environ['format']):
+            for item in self.pubsub.get(self.environ['sub_key'], max_batch_size, is_fifo, self.environ['format'], wait):
 
                 if self.environ['is_json']:
                     out_item = item
@@ -274,7 +288,12 @@ class RESTHandler(Service):
         try:
             getattr(self, '_handle_POST_{}'.format(self.request.input.item_type))()
         except Exception, e:
-            details, status_code = ('Permission denied', FORBIDDEN) if isinstance(e, PermissionDenied) else (e.message, INTERNAL_SERVER_ERROR)
+            if isinstance(e, PermissionDenied):
+                details, status_code = 'Permission denied', FORBIDDEN
+            elif isinstance(e, BadRequest):
+                details, status_code = e.msg, BAD_REQUEST
+            else:
+                details, status_code = e.message, INTERNAL_SERVER_ERROR
             self.logger.warn('Could not handle POST pub/sub (%s %s), e:`%s`', self.cid, details, format_exc(e))
             self._set_payload_data({'status': ZATO_ERROR, 'details':details}, status_code)
 
@@ -35,7 +35,8 @@ class GetList(AdminService):
         input_required = ('cluster_id', 'topic_name')
         output_required = ('id', 'name', 'is_active', 'sec_type', 'client_id', Int('max_depth'), Int('current_depth'),
             Int('in_flight_depth'), 'sub_key', 'delivery_mode')
-        output_optional = (UTC('last_seen'), 'callback')
+        output_optional = (UTC('last_seen'), 'callback', 'group_name', Int('group_depth'), Int('lag'), Int('delivered'),
+            Int('delivery_failures'), Int('delivery_time_avg'), Int('delivery_time_last'), 'last_delivery_error')
         output_repeated = True
 
     def get_data(self, session):
@@ -43,6 +44,20 @@ class GetList(AdminService):
             item.last_seen = self.pubsub.get_consumer_last_seen(item.client_id)
             item.current_depth = self.pubsub.get_consumer_queue_current_depth(item.sub_key)
             item.in_flight_depth = self.pubsub.get_consumer_queue_in_flight_depth(item.sub_key)
+            item.lag = int(self.pubsub.get_consumer_queue_lag(item.sub_key))
+
+            # Members of a group share its queue so its current depth is that of the group
+            item.group_depth = item.current_depth if item.group_name else None
+
+            # Only consumers with callbacks have delivery statistics, times are in milliseconds
+            stats = self.pubsub.get_delivery_stats(item.sub_key)
+            if stats:
+                item.delivered = int(stats.get('delivered', 0))
+                item.delivery_failures = int(stats.get('failures', 0))
+                item.delivery_time_avg = int(float(stats['time_total']) / int(stats['batches']))
+                item.delivery_time_last = int(float(stats['time_last']))
+                item.last_delivery_error = stats.get('last_error')
+
             yield item
 
     def handle(self):
@@ -113,7 +128,7 @@ class Create(_CreateEdit):
         request_elem = 'zato_pubsub_consumers_create_request'
         response_elem = 'zato_pubsub_consumers_create_response'
         input_required = ('cluster_id', 'client_id', 'topic_name', 'is_active', 'max_depth', 'delivery_mode')
-        input_optional = ('callback_id',)
+        input_optional = ('callback_id', 'group_name')
         output_required = ('id', 'name', 'sub_key')
 
     def handle(self):
@@ -133,7 +148,7 @@ class Create(_CreateEdit):
                 sub_key = new_cid()
                 consumer = PubSubConsumer(
                     None, input.is_active, sub_key, input.max_depth, input.delivery_mode, callback[0],
-                    callback[2], topic.id, input.client_id, input.cluster_id)
+                    callback[2], topic.id, input.client_id, input.cluster_id, input.get('group_name') or None)
 
                 session.add(consumer)
                 session.commit()
@@ -148,6 +163,7 @@ class Create(_CreateEdit):
                 input.action = PUB_SUB_CONSUMER.CREATE.value
                 input.client_name = consumer.sec_def.name
                 input.sub_key = sub_key
+                input.group_name = consumer.group_name
                 input.callback_name = callback[1]
                 input.callback_type = callback[2]
                 self.broker_client.publish(input)
@@ -165,7 +181,7 @@ class Edit(_CreateEdit):
         request_elem = 'zato_pubsub_consumers_edit_request'
         response_elem = 'zato_pubsub_consumers_edit_response'
         input_required = ('id', 'is_active', 'max_depth', 'delivery_mode')
-        input_optional = ('callback_id',)
+        input_optional = ('callback_id', 'group_name')
         output_required = ('id', 'name')
 
     def handle(self):
@@ -186,6 +202,7 @@ class Edit(_CreateEdit):
                 consumer.max_depth = input.max_depth
                 consumer.delivery_mode = input.delivery_mode
                 consumer.callback_id = callback[0]
+                consumer.group_name = input.get('group_name') or None
 
                 client_id = consumer.sec_def.id
                 client_name = consumer.sec_def.name
@@ -211,6 +228,7 @@ class Edit(_CreateEdit):
                 msg.sub_key = consumer.sub_key
                 msg.delivery_mode = consumer.delivery_mode
                 msg.callback_id = consumer.callback_id
+                msg.group_name = consumer.group_name
 
                 msg.client_id = client_id
                 msg.client_name = client_name
@@ -21,6 +21,7 @@ from bunch import Bunch
 from zato.common import ZatoException
 from zato.common.odb.model import Cluster, Server
 from zato.common.util import add_scheduler_jobs
+from zato.server.service import Float, Integer
 from zato.server.service.internal import AdminService, AdminSIO
 
 logger = getLogger('zato_singleton')
@@ -172,3 +173,18 @@ class Delete(AdminService):
                 self.logger.error(msg)
                 
                 raise
+
+class GetConnPoolStats(AdminService):
+    """ Returns metrics of connection queues of outgoing connections, such as Suds SOAP, Odoo or OpenStack Swift ones,
+    in the worker the service is invoked in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_server_get_conn_pool_stats_request'
+        response_elem = 'zato_server_get_conn_pool_stats_response'
+        output_required = ('name', 'conn_type', 'address', Integer('pool_size'), Integer('max_size'), Integer('size'),
+            Integer('idle'), Integer('in_use'), Integer('acquired'), Integer('misses'), Integer('timeouts'),
+            Float('wait_time_total'), Float('wait_time_max'))
+        output_repeated = True
+
+    def handle(self):
+        self.response.payload[:] = self.worker_store.get_conn_pool_stats()
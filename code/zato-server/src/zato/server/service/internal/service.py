@@ -24,7 +24,7 @@ from anyjson import loads
 from validate import is_boolean
 
 # Zato
-from zato.common import BROKER, KVDB, ZatoException
+from zato.common import BROKER, KVDB, REQ_RESP_SAMPLE_MODE, ZatoException
 from zato.common.broker_message import SERVICE
 from zato.common.odb.model import Cluster, ChannelAMQP, ChannelWMQ, ChannelZMQ, \
      DeployedService, HTTPSOAP, Server, Service
@@ -436,7 +436,8 @@ class GetRequestResponse(AdminService):
         response_elem = 'zato_service_request_response_response'
         input_required = ('cluster_id', 'name')
         output_required = ('service_id', Integer('sample_req_resp_freq'))
-        output_optional = ('sample_cid', 'sample_req_ts', 'sample_resp_ts', 'sample_req', 'sample_resp', )
+        output_optional = ('sample_cid', 'sample_req_ts', 'sample_resp_ts', 'sample_req', 'sample_resp',
+            'sample_req_resp_mode')
         
     def get_data(self):
         result = {}
@@ -459,6 +460,7 @@ class GetRequestResponse(AdminService):
         self.response.payload.sample_req = result.get('req', '').encode('base64')
         self.response.payload.sample_resp = result.get('resp', '').encode('base64')
         self.response.payload.sample_req_resp_freq = result.get('freq', 0)
+        self.response.payload.sample_req_resp_mode = result.get('mode', REQ_RESP_SAMPLE_MODE.SYNC)
 
 class ConfigureRequestResponse(AdminService):
     """ Updates the request/response-related configuration.
@@ -467,10 +469,25 @@ class ConfigureRequestResponse(AdminService):
         request_elem = 'zato_service_configure_request_response_request'
         response_elem = 'zato_service_configure_request_response_response'
         input_required = ('cluster_id', 'name', Integer('sample_req_resp_freq'))
-        
+        input_optional = ('sample_req_resp_mode',)
+
     def handle(self):
-        key = '{}{}'.format(KVDB.REQ_RESP_SAMPLE, self.request.input.name)
-        self.kvdb.conn.hset(key, 'freq', self.request.input.sample_req_resp_freq)
+        input = self.request.input
+        mode = input.get('sample_req_resp_mode') or REQ_RESP_SAMPLE_MODE.SYNC
+
+        if not REQ_RESP_SAMPLE_MODE.has(mode):
+            raise ValueError('Invalid sample_req_resp_mode `{}`'.format(mode))
+
+        key = '{}{}'.format(KVDB.REQ_RESP_SAMPLE, input.name)
+        self.kvdb.conn.hmset(key, {'freq': input.sample_req_resp_freq, 'mode': mode})
+
+        # Workers cache the configuration so they need to be notified of the change
+        self.broker_client.publish({
+            'action': SERVICE.CONFIGURE_REQUEST_RESPONSE.value,
+            'name': input.name,
+            'freq': input.sample_req_resp_freq,
+            'mode': mode,
+        })
             
 class UploadPackage(AdminService):
     """ Returns a boolean flag indicating whether the server has a WSDL attached.
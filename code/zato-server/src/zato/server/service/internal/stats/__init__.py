@@ -34,9 +34,14 @@ from zato.common.broker_message import STATS
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import add_to_index, build_indexes, convert_raw_times, get_index_key, get_indexed_keys, \
+     LatencyHistogram
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
 
+# Percentiles of response times computed out of histograms, stored along with STATS_KEYS
+PERCENTILES = ((50, 'p50'), (90, 'p90'), (99, 'p99'))
+
 def stop_excluding_rrset(freq, start, stop):
     rrs = rruleset()
     rrs.rrule(rrule(freq, dtstart=start, until=stop))
@@ -66,48 +71,40 @@ class BaseAggregatingService(AdminService):
     def stats_enabled(self):
         return self.server.component_enabled.stats
 
-    def aggregate_raw_times(self, key, service_name, max_batch_size=None):
-        """ Aggregates values from a list living under a given key. Returns its
-        min, max, mean and an overall usage count. 'max_batch_size' controls how
-        many items will be fetched from the list so it's possible to fetch less
-        items than its LLEN returns.
+    def aggregate_histogram(self, hist, service_name):
+        """ Returns min, max, mean and an overall usage count of processing times from a histogram. The mean is computed
+        out of times up to the service's mean_percentile, if one is set, or out of all times otherwise.
         """
-        key_len = self.server.kvdb.conn.llen(key)
-        if max_batch_size:
-            batch_size = min(key_len, max_batch_size)
-            if batch_size < key_len:
-                msg = ('batch_size:[{}] < key_len:[{}], max_batch_size:[{}], key:[{}], '
-                'consider decreasing the job interval or increasing the max_batch_size').format(
-                    batch_size, key_len, max_batch_size, key)
-                self.logger.warn(msg)
-        else:
-            batch_size = key_len
-            
-        times = [int(elem) for elem in self.server.kvdb.conn.lrange(key, 0, batch_size)]
-
-        if times:
+        if hist.count:
             mean_percentile = int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
-            max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
-            
-            return min(times), max(times), (sp_stats.tmean(times, (None, max_score)) or 0), len(times)
+            return hist.min(), hist.max(), hist.mean(mean_percentile), hist.count
         else:
             return 0, 0, 0, 0
-    
-    def collect_service_stats(self, keys_pattern, key_prefix, key_suffix, total_seconds, 
-                              suffix_needs_colon=True, chop_off_service_name=True, needs_rate=True):
 
+    def collect_service_stats(self, key_prefix, key_suffix, total_seconds,
+                              suffix_needs_colon=True, chop_off_service_name=True, needs_rate=True):
+        """ Collects statistics from all keys of a given prefix in the time slice pointed to by key_suffix,
+        including any slices directly below it, e.g. all minutes of a given hour.
+        """
         service_stats = {}
+        keys = get_indexed_keys(self.kvdb.conn, key_prefix, key_suffix)
+
         if suffix_needs_colon:
             key_suffix = ':' + key_suffix
-            
-        for key in self.kvdb.conn.keys(keys_pattern):
+
+        for key in keys:
+            values = self.kvdb.conn.hgetall(key)
+
+            # The index may still point to keys that have already expired
+            if not values:
+                continue
+
             service_name = key.replace(key_prefix, '').replace(key_suffix, '')
             if chop_off_service_name:
                 service_name = service_name[:-3]
-                
-            values = self.kvdb.conn.hgetall(key)
-            
+
             stats = service_stats.setdefault(service_name, {})
+            stats.setdefault('histogram', LatencyHistogram()).merge(LatencyHistogram.from_kvdb(values))
             
             for name in STATS_KEYS:
             
@@ -160,8 +157,7 @@ class BaseAggregatingService(AdminService):
             total_seconds = mdays[delta_diff.month] * SECONDS_IN_DAY # TODO: Use calendar.monthrange instead of mdays so leap years are taken into account
         
         key_suffix = delta_diff.strftime(source_strftime_format)
-        service_stats = self.collect_service_stats(
-            '{}*:{}*'.format(source, key_suffix), source, key_suffix, total_seconds)
+        service_stats = self.collect_service_stats(source, key_suffix, total_seconds)
         
         self.hset_aggr_keys(service_stats, target, key_suffix)
         
@@ -173,14 +169,40 @@ class BaseAggregatingService(AdminService):
             aggr_key = '{}{}:{}'.format(key_prefix, service_name, key_suffix)
             for name in STATS_KEYS:
                 self.hset_aggr_key(aggr_key, name, values[name])
-        
+
+            hist = values.get('histogram')
+            if hist:
+                self.hset_aggr_histogram(aggr_key, hist)
+
+            self.add_aggr_key_to_index(key_prefix, key_suffix, aggr_key)
+
+    def get_expire_after(self):
+        """ Returns in how many seconds aggregated keys should expire.
+        """
+        expire_after = int(self.server.fs_server_config.get('stats', {}).get('expire_after', 24))
+        return expire_after * 60 * 60 # Hours times minutes in an hour and seconds in a minute
+
     def hset_aggr_key(self, aggr_key, hash_key, hash_value):
         self.server.kvdb.conn.hset(aggr_key, hash_key, hash_value)
 
         # Expire the aggregated key after that many hours
-        expire_after = int(self.server.fs_server_config.get('stats', {}).get('expire_after', 24))
-        expire_after = expire_after * 60 * 60 # Hours times minutes in an hour and seconds in a minute
-        self.server.kvdb.conn.expire(aggr_key, expire_after)
+        self.server.kvdb.conn.expire(aggr_key, self.get_expire_after())
+
+    def hset_aggr_histogram(self, aggr_key, hist):
+        """ Stores a histogram along with percentiles computed out of it so that it can be merged into larger
+        time slices later on.
+        """
+        mapping = hist.to_kvdb()
+        for percentile, name in PERCENTILES:
+            mapping[name] = hist.percentile(percentile)
+
+        self.server.kvdb.conn.hmset(aggr_key, mapping)
+        self.server.kvdb.conn.expire(aggr_key, self.get_expire_after())
+
+    def add_aggr_key_to_index(self, key_prefix, key_suffix, aggr_key):
+        """ Makes an aggregated key visible to services looking up keys by time slices.
+        """
+        add_to_index(self.server.kvdb.conn, key_prefix, key_suffix, aggr_key, self.get_expire_after())
 
 # ##############################################################################
         
@@ -190,28 +212,34 @@ class ProcessRawTimes(BaseAggregatingService):
         if not self.stats_enabled():
             return
 
-        # 
-        # Sample config values
-        # 
-        # global_slow_threshold=120
-        # max_batch_size=99999
-        #
-        config = Bunch()
-        for item in self.request.payload.splitlines():
-            key, value = item.split('=')
-            config[key] = int(value)
-
-        for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_RAW + '*'):
-            
-            service_name = key.replace(KVDB.SERVICE_TIME_RAW, '')
+        conn = self.server.kvdb.conn
+        index_key = get_index_key(KVDB.SERVICE_TIME_HIST)
+
+        # Raw times and aggregated keys may have been stored by servers from before the upgrade
+        convert_raw_times(conn)
+        build_indexes(conn, self.get_expire_after())
+
+        for key in get_indexed_keys(conn, KVDB.SERVICE_TIME_HIST):
+
+            service_name = key.replace(KVDB.SERVICE_TIME_HIST, '')
+
+            # Servers add to histograms with HINCRBY so we can read and delete one atomically without losing
+            # any times and the next flush of statistics from any server will create the key anew.
+            with conn.pipeline() as pipe:
+                pipe.hgetall(key)
+                pipe.delete(key)
+                pipe.srem(index_key, key)
+                hist = LatencyHistogram.from_kvdb(pipe.execute()[0])
+
+            if not hist.count:
+                continue
             
             current_mean = float(
                 self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
             current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
             current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
             
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(
-                key, service_name, config.max_batch_size)
+            batch_min, batch_max, batch_mean, batch_total = self.aggregate_histogram(hist, service_name)
             
             self.server.kvdb.conn.hset(
                KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
@@ -220,10 +248,6 @@ class ProcessRawTimes(BaseAggregatingService):
             self.server.kvdb.conn.hset(
                 KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
             
-            # Services use RPUSH for storing raw times so we are safe to use LTRIM
-            # in order to do away with the already processed ones
-            self.server.kvdb.conn.ltrim(key, batch_total, -1)
-            
 # ##############################################################################
 
 class AggregateByMinute(BaseAggregatingService):
@@ -242,18 +266,26 @@ class AggregateByMinute(BaseAggregatingService):
         now = datetime.utcnow()
         key_suffix = (now - timedelta(minutes=2)).strftime('%Y:%m:%d:%H:%M')
         
-        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
+        for key in get_indexed_keys(self.server.kvdb.conn, KVDB.SERVICE_TIME_HIST_BY_MINUTE, key_suffix):
             
-            service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
+            service_name = key.replace(KVDB.SERVICE_TIME_HIST_BY_MINUTE, '').replace(':' + key_suffix, '')
             aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
-            
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+
+            hist = LatencyHistogram.from_kvdb(self.server.kvdb.conn.hgetall(key))
+            batch_min, batch_max, batch_mean, batch_total = self.aggregate_histogram(hist, service_name)
+
+            # The key has already expired
+            if not batch_total:
+                continue
             
             self.hset_aggr_key(aggr_key, 'min', batch_min)
             self.hset_aggr_key(aggr_key, 'max', batch_max)
             self.hset_aggr_key(aggr_key, 'mean', batch_mean)
             self.hset_aggr_key(aggr_key, 'usage', batch_total)
             self.hset_aggr_key(aggr_key, 'rate', batch_total / 60.0) # I.e. req/s
+            self.hset_aggr_histogram(aggr_key, hist)
+
+            self.add_aggr_key_to_index(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, key_suffix, aggr_key)
             
             # Raw per-minute statistics keys will expire by themselves, we don't need
             # to delete them manually.
@@ -315,7 +347,7 @@ class StatsReturningService(AdminService):
         input_optional = ('service_name', Integer('n'), 'n_type')
         output_optional = ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
             'min_resp_time', 'max_resp_time', 'all_services_usage', 'all_services_time',
-            'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services')
+            'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services', 'p50', 'p90', 'p99')
     
     stats_key_prefix = KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE
     
@@ -327,6 +359,12 @@ class StatsReturningService(AdminService):
                 value = float('{:.2f}'.format(100.0 * getattr(stats_elem, name) / all_services_stats[name]))
                 setattr(stats_elem, '{}_perc_all_services'.format(name), value)
                 
+    def set_percentiles(self, stats_elem):
+        """ Sets response time percentiles out of all the histograms collected for a given service.
+        """
+        for percentile, name in PERCENTILES:
+            setattr(stats_elem, name, stats_elem.temp_histogram.percentile(percentile))
+
     def yield_top_n(self, n, n_type, stats_elems):
         """ Yields top N services.
         """
@@ -390,11 +428,17 @@ class StatsReturningService(AdminService):
         
         # 1st pass
         for suffix in suffixes:
-            keys = self.server.kvdb.conn.keys('{}{}:{}'.format(stats_key_prefix, service, suffix))
+            if service == '*':
+                keys = get_indexed_keys(self.server.kvdb.conn, stats_key_prefix, suffix)
+            else:
+                key = '{}{}:{}'.format(stats_key_prefix, service, suffix)
+                keys = [key] if self.server.kvdb.conn.exists(key) else []
+
             for key in keys:
                 service_name = key.replace(stats_key_prefix, '').replace(':{}'.format(suffix), '')
             
                 stats_elem = StatsElem(service_name)
+                stats_elem.temp_histogram = LatencyHistogram()
                 stats_elems[service_name] = stats_elem
                 
                 # When building statistics, we can't expect there will be data for all the time
@@ -416,6 +460,8 @@ class StatsReturningService(AdminService):
                     ((name, float(value)) for (name, value) in self.server.kvdb.conn.hgetall(key).items()))
                     
                 if key_values:
+
+                    stats_elem.temp_histogram.merge(LatencyHistogram.from_kvdb(key_values))
     
                     time = (key_values.usage * key_values.mean)
                     stats_elem.time += time
@@ -447,6 +493,7 @@ class StatsReturningService(AdminService):
             stats_elem.mean = float('{:.2f}'.format(sp_stats.tmean(stats_elem.mean_trend_int)))
             stats_elem.usage = sum(stats_elem.usage_trend_int)
             stats_elem.rate = float('{:.2f}'.format(sum(stats_elem.usage_trend_int) / delta_seconds))
+            self.set_percentiles(stats_elem)
             
             self.set_percent_of_all_services(all_services_stats, stats_elem)
 
@@ -35,6 +35,7 @@ from zato.common import KVDB, StatsElem, ZatoException
 from zato.server.service import Integer, UTC
 from zato.server.service.internal.stats import BaseAggregatingService, STATS_KEYS, StatsReturningService, \
     stop_excluding_rrset
+from zato.server.stats import LatencyHistogram
 
 # ##############################################################################
 
@@ -179,7 +180,7 @@ class BaseSummarizingService(BaseAggregatingService):
             for elem in chain(*patterns):
                 prefix, suffix = elem.split('*')
                 suffix = suffix[1:]
-                stats = self.collect_service_stats(elem, prefix, suffix, None, False, False, False)
+                stats = self.collect_service_stats(prefix, suffix, None, False, False, False)
 
                 for service_name, values in stats.items():
                     stats = services.setdefault(service_name, deepcopy(DEFAULT_STATS))
@@ -195,6 +196,8 @@ class BaseSummarizingService(BaseAggregatingService):
                         elif name == 'min':
                             stats[name] = min(stats[name], value)
 
+                    stats.setdefault('histogram', LatencyHistogram()).merge(values['histogram'])
+
             for service_name, values in services.items():
 
                 values['mean'] = round(sp_stats.tmean(values['mean']), 2)
@@ -575,7 +578,10 @@ class GetSummaryByRange(StatsReturningService, BaseSummarizingService):
                         seen_repeated_stats = True
 
                     # Fetch an existing elem or assign a new one
-                    merged_stats_elem = merged_stats_elems.setdefault(stats_elem.service_name, StatsElem(stats_elem.service_name))
+                    merged_stats_elem = merged_stats_elems.get(stats_elem.service_name)
+                    if not merged_stats_elem:
+                        merged_stats_elem = merged_stats_elems[stats_elem.service_name] = StatsElem(stats_elem.service_name)
+                        merged_stats_elem.temp_histogram = LatencyHistogram()
 
                     # Total time spent by this service and its total usage
                     merged_stats_elem.time += stats_elem.time
@@ -593,6 +599,7 @@ class GetSummaryByRange(StatsReturningService, BaseSummarizingService):
                     # Temporary data, aggregated later on
                     merged_stats_elem.temp_mean += stats_elem.mean
                     merged_stats_elem.temp_mean_count += 1
+                    merged_stats_elem.temp_histogram.merge(stats_elem.temp_histogram)
 
         if merged_stats_elems:
             mean_all_services = all_services_stats.mean / len(merged_stats_elems)
@@ -614,6 +621,7 @@ class GetSummaryByRange(StatsReturningService, BaseSummarizingService):
                     value.mean = round(value.temp_mean / value.temp_mean_count)
                     
                 self.set_percent_of_all_services(all_services_stats, value)
+                self.set_percentiles(value)
         
         if n:
             for stats_elem in self.yield_top_n(int(n), n_type, merged_stats_elems):
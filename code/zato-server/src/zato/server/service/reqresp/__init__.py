@@ -31,8 +31,9 @@ from sqlalchemy.util import KeyedTuple
 
 # Zato
 from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, SIMPLE_IO, TRACE1, ZatoException, ZATO_OK
-from zato.common.util import make_repr
-from zato.server.service.reqresp.sio import AsIs, convert_param, ForceType, ServiceInput, SIOConverter
+from zato.common.util import make_repr, payload_from_request
+from zato.server.service.reqresp.sio import compile_params, convert_sio_param, ForceType, get_sio_plan, ServiceInput, \
+     SIOConverter, SIOPlan
 
 logger = logging.getLogger(__name__)
 
@@ -63,7 +64,7 @@ class HTTPRequestData(object):
 class Request(SIOConverter):
     """ Wraps a service request and adds some useful meta-data.
     """
-    __slots__ = ('logger', 'payload', 'raw_request', 'input', 'cid', 'has_simple_io_config',
+    __slots__ = ('logger', '_payload', 'raw_request', 'stream', 'input', 'cid', 'has_simple_io_config',
                  'simple_io_config', 'bool_parameter_prefixes', 'int_parameters',
                  'int_parameter_suffixes', 'is_xml', 'data_format', 'transport',
                  '_wsgi_environ', 'channel_params', 'merge_channel_params')
@@ -72,6 +73,7 @@ class Request(SIOConverter):
         self.logger = logger
         self.payload = ''
         self.raw_request = ''
+        self.stream = None
         self.input = ServiceInput()
         self.cid = None
         self.simple_io_config = simple_io_config
@@ -88,6 +90,22 @@ class Request(SIOConverter):
         self.merge_channel_params = True
         self.params_priority = PARAMS_PRIORITY.DEFAULT
 
+    @property
+    def payload(self):
+        """ Request's payload. If the request was streamed, it is parsed out of self.stream only when accessed
+        for the first time.
+        """
+        if self._payload is None and self.stream is not None:
+            self.stream.seek(0)
+            self._payload = payload_from_request(self.cid, self.stream.read(), self.data_format, self.transport)
+            self.stream.seek(0)
+
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = value
+
     def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ):
         """ Initializes the object with an invocation-specific data.
         """
@@ -110,8 +128,17 @@ class Request(SIOConverter):
                 self.bool_parameter_prefixes = self.simple_io_config.get('bool_parameter_prefixes', [])
                 self.int_parameters = self.simple_io_config.get('int_parameters', [])
                 self.int_parameter_suffixes = self.simple_io_config.get('int_parameter_suffixes', [])
+
+                # Compiled once per SimpleIO class and reused by all requests afterwards
+                plan = get_sio_plan(sio, self.simple_io_config)
+
             else:
                 self.payload = self.raw_request
+                plan = SIOPlan(sio, {
+                    'bool_parameter_prefixes': self.bool_parameter_prefixes,
+                    'int_parameters': self.int_parameters,
+                    'int_parameter_suffixes': self.int_parameter_suffixes,
+                })
 
             required_params = {}
 
@@ -122,11 +149,11 @@ class Request(SIOConverter):
                     raise ZatoException(cid, 'Missing input')
 
                 required_params.update(self.get_params(
-                    required_list, use_channel_params_only, path_prefix, default_value, use_text))
+                    required_list, use_channel_params_only, path_prefix, default_value, use_text, True, plan.input_required))
 
             if optional_list:
                 optional_params = self.get_params(
-                    optional_list, use_channel_params_only, path_prefix, default_value, use_text, False)
+                    optional_list, use_channel_params_only, path_prefix, default_value, use_text, False, plan.input_optional)
             else:
                 optional_params = {}
 
@@ -143,22 +170,27 @@ class Request(SIOConverter):
                 self.input.update(self.channel_params)
 
     def get_params(self, params_to_visit, use_channel_params_only, path_prefix='', default_value=NO_DEFAULT_VALUE,
-            use_text=True, is_required=True):
+            use_text=True, is_required=True, sio_params=None):
         """ Gets all requested parameters from a message. Will raise ParsingException if any is missing.
+        sio_params, if given, are params_to_visit already compiled into a list of SIOParam objects.
         """
+        if sio_params is None:
+            sio_params = compile_params(params_to_visit, is_required, self.bool_parameter_prefixes, self.int_parameters,
+                self.int_parameter_suffixes, path_prefix)
+
         params = {}
+        payload = '' if use_channel_params_only else self.payload
 
-        for param in params_to_visit:
+        for sio_param in sio_params:
             try:
-                param_name, value = convert_param(
-                    self.cid, '' if use_channel_params_only else self.payload, param, self.data_format, is_required,
-                    default_value, path_prefix, use_text, self.channel_params, self.has_simple_io_config,
-                    self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes, self.params_priority)
+                param_name, value = convert_sio_param(
+                    self.cid, payload, sio_param, self.data_format, default_value, use_text, self.channel_params,
+                    self.has_simple_io_config, self.params_priority)
                 params[param_name] = value
 
             except Exception, e:
                 msg = 'Caught an exception, param:`{}`, params_to_visit:`{}`, has_simple_io_config:`{}`, e:`{}`'.format(
-                    param, params_to_visit, self.has_simple_io_config, format_exc(e))
+                    sio_param.param, params_to_visit, self.has_simple_io_config, format_exc(e))
                 self.logger.error(msg)
                 raise Exception(msg)
 
@@ -197,14 +229,12 @@ class SimpleIOPayload(SIOConverter):
     they don't conflict with user-provided data.
     """
     def __init__(self, zato_cid, logger, data_format, required_list, optional_list, simple_io_config, response_elem, namespace,
-            output_repeated):
+            output_repeated, sio_plan=None):
         self.zato_cid = zato_cid
         self.zato_logger = logger
         self.zato_data_format = data_format
         self.zato_is_xml = self.zato_data_format == SIMPLE_IO.FORMAT.XML
         self.zato_output = []
-        self.zato_required = [(True, name) for name in required_list]
-        self.zato_optional = [(False, name) for name in optional_list]
         self.zato_output_repeated = output_repeated
         self.bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', [])
         self.int_parameters = simple_io_config.get('int_parameters', [])
@@ -213,11 +243,16 @@ class SimpleIOPayload(SIOConverter):
         self.response_elem = response_elem
         self.namespace = namespace
 
-        self.zato_all_attrs = set()
-        for name in chain(required_list, optional_list):
-            if isinstance(name, ForceType):
-                name = name.name
-            self.zato_all_attrs.add(name)
+        # Output parameters are normally compiled once per SimpleIO class but we can still compile them here if need be
+        if sio_plan:
+            self.zato_output_params = sio_plan.output
+            self.zato_all_attrs = sio_plan.output_attrs
+        else:
+            self.zato_output_params = compile_params(required_list, True,
+                self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes)
+            self.zato_output_params.extend(compile_params(optional_list, False,
+                self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes))
+            self.zato_all_attrs = frozenset(sio_param.name for sio_param in self.zato_output_params)
 
         self.set_expected_attrs(required_list, optional_list)
 
@@ -270,32 +305,29 @@ class SimpleIOPayload(SIOConverter):
         self.zato_output.append(item)
         self.zato_output_repeated = True
 
-    def _getvalue(self, name, item, is_sa_namedtuple, is_required, leave_as_is):
+    def _getvalue(self, sio_param, item, is_sa_namedtuple, uses_attrs):
         """ Returns an element's value if any has been provided while taking
         into account the differences between dictionaries and other formats
         as well as the type conversions.
         """
-        lookup_name = name.name if isinstance(name, ForceType) else name
-
-        if is_sa_namedtuple or self._is_sqlalchemy(item):
-            elem_value = getattr(item, lookup_name, '')
+        if uses_attrs:
+            elem_value = getattr(item, sio_param.name, '')
         else:
-            elem_value = item.get(lookup_name, '')
+            elem_value = item.get(sio_param.name, '')
 
         if isinstance(elem_value, basestring) and not elem_value:
-            msg = self._missing_value_log_msg(name, item, is_sa_namedtuple, is_required)
-            if is_required:
+            msg = self._missing_value_log_msg(sio_param.param, item, is_sa_namedtuple, sio_param.is_required)
+            if sio_param.is_required:
                 self.zato_logger.debug(msg)
                 raise ZatoException(self.zato_cid, msg)
             else:
                 if self.zato_logger.isEnabledFor(TRACE1):
                     self.zato_logger.log(TRACE1, msg)
 
-        if leave_as_is:
+        if sio_param.is_as_is:
             return elem_value
         else:
-            return self.convert(name, lookup_name, elem_value, True, self.zato_is_xml, self.bool_parameter_prefixes,
-                self.int_parameters, self.int_parameter_suffixes, None, self.zato_data_format, True)
+            return sio_param.convert(elem_value, True, self.zato_data_format, True)
 
     def _missing_value_log_msg(self, name, item, is_sa_namedtuple, is_required):
         """ Returns a log message indicating that an element was missing.
@@ -338,12 +370,12 @@ class SimpleIOPayload(SIOConverter):
                     out_item = Element('item')
                 else:
                     out_item = {}
-                for is_required, name in chain(self.zato_required, self.zato_optional):
-                    leave_as_is = isinstance(name, AsIs)
-                    elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
 
-                    if isinstance(name, ForceType):
-                        name = name.name
+                uses_attrs = is_sa_namedtuple or self._is_sqlalchemy(item)
+
+                for sio_param in self.zato_output_params:
+                    elem_value = self._getvalue(sio_param, item, is_sa_namedtuple, uses_attrs)
+                    name = sio_param.name
 
                     if isinstance(elem_value, basestring):
                         elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
@@ -484,4 +516,4 @@ class Response(object):
 
         if required_list or optional_list:
             self._payload = SimpleIOPayload(cid, self.logger, data_format, required_list, optional_list, self.simple_io_config,
-                response_elem, namespace, output_repeated)
\ No newline at end of file
+                response_elem, namespace, output_repeated, get_sio_plan(io, self.simple_io_config))
\ No newline at end of file
@@ -12,6 +12,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging
 from copy import deepcopy
 from traceback import format_exc
+from types import ClassType
 
 # Bunch
 from bunch import Bunch
@@ -318,29 +319,106 @@ COMPLEX_VALUE = (Dict, List, ListOfDicts, Nested)
 
 # ################################################################################################################################
 
-def convert_sio(param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters, 
-                int_parameter_suffixes, date_time_format=None, data_format=ZATO_NONE, from_sio_to_external=False):
-    try:
-        if any(param_name.startswith(prefix) for prefix in bool_parameter_prefixes) or isinstance(param, Boolean):
-            value = asbool(value or None) # value can be an empty string and asbool chokes on that
+class SIOParam(object):
+    """ A single SimpleIO parameter along with everything that can be established about it up front, i.e. once per
+    SimpleIO declaration rather than once per each request or each element of a response.
+    """
+    __slots__ = ('param', 'name', 'is_required', 'is_bool', 'is_int', 'is_force_type', 'is_complex', 'is_as_is', 'xml_path')
+
+    def __init__(self, param, is_required, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, path_prefix=None):
+        self.param = param
+        self.is_force_type = isinstance(param, ForceType)
+        self.name = param.name if self.is_force_type else param
+        self.is_required = is_required
+        self.is_bool = any(self.name.startswith(prefix) for prefix in bool_parameter_prefixes) or isinstance(param, Boolean)
+        self.is_int = self.name in int_parameters or any(self.name.endswith(suffix) for suffix in int_parameter_suffixes)
+        self.is_complex = isinstance(param, COMPLEX_VALUE)
+        self.is_as_is = isinstance(param, AsIs)
+        self.xml_path = path('{}.{}'.format(path_prefix, self.name), is_required) if path_prefix is not None else None
 
-        if value is not None:
-            if isinstance(param, ForceType):
-                value = param.convert(value, param_name, data_format, from_sio_to_external)
-            else:
-                if value and value != ZATO_NONE and has_simple_io_config:
-                    if any(param_name==elem for elem in int_parameters) or \
-                       any(param_name.endswith(suffix) for suffix in int_parameter_suffixes):
+    def __repr__(self):
+        return '<{} at {} name:[{}]>'.format(self.__class__.__name__, hex(id(self)), self.name)
+
+    def convert(self, value, has_simple_io_config, data_format=ZATO_NONE, from_sio_to_external=False):
+        """ Converts a value to the parameter's data type.
+        """
+        try:
+            if self.is_bool:
+                value = asbool(value or None) # value can be an empty string and asbool chokes on that
+
+            if value is not None:
+                if self.is_force_type:
+                    value = self.param.convert(value, self.name, data_format, from_sio_to_external)
+                else:
+                    if self.is_int and value and value != ZATO_NONE and has_simple_io_config:
                         value = int(value)
 
-        return value
+            return value
+
+        except Exception, e:
+            msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
+                self.param, self.name, repr(value), type(value), format_exc(e))
+            logger.error(msg)
 
-    except Exception, e:
-        msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
-            param, param_name, repr(value), type(value), format_exc(e))
-        logger.error(msg)
+            raise ZatoException(msg=msg)
 
-        raise ZatoException(msg=msg)
+def compile_params(params, is_required, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, path_prefix=None):
+    """ Turns a list of SimpleIO parameters into a list of SIOParam objects.
+    """
+    return [SIOParam(param, is_required, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, path_prefix)
+        for param in params]
+
+# ################################################################################################################################
+
+class SIOPlan(object):
+    """ A SimpleIO declaration compiled, using a given SimpleIO config, into flat lists of input and output parameters
+    whose conversions are known in advance.
+    """
+    def __init__(self, sio, simple_io_config):
+        self.simple_io_config = simple_io_config
+
+        bool_parameter_prefixes = simple_io_config.get('bool_parameter_prefixes', [])
+        int_parameters = simple_io_config.get('int_parameters', [])
+        int_parameter_suffixes = simple_io_config.get('int_parameter_suffixes', [])
+
+        path_prefix = getattr(sio, 'request_elem', 'request')
+
+        self.input_required = compile_params(getattr(sio, 'input_required', []), True,
+            bool_parameter_prefixes, int_parameters, int_parameter_suffixes, path_prefix)
+
+        self.input_optional = compile_params(getattr(sio, 'input_optional', []), False,
+            bool_parameter_prefixes, int_parameters, int_parameter_suffixes, path_prefix)
+
+        self.output = compile_params(getattr(sio, 'output_required', []), True,
+            bool_parameter_prefixes, int_parameters, int_parameter_suffixes)
+
+        self.output.extend(compile_params(getattr(sio, 'output_optional', []), False,
+            bool_parameter_prefixes, int_parameters, int_parameter_suffixes))
+
+        self.output_attrs = frozenset(sio_param.name for sio_param in self.output)
+
+def get_sio_plan(sio, simple_io_config):
+    """ Returns a plan for a SimpleIO declaration, compiling it first if needed. Plans of SimpleIO classes are stored
+    in the classes themselves so each is compiled only once per worker, as long as its SimpleIO config stays the same.
+    """
+    is_class = isinstance(sio, (type, ClassType))
+
+    # Look it up in the class' own __dict__ so that subclasses of another SimpleIO class are not given its plan
+    plan = sio.__dict__.get('zato_sio_plan') if is_class else None
+
+    if not plan or plan.simple_io_config is not simple_io_config:
+        plan = SIOPlan(sio, simple_io_config)
+        if is_class:
+            sio.zato_sio_plan = plan
+
+    return plan
+
+# ################################################################################################################################
+
+def convert_sio(param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters, 
+                int_parameter_suffixes, date_time_format=None, data_format=ZATO_NONE, from_sio_to_external=False):
+    sio_param = SIOParam(param, False, bool_parameter_prefixes, int_parameters, int_parameter_suffixes)
+    return sio_param.convert(value, has_simple_io_config, data_format, from_sio_to_external)
 
 # ################################################################################################################################
 
@@ -357,9 +435,9 @@ def convert_from_json(payload, param_name, cid, *ignored):
 
 convert_from_dict = convert_from_json
 
-def convert_from_xml(payload, param_name, cid, is_required, is_complex, default_value, path_prefix, use_text):
+def _value_from_xml(payload, xml_path, cid, is_complex, default_value, use_text):
     try:
-        elem = path('{}.{}'.format(path_prefix, param_name), is_required).get_from(payload)
+        elem = xml_path.get_from(payload)
     except ParsingException, e:
         msg = 'Caught an exception while parsing, payload:[<![CDATA[{}]]>], e:[{}]'.format(
             etree.tostring(payload), format_exc(e))
@@ -378,6 +456,10 @@ def convert_from_xml(payload, param_name, cid, is_required, is_complex, default_
 
     return value
 
+def convert_from_xml(payload, param_name, cid, is_required, is_complex, default_value, path_prefix, use_text):
+    return _value_from_xml(
+        payload, path('{}.{}'.format(path_prefix, param_name), is_required), cid, is_complex, default_value, use_text)
+
 convert_impl = {
     DATA_FORMAT.JSON: convert_from_json,
     DATA_FORMAT.XML: convert_from_xml,
@@ -390,7 +472,15 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
                   params_priority):
     """ Converts request parameters from any data format supported into Python objects.
     """
-    param_name = param.name if isinstance(param, ForceType) else param
+    sio_param = SIOParam(param, is_required, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, path_prefix)
+    return convert_sio_param(
+        cid, payload, sio_param, data_format, default_value, use_text, channel_params, has_simple_io_config, params_priority)
+
+def convert_sio_param(cid, payload, sio_param, data_format, default_value, use_text, channel_params, has_simple_io_config,
+                      params_priority):
+    """ Same as convert_param but uses a parameter already compiled into an SIOParam.
+    """
+    param_name = sio_param.name
 
     # First thing is to find out if we have parameters in channel_params. If so and they have priority
     # over payload, we don't look further. If they don't have priority, whether the value from channel_params
@@ -401,8 +491,7 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
 
     # Convert it to a native Python data type
     if channel_value != ZATO_NONE:
-        channel_value = convert_sio(param, param_name, channel_value, has_simple_io_config, False, bool_parameter_prefixes,
-                    int_parameters, int_parameter_suffixes, None, data_format, False)
+        channel_value = sio_param.convert(channel_value, has_simple_io_config, data_format, False)
 
     # Return the value immediately if we already know channel_params are of higer priority
     if params_priority == PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG and channel_value != ZATO_NONE:
@@ -411,8 +500,10 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
     # Ok, at that point we either don't have anything in channel_params or they don't have priority over payload.
 
     if payload is not None:
-        value = convert_impl[data_format](payload, param_name, cid, is_required, isinstance(param, COMPLEX_VALUE), 
-                                          default_value, path_prefix, use_text)
+        if data_format == DATA_FORMAT.XML:
+            value = _value_from_xml(payload, sio_param.xml_path, cid, sio_param.is_complex, default_value, use_text)
+        else:
+            value = convert_impl[data_format](payload, param_name, cid)
     else:
         value = NOT_GIVEN
 
@@ -420,7 +511,7 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
         if default_value != NO_DEFAULT_VALUE:
             value = default_value
         else:
-            if is_required:
+            if sio_param.is_required:
 
                 # Ok, we don't have anything in payload but it still may be in channel_params.
                 # We arrive here if params priority is not params over msg.
@@ -428,18 +519,17 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
 
                 if value == ZATO_NONE:
                     msg = 'Required input element:`{}` not found, value:`{}`, data_format:`{}`, payload:`{}`'\
-                        ', channel_params:`{}`'.format(param, value, data_format, payload, channel_params)
+                        ', channel_params:`{}`'.format(sio_param.param, value, data_format, payload, channel_params)
                     raise ParsingException(cid, msg)
             else:
                 # Not required and not provided on input either in msg or channel params
                 value = ''
 
     else:
-        if value is not None and not isinstance(param, COMPLEX_VALUE):
+        if value is not None and not sio_param.is_complex:
             value = unicode(value)
 
-        if not isinstance(param, AsIs):
-            return param_name, convert_sio(param, param_name, value, has_simple_io_config, data_format==DATA_FORMAT.XML,
-                bool_parameter_prefixes, int_parameters, int_parameter_suffixes, None, data_format, False)
+        if not sio_param.is_as_is:
+            return param_name, sio_param.convert(value, has_simple_io_config, data_format, False)
 
     return param_name, value
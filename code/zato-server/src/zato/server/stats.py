@@ -10,15 +10,306 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from math import ceil
+from threading import Lock
+from traceback import format_exc
 
 # dateutil
 from dateutil.rrule import MINUTELY, rrule
 
+# gevent
+from gevent import sleep, spawn
+
 # Zato
 from zato.common import KVDB
 
 logger = logging.getLogger(__name__)
-                
+
+# All statistics keys start with it so there is no need to repeat it in names of index keys
+_stats_key_prefix = 'zato:stats:service:'
+
+# ################################################################################################################################
+
+def get_index_key(key_prefix, key_suffix=''):
+    """ Returns name of a set holding names of all statistics keys of a given prefix and time slice.
+    """
+    return '{}{}{}'.format(KVDB.SERVICE_STATS_INDEX, key_prefix.replace(_stats_key_prefix, '', 1), key_suffix)
+
+def add_to_index(conn, key_prefix, key_suffix, key, expire=None):
+    """ Adds a statistics key to the index of its time slice and to the one of the slice directly above it, e.g. a key
+    for 2016:01:02:03:04 is added to both 2016:01:02:03:04 and 2016:01:02:03. conn may be a pipeline.
+    """
+    index_keys = [get_index_key(key_prefix, key_suffix)]
+    if ':' in key_suffix:
+        index_keys.append(get_index_key(key_prefix, key_suffix.rsplit(':', 1)[0]))
+
+    for index_key in index_keys:
+        conn.sadd(index_key, key)
+        if expire:
+            conn.expire(index_key, expire)
+
+def get_indexed_keys(conn, key_prefix, key_suffix=''):
+    """ Returns names of all statistics keys of a given prefix that belong to a given time slice or any slice below it.
+    Note that some of the keys may have already expired.
+    """
+    return conn.smembers(get_index_key(key_prefix, key_suffix))
+
+def scan_keys(conn, pattern):
+    """ Uses SCAN to iterate over all keys matching a pattern, to be used only if there is no index to consult.
+    Unlike KEYS, it does not block the KVDB for the duration of the whole iteration.
+    """
+    return conn.scan_iter(pattern)
+
+# Prefixes of keys kept in indexes -> how many colon-separated parts their time slice suffixes consist of
+_indexed_prefixes = {
+    KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE: 5,
+    KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR: 4,
+    KVDB.SERVICE_TIME_AGGREGATED_BY_DAY: 3,
+    KVDB.SERVICE_TIME_AGGREGATED_BY_MONTH: 2,
+    KVDB.SERVICE_SUMMARY_BY_DAY: 3,
+    KVDB.SERVICE_SUMMARY_BY_WEEK: 3,
+    KVDB.SERVICE_SUMMARY_BY_MONTH: 2,
+    KVDB.SERVICE_SUMMARY_BY_YEAR: 1,
+}
+
+def build_indexes(conn, expire=None):
+    """ Adds to indexes aggregated and summary keys stored by servers from before the indexes were introduced, without it
+    they would not be found by anything that looks keys up by time slices. It needs to be done once only so a flag
+    is set in the KVDB afterwards.
+    """
+    if conn.exists(KVDB.SERVICE_STATS_INDEX_BUILT):
+        return
+
+    for key_prefix, suffix_parts in sorted(_indexed_prefixes.iteritems()):
+        with conn.pipeline() as pipe:
+            for key in scan_keys(conn, key_prefix + '*'):
+                key_suffix = ':'.join(key.rsplit(':', suffix_parts)[1:])
+                add_to_index(pipe, key_prefix, key_suffix, key, expire)
+            pipe.execute()
+
+    conn.set(KVDB.SERVICE_STATS_INDEX_BUILT, 1)
+
+# ################################################################################################################################
+
+# Values below that many milliseconds have buckets of their own
+_linear_max = 16
+
+# Each power of two above _linear_max is split into that many buckets
+_sub_bucket_bits = 3
+_sub_buckets = 1 << _sub_bucket_bits
+
+# Sets exact minimum and maximum processing times in a histogram's hash, HINCRBY cannot do it on its own
+_lua_min_max = """
+local min = redis.call('hget', KEYS[1], 'min')
+if not min or tonumber(ARGV[1]) < tonumber(min) then
+    redis.call('hset', KEYS[1], 'min', ARGV[1])
+end
+
+local max = redis.call('hget', KEYS[1], 'max')
+if not max or tonumber(ARGV[2]) > tonumber(max) then
+    redis.call('hset', KEYS[1], 'max', ARGV[2])
+end
+"""
+
+class LatencyHistogram(object):
+    """ A histogram of processing times, in milliseconds. Values below 16 ms are counted exactly while each power of two
+    above that is split into 8 buckets of equal width, which means there are never more than a few hundred buckets
+    and any percentile reported is never off by more than 12.5%. Minimum and maximum values are tracked exactly.
+
+    Histograms are stored in the KVDB as hash fields, one per non-empty bucket, and merging them, be it across workers
+    or from minutes into hours, days and months, is only a matter of adding up counts of matching buckets.
+    """
+    field_prefix = 'h:'
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0 # None if not known, e.g. for histograms read from keys that do not store it
+
+        # Exact extremes, None if not known in which case they are approximated by bucket bounds
+        self.min_value = None
+        self.max_value = None
+
+    def __repr__(self):
+        return '<{} at {} count:[{}], p50:[{}], p99:[{}]>'.format(
+            self.__class__.__name__, hex(id(self)), self.count, self.percentile(50), self.percentile(99))
+
+    @staticmethod
+    def get_bucket(value):
+        value = max(int(value), 0)
+        if value < _linear_max:
+            return value
+
+        shift = value.bit_length() - _sub_bucket_bits - 1
+        return (shift * _sub_buckets) + (value >> shift)
+
+    @staticmethod
+    def get_bucket_bounds(bucket):
+        """ Returns the lowest and highest value a given bucket may contain.
+        """
+        if bucket < _linear_max:
+            return bucket, bucket
+
+        shift = bucket // _sub_buckets - 1
+        base = bucket % _sub_buckets + _sub_buckets
+        return base << shift, ((base + 1) << shift) - 1
+
+    def _merge_extremes(self, min_value, max_value):
+        """ Updates exact extremes with ones of values about to be added, which must be done before self.count changes.
+        """
+        if not self.count:
+            self.min_value, self.max_value = min_value, max_value
+        else:
+            self.min_value = None if (self.min_value is None or min_value is None) else min(self.min_value, min_value)
+            self.max_value = None if (self.max_value is None or max_value is None) else max(self.max_value, max_value)
+
+    def add(self, value, count=1):
+        self._merge_extremes(value, value)
+        bucket = self.get_bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += count
+        if self.sum is not None:
+            self.sum += value * count
+
+    def merge(self, other):
+        if other.count:
+            self._merge_extremes(other.min_value, other.max_value)
+
+        for bucket, count in other.buckets.iteritems():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.sum = None if (self.sum is None or other.sum is None) else self.sum + other.sum
+
+    def percentile(self, percentile):
+        """ Returns the highest value of the bucket the given percentile of all values falls into.
+        """
+        if not self.count:
+            return 0
+
+        rank = max(int(ceil(percentile / 100.0 * self.count)), 1)
+        seen = 0
+
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return self.get_bucket_bounds(bucket)[1]
+
+    def min(self):
+        if not self.count:
+            return 0
+        return self.min_value if self.min_value is not None else self.get_bucket_bounds(min(self.buckets))[0]
+
+    def max(self):
+        if not self.count:
+            return 0
+        return self.max_value if self.max_value is not None else self.get_bucket_bounds(max(self.buckets))[1]
+
+    def mean(self, upper_percentile=None):
+        """ Returns a mean of all values or, if upper_percentile is given, of values up to that percentile only.
+        The mean is exact if the sum of values is known and no upper percentile is given.
+        """
+        if not self.count:
+            return 0
+
+        if not upper_percentile or upper_percentile >= 100:
+            if self.sum is not None:
+                return self.sum / self.count
+            limit = None
+        else:
+            limit = self.percentile(upper_percentile)
+
+        total = 0
+        count = 0
+
+        for bucket in sorted(self.buckets):
+            low, high = self.get_bucket_bounds(bucket)
+            if limit is not None and low > limit:
+                break
+            total += self.buckets[bucket] * (low + high) / 2.0
+            count += self.buckets[bucket]
+
+        return total / count
+
+    def to_kvdb(self):
+        """ Returns a dictionary of hash fields representing the histogram in the KVDB.
+        """
+        return {'{}{}'.format(self.field_prefix, bucket): count for bucket, count in self.buckets.iteritems()}
+
+    @staticmethod
+    def from_kvdb(data):
+        """ Creates a histogram out of hash fields read from the KVDB, other fields, apart from optional sum, min and max,
+        are ignored.
+        """
+        hist = LatencyHistogram()
+        hist.sum = int(float(data['sum'])) if 'sum' in data else None
+
+        for name, count in data.iteritems():
+            if name.startswith(LatencyHistogram.field_prefix):
+                count = int(float(count))
+                hist.buckets[int(name[len(LatencyHistogram.field_prefix):])] = count
+                hist.count += count
+
+        # Keys aggregated before histograms were introduced have min and max but no buckets to go with them
+        if hist.count:
+            hist.min_value = int(float(data['min'])) if 'min' in data else None
+            hist.max_value = int(float(data['max'])) if 'max' in data else None
+
+        return hist
+
+# ################################################################################################################################
+
+def incr_hist(pipe, key, hist):
+    """ Adds a histogram to the one already stored under a given key, if any.
+    """
+    for field, count in sorted(hist.to_kvdb().iteritems()):
+        pipe.hincrby(key, field, count)
+    pipe.hincrby(key, 'sum', hist.sum)
+    if hist.min_value is not None and hist.max_value is not None:
+        pipe.eval(_lua_min_max, 1, key, hist.min_value, hist.max_value)
+
+def convert_raw_times(conn):
+    """ Turns lists of raw processing times, as stored by servers before histograms were introduced, into histograms.
+    It needs to be done once only so a flag is set in the KVDB afterwards.
+    """
+    if conn.exists(KVDB.SERVICE_TIME_RAW_CONVERTED):
+        return
+
+    for key in scan_keys(conn, KVDB.SERVICE_TIME_RAW + '*'):
+        hist_key = key.replace(KVDB.SERVICE_TIME_RAW, KVDB.SERVICE_TIME_HIST, 1)
+        _convert_raw_times(conn, key, hist_key, KVDB.SERVICE_TIME_HIST, '')
+
+    for key in scan_keys(conn, KVDB.SERVICE_TIME_RAW_BY_MINUTE + '*'):
+        hist_key = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, KVDB.SERVICE_TIME_HIST_BY_MINUTE, 1)
+        minute = ':'.join(key.rsplit(':', 5)[1:])
+        _convert_raw_times(conn, key, hist_key, KVDB.SERVICE_TIME_HIST_BY_MINUTE, minute, 300)
+
+    conn.delete(get_index_key(KVDB.SERVICE_TIME_RAW))
+    conn.set(KVDB.SERVICE_TIME_RAW_CONVERTED, 1)
+
+def _convert_raw_times(conn, key, hist_key, index_prefix, index_suffix, expire=None):
+
+    # Reading and deleting a list in one transaction guarantees no other server will convert the same times
+    with conn.pipeline() as pipe:
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        times = pipe.execute()[0]
+
+    if not times:
+        return
+
+    hist = LatencyHistogram()
+    for value in times:
+        hist.add(int(float(value)))
+
+    with conn.pipeline() as pipe:
+        incr_hist(pipe, hist_key, hist)
+        add_to_index(pipe, index_prefix, index_suffix, hist_key, expire)
+        if expire:
+            pipe.expire(hist_key, expire)
+        pipe.execute()
+
+# ################################################################################################################################
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
@@ -27,9 +318,151 @@ class MaintenanceTool(object):
         
     def delete(self, start, stop, interval):
         with self.conn.pipeline() as p:
-            suffixes = (elem.strftime(':%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop))
+            suffixes = (elem.strftime('%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop))
             for suffix in suffixes:
-                for key in self.conn.keys('{}*{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix)):
+                for key in get_indexed_keys(self.conn, KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix):
                     p.delete(key)
+                p.delete(get_index_key(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix))
                     
             p.execute()
+
+# ################################################################################################################################
+
+class ServiceStatsAccumulator(object):
+    """ Collects usage counters and processing times of services invoked in the current worker and periodically flushes
+    them to the KVDB in one pipeline, rather than having each invocation of each service talk to Redis on its own.
+
+    Processing times are stored as histograms, per service and per minute, which aggregating services
+    from zato.server.service.internal.stats turn into per-minute statistics and all-time ones.
+    """
+    def __init__(self, kvdb, flush_interval=5):
+        self.kvdb = kvdb
+        self.flush_interval = flush_interval # In seconds, must be well under 60 for by-minute keys to be aggregated
+        self.update_lock = Lock()
+        self.keep_running = False
+        self.flush_greenlet = None
+
+        # Service name -> how many times it was invoked since last flush
+        self.usage = {}
+
+        # Service name -> total usage across all the servers as of last flush
+        self.usage_total = {}
+
+        # Service name -> last processing time
+        self.last = {}
+
+        # (Service name, minute) -> LatencyHistogram of processing times within that minute
+        self.times = {}
+
+    def get_usage(self, name):
+        """ Increments and returns a service's usage counter. The value returned is the cluster-wide usage as it was
+        during the most recent flush plus how many times the service has been invoked in this worker since then.
+        """
+        with self.update_lock:
+            usage = self.usage[name] = self.usage.get(name, 0) + 1
+            return self.usage_total.get(name, 0) + usage
+
+    def add_time(self, name, minute, processing_time):
+        """ Stores a processing time of a service, minute is a '%Y:%m:%d:%H:%M' string it was measured in.
+        """
+        with self.update_lock:
+            self.last[name] = processing_time
+
+            hist = self.times.get((name, minute))
+            if hist is None:
+                hist = self.times[(name, minute)] = LatencyHistogram()
+
+            hist.add(processing_time)
+
+    def flush(self):
+        """ Writes to the KVDB everything collected since last flush.
+        """
+        with self.update_lock:
+            if not (self.usage or self.times):
+                return
+
+            usage, self.usage = self.usage, {}
+            last, self.last = self.last, {}
+            times, self.times = self.times, {}
+
+        try:
+            with self.kvdb.conn.pipeline() as pipe:
+
+                for name, value in usage.iteritems():
+                    pipe.incrby('{}{}'.format(KVDB.SERVICE_USAGE, name), value)
+
+                for name, value in last.iteritems():
+                    pipe.hset('{}{}'.format(KVDB.SERVICE_TIME_BASIC, name), 'last', value)
+
+                # Times since the most recent run of ProcessRawTimes, regardless of the minute they were measured in
+                all_time = {}
+
+                for (name, minute), hist in sorted(times.iteritems()):
+
+                    key = '{}{}:{}'.format(KVDB.SERVICE_TIME_HIST_BY_MINUTE, name, minute)
+                    incr_hist(pipe, key, hist)
+                    add_to_index(pipe, KVDB.SERVICE_TIME_HIST_BY_MINUTE, minute, key, 300)
+
+                    # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
+                    # to aggregate processing times for a given minute and then it will expire
+
+                    # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
+                    pipe.expire(key, 300)
+
+                    all_time.setdefault(name, LatencyHistogram()).merge(hist)
+
+                for name, hist in sorted(all_time.iteritems()):
+                    key = '{}{}'.format(KVDB.SERVICE_TIME_HIST, name)
+                    incr_hist(pipe, key, hist)
+                    add_to_index(pipe, KVDB.SERVICE_TIME_HIST, '', key)
+
+                result = pipe.execute()
+
+        except Exception, e:
+            logger.warn('Could not flush service statistics, will retry during next flush, e:`%s`', format_exc(e))
+            self._restore(usage, last, times)
+
+        else:
+            # INCRBY replies come first and are in the same order usage was iterated over
+            with self.update_lock:
+                for name, total in zip(usage, result):
+                    self.usage_total[name] = total
+
+    def _restore(self, usage, last, times):
+        """ Merges statistics that could not be flushed back into the ones collected since then.
+        """
+        with self.update_lock:
+            for name, value in usage.iteritems():
+                self.usage[name] = self.usage.get(name, 0) + value
+
+            # Processing times measured since the failed flush are more recent
+            for name, value in last.iteritems():
+                self.last.setdefault(name, value)
+
+            for key, hist in times.iteritems():
+                current = self.times.get(key)
+                if current is not None:
+                    hist.merge(current)
+                self.times[key] = hist
+
+    def _flush_loop(self):
+        while self.keep_running:
+            sleep(self.flush_interval)
+            self.flush()
+
+    def start(self):
+        """ Starts a background greenlet flushing statistics every self.flush_interval seconds.
+        """
+        self.keep_running = True
+        self.flush_greenlet = spawn(self._flush_loop)
+
+    def stop(self):
+        """ Stops the background greenlet and flushes whatever has not been flushed yet.
+        """
+        self.keep_running = False
+        if self.flush_greenlet:
+            self.flush_greenlet.kill(block=False)
+            self.flush_greenlet = None
+        self.flush()
+
+# ################################################################################################################################
@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import httplib
 from ast import literal_eval
+from calendar import timegm
 from cStringIO import StringIO
 from datetime import datetime
 from json import loads
@@ -33,9 +34,11 @@ from tzlocal import get_localzone
 
 # Zato
 from zato.common import ACCESS_LOG_DT_FORMAT, CHANNEL, DATA_FORMAT, ZATO_NONE
-from zato.common.broker_message import CHANNEL as CHANNEL_BROKER_MESSAGE, SERVICE
+from zato.common.broker_message import SERVICE
 from zato.common.test import rand_int, rand_string
 from zato.common.util import new_cid, utcnow
+from zato.server.connection.http_soap.access_log import AccessLog
+from zato.server.connection.http_soap.audit import AuditWriter
 from zato.server.connection.http_soap.channel import RequestDispatcher
 from zato.server.connection.http_soap.url_data import URLData
 from zato.server.base.parallel import ParallelServer
@@ -55,6 +58,17 @@ class FakeWorkerStore(object):
     def __init__(self, request_dispatcher=None):
         self.request_dispatcher = request_dispatcher or FakeRequestDispatcher()
 
+class FakeAccessLogger(object):
+    def __init__(self, is_enabled=True):
+        self.is_enabled = is_enabled
+        self.messages = []
+
+    def info(self, msg):
+        self.messages.append(msg)
+
+    def isEnabledFor(self, ignored):
+        return self.is_enabled
+
 class FakeGunicornSocket(object):
     def __init__(self, expected_cert_der, expected_cert_dict):
         self.expected_cert_der = expected_cert_der
@@ -182,22 +196,6 @@ class AuditTestCase(TestCase):
                         expected_remote_addr_header = 'REMOTE_ADDR'
                         wsgi_environ[expected_remote_addr_header] = expected_remote_addr
 
-                    class FakeSession:
-                        def __init__(self, audit=None):
-                            self.audit = audit
-                            self.commit_called = False
-
-                        def close(self):
-                            pass
-
-                        def commit(self):
-                            self.commit_called = True
-
-                        def add(self, audit):
-                            self.audit = audit
-
-                    fake_session = FakeSession()
-
                     class FakeBrokerClient(object):
                         def __init__(self):
                             self.msg = None
@@ -207,15 +205,18 @@ class AuditTestCase(TestCase):
 
                     class FakeODB(ODBManager):
                         def __init__(self):
-                            self.msg = None
+                            self.batches = []
                             self.cluster = Bunch(id=expected_cluster_id)
 
-                        def session(self):
-                            return fake_session
+                        def audit_set_http_soap_batch(self, requests, responses):
+                            self.batches.append((requests, responses))
+
+                    odb = FakeODB()
 
                     class FakeURLData(URLData):
                         def __init__(self):
                             self.url_sec = {expected_match_target: Bunch(sec_def=ZATO_NONE)}
+                            self.audit_writer = AuditWriter(odb)
 
                         def match(self, *ignored_args, **ignored_kwargs):
                             return True, channel_item
@@ -230,35 +231,43 @@ class AuditTestCase(TestCase):
                     ws.request_dispatcher.request_handler = FakeRequestHandler()
                     ws.request_dispatcher.url_data = FakeURLData()
                     ws.request_dispatcher.url_data.broker_client = bc
-                    ws.request_dispatcher.url_data.odb = FakeODB()
+                    ws.request_dispatcher.url_data.odb = odb
 
                     ps = ParallelServer()
                     ps.worker_store = ws
+                    ps.access_log = AccessLog(FakeAccessLogger(False))
                     ps.on_wsgi_request(wsgi_environ, StartResponse(), cid=expected_cid)
 
+                    # Writes out everything enqueued
+                    ws.request_dispatcher.url_data.audit_writer.stop()
+
                     if expected_audit_enabled:
 
+                        # Both request and response were enqueued in the same batch so they are stored as a single row
+                        eq_(len(odb.batches), 1)
+                        requests, responses = odb.batches[0]
+
+                        eq_(len(requests), 1)
+                        eq_(responses, [])
+
+                        audit = Bunch(requests[0])
+
                         #
                         # Audit 1/2 - Request
                         #
 
                         # Parsing will confirm the proper value was used
-                        datetime.strptime(fake_session.audit.req_time.isoformat(), '%Y-%m-%dT%H:%M:%S.%f')
-
-                        self.assertEquals(fake_session.audit.name, expected_name)
-                        self.assertEquals(fake_session.audit.cid, expected_cid)
-                        self.assertEquals(fake_session.audit.transport, expected_transport)
-                        self.assertEquals(fake_session.audit.connection, expected_connection)
-                        self.assertEquals(fake_session.audit.resp_time, None)
-                        self.assertEquals(fake_session.audit.user_token, expected_username)
-                        self.assertEquals(fake_session.audit.auth_ok, None)
-                        self.assertEquals(fake_session.audit.invoke_ok, None)
-                        self.assertEquals(fake_session.audit.remote_addr, expected_remote_addr)
-                        self.assertEquals(fake_session.audit.req_payload, expected_request[:expected_audit_max_payload])
-                        self.assertEquals(fake_session.audit.resp_headers, None)
-                        self.assertEquals(fake_session.audit.resp_payload, None)
-
-                        req_headers = literal_eval(fake_session.audit.req_headers)
+                        datetime.strptime(audit.req_time.isoformat(), '%Y-%m-%dT%H:%M:%S.%f')
+
+                        self.assertEquals(audit.name, expected_name)
+                        self.assertEquals(audit.cid, expected_cid)
+                        self.assertEquals(audit.transport, expected_transport)
+                        self.assertEquals(audit.connection, expected_connection)
+                        self.assertEquals(audit.user_token, expected_username)
+                        self.assertEquals(audit.remote_addr, expected_remote_addr)
+                        self.assertEquals(audit.req_payload, expected_request[:expected_audit_max_payload])
+
+                        req_headers = literal_eval(audit.req_headers)
 
                         self.assertEquals(req_headers[expected_remote_addr_header], repr(expected_remote_addr))
                         self.assertEquals(req_headers['wsgi.url_scheme'], repr(expected_url_scheme))
@@ -283,21 +292,14 @@ class AuditTestCase(TestCase):
                         # Audit 2/2 - Response
                         #
 
-                        self.assertEquals(bc.msg['action'], CHANNEL_BROKER_MESSAGE.HTTP_SOAP_AUDIT_RESPONSE.value)
-                        self.assertEquals(bc.msg['cid'], expected_cid)
-                        self.assertEquals(bc.msg['data_format'], DATA_FORMAT.JSON)
-                        self.assertEquals(bc.msg['service'], 'zato.http-soap.set-audit-response-data')
-
-                        payload = loads(bc.msg['payload'])
-
-                        self.assertEquals(payload['auth_ok'], expected_auth_ok)
-                        self.assertEquals(payload['invoke_ok'], expected_invoke_ok)
-                        self.assertEquals(payload['resp_payload'], expected_payload)
+                        self.assertEquals(audit.auth_ok, expected_auth_ok)
+                        self.assertEquals(audit.invoke_ok, expected_invoke_ok)
+                        self.assertEquals(audit.resp_payload, expected_payload)
 
-                        # Parsing alone will check its format is valid
-                        datetime.strptime(payload['resp_time'], '%Y-%m-%dT%H:%M:%S.%f')
+                        # Parsing will confirm the proper value was used
+                        datetime.strptime(audit.resp_time.isoformat(), '%Y-%m-%dT%H:%M:%S.%f')
 
-                        wsgi_environ = loads(payload['resp_headers'])
+                        wsgi_environ = loads(audit.resp_headers)
 
                         self.assertEquals(wsgi_environ['wsgi.url_scheme'], repr(expected_url_scheme))
                         self.assertEquals(wsgi_environ['gunicorn.socket'], repr(FakeGunicornSocket(None, None)))
@@ -323,8 +325,8 @@ class AuditTestCase(TestCase):
                         self.assertEquals(channel_item['audit_max_payload'], expected_audit_max_payload)
                         self.assertEquals(channel_item['is_active'], expected_is_active)
                     else:
-                        # Audit not enabled so no response audit message was published on the broker
-                        self.assertTrue(bc.msg is None)
+                        # Audit not enabled so nothing was stored
+                        eq_(odb.batches, [])
 
 # ################################################################################################################################
 
@@ -334,6 +336,9 @@ class HTTPAccessLogTestCase(TestCase):
         def _utcnow(self):
             return datetime(year=2014, month=1, day=12, hour=16, minute=22, second=12, tzinfo=UTC)
 
+        def _time():
+            return timegm(_utcnow(None).utctimetuple())
+
         local_tz = get_localzone()
         _now = _utcnow(None)
 
@@ -404,16 +409,6 @@ class HTTPAccessLogTestCase(TestCase):
                 def handle(self, *ignored_args, **ignored_kwargs):
                     return Bunch(payload=response, content_type='text/plain', headers={}, status_code=httplib.OK)
 
-            class FakeAccessLogger(object):
-                def __init__(self):
-                    self.extra = {}
-
-                def info(self, msg, extra):
-                    self.extra = extra
-
-                def isEnabledFor(self, ignored):
-                    return True
-
             bc = FakeBrokerClient()
             ws = FakeWorkerStore()
             ws.request_dispatcher = RequestDispatcher()
@@ -424,10 +419,18 @@ class HTTPAccessLogTestCase(TestCase):
 
             ps = ParallelServer()
             ps.worker_store = ws
-            ps.access_logger = FakeAccessLogger()
-            ps.on_wsgi_request(wsgi_environ, StartResponse(), cid=cid)
+            ps.access_log = AccessLog(FakeAccessLogger(), 'json')
+
+            with patch('time.time', _time):
+                ps.on_wsgi_request(wsgi_environ, StartResponse(), cid=cid)
 
-            extra = Bunch(ps.access_logger.extra)
+            # Nothing is logged until the access log is flushed
+            eq_(ps.access_log.access_logger.messages, [])
+
+            ps.access_log.flush()
+            eq_(len(ps.access_log.access_logger.messages), 1)
+
+            extra = Bunch(loads(ps.access_log.access_logger.messages[0]))
 
             eq_(extra.channel_name, channel_name)
             eq_(extra.user_agent, user_agent)
@@ -435,10 +438,15 @@ class HTTPAccessLogTestCase(TestCase):
             eq_(extra.http_version, http_version)
             eq_(extra.response_size, len(response))
             eq_(extra.path, url_path)
-            eq_(extra.cid_resp_time, '{}/0.0'.format(cid)) # It's 0.0 because we mock utcnow to be a constant value
+            eq_(extra.cid, cid)
+            eq_(extra.resp_time, 0.0) # It's 0.0 because we mock time to be a constant value
             eq_(extra.method, request_method)
             eq_(extra.remote_ip, remote_ip)
             eq_(extra.req_timestamp_utc, '12/Jan/2014:16:22:12 +0000')
             eq_(extra.req_timestamp, request_timestamp)
 
+            # Still available to services
+            eq_(wsgi_environ['zato.local_tz'], local_tz)
+            eq_(wsgi_environ['zato.request_timestamp'].strftime(ACCESS_LOG_DT_FORMAT), request_timestamp)
+
 # ################################################################################################################################
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import AMQP
+from zato.common.broker_message import CHANNEL
+from zato.server.connection.amqp.channel import ConsumingConnection, ConsumingConnector
+
+# ################################################################################################################################
+
+class FakeConn(object):
+    def __init__(self):
+        self.timeouts = []
+
+    def add_timeout(self, deadline, callback):
+        self.timeouts.append((deadline, callback))
+
+class FakeChannel(object):
+    def __init__(self):
+        self.acked = []
+        self.rejected = []
+        self.qos = None
+
+    def basic_qos(self, callback, prefetch_count):
+        self.qos = prefetch_count
+        callback()
+
+    def basic_consume(self, callback, queue, consumer_tag):
+        pass
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_reject(self, delivery_tag, requeue):
+        self.rejected.append((delivery_tag, requeue))
+
+def _get_consumer(**kwargs):
+    batches = []
+    consumer = ConsumingConnection(Bunch(host='localhost', port=5672, virtual_host='/'), 'my.channel', 'my.queue', 'zato',
+        lambda consumer_tag, messages: batches.append((consumer_tag, messages)), **kwargs)
+
+    consumer.conn = FakeConn()
+    consumer._on_channel_open(FakeChannel())
+
+    return consumer, batches
+
+def _deliver(consumer, *delivery_tags):
+    for delivery_tag in delivery_tags:
+        consumer._on_basic_consume(consumer.channel, Bunch(delivery_tag=delivery_tag), None, 'msg{}'.format(delivery_tag))
+
+# ################################################################################################################################
+
+class ConsumingConnectionTestCase(TestCase):
+
+    def test_single_messages(self):
+        consumer, batches = _get_consumer()
+        _deliver(consumer, 1, 2)
+
+        eq_([[body for _, _, body in messages] for _, messages in batches], [['msg1'], ['msg2']])
+        eq_(consumer.channel.acked, [(1, True), (2, True)])
+
+        # No need for a timer when each message is handed over as soon as it is received
+        eq_(consumer.conn.timeouts, [])
+
+    def test_prefetch_count(self):
+        consumer, _ = _get_consumer(prefetch_count=50)
+        eq_(consumer.channel.qos, 50)
+        eq_(consumer.consumer_tag is not None, True)
+
+    def test_batches(self):
+        consumer, batches = _get_consumer(batch_size=3, batch_interval=250)
+        _deliver(consumer, 1, 2, 3, 4)
+
+        eq_([[body for _, _, body in messages] for _, messages in batches], [['msg1', 'msg2', 'msg3']])
+        eq_(consumer.channel.acked, [(3, True)])
+
+        # The incomplete batch is handed over once the batch interval elapses
+        deadline, callback = consumer.conn.timeouts[0]
+        eq_(deadline, 0.25)
+
+        callback()
+        eq_([[body for _, _, body in messages] for _, messages in batches[1:]], [['msg4']])
+        eq_(consumer.channel.acked, [(3, True), (4, True)])
+
+        # The timer keeps on running
+        eq_(len(consumer.conn.timeouts), 2)
+
+    def test_ack_on_success(self):
+        consumer, batches = _get_consumer(batch_size=2, ack_mode=AMQP.ACK_MODE.ON_SUCCESS.value)
+        _deliver(consumer, 1, 2, 3, 4)
+
+        # Nothing is acknowledged before the messages are processed
+        eq_(len(batches), 2)
+        eq_(consumer.channel.acked, [])
+
+        consumer.settle(consumer.consumer_tag, [1, 2], True)
+        consumer.settle(consumer.consumer_tag, [3, 4], False)
+        consumer.settle('old-consumer-tag', [5], True)
+
+        # Messages are settled in the thread running the IO loop only
+        eq_(consumer.channel.acked, [])
+
+        consumer.conn.timeouts[0][1]()
+        eq_(consumer.channel.acked, [(1, False), (2, False)])
+        eq_(consumer.channel.rejected, [(3, True), (4, True)])
+
+# ################################################################################################################################
+
+class FakeBrokerClient(object):
+    def __init__(self):
+        self.invoked = []
+
+    def invoke_async(self, params):
+        self.invoked.append(params)
+
+class ConsumingConnectorTestCase(TestCase):
+
+    def _get_connector(self, **config):
+        connector = ConsumingConnector(init=False)
+        connector.broker_client = FakeBrokerClient()
+        connector.channel_amqp = Bunch(id=123, service='my.service', data_format='json')
+        connector.channel_amqp.update(config)
+
+        return connector
+
+    def test_on_message(self):
+        connector = self._get_connector()
+        connector._on_message('my.tag', [(1, None, 'msg1')])
+
+        params = connector.broker_client.invoked[0]
+        eq_(params['action'], CHANNEL.AMQP_MESSAGE_RECEIVED.value)
+        eq_(params['service'], 'my.service')
+        eq_(params['payload'], 'msg1')
+        eq_('is_batch' in params, False)
+        eq_('delivery_tags' in params, False)
+
+    def test_on_message_batch(self):
+        connector = self._get_connector(batch_size=10, ack_mode=AMQP.ACK_MODE.ON_SUCCESS.value)
+        connector._on_message('my.tag', [(1, None, 'msg1'), (2, None, 'msg2')])
+
+        params = connector.broker_client.invoked[0]
+        eq_(params['payload'], ['msg1', 'msg2'])
+        eq_(params['is_batch'], True)
+        eq_(params['channel_id'], 123)
+        eq_(params['consumer_tag'], 'my.tag')
+        eq_(params['delivery_tags'], [1, 2])
+
+    def test_settle(self):
+        settled = []
+        connector = self._get_connector(consumer=Bunch(settle=lambda *args: settled.append(args)))
+
+        connector.on_broker_msg_CHANNEL_AMQP_MESSAGE_ACK(Bunch(consumer_tag='my.tag', delivery_tags=[1, 2]))
+        connector.on_broker_msg_CHANNEL_AMQP_MESSAGE_REJECT(Bunch(consumer_tag='my.tag', delivery_tags=[3]))
+
+        eq_(settled, [('my.tag', [1, 2], True), ('my.tag', [3], False)])
+
+# ################################################################################################################################
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# amqp
+from amqp.serialization import AMQPReader, AMQPWriter
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.broker_message import MESSAGE_TYPE
+from zato.server.connection.amqp import publisher
+from zato.server.connection.amqp.outgoing import PublisherFacade
+from zato.server.connection.amqp.publisher import _Channel, DirectPublisher
+
+# ################################################################################################################################
+
+class FakeChannel(object):
+    """ Stands in for _Channel in DirectPublisher.
+    """
+    instances = []
+
+    def __init__(self, def_amqp, confirm):
+        self.batches = []
+        self.fail_with = None
+        self.nack_bodies = []
+        self.confirmed_bodies = [] # Ones confirmed before fail_with is raised
+        self.pending = set()
+        self.is_closed = False
+        self.sleep = 0
+        self.instances.append(self)
+
+    def publish(self, batch):
+        self.pending = set(idx for idx, msg in enumerate(batch) if msg[0] not in self.confirmed_bodies)
+        if self.fail_with:
+            raise self.fail_with
+        gevent.sleep(self.sleep)
+        self.batches.append([body for body, _, _, _, _ in batch])
+        return [msg for msg in batch if msg[0] in self.nack_bodies]
+
+    def check(self):
+        pass
+
+    def close(self):
+        self.is_closed = True
+
+class FakeAMQPChannel(object):
+    """ Stands in for an amqp.Channel in _Channel, dispatching confirms through _METHOD_MAP the way amqp does.
+    """
+    _METHOD_MAP = {}
+
+    def __init__(self, nack_tags=(), fail_after=None):
+        self.published = []
+        self.nack_tags = nack_tags
+        self.fail_after = fail_after
+        self.is_confirm = False
+
+    def confirm_select(self):
+        self.is_confirm = True
+
+    def basic_publish(self, msg, exchange, routing_key):
+        if len(self.published) == self.fail_after:
+            raise Exception('Connection lost')
+        self.published.append((msg.body, exchange, routing_key))
+
+    def _dispatch(self, method_sig, *args):
+        writer = AMQPWriter()
+        writer.write_longlong(args[0])
+        for bit in args[1:]:
+            writer.write_bit(bit)
+
+        self._METHOD_MAP[method_sig](self, AMQPReader(writer.getvalue()))
+
+    def wait(self, allowed_methods):
+        last = len(self.published)
+        acked = [tag for tag in range(1, last + 1) if tag not in self.nack_tags]
+
+        # Basic.Nack
+        for tag in self.nack_tags:
+            self._dispatch((60, 120), tag, False, False)
+
+        # Basic.Ack - a single multiple=True ack for everything up to the last one confirmed
+        if acked:
+            self._dispatch((60, 80), max(acked), True)
+
+class FakeAMQPConnection(object):
+    def __init__(self, amqp_channel):
+        self.amqp_channel = amqp_channel
+
+    def channel(self):
+        return self.amqp_channel
+
+def _get_params(body, properties=None, headers=None):
+    return {'out_name':'my.out', 'body':body, 'exchange':b'my.exchange', 'routing_key':b'my.key',
+        'properties':properties or {}, 'headers':headers or {}}
+
+def _get_publisher(fallback, **kwargs):
+    out_amqp = Bunch(name='my.out', delivery_mode=2, priority=5, content_type='text/plain', content_encoding=None,
+        expiration=None, user_id=None, app_id='my.app')
+    def_amqp = Bunch(host='localhost', port=5672, vhost='/')
+
+    return DirectPublisher(out_amqp, def_amqp, fallback, pool_size=1, **kwargs)
+
+# ################################################################################################################################
+
+class DirectPublisherTestCase(TestCase):
+
+    def setUp(self):
+        FakeChannel.instances[:] = []
+        self.patcher = patch.object(publisher, '_Channel', FakeChannel)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_get_message(self):
+        dp = _get_publisher(None)
+        headers = {'a':'b'}
+
+        (body, exchange, routing_key, msg_headers, properties), params = dp.get_message(
+            _get_params('zzz', {'priority':9}, headers))
+
+        eq_(body, b'zzz')
+        eq_(exchange, b'my.exchange')
+        eq_(routing_key, b'my.key')
+        eq_(properties, {'delivery_mode':2, 'priority':9, 'content_type':'text/plain', 'app_id':'my.app',
+            'content_encoding':'utf-8'})
+        eq_(sorted(msg_headers), ['X-Zato-Component', 'X-Zato-Msg-TS', 'a'])
+
+        # Input headers are left intact
+        eq_(headers, {'a':'b'})
+
+    def test_get_message_serialized(self):
+        dp = _get_publisher(None)
+        dp.out_amqp.content_type = None
+
+        (body, _, _, _, properties), _ = dp.get_message(_get_params({'a':1}))
+
+        eq_(body, '{"a": 1}')
+        eq_(properties['content_type'], 'application/json')
+
+    def test_publish_batches(self):
+        dp = _get_publisher(None, batch_size=2, batch_interval=0.01)
+        dp.start()
+        gevent.sleep(0)
+
+        for idx in range(5):
+            dp.put(_get_params('msg{}'.format(idx)))
+
+        gevent.sleep(0.1)
+
+        channel = FakeChannel.instances[0]
+        eq_(sum(channel.batches, []), ['msg0', 'msg1', 'msg2', 'msg3', 'msg4'])
+        eq_(max(len(batch) for batch in channel.batches), 2)
+
+        dp.stop()
+        eq_(channel.is_closed, True)
+
+    def test_publish_error_fallback(self):
+        fallback = []
+        dp = _get_publisher(fallback.append)
+        dp.start()
+        gevent.sleep(0)
+
+        channel = FakeChannel.instances[0]
+        channel.fail_with = Exception('Connection lost')
+
+        dp.publish([dp.get_message(_get_params('msg1')), dp.get_message(_get_params('msg2'))])
+        gevent.sleep(0)
+
+        eq_([params['body'] for params in fallback], ['msg1', 'msg2'])
+
+        # The broken channel has been replaced with a new one
+        eq_(channel.is_closed, True)
+        eq_(len(FakeChannel.instances), 2)
+        eq_(dp.conn_queue.size, 1)
+
+        dp.stop()
+
+    def test_publish_error_confirmed_not_resent(self):
+        fallback = []
+        dp = _get_publisher(fallback.append)
+        dp.start()
+        gevent.sleep(0)
+
+        channel = FakeChannel.instances[0]
+        channel.confirmed_bodies = ['msg1']
+        channel.fail_with = Exception('Connection lost')
+
+        dp.publish([dp.get_message(_get_params('msg1')), dp.get_message(_get_params('msg2'))])
+
+        # The message already confirmed by the broker is not published again
+        eq_([params['body'] for params in fallback], ['msg2'])
+
+        dp.stop()
+
+    def test_publish_nack_fallback(self):
+        fallback = []
+        dp = _get_publisher(fallback.append)
+        dp.start()
+        gevent.sleep(0)
+
+        FakeChannel.instances[0].nack_bodies = ['msg2']
+
+        dp.publish([dp.get_message(_get_params('msg1')), dp.get_message(_get_params('msg2'))])
+        eq_([params['body'] for params in fallback], ['msg2'])
+
+        dp.stop()
+
+    def test_stop_fallback(self):
+        fallback = []
+        dp = _get_publisher(fallback.append)
+        dp.put(_get_params('msg1'))
+        dp.stop()
+
+        eq_([params['body'] for params in fallback], ['msg1'])
+
+    def test_stop_waits_for_batch(self):
+        fallback = []
+        dp = _get_publisher(fallback.append)
+        dp.start()
+        gevent.sleep(0)
+
+        channel = FakeChannel.instances[0]
+        channel.sleep = 0.05
+
+        dp.put(_get_params('msg1'))
+        gevent.sleep(0.02)
+        dp.stop()
+
+        # The batch being published when the publisher was stopped has been published in full
+        eq_(channel.batches, [['msg1']])
+        eq_(fallback, [])
+        eq_(dp.greenlets, [])
+
+    def test_stop_timeout_fallback(self):
+        fallback = []
+        dp = _get_publisher(fallback.append)
+        dp.start()
+        gevent.sleep(0)
+
+        channel = FakeChannel.instances[0]
+        channel.sleep = 1
+
+        dp.put(_get_params('msg1'))
+        gevent.sleep(0.02)
+        dp.stop(timeout=0.01)
+
+        # A batch that could not be published in time is handed over to fallback_func and its channel is closed
+        eq_(channel.batches, [])
+        eq_([params['body'] for params in fallback], ['msg1'])
+        eq_(channel.is_closed, True)
+
+# ################################################################################################################################
+
+class ChannelTestCase(TestCase):
+
+    def _get_channel(self, confirm=True, **kwargs):
+        def_amqp = Bunch(host='localhost', port=5672, username='user', password='password', vhost='/', frame_max=131072,
+            heartbeat=30)
+        amqp_channel = FakeAMQPChannel(**kwargs)
+
+        with patch.object(publisher, 'Connection', lambda **ignored: FakeAMQPConnection(amqp_channel)):
+            channel = _Channel(def_amqp, confirm)
+
+        eq_(amqp_channel.is_confirm, confirm)
+        return channel
+
+    def _get_batch(self, *bodies):
+        return [(body, b'my.exchange', b'my.key', {}, {}) for body in bodies]
+
+    def test_publish_confirmed(self):
+        channel = self._get_channel()
+
+        eq_(channel.publish(self._get_batch('a', 'b', 'c')), [])
+        eq_(channel.unconfirmed, {})
+        eq_([body for body, _, _ in channel.channel.published], ['a', 'b', 'c'])
+
+        # Delivery tags keep increasing across batches
+        eq_(channel.publish(self._get_batch('d')), [])
+        eq_(channel.delivery_tag, 4)
+
+    def test_publish_nacked(self):
+        channel = self._get_channel(nack_tags=(2,))
+        eq_(channel.publish(self._get_batch('a', 'b', 'c')), self._get_batch('b'))
+
+        # Other channels are not affected
+        eq_(FakeAMQPChannel._METHOD_MAP, {})
+
+    def test_publish_error_pending(self):
+        channel = self._get_channel(fail_after=2)
+
+        with self.assertRaises(Exception):
+            channel.publish(self._get_batch('a', 'b', 'c'))
+        eq_(channel.pending, set([0, 1, 2]))
+
+        # Without confirms, messages sent already are not pending anymore
+        channel = self._get_channel(confirm=False, fail_after=2)
+
+        with self.assertRaises(Exception):
+            channel.publish(self._get_batch('a', 'b', 'c'))
+        eq_(channel.pending, set([2]))
+
+# ################################################################################################################################
+
+class FakeBrokerClient(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, msg, msg_type):
+        self.published.append((msg, msg_type))
+
+class FakeDirectPublisher(object):
+    def __init__(self):
+        self.params = []
+
+    def put(self, params):
+        self.params.append(params)
+
+class PublisherFacadeTestCase(TestCase):
+
+    def test_send(self):
+        broker_client = FakeBrokerClient()
+        direct_publisher = FakeDirectPublisher()
+
+        facade = PublisherFacade(broker_client, {'my.direct':direct_publisher})
+        facade.send('msg1', 'my.direct', 'my.exchange', 'my.key')
+        facade.send('msg2', 'my.other', 'my.exchange', 'my.key')
+
+        eq_([params['body'] for params in direct_publisher.params], ['msg1'])
+        eq_([(params['body'], msg_type) for params, msg_type in broker_client.published],
+            [('msg2', MESSAGE_TYPE.TO_AMQP_PUBLISHING_CONNECTOR_ALL)])
+
+# ################################################################################################################################
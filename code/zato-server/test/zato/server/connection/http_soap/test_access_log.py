@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from cStringIO import StringIO
+from unittest import TestCase
+
+# anyjson
+from anyjson import loads
+
+# nose
+from nose.tools import eq_
+
+# pytz
+from pytz import timezone
+
+# Zato
+from zato.server.connection.http_soap import access_log
+from zato.server.connection.http_soap.access_log import AccessLog, is_legacy_format, TimestampCache
+
+# ################################################################################################################################
+
+class FakeAccessLogger(object):
+    def __init__(self, is_enabled=True):
+        self.is_enabled = is_enabled
+        self.messages = []
+
+    def info(self, msg):
+        self.messages.append(msg)
+
+    def isEnabledFor(self, ignored):
+        return self.is_enabled
+
+def _add(log, cid, req_time=1389543732.0):
+    log.add('10.1.2.3', cid, req_time, 0.25, 'my.channel', 'POST', '/foo', 'HTTP/1.1', '200', 123, 'curl/7.0')
+
+# The format logging.conf files had before access log lines were formatted by AccessLog
+_legacy_format = '%(remote_ip)s %(cid_resp_time)s "%(channel_name)s" [%(req_timestamp)s] "%(method)s %(path)s %(http_version)s" ' \
+    '%(status_code)s %(response_size)s "-" "%(user_agent)s"'
+
+def _get_logger(fmt):
+    out = StringIO()
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(logging.Formatter(fmt))
+
+    access_logger = logging.Logger('test_access_log', logging.INFO)
+    access_logger.addHandler(handler)
+
+    return access_logger, out
+
+# ################################################################################################################################
+
+class TimestampCacheTestCase(TestCase):
+
+    def test_get(self):
+        cache = TimestampCache(timezone('Europe/Warsaw'))
+
+        first = cache.get(1389543732.1)
+        eq_(first, ('12/Jan/2014:16:22:12 +0000', '12/Jan/2014:17:22:12 +0100'))
+
+        # The same second is not formatted again
+        eq_(cache.get(1389543732.9) is first, True)
+
+        eq_(cache.get(1389543733.0), ('12/Jan/2014:16:22:13 +0000', '12/Jan/2014:17:22:13 +0100'))
+
+# ################################################################################################################################
+
+class AccessLogTestCase(TestCase):
+
+    def test_is_enabled(self):
+        eq_(AccessLog(FakeAccessLogger()).is_enabled, True)
+        eq_(AccessLog(FakeAccessLogger(False)).is_enabled, False)
+
+    def test_combined(self):
+        log = AccessLog(FakeAccessLogger(), local_tz=timezone('UTC'))
+        _add(log, 'cid1')
+        log.flush()
+
+        eq_(log.access_logger.messages, [
+            '10.1.2.3 cid1/0.25 "my.channel" [12/Jan/2014:16:22:12 +0000] "POST /foo HTTP/1.1" 200 123 "-" "curl/7.0"'])
+
+    def test_json(self):
+        log = AccessLog(FakeAccessLogger(), 'json', local_tz=timezone('UTC'))
+        _add(log, 'cid1')
+        log.flush()
+
+        eq_(loads(log.access_logger.messages[0]), {
+            'remote_ip': '10.1.2.3',
+            'cid': 'cid1',
+            'resp_time': 0.25,
+            'channel_name': 'my.channel',
+            'req_timestamp_utc': '12/Jan/2014:16:22:12 +0000',
+            'req_timestamp': '12/Jan/2014:16:22:12 +0000',
+            'method': 'POST',
+            'path': '/foo',
+            'http_version': 'HTTP/1.1',
+            'status_code': '200',
+            'response_size': 123,
+            'user_agent': 'curl/7.0',
+        })
+
+    def test_batch_size(self):
+        log = AccessLog(FakeAccessLogger(), batch_size=2)
+        for idx in range(5):
+            _add(log, 'cid{}'.format(idx))
+        log.flush()
+
+        eq_([len(msg.splitlines()) for msg in log.access_logger.messages], [2, 2, 1])
+
+        # Everything has been written out already
+        log.flush()
+        eq_(len(log.access_logger.messages), 3)
+
+    def test_buffer_full(self):
+        log = AccessLog(FakeAccessLogger(), buffer_size=2)
+        for idx in range(5):
+            _add(log, 'cid{}'.format(idx))
+
+        eq_(log.dropped, 3)
+
+        log.flush()
+        eq_(log.dropped, 0)
+
+        # The most recent records are kept
+        lines = log.access_logger.messages[0].splitlines()
+        eq_([line.split()[1].split('/')[0] for line in lines], ['cid3', 'cid4'])
+
+    def test_is_legacy_format(self):
+        eq_(is_legacy_format(_get_logger(_legacy_format)[0]), True)
+        eq_(is_legacy_format(_get_logger('%(message)s')[0]), False)
+        eq_(is_legacy_format(FakeAccessLogger()), False)
+
+    def test_legacy_format(self):
+        access_logger, out = _get_logger(_legacy_format)
+
+        log = AccessLog(access_logger, 'json', local_tz=timezone('UTC'))
+        _add(log, 'cid1')
+        _add(log, 'cid2')
+        log.flush()
+
+        # Each request is logged separately in the format configured in logging.conf
+        eq_(out.getvalue().splitlines(), [
+            '10.1.2.3 cid1/0.25 "my.channel" [12/Jan/2014:16:22:12 +0000] "POST /foo HTTP/1.1" 200 123 "-" "curl/7.0"',
+            '10.1.2.3 cid2/0.25 "my.channel" [12/Jan/2014:16:22:12 +0000] "POST /foo HTTP/1.1" 200 123 "-" "curl/7.0"',
+        ])
+
+    def test_register_formatter(self):
+        access_log.register_formatter('cid-only', lambda record, ts_cache: record[1])
+        try:
+            log = AccessLog(FakeAccessLogger(), 'cid-only')
+            _add(log, 'cid1')
+            log.stop()
+
+            eq_(log.access_logger.messages, ['cid1'])
+        finally:
+            del access_log.formatters['cid-only']
+
+# ################################################################################################################################
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+# gevent
+import gevent
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import AUDIT_LOG
+from zato.server.connection.http_soap.audit import AuditWriter
+
+# ################################################################################################################################
+
+class FakeODB(object):
+    def __init__(self, sleep_time=0):
+        self.batches = []
+        self.sleep_time = sleep_time
+
+    def audit_set_http_soap_batch(self, requests, responses):
+        gevent.sleep(self.sleep_time)
+        self.batches.append((requests, responses))
+
+def _get_data(data=None):
+    return dict(data or {})
+
+# ################################################################################################################################
+
+class AuditWriterTestCase(TestCase):
+
+    def test_request_response_same_batch(self):
+        odb = FakeODB()
+        writer = AuditWriter(odb)
+        writer.add_request('cid1', _get_data, {'name':'req1'})
+        writer.add_response('cid1', _get_data, {'resp_payload':'resp1', 'invoke_ok':True})
+        writer.add_request('cid2', _get_data, {'name':'req2'})
+        writer.stop()
+
+        eq_(len(odb.batches), 1)
+        requests, responses = odb.batches[0]
+
+        eq_(responses, [])
+        eq_(requests, [
+            {'cid':'cid1', 'name':'req1', 'resp_time':None, 'resp_headers':None, 'resp_payload':'resp1', 'invoke_ok':True,
+             'auth_ok':None},
+            {'cid':'cid2', 'name':'req2', 'resp_time':None, 'resp_headers':None, 'resp_payload':None, 'invoke_ok':None,
+             'auth_ok':None},
+        ])
+
+    def test_response_only(self):
+        odb = FakeODB()
+        writer = AuditWriter(odb)
+        writer.add_response('cid1', _get_data, {'resp_payload':'resp1'})
+        writer.stop()
+
+        eq_(odb.batches, [([], [{'cid':'cid1', 'resp_payload':'resp1'}])])
+
+    def test_batch_size(self):
+        odb = FakeODB()
+        writer = AuditWriter(odb, batch_size=2)
+        for idx in range(5):
+            writer.add_request('cid{}'.format(idx), _get_data)
+        writer.stop()
+
+        eq_([len(requests) for requests, _ in odb.batches], [2, 2, 1])
+
+    def test_prepare_error(self):
+        def _raise():
+            raise ValueError()
+
+        odb = FakeODB()
+        writer = AuditWriter(odb)
+        writer.add_request('cid1', _raise)
+        writer.add_request('cid2', _get_data)
+        writer.stop()
+
+        eq_(odb.batches, [([{'cid':'cid2', 'resp_time':None, 'resp_headers':None, 'resp_payload':None, 'invoke_ok':None,
+            'auth_ok':None}], [])])
+
+    def test_overflow_drop(self):
+        odb = FakeODB()
+        writer = AuditWriter(odb, max_queue_size=2)
+        for idx in range(5):
+            writer.add_request('cid{}'.format(idx), _get_data)
+
+        eq_(writer.dropped, 3)
+
+        writer.stop()
+        eq_([elem['cid'] for elem in odb.batches[0][0]], ['cid0', 'cid1'])
+
+    def test_overflow_spill(self):
+        spill_dir = mkdtemp()
+        try:
+            odb = FakeODB()
+            writer = AuditWriter(odb, max_queue_size=2, overflow_policy=AUDIT_LOG.OVERFLOW_POLICY.SPILL, spill_dir=spill_dir)
+            writer.add_request('cid1', _get_data)
+            writer.add_request('cid2', _get_data)
+            writer.add_request('cid3', _get_data)
+            writer.add_response('cid3', _get_data, {'resp_payload':'resp3'})
+
+            eq_(writer.dropped, 0)
+            eq_(writer.is_spilling, True)
+
+            # Records are spilled over in the background rather than when they are added
+            eq_(writer.spill_queue.qsize(), 2)
+            eq_(os.path.exists(writer.spill_path), False)
+
+            writer._spill()
+            eq_(writer.spill_queue.qsize(), 0)
+            eq_(os.path.exists(writer.spill_path), True)
+
+            writer.stop()
+
+            eq_(writer.is_spilling, False)
+            eq_(os.path.exists(writer.spill_path), False)
+
+            # The queued request first, followed by the spilled over ones, in the order they were added
+            eq_(len(odb.batches), 2)
+            eq_([elem['cid'] for elem in odb.batches[0][0]], ['cid1', 'cid2'])
+            eq_([(elem['cid'], elem['resp_payload']) for elem in odb.batches[1][0]], [('cid3', 'resp3')])
+
+        finally:
+            rmtree(spill_dir)
+
+    def test_overflow_spill_full(self):
+        spill_dir = mkdtemp()
+        try:
+            writer = AuditWriter(FakeODB(), max_queue_size=1, overflow_policy=AUDIT_LOG.OVERFLOW_POLICY.SPILL,
+                spill_dir=spill_dir)
+
+            for idx in range(4):
+                writer.add_request('cid{}'.format(idx), _get_data)
+
+            # One record is in the queue, one is waiting to be spilled over and there is no room for the rest
+            eq_(writer.dropped, 2)
+
+        finally:
+            rmtree(spill_dir)
+
+    def test_stop_running(self):
+        odb = FakeODB()
+        writer = AuditWriter(odb, batch_size=2, flush_interval=0.01)
+        writer.start()
+
+        for idx in range(5):
+            writer.add_request('cid{}'.format(idx), _get_data)
+        writer.stop()
+
+        # Everything is stored by the writer's own greenlet before it stops
+        eq_(writer.writer_greenlet, None)
+        eq_(sorted(elem['cid'] for requests, _ in odb.batches for elem in requests), ['cid0', 'cid1', 'cid2', 'cid3', 'cid4'])
+
+    def test_stop_timeout(self):
+        odb = FakeODB(sleep_time=1)
+        writer = AuditWriter(odb, flush_interval=0.01)
+        writer.start()
+
+        writer.add_request('cid1', _get_data)
+        gevent.sleep(0.02)
+
+        writer_greenlet = writer.writer_greenlet
+        writer.stop(0.01)
+
+        # The writer is not waited for any longer than told to
+        eq_(writer.writer_greenlet, None)
+        gevent.sleep(0)
+        eq_(writer_greenlet.dead, True)
+        eq_(odb.batches, [])
+
+    def test_spill_requires_dir(self):
+        self.assertRaises(ValueError, AuditWriter, FakeODB(), overflow_policy=AUDIT_LOG.OVERFLOW_POLICY.SPILL)
+
+# ################################################################################################################################
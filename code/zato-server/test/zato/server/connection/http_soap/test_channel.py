@@ -32,7 +32,7 @@ from nose.tools import eq_
 from zato.common import CHANNEL, DATA_FORMAT, SIMPLE_IO, URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_NONE, ZATO_OK
 from zato.common.test import rand_string
 from zato.common.util import new_cid
-from zato.server.connection.http_soap import channel
+from zato.server.connection.http_soap import channel, RequestEntityTooLarge
 from zato.server.service.internal import AdminService, Service
 
 # ##############################################################################
@@ -343,6 +343,46 @@ class TestRequestDispatcher(MessageHandlingBase):
         eq_(rd.request_handler.worker_store, worker_store)
         eq_(rd.request_handler.simple_io_config, simple_io_config)
 
+    def test_get_payload(self):
+        rd = channel.RequestDispatcher()
+        cid = uuid4().hex
+        payload = uuid4().hex
+
+        for max_body_size in(None, 0, len(payload)):
+            channel_item = Bunch(stream_request=False, max_body_size=max_body_size)
+            wsgi_environ = {'wsgi.input': StringIO(payload), 'CONTENT_LENGTH': str(len(payload))}
+            eq_(rd.get_payload(cid, channel_item, wsgi_environ), payload)
+
+    def test_get_payload_too_large(self):
+        rd = channel.RequestDispatcher()
+        cid = uuid4().hex
+        payload = uuid4().hex
+
+        for stream_request in(True, False):
+            channel_item = Bunch(stream_request=stream_request, max_body_size=len(payload) - 1)
+
+            # Rejected because of Content-Length, before reading the body
+            wsgi_input = StringIO(payload)
+            wsgi_environ = {'wsgi.input': wsgi_input, 'CONTENT_LENGTH': str(len(payload))}
+            self.assertRaises(RequestEntityTooLarge, rd.get_payload, cid, channel_item, wsgi_environ)
+            eq_(wsgi_input.tell(), 0)
+
+            # No Content-Length so the body needs to be read
+            wsgi_environ = {'wsgi.input': StringIO(payload)}
+            self.assertRaises(RequestEntityTooLarge, rd.get_payload, cid, channel_item, wsgi_environ)
+
+    def test_get_payload_streamed(self):
+        payload = uuid4().hex * 10000
+
+        for spool_threshold, is_spooled in((len(payload) - 1, True), (len(payload), False)):
+            rd = channel.RequestDispatcher(spool_threshold=spool_threshold)
+            channel_item = Bunch(stream_request=True, max_body_size=None)
+            wsgi_environ = {'wsgi.input': StringIO(payload)}
+
+            stream = rd.get_payload(uuid4().hex, channel_item, wsgi_environ)
+            eq_(stream._rolled, is_spooled)
+            eq_(stream.read(), payload)
+
 # ##############################################################################
 
 class TestRequestHandler(TestCase):
@@ -9,19 +9,28 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import httplib, ssl
+import httplib, os, ssl
+from cStringIO import StringIO
 from datetime import datetime
 from logging import getLogger
-from tempfile import NamedTemporaryFile
+from shutil import rmtree
+from tempfile import mkdtemp, NamedTemporaryFile
 from time import sleep
 from unittest import TestCase
 
 # bunch
 from bunch import Bunch
 
+# gevent
+import gevent
+from gevent.event import Event
+
 # lxml
 from lxml import etree
 
+# mock
+from mock import patch
+
 # nose
 from nose.tools import eq_
 
@@ -30,13 +39,13 @@ import requests
 requests.packages.urllib3.disable_warnings()
 
 # Zato
-from zato.common import CONTENT_TYPE, DATA_FORMAT, SEC_DEF_TYPE, URL_TYPE, ZATO_NONE
+from zato.common import CONTENT_TYPE, DATA_FORMAT, SEC_DEF_TYPE, TimeoutException, URL_TYPE, ZATO_NONE
 from zato.common.util import get_component_name
 from zato.common import CONTENT_TYPE, DATA_FORMAT, SEC_DEF_TYPE, soapenv11_namespace, soapenv12_namespace, URL_TYPE, ZATO_NONE
 from zato.common.test import rand_float, rand_int, rand_string
 from zato.common.test.tls import TLSServer
 from zato.common.test.tls_material import ca_cert, ca_cert_invalid, client1_cert, client1_key
-from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper
+from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper, PlainHTTPFacade, SudsSOAPWrapper
 
 logger = getLogger(__name__)
 
@@ -705,3 +714,323 @@ class TLSHTTPTestCase(TestCase, Base):
                                     func(cid)
 
 # ################################################################################################################################
+
+class _FakeRaw(object):
+    def __init__(self, body):
+        self.buff = StringIO(body)
+        self.decode_content = False
+
+    def read(self, *args):
+        return self.buff.read(*args)
+
+class _FakeStreamResponse(object):
+    def __init__(self, body):
+        self.body = body
+        self.raw = _FakeRaw(body)
+        self.is_closed = False
+
+    def iter_content(self, chunk_size):
+        for idx in range(0, len(self.body), chunk_size):
+            yield self.body[idx:idx+chunk_size]
+
+    def iter_lines(self, chunk_size):
+        for line in self.body.splitlines():
+            yield line
+
+    def close(self):
+        self.is_closed = True
+
+class _FakeStreamSession(_FakeSession):
+    def __init__(self, body):
+        super(_FakeStreamSession, self).__init__()
+        self.body = body
+
+    def request(self, *args, **kwargs):
+        self.request_kwargs = kwargs
+        return _FakeStreamResponse(self.body)
+
+class StreamTestCase(TestCase, Base):
+
+    def _get_wrapper(self, data_format, body):
+        config = self._get_config()
+        config['data_format'] = data_format
+        config['sec_type'] = None
+
+        wrapper = HTTPSOAPWrapper(config, _FakeRequestsModule())
+        wrapper.session = _FakeStreamSession(body)
+
+        return wrapper
+
+    def test_stream_json(self):
+        wrapper = self._get_wrapper(DATA_FORMAT.JSON, '{"a":1}\n\n{"a":2}\n')
+        response = wrapper.get(rand_string(), stream=True)
+
+        eq_(wrapper.session.request_kwargs['stream'], True)
+        eq_(response.is_closed, False)
+
+        eq_(list(response.data), [{'a':1}, {'a':2}])
+        eq_(response.is_closed, True)
+
+    def test_stream_xml_children(self):
+        wrapper = self._get_wrapper(DATA_FORMAT.XML, '<root><a>1</a><a><b>2</b></a><c/></root>')
+        response = wrapper.get(rand_string(), stream=True)
+
+        eq_([elem.tag for elem in response.data], ['a', 'a', 'c'])
+
+    def test_stream_xml_tag(self):
+        wrapper = self._get_wrapper(DATA_FORMAT.XML, '<root><a><b>1</b></a><a><b>2</b></a></root>')
+        response = wrapper.get(rand_string(), stream=True, xml_tag='b')
+
+        eq_([elem.text for elem in response.data], ['1', '2'])
+
+    def test_stream_xml_memory(self):
+        body = '<root>{}</root>'.format('<x/><a><b>1</b><c/></a>' * 5)
+
+        def get_preceding(elem):
+            return len(list(elem.itersiblings(preceding=True)))
+
+        # Elements returned are removed from the document as it is being parsed, along with the ones that precede them,
+        # so only the last one returned is still there when the next one is.
+        wrapper = self._get_wrapper(DATA_FORMAT.XML, body)
+        response = wrapper.get(rand_string(), stream=True)
+        eq_([get_preceding(elem) for elem in response.data], [0] + [1] * 9)
+
+        wrapper = self._get_wrapper(DATA_FORMAT.XML, body)
+        response = wrapper.get(rand_string(), stream=True, xml_tag='b')
+        eq_([get_preceding(elem.getparent()) for elem in response.data], [1] + [2] * 4)
+
+    def test_stream_chunks(self):
+        wrapper = self._get_wrapper(None, 'abcdefg')
+        response = wrapper.get(rand_string(), stream=True, chunk_size=3)
+
+        eq_(list(response.data), ['abc', 'def', 'g'])
+        eq_(response.is_closed, True)
+
+# ################################################################################################################################
+
+class _FakeConn(object):
+    def __init__(self, response, sleep_time=0):
+        self.response = response
+        self.sleep_time = sleep_time
+        self.calls = []
+
+    def http_request(self, method, cid, data='', params=None, *args, **kwargs):
+        self.calls.append((method, cid, data, params, kwargs))
+        gevent.sleep(self.sleep_time)
+
+        if isinstance(self.response, Exception):
+            raise self.response
+
+        return self.response
+
+class _BlockingConn(object):
+    """ Keeps track of how many calls are in progress at a time, each one completing once can_complete is set.
+    """
+    def __init__(self, can_complete, in_progress):
+        self.can_complete = can_complete
+        self.in_progress = in_progress
+        self.max_in_progress = 0
+
+    def http_request(self, method, cid, *args, **kwargs):
+        self.in_progress.append(self)
+        self.max_in_progress = max(self.max_in_progress, len(self.in_progress))
+        self.can_complete.wait()
+        self.in_progress.remove(self)
+
+        return 'OK'
+
+class PlainHTTPFacadeTestCase(TestCase):
+
+    def test_config_dict_api(self):
+        config_dict = {'a': Bunch(conn=_FakeConn('resp-a'))}
+        facade = PlainHTTPFacade(config_dict)
+
+        eq_(facade['a'].conn.response, 'resp-a')
+        eq_(list(facade), ['a'])
+        eq_(facade.get('b'), None)
+
+    def test_invoke_many(self):
+        cid = rand_string()
+        config_dict = {
+            'a': Bunch(conn=_FakeConn('resp-a', 0.02)),
+            'b': Bunch(conn=_FakeConn('resp-b')),
+            'c': Bunch(conn=_FakeConn(ValueError('c'))),
+            'd': Bunch(conn=_FakeConn('resp-d', 5)),
+            'e': Bunch(conn=_FakeConn('resp-e', 5)),
+        }
+        facade = PlainHTTPFacade(config_dict)
+
+        results = facade.invoke_many(cid, [
+            {'name':'a'},
+            {'name':'b', 'method':'POST', 'data':'data-b', 'params':{'x':1}, 'headers':{'X-Foo':'1'}},
+            {'name':'c'},
+            {'name':'d', 'timeout':0.01},
+            {'name':'e'},
+        ], timeout=0.1)
+
+        eq_([result.name for result in results], ['a', 'b', 'c', 'd', 'e'])
+        eq_([result.ok for result in results], [True, True, False, False, False])
+        eq_([result.response for result in results], ['resp-a', 'resp-b', None, None, None])
+
+        eq_(config_dict['b'].conn.calls, [('POST', cid, 'data-b', {'x':1}, {'headers':{'X-Foo':'1'}})])
+        eq_(isinstance(results[2].exception, ValueError), True)
+
+        # Per-call timeout
+        eq_(isinstance(results[3].exception, TimeoutException), True)
+
+        # Overall timeout
+        eq_(isinstance(results[4].exception, TimeoutException), True)
+        eq_(results[4].time, 0.1)
+
+    def _check_invoke_many_concurrency(self, concurrency, expected):
+        can_complete = Event()
+        in_progress = []
+
+        config_dict = dict((name, Bunch(conn=_BlockingConn(can_complete, in_progress))) for name in 'abcd')
+        facade = PlainHTTPFacade(config_dict)
+
+        greenlet = gevent.spawn(facade.invoke_many, rand_string(), [{'name':name} for name in 'abcd'], concurrency=concurrency)
+
+        # Lets all the calls that can be made start, however long it takes, none will complete before can_complete is set
+        gevent.sleep(0.01)
+        eq_(len(in_progress), expected)
+
+        can_complete.set()
+        eq_([result.ok for result in greenlet.get(timeout=1)], [True] * 4)
+        eq_(max(item.conn.max_in_progress for item in config_dict.values()), expected)
+
+    def test_invoke_many_concurrency(self):
+
+        # Running concurrently, all of them are in progress at the same time ..
+        self._check_invoke_many_concurrency(None, 4)
+
+        # .. unless told otherwise.
+        self._check_invoke_many_concurrency(1, 1)
+        self._check_invoke_many_concurrency(3, 3)
+
+# ################################################################################################################################
+
+_wsdl = """<?xml version="1.0" encoding="utf-8"?>
+<definitions name="Test" targetNamespace="urn:test" xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" xmlns:tns="urn:test" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <message name="PingRequest"><part name="data" type="xsd:string"/></message>
+  <message name="PingResponse"><part name="data" type="xsd:string"/></message>
+  <portType name="TestPortType">
+    <operation name="ping"><input message="tns:PingRequest"/><output message="tns:PingResponse"/></operation>
+  </portType>
+  <binding name="TestBinding" type="tns:TestPortType">
+    <soap:binding style="rpc" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="ping">
+      <soap:operation soapAction="ping"/>
+      <input><soap:body use="literal" namespace="urn:test"/></input>
+      <output><soap:body use="literal" namespace="urn:test"/></output>
+    </operation>
+  </binding>
+  <service name="TestService">
+    <port name="TestPort" binding="tns:TestBinding"><soap:address location="http://localhost/test"/></port>
+  </service>
+</definitions>
+"""
+
+class SudsSOAPWrapperTestCase(TestCase, Base):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.wsdl_cache_dir = os.path.join(self.tmp_dir, 'wsdl-cache')
+        self.wsdl_path = os.path.join(self.tmp_dir, 'test.wsdl')
+        self._write_wsdl(_wsdl)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _write_wsdl(self, wsdl):
+        with open(self.wsdl_path, 'w') as f:
+            f.write(wsdl)
+
+    def _get_wrapper(self):
+        config = self._get_config()
+        config['name'] = rand_string()
+        config['sec_type'] = None
+        config['username'] = config['password'] = None
+        config['address_host'] = 'file://'
+        config['address_url_path'] = self.wsdl_path
+        config['pool_size'] = 3
+        config['queue_build_cap'] = 1
+        config['wsdl_cache_dir'] = self.wsdl_cache_dir
+
+        with patch('zato.server.connection.http_soap.outgoing.requests', _FakeRequestsModule()):
+            return SudsSOAPWrapper(config)
+
+    def _add_clients(self, wrapper):
+        """ Adds pool_size clients and returns how many times the WSDL was parsed in the process.
+        """
+        from suds.wsdl import Definitions
+
+        with patch.object(Definitions, 'build_schema', autospec=True, side_effect=Definitions.build_schema) as build_schema:
+            for x in range(wrapper.config['pool_size']):
+                wrapper.add_client()
+
+        return build_schema.call_count
+
+    def test_parsed_once_per_pool(self):
+        wrapper = self._get_wrapper()
+        eq_(self._add_clients(wrapper), 1)
+
+        clients = [wrapper.client.acquire() for x in range(3)]
+        eq_(len(set(id(client) for client in clients)), 3)
+        eq_(len(set(id(client.wsdl) for client in clients)), 1)
+
+    def test_cached_on_disk(self):
+        eq_(self._add_clients(self._get_wrapper()), 1)
+
+        # Another wrapper, e.g. after a restart, reads the WSDL from disk
+        eq_(self._add_clients(self._get_wrapper()), 0)
+
+        # Unless the WSDL has changed in the meantime ..
+        self._write_wsdl(_wsdl.replace('TestService', 'TestService2'))
+        eq_(self._add_clients(self._get_wrapper()), 1)
+
+        # .. in which case only the new version is kept
+        address_dirs = os.listdir(self.wsdl_cache_dir)
+        eq_(len(address_dirs), 1)
+        eq_(len(os.listdir(os.path.join(self.wsdl_cache_dir, address_dirs[0]))), 1)
+
+    def test_clear_wsdl_cache(self):
+        wrapper = self._get_wrapper()
+        eq_(self._add_clients(wrapper), 1)
+
+        wrapper.clear_wsdl_cache()
+        eq_(os.listdir(self.wsdl_cache_dir), [])
+        eq_(self._add_clients(self._get_wrapper()), 1)
+
+    def test_wsdl_hash_imports(self):
+        from suds.transport.http import HttpTransport
+
+        xsd = """<?xml version="1.0" encoding="utf-8"?>
+        <schema xmlns="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:test">{}</schema>
+        """
+
+        self._write_wsdl(_wsdl.replace('<message name="PingRequest">', """<types>
+          <xsd:schema targetNamespace="urn:test"><xsd:import namespace="urn:test" schemaLocation="types.xsd"/></xsd:schema>
+        </types>
+        <message name="PingRequest">"""))
+
+        # One schema includes another one, relative locations are resolved against the importing document
+        os.mkdir(os.path.join(self.tmp_dir, 'common'))
+        with open(os.path.join(self.tmp_dir, 'types.xsd'), 'w') as f:
+            f.write(xsd.format('<include schemaLocation="common/common.xsd"/>'))
+
+        def write_common(type_name):
+            with open(os.path.join(self.tmp_dir, 'common', 'common.xsd'), 'w') as f:
+                f.write(xsd.format('<simpleType name="{}"><restriction base="string"/></simpleType>'.format(type_name)))
+
+        write_common('Type1')
+        wrapper = self._get_wrapper()
+        hash1 = wrapper.get_wsdl_hash(HttpTransport())
+        eq_(hash1, wrapper.get_wsdl_hash(HttpTransport()))
+
+        # A change in a document imported indirectly means the cached WSDL cannot be used anymore
+        write_common('Type2')
+        self.assertNotEquals(wrapper.get_wsdl_hash(HttpTransport()), hash1)
+
+# ################################################################################################################################
@@ -225,6 +225,97 @@ class URLDataTestCase(TestCase):
         match, _ = ud.match('/customer/1 23/order/4 56', soap_action3)
         eq_(sorted(match.items()), [(u'cid', u'1 23'), (u'oid', u'4 56')])
 
+    def test_match_precedence_router(self):
+        """ Channels matched through URLRouter are returned in the same order a linear scan of .channel_data would have used.
+        """
+        ud = url_data.URLData([])
+
+        for name, url_path in (('name-3', '/customer/123'), ('name-2', '/customer/{cid}'), ('name-1', '/custom?er/{cid}')):
+            item = Bunch()
+            item.name = name
+            item.match_target = '{}{}'.format(MISC.SEPARATOR, url_path)
+            item.match_target_compiled = url_data.Matcher(item.match_target)
+            ud.channel_data.add(item)
+
+        match, info = ud.match('/customer/123', '')
+        eq_(sorted(match.items()), [('cid', '123')])
+        eq_(info.name, 'name-1')
+
+        # A regex pattern cannot be indexed by its segments so it has to be in the fallback list
+        eq_(len(ud.router.fallback), 1)
+        eq_(ud.router.fallback[0].name, 'name-1')
+
+        match, info = ud.match('/customer/123/order', '')
+        self.assertIsNone(match)
+        self.assertIsNone(info)
+
+    def test_match_router_dots(self):
+        """ Dots are matched literally so channels with dots in their patterns are indexed like any other ones.
+        """
+        ud = url_data.URLData([])
+
+        for name, soap_action, url_path in (('name-1', 'urn:api.get', '/api/v1.0/{cid}'), ('name-2', '', '/api/v1.0/{cid}')):
+            item = Bunch()
+            item.name = name
+            item.match_target = '{}{}{}'.format(soap_action, MISC.SEPARATOR, url_path)
+            item.match_target_compiled = url_data.Matcher(item.match_target)
+            ud.channel_data.add(item)
+
+        match, info = ud.match('/api/v1.0/123', '')
+        eq_(sorted(match.items()), [('cid', '123')])
+        eq_(info.name, 'name-2')
+
+        match, info = ud.match('/api/v1.0/123', 'urn:api.get')
+        eq_(info.name, 'name-1')
+
+        eq_(len(ud.router.fallback), 0)
+
+        match, info = ud.match('/api/v100/123', '')
+        self.assertIsNone(match)
+        self.assertIsNone(info)
+
+        match, info = ud.match('/api/v1.0/123', 'urn:apixget')
+        self.assertIsNone(match)
+        self.assertIsNone(info)
+
+    def test_match_router_create_delete(self):
+
+        ud = url_data.URLData([])
+        ud.url_sec = {}
+        ud._sec_info_from_msg = lambda msg: Bunch()
+
+        # Build the router before any channel exists so that only incremental updates are exercised below
+        match, _ = ud.match('/customer/123', '')
+        self.assertIsNone(match)
+
+        def _dummy_channel_item_from_msg(msg, match_target, *ignored):
+            item = Bunch()
+            item.name = msg.name
+            item.match_target = match_target
+            item.match_target_compiled = url_data.Matcher(match_target)
+            return item
+
+        ud._channel_item_from_msg = _dummy_channel_item_from_msg
+
+        msg = Bunch()
+        msg.name = 'name-1'
+        msg.soap_action = ''
+        msg.url_path = '/customer/{cid}'
+
+        ud._create_channel(msg, {})
+
+        match, info = ud.match('/customer/123', '')
+        eq_(sorted(match.items()), [('cid', '123')])
+        eq_(info.name, 'name-1')
+
+        msg.old_soap_action = msg.soap_action
+        msg.old_url_path = msg.url_path
+
+        ud._delete_channel(msg)
+
+        match, _ = ud.match('/customer/123', '')
+        self.assertIsNone(match)
+
 # ################################################################################################################################
 
     def test_check_security(self):
@@ -1436,11 +1527,11 @@ class URLDataTestCase(TestCase):
                 eq_(msg[name], channel_item[name])
 
             if needs_security_id:
-                eq_(len(channel_item.keys()), 33)
+                eq_(len(channel_item.keys()), 35)
                 for name in('sec_type', 'security_id', 'security_name'):
                     eq_(msg[name], channel_item[name])
             else:
-                eq_(len(channel_item.keys()), 30)
+                eq_(len(channel_item.keys()), 32)
 
         for needs_security_id in(True, False):
             msg = get_msg(needs_security_id)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from smtplib import SMTPServerDisconnected
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# mock
+from mock import patch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import EMAIL, SMTPMessage
+from zato.server.connection.email import get_body_structure, get_uid_set, Imbox, SMTPConnection
+
+# ################################################################################################################################
+
+class FakeSMTP(object):
+    def __init__(self):
+        self.noop_calls = 0
+
+    def noop(self):
+        self.noop_calls += 1
+        return 250, b'OK'
+
+class FakeOutbox(object):
+    instances = []
+
+    def __init__(self, *args):
+        self.args = args
+        self.connect_calls = 0
+        self.is_disconnected = False
+        self.sent = []
+        self.fail_next = None
+        self.fail_always = None
+        self._conn = None
+        self.instances.append(self)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.disconnect()
+
+    def connect(self):
+        self.connect_calls += 1
+        self._conn = FakeSMTP()
+
+    def disconnect(self):
+        self.is_disconnected = True
+
+    def send(self, email, atts, from_):
+        if self.fail_always:
+            raise self.fail_always
+
+        if self.fail_next:
+            e, self.fail_next = self.fail_next, None
+            raise e
+
+        if email.subject == 'invalid':
+            raise Exception('Invalid message')
+
+        if email.subject == 'slow':
+            gevent.sleep(10)
+
+        self.sent.append(email.subject)
+
+class FakeIMAP(object):
+    def __init__(self, uids, uid_after_literal=False):
+        self.uids = uids
+        self.uid_after_literal = uid_after_literal
+        self.calls = []
+
+    def _get_raw(self, uid):
+        return b'Subject: msg{}\r\n\r\nHello'.format(uid)
+
+    def uid(self, command, *args):
+        self.calls.append((command,) + args)
+
+        if command == 'search':
+            return 'OK', [b' '.join(self.uids)]
+
+        uid_set, items = args
+        uids = [uid for uid in self.uids if uid in get_uid_set_members(uid_set)]
+        data = []
+
+        for idx, uid in enumerate(uids, 1):
+            if 'BODYSTRUCTURE' in items:
+                data.append(b'{} (UID {} BODYSTRUCTURE ("text" "plain" ("charset" "us-ascii") NIL NIL "7bit" 5 1))'.format(idx, uid))
+            elif self.uid_after_literal:
+                data.append((b'{} (BODY[] {{10}}'.format(idx), self._get_raw(uid)))
+                data.append(b' UID {})'.format(uid))
+            else:
+                data.append((b'{} (UID {} BODY[] {{10}}'.format(idx, uid), self._get_raw(uid)))
+                data.append(b')')
+
+        return 'OK', data
+
+def get_uid_set_members(uid_set):
+    out = set()
+    for elem in uid_set.split(','):
+        start, _, end = elem.partition(':')
+        out.update(str(uid) for uid in range(int(start), int(end or start) + 1))
+    return out
+
+def _get_imbox(uids, **kwargs):
+    imbox = Imbox.__new__(Imbox)
+    imbox.connection = FakeIMAP(uids, **kwargs)
+    return imbox
+
+def _get_msg(subject):
+    msg = SMTPMessage()
+    msg.from_ = 'from@example.com'
+    msg.to = 'to@example.com'
+    msg.subject = subject
+    msg.body = 'Hello'
+
+    return msg
+
+def _get_conn(pool_size=None):
+    config = Bunch(name='my.smtp', is_active=True, host='localhost', port=25, mode_outbox=None, is_debug=False, timeout=10,
+        username='', password='', pool_size=pool_size, pool_acquire_timeout=1)
+
+    conn = SMTPConnection(config, config)
+    gevent.sleep(0)
+
+    return conn
+
+# ################################################################################################################################
+
+class SMTPConnectionTestCase(TestCase):
+
+    def setUp(self):
+        FakeOutbox.instances[:] = []
+        self.patcher = patch('zato.server.connection.email.AnonymousOutbox', FakeOutbox)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_send_unpooled(self):
+        conn = _get_conn()
+        conn.send(_get_msg('a'))
+        conn.send(_get_msg('b'))
+
+        # Each message is sent over a new session
+        eq_([outbox.sent for outbox in FakeOutbox.instances], [['a'], ['b']])
+        eq_([outbox.is_disconnected for outbox in FakeOutbox.instances], [True, True])
+
+    def test_send_pooled(self):
+        conn = _get_conn(pool_size=1)
+        conn.send(_get_msg('a'))
+        conn.send(_get_msg('b'))
+
+        eq_(len(FakeOutbox.instances), 1)
+
+        outbox = FakeOutbox.instances[0]
+        eq_(outbox.sent, ['a', 'b'])
+        eq_(outbox.connect_calls, 1)
+        eq_(outbox.is_disconnected, False)
+
+        conn.conn_queue.check_idle()
+        eq_(outbox._conn.noop_calls, 1)
+
+        conn.close()
+        eq_(outbox.is_disconnected, True)
+
+    def test_send_pooled_reconnects(self):
+        conn = _get_conn(pool_size=1)
+
+        outbox = FakeOutbox.instances[0]
+        outbox.fail_next = SMTPServerDisconnected()
+
+        conn.send(_get_msg('a'))
+
+        eq_(outbox.sent, ['a'])
+        eq_(outbox.connect_calls, 2)
+
+    def test_send_pooled_discards_broken(self):
+        conn = _get_conn(pool_size=1)
+
+        outbox = FakeOutbox.instances[0]
+        outbox.fail_always = SMTPServerDisconnected()
+
+        conn.send(_get_msg('a'))
+        gevent.sleep(0)
+
+        # A session that cannot be used even after reconnecting is not given to the next sender
+        eq_(outbox.connect_calls, 2)
+        eq_(outbox.is_disconnected, True)
+        eq_(len(FakeOutbox.instances), 2)
+
+        conn.send(_get_msg('b'))
+        eq_(FakeOutbox.instances[1].sent, ['b'])
+
+    def test_send_many(self):
+        conn = _get_conn(pool_size=2)
+        callback_results = []
+
+        subjects = ['a', 'invalid', 'c', 'd']
+        results = conn.send_many([_get_msg(subject) for subject in subjects], callback=callback_results.append).get(timeout=1)
+
+        eq_([result.idx for result in results], [0, 1, 2, 3])
+        eq_([result.ok for result in results], [True, False, True, True])
+        eq_(str(results[1].exception), 'Invalid message')
+        eq_(len(callback_results), 4)
+
+        # Only the pooled sessions were used
+        eq_(len(FakeOutbox.instances), 2)
+        eq_(sorted(sum([outbox.sent for outbox in FakeOutbox.instances], [])), ['a', 'c', 'd'])
+
+    def test_send_many_empty(self):
+        conn = _get_conn(pool_size=1)
+        eq_(conn.send_many([]).get(timeout=1), [])
+
+    def test_close_pending(self):
+        conn = _get_conn(pool_size=1)
+        conn._start_send_many()
+
+        # Stop the workers so that messages stay in the queue
+        for greenlet in conn.send_greenlets:
+            greenlet.kill()
+
+        async_result = conn.send_many([_get_msg('a'), _get_msg('b')])
+        gevent.sleep(0)
+        conn.close()
+
+        results = async_result.get(timeout=1)
+        eq_([result.ok for result in results], [False, False])
+
+    def test_close_in_progress(self):
+        conn = _get_conn(pool_size=1)
+
+        # The worker is busy sending the first message, the second one waits in the queue
+        # and the third one cannot be put in the queue yet.
+        with patch.object(EMAIL.DEFAULT, 'SEND_MANY_QUEUE_SIZE', 1):
+            async_result = conn.send_many([_get_msg('slow'), _get_msg('b'), _get_msg('c')])
+            gevent.sleep(0.01)
+
+        conn.close()
+
+        # All the results are available right after the connection is closed
+        eq_(async_result.ready(), True)
+        results = async_result.get()
+
+        eq_([result.idx for result in results], [0, 1, 2])
+        eq_([result.ok for result in results], [False, False, False])
+        eq_([str(result.exception) for result in results], ['Connection closed'] * 3)
+        eq_(conn.enqueue_jobs, [])
+
+# ################################################################################################################################
+
+class ImboxTestCase(TestCase):
+
+    def test_get_uid_set(self):
+        eq_(get_uid_set(['3', '1', '2', '7', '9', '10']), '1:3,7,9:10')
+        eq_(get_uid_set(['5']), '5')
+
+    def test_get_body_structure(self):
+        eq_(get_body_structure(b'1 (UID 5 BODYSTRUCTURE ("text" "plain" ("name" "a)b") NIL))'),
+            b'("text" "plain" ("name" "a)b") NIL)')
+
+    def test_fetch_list_batches(self):
+        imbox = _get_imbox([b'1', b'2', b'3', b'4', b'5'])
+        result = [(uid, msg.subject) for uid, msg in imbox.fetch_list('ALL', batch_size=2)]
+
+        eq_(result, [('1', 'msg1'), ('2', 'msg2'), ('3', 'msg3'), ('4', 'msg4'), ('5', 'msg5')])
+
+        fetch_calls = [call for call in imbox.connection.calls if call[0] == 'fetch']
+        eq_([call[1] for call in fetch_calls], ['1:2', '3:4', '5'])
+        eq_(fetch_calls[0][2], '(UID BODY.PEEK[])')
+
+    def test_fetch_list_uid_after_literal(self):
+        imbox = _get_imbox([b'7', b'8'], uid_after_literal=True)
+        eq_([(uid, msg.subject) for uid, msg in imbox.fetch_list('ALL')], [('7', 'msg7'), ('8', 'msg8')])
+
+    def test_fetch_list_headers(self):
+        imbox = _get_imbox([b'1'])
+        list(imbox.fetch_list('ALL', fetch_mode=EMAIL.IMAP.FETCH_MODE.HEADERS.value))
+
+        eq_(imbox.connection.calls[-1][2], '(UID BODY.PEEK[HEADER])')
+
+    def test_fetch_list_structure(self):
+        imbox = _get_imbox([b'1'])
+        result = list(imbox.fetch_list('ALL', fetch_mode=EMAIL.IMAP.FETCH_MODE.STRUCTURE.value))
+
+        eq_(result, [('1', b'("text" "plain" ("charset" "us-ascii") NIL NIL "7bit" 5 1)')])
+
+    def test_fetch_list_since_uid(self):
+
+        # The server returns the newest message for n:* even if its UID is lower than n
+        imbox = _get_imbox([b'3'])
+        eq_(list(imbox.fetch_list('UNSEEN', since_uid=5)), [])
+        eq_(imbox.connection.calls[0], ('search', None, 'UID 6:* UNSEEN'))
+
+# ################################################################################################################################
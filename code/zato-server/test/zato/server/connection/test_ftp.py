@@ -9,36 +9,129 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from socket import error as socket_error
 from unittest import TestCase
 
 # Bunch
 from bunch import Bunch
 
+# gevent
+import gevent
+
 # mock
 from mock import patch
 
+# nose
+from nose.tools import eq_
+
 # Zato
+from zato.common import Inactive
 from zato.common.test import rand_string
 from zato.server.connection.ftp import FTPStore
 
+class FTPFacade(object):
+    def __init__(self, host, user, password, acct, timeout, port, dircache):
+        self.password = password
+        self.timeout = timeout
+        self.is_closed = False
+
+    def keep_alive(self):
+        pass
+
+    def close(self):
+        self.is_closed = True
+
+def _get_params(name='test', is_active=True, pool_size=1):
+    params = Bunch({'name':name, 'is_active':is_active, 'port':21, 'dircache':True, 'timeout':None, 'pool_size':pool_size})
+
+    for name in 'host', 'user', 'password', 'acct':
+        params[name] = rand_string()
+
+    return params
+
 class TestFTP(TestCase):
     def test_timeout_is_float(self):
         """ GH #188 - Parameter 'timeout' should be a float.
         """
-        class FTPFacade(object):
-            def __init__(self, host, user, password, acct, timeout, port, dircache):
-                self.timeout = timeout
 
         with patch('zato.server.connection.ftp.FTPFacade', FTPFacade):
             store = FTPStore()
-    
-            conn_name = 'test'
-            timeout = '20' # String at that point
-            params = Bunch({'name':conn_name, 'is_active':True, 'port':21, 'dircache':True, 'timeout':timeout})
-    
-            for name in 'host', 'user', 'password', 'acct':
-                params[name] = rand_string()
-    
+
+            params = _get_params()
+            params.timeout = '20' # String at that point
+
             store.add_params([params])
-            conn = store.get(conn_name)
-            self.assertIsInstance(conn.timeout, float)
\ No newline at end of file
+            conn = store.get(params.name)
+            self.assertIsInstance(conn.timeout, float)
+
+    def test_acquire_reuses_connections(self):
+        with patch('zato.server.connection.ftp.FTPFacade', FTPFacade):
+            store = FTPStore()
+            store.add_params([_get_params()])
+            gevent.sleep(0)
+
+            with store.acquire('test') as conn1:
+                pass
+
+            with store.acquire('test') as conn2:
+                pass
+
+            eq_(conn1 is conn2, True)
+            eq_(conn1.is_closed, False)
+
+    def test_acquire_discards_broken_connections(self):
+        with patch('zato.server.connection.ftp.FTPFacade', FTPFacade):
+            store = FTPStore()
+            store.add_params([_get_params()])
+            gevent.sleep(0)
+
+            with self.assertRaises(socket_error):
+                with store.acquire('test') as conn1:
+                    raise socket_error('Connection reset by peer')
+
+            gevent.sleep(0)
+
+            with store.acquire('test') as conn2:
+                pass
+
+            eq_(conn1.is_closed, True)
+            eq_(conn1 is conn2, False)
+
+    def test_acquire_inactive(self):
+        with patch('zato.server.connection.ftp.FTPFacade', FTPFacade):
+            store = FTPStore()
+            store.add_params([_get_params(is_active=False)])
+
+            self.assertRaises(Inactive, store.acquire, 'test')
+            eq_(store.conn_queues, {})
+
+    def test_change_password_rebuilds_queue(self):
+        with patch('zato.server.connection.ftp.FTPFacade', FTPFacade):
+            store = FTPStore()
+            store.add_params([_get_params()])
+            gevent.sleep(0)
+
+            with store.acquire('test') as old_conn:
+                pass
+
+            store.change_password('test', 'new.password')
+            gevent.sleep(0)
+
+            with store.acquire('test') as new_conn:
+                eq_(new_conn.password, 'new.password')
+
+            eq_(old_conn.is_closed, True)
+
+    def test_delete_closes_connections(self):
+        with patch('zato.server.connection.ftp.FTPFacade', FTPFacade):
+            store = FTPStore()
+            store.add_params([_get_params()])
+            gevent.sleep(0)
+
+            with store.acquire('test') as conn:
+                pass
+
+            store.delete('test')
+
+            eq_(conn.is_closed, True)
+            eq_(store.conn_queues, {})
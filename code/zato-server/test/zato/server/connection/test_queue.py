@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from itertools import count
+from unittest import TestCase
+
+# gevent
+import gevent
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.server.connection.queue import ConnectionQueue
+
+# ################################################################################################################################
+
+class ClientFactory(object):
+    def __init__(self):
+        self.conn_queue = None
+        self.counter = count(1)
+
+    def add_client(self):
+        self.conn_queue.put_client('client{}'.format(next(self.counter)))
+
+def _get_queue(pool_size=1, **kwargs):
+    factory = ClientFactory()
+    factory.conn_queue = ConnectionQueue(pool_size, 1, 'my.conn', 'Test', 'test://', factory.add_client, **kwargs)
+    factory.conn_queue.build_queue()
+    gevent.sleep(0)
+
+    return factory.conn_queue
+
+# ################################################################################################################################
+
+class ConnectionQueueTestCase(TestCase):
+
+    def test_acquire_release(self):
+        conn_queue = _get_queue()
+
+        with conn_queue() as client:
+            eq_(client, 'client1')
+            eq_(conn_queue.in_use, 1)
+
+        eq_(conn_queue.in_use, 0)
+        eq_(conn_queue.queue.qsize(), 1)
+
+    def test_acquire_waits(self):
+        conn_queue = _get_queue()
+        client = conn_queue.acquire()
+
+        gevent.spawn_later(0.05, conn_queue.release, client)
+
+        # Blocks until the client is released by the other greenlet
+        eq_(conn_queue.acquire(), 'client1')
+
+        stats = conn_queue.get_stats()
+        eq_(stats['acquired'], 2)
+        eq_(stats['misses'], 1)
+        eq_(stats['timeouts'], 0)
+        eq_(stats['wait_time_max'] > 0, True)
+
+    def test_acquire_timeout(self):
+        conn_queue = _get_queue(acquire_timeout=0.01)
+        conn_queue.acquire()
+
+        self.assertRaises(Exception, conn_queue.acquire)
+        eq_(conn_queue.timeouts, 1)
+
+    def test_grow_and_shrink(self):
+        conn_queue = _get_queue(max_size=2, idle_timeout=0, acquire_timeout=0.01)
+
+        client1 = conn_queue.acquire()
+        client2 = conn_queue.acquire()
+        eq_(sorted([client1, client2]), ['client1', 'client2'])
+        eq_(conn_queue.size, 2)
+
+        # Never more than max_size clients
+        self.assertRaises(Exception, conn_queue.acquire)
+        eq_(conn_queue.size, 2)
+
+        conn_queue.release(client1)
+        conn_queue.release(client2)
+        gevent.sleep(0.01)
+
+        # Back to pool_size once idle
+        conn_queue.check_idle()
+        eq_(conn_queue.size, 1)
+        eq_(conn_queue.queue.qsize(), 1)
+
+    def test_health_check(self):
+        def health_check(client):
+            if client == 'client1':
+                raise Exception('Invalid client')
+
+        conn_queue = _get_queue(health_check_func=health_check)
+        conn_queue.check_idle()
+        gevent.sleep(0)
+
+        # The invalid client has been replaced
+        eq_(conn_queue.size, 1)
+        eq_(conn_queue.acquire(), 'client2')
+
+    def test_close(self):
+        conn_queue = _get_queue(max_size=2)
+        eq_(conn_queue.maintenance_greenlet is not None, True)
+
+        conn_queue.close()
+        eq_(conn_queue.maintenance_greenlet, None)
+        eq_(conn_queue.keep_connecting, False)
+
+    def test_close_unreachable(self):
+
+        # No client can ever be created
+        conn_queue = ConnectionQueue(1, 1, 'my.conn', 'Test', 'test://', lambda: None)
+        conn_queue.build_queue()
+        build_greenlet = conn_queue.build_greenlet
+        gevent.sleep(0)
+
+        conn_queue.close()
+        gevent.sleep(0)
+
+        # The queue stops trying to build itself
+        eq_(conn_queue.build_greenlet, None)
+        eq_(build_greenlet.dead, True)
+
+    def test_close_client_func(self):
+        closed = []
+        conn_queue = _get_queue(close_client_func=closed.append)
+        client = conn_queue.acquire()
+
+        # Idle clients are closed along with the queue ..
+        conn_queue.close()
+        eq_(closed, [])
+
+        # .. and the ones in use are closed when released.
+        conn_queue.release(client)
+        eq_(closed, ['client1'])
+        eq_(conn_queue.queue.qsize(), 0)
+
+    def test_close_idle_clients(self):
+        closed = []
+        conn_queue = _get_queue(pool_size=2, close_client_func=closed.append)
+        gevent.sleep(0)
+
+        conn_queue.close()
+        eq_(sorted(closed), ['client1', 'client2'])
+
+    def test_discard(self):
+        closed = []
+        conn_queue = _get_queue(close_client_func=closed.append)
+        client = conn_queue.acquire()
+
+        conn_queue.discard(client)
+        gevent.sleep(0)
+
+        # The broken client is closed and replaced with a new one
+        eq_(closed, ['client1'])
+        eq_(conn_queue.in_use, 0)
+        eq_(conn_queue.size, 1)
+        eq_(conn_queue.acquire(), 'client2')
+
+    def test_discard_on(self):
+        closed = []
+        conn_queue = _get_queue(close_client_func=closed.append, discard_on=(IOError,))
+
+        with self.assertRaises(ValueError):
+            with conn_queue() as client:
+                raise ValueError()
+
+        # Other exceptions do not make clients unusable
+        eq_(closed, [])
+
+        with self.assertRaises(IOError):
+            with conn_queue() as client:
+                raise IOError()
+
+        gevent.sleep(0)
+
+        eq_(closed, [client])
+        eq_(conn_queue.in_use, 0)
+        eq_(conn_queue.acquire(), 'client2')
+
+# ################################################################################################################################
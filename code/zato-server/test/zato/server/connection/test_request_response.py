@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import KVDB, REQ_RESP_SAMPLE_MODE
+from zato.server.connection.request_response import SampleConfig
+
+# ################################################################################################################################
+
+class FakeConn(object):
+    def __init__(self, data):
+        self.data = data
+        self.hmget_calls = []
+
+    def hmget(self, key, *fields):
+        self.hmget_calls.append(key)
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+# ################################################################################################################################
+
+class SampleConfigTestCase(TestCase):
+
+    def test_get_cached(self):
+        key = KVDB.REQ_RESP_SAMPLE + 'a'
+        conn = FakeConn({key: {'freq': '3', 'mode': REQ_RESP_SAMPLE_MODE.ASYNC}})
+        config = SampleConfig(Bunch(conn=conn))
+
+        eq_(config.get('a'), (key, 3, REQ_RESP_SAMPLE_MODE.ASYNC))
+        eq_(config.get('a'), (key, 3, REQ_RESP_SAMPLE_MODE.ASYNC))
+
+        # Services not configured at all are cached too
+        eq_(config.get('b'), (KVDB.REQ_RESP_SAMPLE + 'b', 0, REQ_RESP_SAMPLE_MODE.SYNC))
+        eq_(config.get('b'), (KVDB.REQ_RESP_SAMPLE + 'b', 0, REQ_RESP_SAMPLE_MODE.SYNC))
+
+        eq_(conn.hmget_calls, [key, KVDB.REQ_RESP_SAMPLE + 'b'])
+
+    def test_should_store(self):
+        key = KVDB.REQ_RESP_SAMPLE + 'a'
+        config = SampleConfig(Bunch(conn=FakeConn({key: {'freq': '2'}})))
+
+        eq_(config.should_store(1, 'a'), (None, 0, None))
+        eq_(config.should_store(2, 'a'), (key, 2, REQ_RESP_SAMPLE_MODE.SYNC))
+
+    def test_set(self):
+        key = KVDB.REQ_RESP_SAMPLE + 'a'
+        conn = FakeConn({})
+        config = SampleConfig(Bunch(conn=conn))
+
+        config.set('a', '5', REQ_RESP_SAMPLE_MODE.ASYNC)
+        eq_(config.should_store(10, 'a'), (key, 5, REQ_RESP_SAMPLE_MODE.ASYNC))
+
+        config.set('a', 0)
+        eq_(config.should_store(10, 'a'), (None, 0, None))
+
+        # Configuration set through broker messages never needs to be read from the KVDB
+        eq_(conn.hmget_calls, [])
+
+# ################################################################################################################################
@@ -19,6 +19,7 @@ from zato.common import zato_namespace
 from zato.common.broker_message import CHANNEL, MESSAGE_TYPE
 from zato.common.odb.model import ChannelAMQP, Service
 from zato.common.test import rand_bool, rand_int, rand_string, ServiceTestCase
+from zato.server.service import Integer
 from zato.server.service.internal.channel.amqp import Create, Edit, Delete, GetList
 
 # ##############################################################################
@@ -55,7 +56,8 @@ class GetListTestCase(ServiceTestCase):
         return Bunch(
             {'id':rand_int(), 'name':rand_string(), 'is_active':rand_bool(), 'queue':rand_string(), 
              'consumer_tag_prefix':rand_string(), 'def_name':rand_string(), 'def_id':rand_int(), 
-             'service_name':rand_string(), 'data_format':rand_string()}
+             'service_name':rand_string(), 'data_format':rand_string(), 'prefetch_count':rand_int(),
+             'batch_size':rand_int(), 'batch_interval':rand_int(), 'ack_mode':rand_string()}
         )
     
     def test_sio(self):
@@ -64,9 +66,10 @@ class GetListTestCase(ServiceTestCase):
         self.assertEquals(self.sio.input_required, ('cluster_id',))
         self.assertEquals(self.sio.output_required, ('id', 'name', 'is_active', 'queue', 'consumer_tag_prefix', 
             'def_name', 'def_id', 'service_name', 'data_format'))
+        self.assertEquals(self.sio.output_optional, (self.wrap_force_type(Integer('prefetch_count')),
+            self.wrap_force_type(Integer('batch_size')), self.wrap_force_type(Integer('batch_interval')), 'ack_mode'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'input_optional')
-        self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
         
     def test_impl(self):
         self.assertEquals(self.service_class.get_name(), 'zato.channel.amqp.get-list')
@@ -93,7 +96,8 @@ class CreateTestCase(_Base):
     def get_request_data(self):
         return {'cluster_id':rand_int(), 'name':self.name, 'is_active':rand_bool(), 'def_id':self.def_id,
                 'queue':rand_string(), 'consumer_tag_prefix':rand_string(), 'service':rand_string(),
-                'data_format':rand_string()}
+                'data_format':rand_string(), 'prefetch_count':rand_int(), 'batch_size':rand_int(),
+                'batch_interval':rand_int(), 'ack_mode':rand_string()}
     
     def get_response_data(self):
         return Bunch({'id':self.id, 'name':self.name})
@@ -103,7 +107,8 @@ class CreateTestCase(_Base):
         self.assertEquals(self.sio.request_elem, 'zato_channel_amqp_create_request')
         self.assertEquals(self.sio.response_elem, 'zato_channel_amqp_create_response')
         self.assertEquals(self.sio.input_required, ('cluster_id', 'name', 'is_active', 'def_id', 'queue', 'consumer_tag_prefix', 'service'))
-        self.assertEquals(self.sio.input_optional, ('data_format',))
+        self.assertEquals(self.sio.input_optional, ('data_format', self.wrap_force_type(Integer('prefetch_count')),
+            self.wrap_force_type(Integer('batch_size')), self.wrap_force_type(Integer('batch_interval')), 'ack_mode'))
         self.assertEquals(self.sio.output_required, ('id', 'name'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
@@ -142,7 +147,8 @@ class EditTestCase(_Base):
     
     def get_request_data(self):
         return {'id': self.id, 'cluster_id':rand_int(), 'name':self.name, 'is_active':rand_bool(), 'queue':rand_string(), 
-             'consumer_tag_prefix':rand_string(), 'def_id':self.def_id, 'service':rand_string(), 'data_format':rand_string()}
+             'consumer_tag_prefix':rand_string(), 'def_id':self.def_id, 'service':rand_string(), 'data_format':rand_string(),
+             'prefetch_count':rand_int(), 'batch_size':rand_int(), 'batch_interval':rand_int(), 'ack_mode':rand_string()}
     
     def get_response_data(self):
         return Bunch({'id':self.id, 'name':self.name})
@@ -151,7 +157,8 @@ class EditTestCase(_Base):
         self.assertEquals(self.sio.request_elem, 'zato_channel_amqp_edit_request')
         self.assertEquals(self.sio.response_elem, 'zato_channel_amqp_edit_response')
         self.assertEquals(self.sio.input_required, ('id', 'cluster_id', 'name', 'is_active', 'def_id', 'queue', 'consumer_tag_prefix', 'service'))
-        self.assertEquals(self.sio.input_optional, ('data_format',))
+        self.assertEquals(self.sio.input_optional, ('data_format', self.wrap_force_type(Integer('prefetch_count')),
+            self.wrap_force_type(Integer('batch_size')), self.wrap_force_type(Integer('batch_interval')), 'ack_mode'))
         self.assertEquals(self.sio.output_required, ('id', 'name'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
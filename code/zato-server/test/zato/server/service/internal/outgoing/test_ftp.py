@@ -14,7 +14,7 @@ from bunch import Bunch
 # Zato
 from zato.common import zato_namespace
 from zato.common.test import rand_bool, rand_int, rand_string, ServiceTestCase
-from zato.server.service import Boolean
+from zato.server.service import Boolean, Integer
 from zato.server.service.internal.outgoing.ftp import GetList, Create, Edit, Delete, ChangePassword
 
 ##############################################################################
@@ -32,7 +32,7 @@ class GetListTestCase(ServiceTestCase):
         return Bunch(
             {'id':rand_int(), 'name':rand_string(), 'is_active':rand_bool(), 'host':rand_string(), 
              'port':rand_int(), 'user':rand_string(), 'acct':rand_string(), 
-             'timeout':rand_int(), 'dircache':rand_bool()}
+             'timeout':rand_int(), 'dircache':rand_bool(), 'pool_size':rand_int()}
         )
     
     def test_sio(self):
@@ -40,7 +40,8 @@ class GetListTestCase(ServiceTestCase):
         self.assertEquals(self.sio.response_elem, 'zato_outgoing_ftp_get_list_response')
         self.assertEquals(self.sio.input_required, ('cluster_id',))
         self.assertEquals(self.sio.output_required, ('id', 'name', 'is_active', 'host', 'port'))
-        self.assertEquals(self.sio.output_optional, ('user', 'acct', 'timeout', self.wrap_force_type(Boolean('dircache'))))
+        self.assertEquals(self.sio.output_optional, ('user', 'acct', 'timeout', self.wrap_force_type(Boolean('dircache')),
+            self.wrap_force_type(Integer('pool_size'))))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'input_optional')
         
@@ -57,7 +58,8 @@ class CreateTestCase(ServiceTestCase):
     
     def get_request_data(self):
         return {'cluster_id':rand_int(), 'name':rand_string(), 'is_active':rand_bool(), 'host':rand_string(),
-                'port':rand_int(),'dircache':rand_bool(), 'user':rand_string(), 'acct':rand_string(), 'timeout':rand_int()}
+                'port':rand_int(),'dircache':rand_bool(), 'user':rand_string(), 'acct':rand_string(), 'timeout':rand_int(),
+                'pool_size':rand_int()}
     
     def get_response_data(self):
         return Bunch({'id':self.id, 'name':self.name})
@@ -67,7 +69,7 @@ class CreateTestCase(ServiceTestCase):
         self.assertEquals(self.sio.request_elem, 'zato_outgoing_ftp_create_request')
         self.assertEquals(self.sio.response_elem, 'zato_outgoing_ftp_create_response')
         self.assertEquals(self.sio.input_required, ('cluster_id', 'name', 'is_active', 'host', 'port', self.wrap_force_type(Boolean('dircache'))))
-        self.assertEquals(self.sio.input_optional, ('user', 'acct', 'timeout'))
+        self.assertEquals(self.sio.input_optional, ('user', 'acct', 'timeout', self.wrap_force_type(Integer('pool_size'))))
         self.assertEquals(self.sio.output_required, ('id', 'name'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
@@ -87,7 +89,7 @@ class EditTestCase(ServiceTestCase):
     def get_request_data(self):
         return {'id':rand_int(), 'cluster_id':rand_int(), 'name':rand_string(), 'is_active':rand_bool(),
                 'host':rand_string(),'port':rand_int(), 'dircache':rand_bool(), 'user':rand_string(), 'acct':rand_string(),
-                'timeout':rand_int()}
+                'timeout':rand_int(), 'pool_size':rand_int()}
     
     def get_response_data(self):
         return Bunch({'id':rand_int(), 'name':rand_string()})
@@ -97,7 +99,7 @@ class EditTestCase(ServiceTestCase):
         self.assertEquals(self.sio.response_elem, 'zato_outgoing_ftp_edit_response')
         self.assertEquals(self.sio.input_required, ('id', 'cluster_id', 'name', 'is_active', 'host', 'port',
                                                     self.wrap_force_type(Boolean('dircache'))))
-        self.assertEquals(self.sio.input_optional, ('user', 'acct', 'timeout'))       
+        self.assertEquals(self.sio.input_optional, ('user', 'acct', 'timeout', self.wrap_force_type(Integer('pool_size'))))       
         self.assertEquals(self.sio.output_required, ('id', 'name'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
@@ -14,7 +14,8 @@ from bunch import Bunch
 # Zato
 from zato.common import zato_namespace
 from zato.common.test import rand_int, rand_string, ServiceTestCase
-from zato.server.service.internal.server import Edit, Delete, GetByID
+from zato.server.service import Float, Integer
+from zato.server.service.internal.server import Edit, Delete, GetByID, GetConnPoolStats
 
 ################################################################################
 
@@ -105,3 +106,34 @@ class DeleteTestCase(ServiceTestCase):
         
     def test_impl(self):
         self.assertEquals(self.service_class.get_name(), 'zato.server.delete')
+
+##############################################################################
+
+class GetConnPoolStatsTestCase(ServiceTestCase):
+
+    def setUp(self):
+        self.service_class = GetConnPoolStats
+        self.sio = self.service_class.SimpleIO
+
+    def get_request_data(self):
+        return {}
+
+    def get_response_data(self):
+        return Bunch({'name':rand_string(), 'conn_type':rand_string(), 'address':rand_string(), 'pool_size':rand_int(),
+                      'max_size':rand_int(), 'size':rand_int(), 'idle':rand_int(), 'in_use':rand_int(),
+                      'acquired':rand_int(), 'misses':rand_int(), 'timeouts':rand_int(), 'wait_time_total':rand_int(),
+                      'wait_time_max':rand_int()})
+
+    def test_sio(self):
+        self.assertEquals(self.sio.request_elem, 'zato_server_get_conn_pool_stats_request')
+        self.assertEquals(self.sio.response_elem, 'zato_server_get_conn_pool_stats_response')
+        self.assertEquals(self.sio.output_required, ('name', 'conn_type', 'address', Integer('pool_size'),
+            Integer('max_size'), Integer('size'), Integer('idle'), Integer('in_use'), Integer('acquired'), Integer('misses'),
+            Integer('timeouts'), Float('wait_time_total'), Float('wait_time_max')))
+        self.assertEquals(self.sio.output_repeated, True)
+        self.assertEquals(self.sio.namespace, zato_namespace)
+        self.assertRaises(AttributeError, getattr, self.sio, 'input_required')
+        self.assertRaises(AttributeError, getattr, self.sio, 'input_optional')
+
+    def test_impl(self):
+        self.assertEquals(self.service_class.get_name(), 'zato.server.get-conn-pool-stats')
@@ -19,8 +19,8 @@ from zato.common import DATA_FORMAT, NO_DEFAULT_VALUE, PARAMS_PRIORITY, SIMPLE_I
 from zato.common.test import rand_bool, rand_csv, rand_date_utc, rand_dict, rand_float, rand_int, rand_list, rand_list_of_dicts, \
      rand_nested, rand_opaque, rand_string, rand_unicode
 from zato.common.util import new_cid
-from zato.server.service.reqresp.sio import AsIs, Boolean, convert_param, CSV, Dict, Float, ForceType, Integer, List, \
-     ListOfDicts, Nested, Opaque, Unicode, UTC, ValidationException
+from zato.server.service.reqresp.sio import AsIs, Boolean, convert_param, CSV, Dict, Float, ForceType, get_sio_plan, Integer, \
+     List, ListOfDicts, Nested, Opaque, Unicode, UTC, ValidationException
 
 class SIOTestCase(TestCase):
     def test_dict_no_keys_specified(self):
@@ -293,3 +293,72 @@ class ConvertParamTestCase(TestCase):
                 self.assertEquals(expected_value, given_value)
 
 # ################################################################################################################################
+
+class SIOPlanTestCase(TestCase):
+    def test_plan(self):
+
+        class SimpleIO:
+            input_required = ('is_a', Integer('b'))
+            input_optional = (AsIs('c_id'),)
+            output_required = ('d_count',)
+            output_optional = (Boolean('e'), 'f')
+
+        simple_io_config = {
+            'bool_parameter_prefixes': ['is_'],
+            'int_parameters': [],
+            'int_parameter_suffixes': ['_id', '_count'],
+        }
+
+        plan = get_sio_plan(SimpleIO, simple_io_config)
+
+        eq_([sio_param.name for sio_param in plan.input_required], ['is_a', 'b'])
+        eq_([sio_param.name for sio_param in plan.input_optional], ['c_id'])
+        eq_([sio_param.name for sio_param in plan.output], ['d_count', 'e', 'f'])
+        eq_(plan.output_attrs, frozenset(['d_count', 'e', 'f']))
+
+        is_a, b = plan.input_required
+        c_id, = plan.input_optional
+        d_count, e, f = plan.output
+
+        self.assertTrue(is_a.is_bool)
+        self.assertTrue(is_a.is_required)
+        self.assertTrue(b.is_force_type)
+        self.assertTrue(c_id.is_as_is)
+        self.assertFalse(c_id.is_required)
+        self.assertTrue(d_count.is_int)
+        self.assertTrue(e.is_bool)
+        self.assertFalse(f.is_bool)
+        self.assertFalse(f.is_int)
+
+        eq_(is_a.xml_path.path, 'request.is_a')
+        eq_(d_count.xml_path, None)
+
+        eq_(is_a.convert('true', True), True)
+        eq_(d_count.convert('123', True), 123)
+        eq_(d_count.convert('123', False), '123')
+        eq_(f.convert('123', True), '123')
+
+    def test_plan_cached(self):
+
+        class SimpleIO:
+            input_required = ('a',)
+
+        class SubSimpleIO(SimpleIO):
+            input_required = ('b',)
+
+        simple_io_config = {}
+
+        plan1 = get_sio_plan(SimpleIO, simple_io_config)
+        plan2 = get_sio_plan(SimpleIO, simple_io_config)
+        self.assertIs(plan1, plan2)
+
+        # A subclass must not reuse its parent's plan
+        plan3 = get_sio_plan(SubSimpleIO, simple_io_config)
+        self.assertIsNot(plan1, plan3)
+        eq_(plan3.input_required[0].name, 'b')
+
+        # A new config means the plan needs to be compiled anew
+        plan4 = get_sio_plan(SimpleIO, {})
+        self.assertIsNot(plan1, plan4)
+
+# ################################################################################################################################
@@ -12,6 +12,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import ast
 from json import loads
 from logging import getLogger, INFO
+from tempfile import TemporaryFile
 from time import time
 from unittest import TestCase
 from uuid import uuid4
@@ -35,7 +36,7 @@ from retools.lock import LockTimeout
 from zato.common import CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, \
      SCHEDULER, URL_TYPE
 from zato.common.test import FakeKVDB, rand_string, rand_int, ServiceTestCase
-from zato.server.service import List, Service
+from zato.server.service import InvocationContextStore, List, Service
 from zato.server.service.reqresp import HTTPRequestData, Request
 
 logger = getLogger(__name__)
@@ -75,6 +76,20 @@ class HooksTestCase(ServiceTestCase):
 
 # ################################################################################################################################
 
+class FacadesTestCase(ServiceTestCase):
+    def test__facades(self):
+
+        class MyService(Service):
+            def handle(self):
+                self.environ['facades'] = self.outgoing, self.cloud, self.email, self.search
+
+        instance = self.invoke(MyService, {}, {})
+
+        for facade in instance.environ['facades']:
+            eq_(facade is None, False)
+
+# ################################################################################################################################
+
 class TestLogInputOutput(ServiceTestCase):
     def test__log_input_output(self):
         
@@ -314,6 +329,26 @@ class TestRequest(TestCase):
                              'g': 'g-msg',
                              'h':'channel_param_h'}.items()))
 
+    def test_payload_streamed(self):
+        stream = TemporaryFile()
+        stream.write('{"a":"b"}')
+        stream.seek(0)
+
+        request = Request(None)
+        request.cid = uuid4().hex
+        request.data_format = DATA_FORMAT.JSON
+        request.payload = None
+        request.stream = stream
+
+        # Nothing is read until the payload is needed
+        eq_(request.stream.tell(), 0)
+
+        eq_(request.payload, {'a':'b'})
+        eq_(request.payload, {'a':'b'})
+
+        # The stream can be still read by the service after its payload has been parsed
+        eq_(request.stream.read(), '{"a":"b"}')
+
 # ################################################################################################################################
 
 class TestSIOListDataType(ServiceTestCase):
@@ -493,3 +528,57 @@ class RESTTargetType(ServiceTestCase):
 
         MyService2.add_http_method_handlers()
         self.assertDictEqual(MyService2.http_method_handlers, {})
+
+# ################################################################################################################################
+
+class TestInvocationContextStore(TestCase):
+
+    def _get_worker_store(self, slow_threshold):
+        worker_store = Bunch()
+        worker_store.broker_client = None
+        worker_store.email_smtp_api = rand_string()
+        worker_store.email_imap_api = rand_string()
+        worker_store.server = Bunch()
+        worker_store.server.service_store = Bunch()
+        worker_store.server.service_store.services = {'my.service': {'slow_threshold': slow_threshold}}
+
+        return worker_store
+
+    def test_get(self):
+
+        slow_threshold = rand_int()
+        worker_store = self._get_worker_store(slow_threshold)
+        store = InvocationContextStore(worker_store)
+
+        ctx = store.get('my.service')
+        eq_(ctx.impl_name, 'my.service')
+        eq_(ctx.slow_threshold, slow_threshold)
+
+        # The same context is returned each time
+        self.assertIs(store.get('my.service'), ctx)
+
+        # Facades are shared and created only once
+        email = ctx.facades.email
+        eq_(email.smtp, worker_store.email_smtp_api)
+        eq_(email.imap, worker_store.email_imap_api)
+        self.assertIs(ctx.facades.email, email)
+
+    def test_invalidate(self):
+
+        worker_store = self._get_worker_store(rand_int())
+        store = InvocationContextStore(worker_store)
+
+        ctx = store.get('my.service')
+        facades = ctx.facades
+
+        new_slow_threshold = rand_int()
+        worker_store.server.service_store.services['my.service']['slow_threshold'] = new_slow_threshold
+
+        store.invalidate('my.service')
+
+        ctx = store.get('my.service')
+        eq_(ctx.slow_threshold, new_slow_threshold)
+        self.assertIs(ctx.facades, facades)
+
+        store.invalidate()
+        self.assertIsNot(store.get('my.service').facades, facades)
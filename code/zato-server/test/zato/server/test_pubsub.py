@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from httplib import INTERNAL_SERVER_ERROR, OK
+from json import loads
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import DATA_FORMAT, PUB_SUB
+from zato.common.pubsub import Consumer, QueueNotifier
+from zato.server.pubsub import CallbackDelivery, ConsumerDelivery
+
+# ################################################################################################################################
+
+class FakePubSubImpl(object):
+    def __init__(self, consumers):
+        self.consumers = consumers
+        self.stats = []
+        self.notifier = QueueNotifier(None, None)
+        self.leases = {} # Lease key -> whether it is held
+
+    def acquire_delivery_lease(self, sub_key, max_leases, expires):
+        for idx in range(max_leases):
+            key = '{}:{}'.format(sub_key, idx)
+            if not self.leases.get(key):
+                self.leases[key] = True
+                return key, 'token'
+
+    def release_delivery_lease(self, lease):
+        self.leases[lease[0]] = False
+
+    def get_callback_consumers(self):
+        return self.consumers
+
+    def get_consumer_queue(self, sub_key):
+        return 'queue:{}'.format(sub_key)
+
+    def update_delivery_stats(self, sub_key, msg_count, delivery_time, error=None):
+        self.stats.append((sub_key, msg_count, error))
+
+class FakePubSub(object):
+    def __init__(self, msg_ids, consumers=None):
+        self.queue = list(msg_ids)
+        self.acked = []
+        self.rejected = []
+        self.impl = FakePubSubImpl(consumers or [])
+
+    def get(self, sub_key, max_batch_size, get_format):
+        eq_(get_format, PUB_SUB.GET_FORMAT.JSON.id)
+        batch, self.queue = self.queue[:max_batch_size+1], self.queue[max_batch_size+1:]
+        return ({'payload': 'payload-{}'.format(msg_id), 'metadata': {'msg_id': msg_id}} for msg_id in batch)
+
+    def acknowledge(self, sub_key, msg_ids):
+        self.acked.extend(msg_ids)
+
+    def reject(self, sub_key, msg_ids):
+        self.rejected.extend(msg_ids)
+        self.queue.extend(msg_ids)
+
+class FakeHTTPConn(object):
+    def __init__(self, status_codes=None, sleep=0):
+        self.status_codes = status_codes or []
+        self.sleep = sleep
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def post(self, cid, data, headers):
+        self.requests.append(loads(data))
+        self.in_flight += 1
+        self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        gevent.sleep(self.sleep)
+        self.in_flight -= 1
+
+        return Bunch(status_code=self.status_codes.pop(0) if self.status_codes else OK, text='')
+
+def _get_delivery(pubsub, conn, **kwargs):
+    outconn = Bunch(config={'data_format': DATA_FORMAT.JSON}, conn=conn)
+    consumer = Consumer(1, 'my.consumer', sub_key='my.sub_key', callback_name='my.outconn')
+
+    return ConsumerDelivery(pubsub, consumer, {'my.outconn': outconn}.get, **kwargs)
+
+# ################################################################################################################################
+
+class ConsumerDeliveryTestCase(TestCase):
+
+    def test_batches(self):
+        pubsub = FakePubSub(range(5))
+        conn = FakeHTTPConn()
+
+        delivery = _get_delivery(pubsub, conn, max_batch_size=2)
+        delivery.keep_running = True
+        delivery.deliver_available()
+        gevent.sleep(0.01)
+
+        eq_([request['results_count'] for request in conn.requests], [2, 2, 1])
+        eq_(sorted(pubsub.acked), range(5))
+        eq_(pubsub.rejected, [])
+        eq_(pubsub.impl.stats, [('my.sub_key', 2, None), ('my.sub_key', 2, None), ('my.sub_key', 1, None)])
+
+    def test_max_in_flight(self):
+        pubsub = FakePubSub(range(6))
+        conn = FakeHTTPConn(sleep=0.01)
+
+        delivery = _get_delivery(pubsub, conn, max_batch_size=1, max_in_flight=2)
+        delivery.keep_running = True
+        delivery.deliver_available()
+        gevent.sleep(0.05)
+
+        eq_(len(conn.requests), 6)
+        eq_(conn.max_in_flight, 2)
+        eq_(sorted(pubsub.acked), range(6))
+        eq_(pubsub.impl.leases, {'my.sub_key:0': False, 'my.sub_key:1': False})
+
+    def test_max_in_flight_cluster(self):
+        pubsub = FakePubSub(range(6))
+        conn = FakeHTTPConn(sleep=0.01)
+
+        # Two servers delivering to the same consumer
+        delivery1 = _get_delivery(pubsub, conn, max_batch_size=1)
+        delivery2 = _get_delivery(pubsub, conn, max_batch_size=1)
+
+        delivery1.keep_running = True
+        delivery2.keep_running = True
+
+        delivery1.deliver_available()
+        delivery2.deliver_available()
+        gevent.sleep(0.1)
+
+        # The other server could not get the lease so messages were delivered one by one, in order
+        eq_(conn.max_in_flight, 1)
+        eq_([request['results'][0]['metadata']['msg_id'] for request in conn.requests], range(6))
+        eq_(pubsub.acked, range(6))
+
+    def test_backoff(self):
+        pubsub = FakePubSub([1])
+        conn = FakeHTTPConn([INTERNAL_SERVER_ERROR, INTERNAL_SERVER_ERROR])
+
+        delivery = _get_delivery(pubsub, conn, backoff_initial=0.01, backoff_max=0.015)
+        delivery.keep_running = True
+        delivery.deliver_available()
+        gevent.sleep(0.1)
+
+        # Failed twice, backing off for 0.01 and then 0.015 seconds, delivered the third time
+        eq_(len(conn.requests), 3)
+        eq_(pubsub.rejected, [1, 1])
+        eq_(pubsub.acked, [1])
+        eq_(delivery.failures, 0)
+        eq_([error is not None for sub_key, msg_count, error in pubsub.impl.stats], [True, True, False])
+
+    def test_backoff_holds_lease(self):
+        pubsub = FakePubSub([1])
+        conn = FakeHTTPConn([INTERNAL_SERVER_ERROR])
+
+        delivery1 = _get_delivery(pubsub, conn, backoff_initial=0.05)
+        delivery1.keep_running = True
+        gevent.spawn(delivery1.deliver_available)
+        gevent.sleep(0.01)
+
+        # Another server cannot deliver the rejected message until the backoff is over
+        delivery2 = _get_delivery(pubsub, conn)
+        delivery2.keep_running = True
+        delivery2.deliver_available()
+
+        eq_(len(conn.requests), 1)
+        eq_(pubsub.impl.leases, {'my.sub_key:0': True})
+
+        gevent.sleep(0.1)
+        eq_(pubsub.acked, [1])
+        eq_(pubsub.impl.leases, {'my.sub_key:0': False})
+
+    def test_get_backoff(self):
+        delivery = _get_delivery(FakePubSub([]), FakeHTTPConn(), backoff_initial=1, backoff_max=10)
+
+        backoffs = []
+        for failures in range(1, 7):
+            delivery.failures = failures
+            backoffs.append(delivery.get_backoff())
+
+        eq_(backoffs, [1, 2, 4, 8, 10, 10])
+
+    def test_wake(self):
+        pubsub = FakePubSub([1])
+        conn = FakeHTTPConn()
+
+        delivery = _get_delivery(pubsub, conn, poll_interval=60)
+        delivery.start()
+        gevent.sleep(0)
+
+        # Nothing is delivered until the greenlet is woken up
+        eq_(conn.requests, [])
+
+        delivery.wake()
+        gevent.sleep(0.01)
+        delivery.stop()
+
+        eq_(pubsub.acked, [1])
+
+# ################################################################################################################################
+
+class CallbackDeliveryTestCase(TestCase):
+
+    def test_sync_notify(self):
+        consumer1 = Consumer(1, 'consumer1', sub_key='sub_key1')
+        consumer2 = Consumer(2, 'consumer2', sub_key='sub_key2')
+        pubsub = FakePubSub([], [consumer1, consumer2])
+
+        delivery = CallbackDelivery(pubsub, None, poll_interval=60)
+        delivery.sync()
+        eq_(sorted(delivery.deliveries), ['sub_key1', 'sub_key2'])
+
+        delivery.notify('queue:sub_key2')
+        eq_(delivery.deliveries['sub_key1'].event.is_set(), False)
+        eq_(delivery.deliveries['sub_key2'].event.is_set(), True)
+
+        # Consumers no longer delivered to by callbacks are stopped
+        consumer2_delivery = delivery.deliveries['sub_key2']
+        pubsub.impl.consumers = [consumer1]
+        delivery.sync()
+
+        eq_(sorted(delivery.deliveries), ['sub_key1'])
+        eq_(consumer2_delivery.keep_running, False)
+
+        delivery.stop()
+
+# ################################################################################################################################
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import KVDB
+from zato.server.stats import _lua_min_max, add_to_index, build_indexes, convert_raw_times, get_index_key, LatencyHistogram, \
+    ServiceStatsAccumulator
+
+# ################################################################################################################################
+
+class FakePipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def __getattr__(self, name):
+        def _command(*args):
+            self.commands.append((name,) + args)
+        return _command
+
+    def execute(self):
+        if self.conn.error:
+            raise self.conn.error
+
+        self.conn.executed.append(self.commands)
+        result = []
+
+        for cmd in self.commands:
+            if cmd[0] == 'incrby':
+                result.append(self.conn.usage_total)
+            elif cmd[0] == 'lrange':
+                result.append(self.conn.lists.get(cmd[1], []))
+            elif cmd[0] == 'delete':
+                result.append(int(self.conn.lists.pop(cmd[1], None) is not None))
+            else:
+                result.append(None)
+
+        return result
+
+class FakeConn(object):
+    def __init__(self, usage_total=0):
+        self.usage_total = usage_total
+        self.executed = []
+        self.error = None
+        self.lists = {}
+        self.values = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def scan_iter(self, pattern):
+        return [key for key in sorted(set(self.lists) | set(self.values)) if key.startswith(pattern[:-1])]
+
+    def exists(self, key):
+        return key in self.values
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+# ################################################################################################################################
+
+class ServiceStatsAccumulatorTestCase(TestCase):
+
+    def test_flush(self):
+        conn = FakeConn(100)
+        acc = ServiceStatsAccumulator(Bunch(conn=conn))
+
+        eq_(acc.get_usage('a'), 1)
+        eq_(acc.get_usage('a'), 2)
+
+        acc.add_time('a', '2016:01:02:03:04', 10)
+        acc.add_time('a', '2016:01:02:03:04', 20)
+        acc.add_time('a', '2016:01:02:03:05', 30)
+
+        acc.flush()
+
+        eq_(len(conn.executed), 1)
+        key_04 = KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'a:2016:01:02:03:04'
+        key_05 = KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'a:2016:01:02:03:05'
+        index_04 = KVDB.SERVICE_STATS_INDEX + 'time:hist-by-minute:2016:01:02:03:04'
+        index_05 = KVDB.SERVICE_STATS_INDEX + 'time:hist-by-minute:2016:01:02:03:05'
+        index_03 = KVDB.SERVICE_STATS_INDEX + 'time:hist-by-minute:2016:01:02:03'
+
+        eq_(conn.executed[0], [
+            ('incrby', KVDB.SERVICE_USAGE + 'a', 2),
+            ('hset', KVDB.SERVICE_TIME_BASIC + 'a', 'last', 30),
+
+            ('hincrby', key_04, 'h:10', 1),
+            ('hincrby', key_04, 'h:18', 1),
+            ('hincrby', key_04, 'sum', 30),
+            ('eval', _lua_min_max, 1, key_04, 10, 20),
+            ('sadd', index_04, key_04),
+            ('expire', index_04, 300),
+            ('sadd', index_03, key_04),
+            ('expire', index_03, 300),
+            ('expire', key_04, 300),
+
+            ('hincrby', key_05, 'h:23', 1),
+            ('hincrby', key_05, 'sum', 30),
+            ('eval', _lua_min_max, 1, key_05, 30, 30),
+            ('sadd', index_05, key_05),
+            ('expire', index_05, 300),
+            ('sadd', index_03, key_05),
+            ('expire', index_03, 300),
+            ('expire', key_05, 300),
+
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'a', 'h:10', 1),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'a', 'h:18', 1),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'a', 'h:23', 1),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'a', 'sum', 60),
+            ('eval', _lua_min_max, 1, KVDB.SERVICE_TIME_HIST + 'a', 10, 30),
+            ('sadd', KVDB.SERVICE_STATS_INDEX + 'time:hist:', KVDB.SERVICE_TIME_HIST + 'a'),
+        ])
+
+        # Usage continues from the cluster-wide value returned by the KVDB
+        eq_(acc.get_usage('a'), 101)
+
+    def test_flush_nothing_collected(self):
+        conn = FakeConn()
+        acc = ServiceStatsAccumulator(Bunch(conn=conn))
+        acc.flush()
+
+        eq_(conn.executed, [])
+
+    def test_flush_error(self):
+        conn = FakeConn(100)
+        acc = ServiceStatsAccumulator(Bunch(conn=conn))
+
+        acc.get_usage('a')
+        acc.add_time('a', '2016:01:02:03:04', 10)
+
+        conn.error = Exception('Connection refused')
+        acc.flush()
+
+        eq_(conn.executed, [])
+
+        # Anything collected after the failed flush is merged with what could not be flushed
+        acc.get_usage('a')
+        acc.add_time('a', '2016:01:02:03:04', 20)
+
+        conn.error = None
+        acc.flush()
+
+        key = KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'a:2016:01:02:03:04'
+        commands = conn.executed[0]
+
+        self.assertIn(('incrby', KVDB.SERVICE_USAGE + 'a', 2), commands)
+        self.assertIn(('hset', KVDB.SERVICE_TIME_BASIC + 'a', 'last', 20), commands)
+        self.assertIn(('hincrby', key, 'sum', 30), commands)
+        self.assertIn(('eval', _lua_min_max, 1, key, 10, 20), commands)
+
+    def test_stop_flushes(self):
+        conn = FakeConn()
+        acc = ServiceStatsAccumulator(Bunch(conn=conn), 3600)
+        acc.start()
+        acc.add_time('a', '2016:01:02:03:04', 10)
+        acc.stop()
+
+        eq_(len(conn.executed), 1)
+        eq_(acc.flush_greenlet, None)
+
+class ConvertRawTimesTestCase(TestCase):
+
+    def test_convert_raw_times(self):
+        conn = FakeConn()
+        raw_key = KVDB.SERVICE_TIME_RAW + 'a'
+        raw_minute_key = KVDB.SERVICE_TIME_RAW_BY_MINUTE + 'a:2016:01:02:03:04'
+        hist_key = KVDB.SERVICE_TIME_HIST + 'a'
+        hist_minute_key = KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'a:2016:01:02:03:04'
+        index_04 = KVDB.SERVICE_STATS_INDEX + 'time:hist-by-minute:2016:01:02:03:04'
+        index_03 = KVDB.SERVICE_STATS_INDEX + 'time:hist-by-minute:2016:01:02:03'
+
+        conn.lists[raw_key] = ['10', '500']
+        conn.lists[raw_minute_key] = ['7']
+
+        convert_raw_times(conn)
+
+        eq_(conn.lists, {})
+        eq_(conn.values, {KVDB.SERVICE_TIME_RAW_CONVERTED: 1})
+        eq_(conn.executed[1], [
+            ('hincrby', hist_key, 'h:10', 1),
+            ('hincrby', hist_key, 'h:' + str(LatencyHistogram.get_bucket(500)), 1),
+            ('hincrby', hist_key, 'sum', 510),
+            ('eval', _lua_min_max, 1, hist_key, 10, 500),
+            ('sadd', KVDB.SERVICE_STATS_INDEX + 'time:hist:', hist_key),
+        ])
+        eq_(conn.executed[3], [
+            ('hincrby', hist_minute_key, 'h:7', 1),
+            ('hincrby', hist_minute_key, 'sum', 7),
+            ('eval', _lua_min_max, 1, hist_minute_key, 7, 7),
+            ('sadd', index_04, hist_minute_key),
+            ('expire', index_04, 300),
+            ('sadd', index_03, hist_minute_key),
+            ('expire', index_03, 300),
+            ('expire', hist_minute_key, 300),
+        ])
+
+        # Raw times are converted once only
+        conn.lists[raw_key] = ['10']
+        convert_raw_times(conn)
+        eq_(len(conn.executed), 4)
+
+class IndexTestCase(TestCase):
+
+    def test_get_index_key(self):
+        eq_(get_index_key(KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, '2016:01:02:03'),
+            'zato:stats:service:index:time:aggr-by-hour:2016:01:02:03')
+        eq_(get_index_key(KVDB.SERVICE_TIME_RAW), 'zato:stats:service:index:time:raw:')
+
+    def test_add_to_index(self):
+        conn = FakeConn()
+        pipe = conn.pipeline()
+        add_to_index(pipe, KVDB.SERVICE_SUMMARY_BY_DAY, '2016:01:02', 'key1', 123)
+
+        eq_(pipe.commands, [
+            ('sadd', 'zato:stats:service:index:summary:by-day:2016:01:02', 'key1'),
+            ('expire', 'zato:stats:service:index:summary:by-day:2016:01:02', 123),
+            ('sadd', 'zato:stats:service:index:summary:by-day:2016:01', 'key1'),
+            ('expire', 'zato:stats:service:index:summary:by-day:2016:01', 123),
+        ])
+
+    def test_build_indexes(self):
+        conn = FakeConn()
+        minute_key = KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE + 'my.service:2016:01:02:03:04'
+        year_key = KVDB.SERVICE_SUMMARY_BY_YEAR + 'my.service:2016'
+
+        conn.values[minute_key] = {}
+        conn.values[year_key] = {}
+
+        build_indexes(conn, 123)
+
+        commands = sum(conn.executed, [])
+        eq_([cmd for cmd in commands if cmd[0] == 'sadd'], [
+            ('sadd', 'zato:stats:service:index:summary:by-year:2016', year_key),
+            ('sadd', 'zato:stats:service:index:time:aggr-by-minute:2016:01:02:03:04', minute_key),
+            ('sadd', 'zato:stats:service:index:time:aggr-by-minute:2016:01:02:03', minute_key),
+        ])
+        eq_(conn.values[KVDB.SERVICE_STATS_INDEX_BUILT], 1)
+
+        # Indexes are built once only
+        build_indexes(conn, 123)
+        eq_(sum(conn.executed, []), commands)
+
+class LatencyHistogramTestCase(TestCase):
+
+    def test_buckets(self):
+
+        # Each value is in a bucket whose bounds contain it and buckets follow each other without gaps
+        prev_high = -1
+        for bucket in range(LatencyHistogram.get_bucket(10 ** 7)):
+            low, high = LatencyHistogram.get_bucket_bounds(bucket)
+            eq_(low, prev_high + 1)
+            eq_(LatencyHistogram.get_bucket(low), bucket)
+            eq_(LatencyHistogram.get_bucket(high), bucket)
+            self.assertTrue(high - low <= low / 8.0)
+            prev_high = high
+
+    def test_percentiles(self):
+        hist = LatencyHistogram()
+        for value in range(1, 101):
+            hist.add(value)
+
+        eq_(hist.count, 100)
+        eq_(hist.min(), 1)
+        eq_(hist.max(), 100)
+        eq_(hist.mean(), 50.5)
+        eq_(hist.percentile(10), 10)
+        eq_(hist.percentile(50), 51)
+        eq_(hist.percentile(99), 103)
+
+        # Only values up to the 10th percentile are taken into account
+        eq_(hist.mean(10), 5.5)
+
+    def test_merge_kvdb(self):
+        hist1 = LatencyHistogram()
+        hist1.add(1)
+        hist1.add(500)
+
+        hist2 = LatencyHistogram()
+        hist2.add(1)
+
+        data = hist1.to_kvdb()
+        data['sum'] = '501'
+        data['usage'] = '2' # Not a histogram field so it must be ignored
+
+        merged = LatencyHistogram.from_kvdb(data)
+        eq_(merged.sum, 501)
+
+        merged.merge(hist2)
+        eq_(merged.count, 3)
+        eq_(merged.sum, 502)
+        eq_(merged.percentile(50), 1)
+        eq_(merged.max(), LatencyHistogram.get_bucket_bounds(LatencyHistogram.get_bucket(500))[1])
+
+        # Sum is not known if any of the histograms merged did not have it
+        merged.merge(LatencyHistogram.from_kvdb(hist2.to_kvdb()))
+        eq_(merged.sum, None)
+
+    def test_min_max(self):
+        hist1 = LatencyHistogram()
+        hist1.add(130)
+        hist1.add(500)
+
+        eq_(hist1.min(), 130)
+        eq_(hist1.max(), 500)
+
+        data = hist1.to_kvdb()
+        data['min'] = '130'
+        data['max'] = '500'
+
+        hist2 = LatencyHistogram()
+        hist2.add(131)
+        hist2.merge(LatencyHistogram.from_kvdb(data))
+
+        eq_(hist2.min(), 130)
+        eq_(hist2.max(), 500)
+
+        # An empty histogram does not change the extremes
+        hist2.merge(LatencyHistogram())
+        eq_(hist2.min(), 130)
+
+        # Without exact values stored, bucket bounds are used instead
+        hist3 = LatencyHistogram.from_kvdb(hist1.to_kvdb())
+        eq_(hist3.min(), LatencyHistogram.get_bucket_bounds(LatencyHistogram.get_bucket(130))[0])
+        eq_(hist3.max(), LatencyHistogram.get_bucket_bounds(LatencyHistogram.get_bucket(500))[1])
+
+# ################################################################################################################################
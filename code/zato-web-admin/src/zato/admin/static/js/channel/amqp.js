@@ -55,6 +55,11 @@ $.fn.zato.channel.amqp.data_table.new_row = function(item, data, include_tr) {
     row += String.format("<td class='ignore item_id_{0}'>{0}</td>", item.id);
     row += String.format("<td class='ignore'>{0}</td>", is_active);
     row += String.format("<td class='ignore'>{0}</td>", item.def_id);
+    row += String.format("<td class='ignore'>{0}</td>", item.data_format ? item.data_format : "");
+    row += String.format("<td class='ignore'>{0}</td>", item.prefetch_count ? item.prefetch_count : "");
+    row += String.format("<td class='ignore'>{0}</td>", item.batch_size ? item.batch_size : "");
+    row += String.format("<td class='ignore'>{0}</td>", item.batch_interval ? item.batch_interval : "");
+    row += String.format("<td class='ignore'>{0}</td>", item.ack_mode ? item.ack_mode : "");
 
     if(include_tr) {
         row += '</tr>';
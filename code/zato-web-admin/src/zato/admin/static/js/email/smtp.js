@@ -58,6 +58,7 @@ $.fn.zato.email.smtp.data_table.new_row = function(item, data, include_tr) {
     row += String.format("<td class='ignore'>{0}</td>", is_debug);
     row += String.format("<td class='ignore'>{0}</td>", item.mode);
     row += String.format("<td class='ignore'>{0}</td>", item.username ? item.username : "");
+    row += String.format("<td class='ignore'>{0}</td>", item.pool_size ? item.pool_size : "");
 
     if(include_tr) {
         row += '</tr>';
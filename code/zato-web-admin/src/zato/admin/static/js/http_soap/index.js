@@ -86,6 +86,8 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
     var merge_url_params_req_tr = '';
     var url_params_pri_tr = '';
     var params_pri_tr = '';
+    var stream_request_tr = '';
+    var max_body_size_tr = '';
     var serialization_type = item.serialization_type ? item.serialization_type : 'string';
 
     if(is_soap) {
@@ -100,6 +102,8 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         merge_url_params_req_tr += String.format('<td class="ignore">{0}</td>', merge_url_params_req);
         url_params_pri_tr += String.format('<td class="ignore">{0}</td>', item.url_params_pri);
         params_pri_tr += String.format('<td class="ignore">{0}</td>', item.params_pri);
+        stream_request_tr += String.format('<td class="ignore">{0}</td>', item.stream_request == true);
+        max_body_size_tr += String.format('<td class="ignore">{0}</td>', item.max_body_size ? item.max_body_size : '');
 
     }
 
@@ -159,6 +163,8 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         row += merge_url_params_req_tr;
         row += url_params_pri_tr;
         row += params_pri_tr;
+        row += stream_request_tr;
+        row += max_body_size_tr;
     }
 
     row += String.format('<td>{0}</td>', String.format("<a href=\"javascript:$.fn.zato.http_soap.edit('{0}')\">Edit</a>", item.id));
@@ -49,6 +49,7 @@ $.fn.zato.outgoing.ftp.data_table.new_row = function(item, data, include_tr) {
     row += String.format('<td>{0}</td>', item.timeout ? item.timeout : '');
     row += String.format('<td>{0}</td>', item.port);
     row += String.format('<td>{0}</td>', dircache ? 'Yes' : 'No');
+    row += String.format('<td>{0}</td>', item.pool_size ? item.pool_size : '');
     row += String.format('<td>{0}</td>', String.format("<a href='javascript:$.fn.zato.data_table.change_password({0})'>Change password</a>", item.id));
     row += String.format('<td>{0}</td>', String.format("<a href=\"javascript:$.fn.zato.outgoing.ftp.edit('{0}')\">Edit</a>", item.id));
     row += String.format('<td>{0}</td>', String.format("<a href='javascript:$.fn.zato.outgoing.ftp.delete_({0});'>Delete</a>", item.id));
@@ -52,8 +52,10 @@ $.fn.zato.pubsub.consumers.data_table.new_row = function(item, data, include_tr)
     row += String.format('<td>{0}</td>', data.sub_key);
     row += String.format('<td>{0}</td>', is_active ? "Yes": "No");
     row += String.format('<td>{0}</td>', item.delivery_mode);
+    row += String.format('<td>{0}</td>', data.group_name ? data.group_name : "<span class='form_hint'>---</span>");
     row += String.format('<td>{0}</td>', data.current_depth);
     row += String.format('<td>{0}</td>', data.in_flight_depth ? data.in_flight_depth : "0");
+    row += String.format('<td>{0}</td>', data.lag ? data.lag : "0");
     row += String.format('<td>{0}</td>', item.max_depth);
     row += String.format('<td><span class="{0}">{1}</span></td>', last_seen_css_class, last_seen);
 
@@ -71,6 +73,7 @@ $.fn.zato.pubsub.consumers.data_table.new_row = function(item, data, include_tr)
     row += String.format("<td class='ignore'>{0}</td>", is_active);
     row += String.format("<td class='ignore'>{0}</td>", data.callback);
     row += String.format("<td class='ignore'>{0}</td>", data.client_id);
+    row += String.format("<td class='ignore'>{0}</td>", data.group_name);
 
     if(include_tr) {
         row += '</tr>';
@@ -16,6 +16,7 @@ from django import forms
 
 # Zato
 from zato.admin.web.forms import add_services, DataFormatForm
+from zato.common import AMQP
 
 class CreateForm(DataFormatForm):
     name = forms.CharField(widget=forms.TextInput(attrs={'style':'width:100%'}))
@@ -24,12 +25,21 @@ class CreateForm(DataFormatForm):
     queue = forms.CharField(widget=forms.TextInput(attrs={'style':'width:50%'}))
     consumer_tag_prefix = forms.CharField(widget=forms.TextInput(attrs={'style':'width:50%'}))
     service = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:100%'}))
+    prefetch_count = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:20%'}))
+    batch_size = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:20%'}))
+    batch_interval = forms.CharField(
+        required=False, initial=AMQP.DEFAULT.BATCH_INTERVAL, widget=forms.TextInput(attrs={'style':'width:20%'}))
+    ack_mode = forms.ChoiceField(widget=forms.Select())
 
     def __init__(self, prefix=None, post_data=None, req=None):
         super(CreateForm, self).__init__(post_data, prefix=prefix)
         self.fields['def_id'].choices = []
         add_services(self, req)
 
+        self.fields['ack_mode'].choices = []
+        for name, value in AMQP.ACK_MODE.iteritems():
+            self.fields['ack_mode'].choices.append([value.value, name.replace('_', ' ').capitalize()])
+
     def set_def_id(self, def_ids):
         # Sort AMQP definitions by their names.
         def_ids = sorted(def_ids.iteritems(), key=itemgetter(1))
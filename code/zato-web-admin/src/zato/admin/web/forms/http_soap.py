@@ -47,6 +47,8 @@ class CreateForm(DataFormatForm):
     security = forms.ChoiceField(widget=forms.Select())
     has_rbac = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     content_type = forms.CharField(widget=forms.TextInput(attrs={'style':'width:100%'}))
+    stream_request = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    max_body_size = forms.CharField(widget=forms.TextInput(attrs={'style':'width:20%'}))
     connection = forms.CharField(widget=forms.HiddenInput())
     transport = forms.CharField(widget=forms.HiddenInput())
 
@@ -87,6 +89,7 @@ class EditForm(CreateForm):
     is_active = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     merge_url_params_req = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     has_rbac = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    stream_request = forms.BooleanField(required=False, widget=forms.CheckboxInput())
 
 class ChooseClusterForm(_ChooseClusterForm):
     connection = forms.CharField(widget=forms.HiddenInput())
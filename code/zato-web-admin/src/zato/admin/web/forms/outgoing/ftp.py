@@ -14,6 +14,9 @@ from ftplib import FTP_PORT
 # Django
 from django import forms
 
+# Zato
+from zato.common import FTP
+
 class CreateForm(forms.Form):
     name = forms.CharField(widget=forms.TextInput(attrs={'style':'width:100%'}))
     is_active = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
@@ -23,6 +26,7 @@ class CreateForm(forms.Form):
     acct = forms.CharField(widget=forms.TextInput(attrs={'style':'width:100%'}))
     timeout = forms.CharField(widget=forms.TextInput(attrs={'style':'width:10%'}))
     dircache = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
+    pool_size = forms.CharField(initial=FTP.DEFAULT.POOL_SIZE, widget=forms.TextInput(attrs={'style':'width:10%'}))
     
     def __init__(self, prefix=None, post_data=None):
         super(CreateForm, self).__init__(post_data, prefix=prefix)
@@ -23,6 +23,7 @@ class CreateForm(forms.Form):
     client_id = forms.ChoiceField(widget=forms.Select())
     delivery_mode = forms.ChoiceField(widget=forms.Select())
     callback_id = forms.ChoiceField(widget=forms.Select())
+    group_name = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:50%'}))
     max_depth = forms.CharField(
         initial=PUB_SUB.DEFAULT_MAX_BACKLOG, widget=forms.TextInput(attrs={'class':'required', 'style':'width:20%'}))
 
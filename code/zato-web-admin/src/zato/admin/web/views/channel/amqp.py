@@ -39,6 +39,10 @@ def _get_edit_create_message(params, prefix=''):
         'consumer_tag_prefix': params[prefix + 'consumer_tag_prefix'],
         'service': params[prefix + 'service'],
         'data_format': params.get(prefix + 'data_format'),
+        'prefetch_count': params.get(prefix + 'prefetch_count'),
+        'batch_size': params.get(prefix + 'batch_size'),
+        'batch_interval': params.get(prefix + 'batch_interval'),
+        'ack_mode': params.get(prefix + 'ack_mode'),
     }
 
 def _edit_create_response(client, verb, id, name, def_id, cluster_id):
@@ -60,6 +64,7 @@ class Index(_Index):
         input_required = ('cluster_id',)
         output_required = ('id', 'name', 'is_active', 'queue', 'consumer_tag_prefix', 
             'def_name', 'def_id', 'service_name', 'data_format')
+        output_optional = ('prefetch_count', 'batch_size', 'batch_interval', 'ack_mode')
         output_repeated = True
     
     def handle(self):
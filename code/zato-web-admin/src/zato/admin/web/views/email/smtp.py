@@ -34,7 +34,7 @@ class Index(_Index):
     class SimpleIO(_Index.SimpleIO):
         input_required = ('cluster_id',)
         output_required = ('id', 'name', 'is_active', 'host', 'port', 'timeout', 'username', 'is_debug', 'mode', 'ping_address')
-        output_optional = ('username',)
+        output_optional = ('username', 'pool_size')
         output_repeated = True
 
     def handle(self):
@@ -50,6 +50,7 @@ class _CreateEdit(CreateEdit):
 
     class SimpleIO(CreateEdit.SimpleIO):
         input_required = ('name', 'is_active', 'host', 'port', 'timeout', 'username', 'is_debug', 'mode', 'ping_address')
+        input_optional = ('pool_size',)
         output_required = ('id', 'name')
 
     def success_message(self, item):
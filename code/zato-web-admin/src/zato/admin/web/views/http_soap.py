@@ -84,6 +84,8 @@ def _get_edit_create_message(params, prefix=''):
         'security_id': security_id,
         'has_rbac': bool(params.get(prefix + 'has_rbac')),
         'content_type': params.get(prefix + 'content_type'),
+        'stream_request': bool(params.get(prefix + 'stream_request')),
+        'max_body_size': params.get(prefix + 'max_body_size'),
     }
 
 def _edit_create_response(id, verb, transport, connection, name):
@@ -119,6 +121,9 @@ def index(req):
     if transport == 'soap':
         colspan += 2
 
+    if connection == 'channel':
+        colspan += 2
+
     if req.zato.cluster_id:
         for def_item in req.zato.client.invoke('zato.security.get-list', {'cluster_id': req.zato.cluster.id}):
             if connection == 'outgoing':
@@ -163,7 +168,8 @@ def index(req):
                     item.pool_size, item.merge_url_params_req, item.url_params_pri, item.params_pri,
                     item.serialization_type, item.timeout, item.sec_tls_ca_cert_id, service_id=item.service_id,
                     service_name=item.service_name, security_id=security_id, has_rbac=item.has_rbac,
-                    security_name=security_name, content_type=item.content_type)
+                    security_name=security_name, content_type=item.content_type, stream_request=item.stream_request,
+                    max_body_size=item.max_body_size)
             items.append(item)
 
     return_data = {'zato_clusters':req.zato.clusters,
@@ -37,7 +37,7 @@ class Index(_Index):
         input_required = ('cluster_id', 'topic_name')
         output_required = ('id', 'name', 'is_active', 'sec_type', 'client_id', 'last_seen', 'max_depth', 'current_depth',
             'in_flight_depth', 'sub_key', 'delivery_mode')
-        output_optional = ('callback_id',)
+        output_optional = ('callback_id', 'group_name', 'group_depth', 'lag')
         output_repeated = True
 
     def handle(self):
@@ -65,6 +65,7 @@ class Index(_Index):
         super(Index, self)._handle_item_list(item_list)
         for item in self.items:
             item.callback_id = item.callback_id or ''
+            item.group_name = item.group_name or ''
             if item.last_seen:
                 item.last_seen = from_utc_to_user(item.last_seen + '+00:00', self.req.zato.user_profile)
 
@@ -75,7 +76,7 @@ class _CreateEdit(CreateEdit):
 
     class SimpleIO(CreateEdit.SimpleIO):
         input_required = ('id', 'cluster_id', 'client_id', 'is_active', 'topic_name', 'max_depth', 'delivery_mode')
-        input_optional = ('callback_id',)
+        input_optional = ('callback_id', 'group_name')
         output_required = ('id', 'name', 'last_seen', 'current_depth', 'in_flight_depth', 'sub_key')
 
     def success_message(self, item):
@@ -95,6 +96,7 @@ class _CreateEdit(CreateEdit):
 
         return_data['last_seen'] = None
         return_data['current_depth'] = 0
+        return_data['group_name'] = self.req.POST.get('group_name') or self.req.POST.get('edit-group_name') or ''
 
         client_id = self.req.POST.get('id')
         if client_id:
@@ -379,6 +379,7 @@ def request_response(req, service_name):
         service.sample_req_ts = ts['sample_req_ts']
         service.sample_resp_ts = ts['sample_resp_ts']
         service.sample_req_resp_freq = service_response.data.sample_req_resp_freq
+        service.sample_req_resp_mode = service_response.data.sample_req_resp_mode
 
     return_data = {
         'cluster_id': req.zato.cluster_id,
@@ -394,7 +395,8 @@ def request_response_configure(req, service_name, cluster_id):
         input_dict = {
             'name': service_name,
             'cluster_id': req.zato.cluster_id,
-            'sample_req_resp_freq': req.POST['sample_req_resp_freq']
+            'sample_req_resp_freq': req.POST['sample_req_resp_freq'],
+            'sample_req_resp_mode': req.POST.get('sample_req_resp_mode'),
         }
         req.zato.client.invoke('zato.service.configure-request-response', input_dict)
         return HttpResponse('Saved successfully')